@@ -0,0 +1,408 @@
+"""
+============================================
+COLA DE ADMISIÓN A GEMINI - VIAJEIA
+============================================
+
+La cuota de Gemini es el recurso más escaso del backend. Toda llamada a
+Gemini pide antes un turno a esta cola, que decide quién pasa y cuándo:
+
+- Capacidad: como mucho GEMINI_MAX_CONCURRENT llamadas a la vez y, si se
+  configuran, GEMINI_RPM llamadas y GEMINI_TPM tokens por minuto (cubetas
+  que se recargan de forma continua y admiten ~10 segundos de ráfaga).
+  Cada turno reserva los tokens estimados del prompt más el máximo de
+  salida; al terminar se ajusta con los tokens que informó Gemini.
+- Equidad: cola justa ponderada (start-time fair queueing) por cliente.
+  Un usuario que manda muchas consultas seguidas no deja esperando al
+  resto: su consulta siguiente se ordena después de las de los demás.
+- Prioridad: los usuarios autenticados con Firebase pesan
+  GEMINI_PESO_AUTENTICADO veces más que los anónimos (identificados por
+  IP) y esperan más antes de rendirse. Los anónimos nunca se quedan sin
+  turno: solo avanzan más despacio cuando hay competencia.
+- Plazos: al entrar se estima la espera; si supera el plazo de la clase
+  (GEMINI_QUEUE_TIMEOUT / GEMINI_QUEUE_TIMEOUT_ANONIMO) la consulta se
+  rechaza en el acto con 503 y Retry-After, en lugar de esperar para
+  fallar al final. Si la estimación falló, igual se rechaza al vencer el plazo.
+- Cuota agotada: si Gemini responde RESOURCE_EXHAUSTED, la cola deja de
+  dar turnos durante GEMINI_QUOTA_BACKOFF segundos.
+
+La cola es la misma para app.py (hilos) y app_async.py (event loop):
+pedir() bloquea el hilo y pedir_async() espera sin bloquear.
+
+¿Por qué es importante?
+- Una ráfaga de pocos usuarios ya no agota la cuota de todos
+- Los errores de cuota se convierten en esperas cortas o 503 inmediatos y claros
+- Quien no va a conseguir turno se entera enseguida y puede reintentar
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+
+from google.api_core import exceptions as errores_google
+
+from autenticacion import CLASE_ANONIMO, CLASE_AUTENTICADO
+from metricas import registro
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Llamadas simultáneas a Gemini; las demás esperan turno en la cola
+GEMINI_MAX_CONCURRENT = int(os.getenv('GEMINI_MAX_CONCURRENT', '32'))
+# Llamadas y tokens por minuto que se le piden a Gemini como mucho (0 = sin límite)
+GEMINI_RPM = float(os.getenv('GEMINI_RPM', '0'))
+GEMINI_TPM = float(os.getenv('GEMINI_TPM', '0'))
+# Espera máxima en la cola antes de responder 503 (segundos), por clase
+GEMINI_QUEUE_TIMEOUT = float(os.getenv('GEMINI_QUEUE_TIMEOUT', '10'))
+GEMINI_QUEUE_TIMEOUT_ANONIMO = float(os.getenv('GEMINI_QUEUE_TIMEOUT_ANONIMO', '5'))
+# Peso de los usuarios autenticados frente a los anónimos (peso 1)
+GEMINI_PESO_AUTENTICADO = float(os.getenv('GEMINI_PESO_AUTENTICADO', '3'))
+# Segundos sin dar turnos después de un RESOURCE_EXHAUSTED de Gemini
+GEMINI_QUOTA_BACKOFF = float(os.getenv('GEMINI_QUOTA_BACKOFF', '10'))
+
+# Segundos de ráfaga que admiten las cubetas de llamadas y tokens por minuto
+RAFAGA_SEGUNDOS = 10
+# Duración inicial estimada de una llamada a Gemini (se ajusta con cada llamada)
+SERVICIO_INICIAL = 2.0
+# Clientes cuya etiqueta de equidad se recuerda antes de limpiar las viejas
+MAX_CLIENTES = 10000
+
+CLASES = (CLASE_AUTENTICADO, CLASE_ANONIMO)
+# Errores con los que Gemini avisa que se agotó la cuota
+CUOTA_AGOTADA = (errores_google.ResourceExhausted, errores_google.TooManyRequests)
+
+
+class ServidorSaturado(Exception):
+    """El servidor no puede atender la consulta ahora (se responde 503)."""
+
+    def __init__(self, mensaje, retry_after=None):
+        super().__init__(mensaje)
+        self.retry_after = retry_after
+
+
+class Cubeta:
+    """Cubeta de fichas: `por_minuto` fichas por minuto, con RAFAGA_SEGUNDOS de reserva."""
+
+    def __init__(self, por_minuto):
+        self.por_segundo = por_minuto / 60
+        self.capacidad = max(1.0, self.por_segundo * RAFAGA_SEGUNDOS)
+        self.fichas = self.capacidad
+        self._actualizada = time.monotonic()
+
+    def recargar(self, ahora):
+        self.fichas = min(self.capacidad, self.fichas + (ahora - self._actualizada) * self.por_segundo)
+        self._actualizada = ahora
+
+    def espera(self, cantidad):
+        """
+        Segundos hasta que haya `cantidad` fichas (0 si ya hay). Una consulta
+        más grande que la cubeta entera pasa con la cubeta llena.
+        """
+        return max(0.0, min(cantidad, self.capacidad) - self.fichas) / self.por_segundo
+
+
+class Turno:
+    """El lugar de una consulta en la cola de Gemini."""
+
+    __slots__ = ('cliente', 'clase', 'costo', 'etiqueta', 'secuencia', 'limite',
+                 'concedido', 'cancelado', 'liberado', 'inicio', 'avisar')
+
+    def __init__(self, cliente, clase, costo, etiqueta, secuencia, limite):
+        self.cliente = cliente
+        self.clase = clase
+        self.costo = costo
+        self.etiqueta = etiqueta
+        self.secuencia = secuencia
+        self.limite = limite
+        self.concedido = False
+        self.cancelado = False
+        self.liberado = False
+        self.inicio = None
+        self.avisar = None  # Despierta a quien espera el turno
+
+    def __lt__(self, otro):
+        return (self.etiqueta, self.secuencia) < (otro.etiqueta, otro.secuencia)
+
+
+class ColaGemini:
+    """
+    Cola de admisión a Gemini con capacidad, equidad por cliente,
+    prioridad por clase y plazos (ver el comienzo del módulo).
+    """
+
+    def __init__(self, max_concurrentes=GEMINI_MAX_CONCURRENT, rpm=GEMINI_RPM, tpm=GEMINI_TPM,
+                 plazos=None, pesos=None, pausa_cuota=GEMINI_QUOTA_BACKOFF):
+        self.max_concurrentes = max_concurrentes
+        self.llamadas = Cubeta(rpm) if rpm > 0 else None
+        self.tokens = Cubeta(tpm) if tpm > 0 else None
+        self.plazos = plazos or {CLASE_AUTENTICADO: GEMINI_QUEUE_TIMEOUT, CLASE_ANONIMO: GEMINI_QUEUE_TIMEOUT_ANONIMO}
+        self.pesos = pesos or {CLASE_AUTENTICADO: GEMINI_PESO_AUTENTICADO, CLASE_ANONIMO: 1.0}
+        self.pausa_cuota = pausa_cuota
+
+        self._lock = threading.Lock()
+        self._cola = []  # heap de Turno por (etiqueta, secuencia)
+        self._secuencia = itertools.count()
+        self._virtual = 0.0  # Tiempo virtual: etiqueta del último turno concedido
+        self._fin_cliente = {}  # { cliente: etiqueta de fin de su última consulta }
+        self._pausa_hasta = 0.0
+        self._servicio = SERVICIO_INICIAL  # Promedio móvil de la duración de una llamada
+
+        # Contadores
+        self.en_curso = 0
+        self.esperando = {clase: 0 for clase in CLASES}
+        self.concedidos = {clase: 0 for clase in CLASES}
+        self.rechazados = {(clase, motivo): 0 for clase in CLASES for motivo in ('estimacion', 'plazo')}
+        self.pausas = 0
+
+    # ============================================
+    # ENTRADA Y SALIDA
+    # ============================================
+
+    def _encolar(self, cliente, clase, costo, avisar):
+        """
+        Pone la consulta en la cola (o la rechaza si no llegaría a tiempo).
+        `avisar` se llama (con el lock tomado) cuando se concede el turno.
+
+        Raises:
+            ServidorSaturado
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            plazo = self.plazos[clase]
+            # Start-time fair queueing: empieza cuando termina la consulta anterior del cliente
+            fin_anterior = self._fin_cliente.get(cliente, 0.0)
+            etiqueta = max(self._virtual, fin_anterior)
+            turno = Turno(cliente, clase, costo, etiqueta, next(self._secuencia), ahora + plazo)
+            turno.avisar = avisar
+
+            espera = self._estimar_espera(turno, ahora)
+            if espera > plazo:
+                self.rechazados[(clase, 'estimacion')] += 1
+                raise ServidorSaturado(
+                    'Hay demasiadas consultas esperando a Gemini. Intenta de nuevo en unos segundos.',
+                    retry_after=max(1, math.ceil(min(espera, 60)))
+                )
+
+            self._fin_cliente[cliente] = etiqueta + costo / self.pesos[clase]
+            if len(self._fin_cliente) > MAX_CLIENTES:
+                # Los clientes que ya no van adelantados no necesitan etiqueta
+                self._fin_cliente = {c: fin for c, fin in self._fin_cliente.items() if fin > self._virtual}
+            heapq.heappush(self._cola, turno)
+            self.esperando[clase] += 1
+            return turno
+
+    def _cancelar(self, turno):
+        """Saca de la cola un turno que no se va a usar. Debe llamarse con el lock tomado."""
+        if not turno.concedido and not turno.cancelado:
+            turno.cancelado = True
+            self.esperando[turno.clase] -= 1
+
+    def liberar(self, turno, response=None, error=None):
+        """
+        Devuelve un turno concedido. Con la respuesta de Gemini se ajustan los
+        tokens reservados; con un error de cuota agotada se pausa la cola.
+        Se puede llamar más de una vez: solo la primera cuenta.
+        """
+        with self._lock:
+            if turno is None or not turno.concedido or turno.liberado:
+                return
+            turno.liberado = True
+            ahora = time.monotonic()
+            self.en_curso -= 1
+            self._servicio += 0.2 * ((ahora - turno.inicio) - self._servicio)
+            usados = tokens_usados(response)
+            if self.tokens is not None and usados:
+                # Se reservó el máximo de salida: se devuelve lo que no se usó
+                self.tokens.recargar(ahora)
+                self.tokens.fichas = min(self.tokens.capacidad, self.tokens.fichas + turno.costo - usados)
+            if isinstance(error, CUOTA_AGOTADA):
+                self._pausa_hasta = max(self._pausa_hasta, ahora + self.pausa_cuota)
+                self.pausas += 1
+            self._despachar(ahora)
+
+    # ============================================
+    # DESPACHO
+    # ============================================
+
+    def _despachar(self, ahora):
+        """
+        Concede turnos mientras haya capacidad. Debe llamarse con el lock tomado.
+
+        Returns:
+            Segundos hasta que el siguiente turno podría pasar por ritmo o pausa
+            (None si espera a que se libere una llamada o la cola está vacía)
+        """
+        if ahora < self._pausa_hasta:
+            return self._pausa_hasta - ahora
+        for cubeta in (self.llamadas, self.tokens):
+            if cubeta is not None:
+                cubeta.recargar(ahora)
+
+        while self._cola and self.en_curso < self.max_concurrentes:
+            turno = self._cola[0]
+            if turno.cancelado:
+                heapq.heappop(self._cola)
+                continue
+            espera = max(
+                self.llamadas.espera(1) if self.llamadas is not None else 0.0,
+                self.tokens.espera(turno.costo) if self.tokens is not None else 0.0
+            )
+            if espera > 0:
+                return espera
+            heapq.heappop(self._cola)
+            if self.llamadas is not None:
+                self.llamadas.fichas -= 1
+            if self.tokens is not None:
+                self.tokens.fichas -= turno.costo
+            self._virtual = max(self._virtual, turno.etiqueta)
+            turno.concedido = True
+            turno.inicio = ahora
+            self.en_curso += 1
+            self.esperando[turno.clase] -= 1
+            self.concedidos[turno.clase] += 1
+            turno.avisar()
+        return None
+
+    def _estimar_espera(self, turno, ahora):
+        """
+        Segundos que esperaría `turno` si entrara ahora a la cola: por las
+        consultas que quedarían delante, por el ritmo y por la pausa de cuota.
+        Debe llamarse con el lock tomado.
+        """
+        delante = [t for t in self._cola if not t.cancelado and t < turno]
+        posicion = len(delante) + 1
+        espera = max(0.0, self._pausa_hasta - ahora)
+
+        libres = self.max_concurrentes - self.en_curso
+        if posicion > libres:
+            # Cada "ronda" de llamadas simultáneas dura lo que dura una llamada
+            espera = max(espera, math.ceil((posicion - libres) / self.max_concurrentes) * self._servicio)
+        if self.llamadas is not None:
+            self.llamadas.recargar(ahora)
+            espera = max(espera, (posicion - self.llamadas.fichas) / self.llamadas.por_segundo)
+        if self.tokens is not None:
+            self.tokens.recargar(ahora)
+            costo = sum(min(t.costo, self.tokens.capacidad) for t in delante + [turno])
+            espera = max(espera, (costo - self.tokens.fichas) / self.tokens.por_segundo)
+        return espera
+
+    def _rechazar_por_plazo(self, turno):
+        """Saca el turno vencido de la cola. Debe llamarse con el lock tomado."""
+        self._cancelar(turno)
+        self.rechazados[(turno.clase, 'plazo')] += 1
+        return ServidorSaturado(
+            'Hay demasiadas consultas esperando a Gemini. Intenta de nuevo en unos segundos.',
+            retry_after=max(1, math.ceil(self._servicio))
+        )
+
+    # ============================================
+    # ESPERA DEL TURNO
+    # ============================================
+
+    def pedir(self, cliente, clase, costo):
+        """
+        Espera (bloqueando el hilo) un turno para llamar a Gemini.
+
+        Args:
+            cliente: Clave de equidad (uid de Firebase o IP)
+            clase: CLASE_AUTENTICADO o CLASE_ANONIMO
+            costo: Tokens estimados de la llamada (entrada más máximo de salida)
+
+        Returns:
+            Turno: se devuelve con liberar()
+
+        Raises:
+            ServidorSaturado: si no va a haber turno dentro del plazo de la clase
+        """
+        aviso = threading.Event()
+        turno = self._encolar(cliente, clase, costo, aviso.set)
+        while True:
+            with self._lock:
+                ahora = time.monotonic()
+                siguiente = self._despachar(ahora)
+                if turno.concedido:
+                    return turno
+                restante = turno.limite - ahora
+                if restante <= 0:
+                    raise self._rechazar_por_plazo(turno)
+            aviso.wait(min(restante, siguiente) if siguiente is not None else restante)
+
+    async def pedir_async(self, cliente, clase, costo):
+        """Versión asíncrona de pedir (los turnos se conceden en el mismo event loop)."""
+        aviso = asyncio.Event()
+        turno = self._encolar(cliente, clase, costo, aviso.set)
+        try:
+            while True:
+                with self._lock:
+                    ahora = time.monotonic()
+                    siguiente = self._despachar(ahora)
+                    if turno.concedido:
+                        return turno
+                    restante = turno.limite - ahora
+                    if restante <= 0:
+                        raise self._rechazar_por_plazo(turno)
+                aviso.clear()
+                try:
+                    await asyncio.wait_for(aviso.wait(), min(restante, siguiente) if siguiente is not None else restante)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            # El cliente se fue: el turno se devuelve (o deja de esperarse)
+            with self._lock:
+                self._cancelar(turno)
+            self.liberar(turno)
+            raise
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'en_curso', 'esperando', 'concedidos', 'rechazados', 'pausas', ... }
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            return {
+                'en_curso': self.en_curso,
+                'max_concurrentes': self.max_concurrentes,
+                'esperando': dict(self.esperando),
+                'concedidos': dict(self.concedidos),
+                'rechazados': {f'{clase}_{motivo}': valor for (clase, motivo), valor in self.rechazados.items()},
+                'pausas': self.pausas,
+                'pausada': ahora < self._pausa_hasta,
+                'servicio_medio_s': round(self._servicio, 2)
+            }
+
+
+def tokens_usados(response):
+    """Tokens (entrada y salida) que informó Gemini en una respuesta, o 0."""
+    uso = getattr(response, 'usage_metadata', None)
+    if not uso:
+        return 0
+    return getattr(uso, 'total_token_count', 0) or 0
+
+
+def costo_prompt(prompt):
+    """Tokens que se reservan para un Prompt: los de entrada estimados más el máximo de salida."""
+    return prompt.tokens['total'] + prompt.config.max_output_tokens
+
+
+cola_gemini = ColaGemini()
+
+
+def _muestras_cola():
+    """Estado de la cola de Gemini para /api/metrics."""
+    with cola_gemini._lock:
+        muestras = [('viajeia_gemini_en_curso', 'gauge', {}, cola_gemini.en_curso),
+                    ('viajeia_gemini_pausas_total', 'counter', {}, cola_gemini.pausas)]
+        for clase in CLASES:
+            muestras.append(('viajeia_esperando_gemini', 'gauge', {'clase': clase}, cola_gemini.esperando[clase]))
+            muestras.append(('viajeia_gemini_turnos_total', 'counter', {'clase': clase}, cola_gemini.concedidos[clase]))
+        for (clase, motivo), valor in cola_gemini.rechazados.items():
+            muestras.append(('viajeia_rechazadas_cola_gemini_total', 'counter', {'clase': clase, 'motivo': motivo}, valor))
+    return muestras
+
+
+registro.agregar_colector(_muestras_cola)
@@ -1,19 +1,53 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
 import google.generativeai as genai
+import atexit
+import logging
 import os
-import requests
+import queue
+import threading
 import time
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError, as_completed
 from dotenv import load_dotenv
 
-# 🔒 SEGURIDAD: Importar módulos de seguridad
-from security import validar_pregunta, sanitizar_texto, validar_destino, validar_fecha
-from rate_limiter import verificar_limite, registrar_request
-
 # Cargar variables de entorno desde el archivo .env
+# (antes de importar los módulos del proyecto, que leen su configuración al importarse)
 load_dotenv()
 
+from metricas import configurar_logging, incrementar, medir, observar, registro
+
+configurar_logging()
+logger = logging.getLogger('viajeia.app')
+
+# 🔒 SEGURIDAD: Importar módulos de seguridad
+from rate_limiter import reservar_request, reservar_requests, reservar_request_destino, liberar_request
+from http_cliente import ClienteUpstream
+from precarga import crear_precargador
+from prompts import INSTRUCCION_SISTEMA, registrar_uso
+from gemini_cliente import crear_modelo
+from coalescencia import GEMINI_RESPONSE_TIMEOUT, generaciones
+from admision import ServidorSaturado, cola_gemini, costo_prompt
+from autenticacion import identificar_usuario
+from transporte import comprimir_respuesta
+from planificacion import (
+    GEMINI_MODEL, PROMPT_WEATHER_WAIT, opciones_cliente_gemini,
+    OPENWEATHER_URL, EXCHANGERATE_URL, UNSPLASH_URL, openweather_api_key, unsplash_api_key,
+    cache_clima, cache_tipo_cambio, cache_fotos, cache_disco, clave_destino,
+    parametros_clima, parsear_clima, parsear_tabla_cambio, tipo_cambio_desde_tabla,
+    parametros_fotos, parsear_fotos, pais_destino, obtener_moneda_pais, construir_info_destino,
+    construir_prompt, mensaje_error_gemini,
+    buscar_respuesta_cacheada, guardar_respuesta, registrar_turno, clave_generacion,
+    BATCH_DEADLINE, resultado_error_item, validar_consulta_destino
+)
+from consultas import (
+    CABECERAS_SSE, ENDPOINTS, leer_cuerpo, identidad_consulta, armar_solicitud, cargar_contexto,
+    armar_lote, asignar_reservas, error_consulta, error_rate_limit, error_saturado,
+    nuevo_plan, destino_solicitud, planes_lote, fuentes_precarga,
+    armar_respuesta, armar_item, error_item_gemini, errores_vencidos, armar_resultados,
+    evento_sse, evento_generacion, evento_info_destino, evento_fotos, evento_demorado,
+    respuesta_destino, respuesta_fotos_destino, estado_backend
+)
+
 app = Flask(__name__)
 # Configurar CORS para permitir peticiones desde el frontend
 # En producción, permite solo dominios específicos; en desarrollo, permite todos
@@ -23,349 +57,745 @@ CORS(app, resources={r"/api/*": {"origins": cors_origins}})
 # Inicializar el cliente de Gemini
 gemini_api_key = os.getenv('GEMINI_API_KEY')
 if not gemini_api_key:
-    print("⚠️  ADVERTENCIA: GEMINI_API_KEY no está configurada. Asegúrate de crear un archivo .env con tu API key.")
+    logger.warning("GEMINI_API_KEY no está configurada. Asegúrate de crear un archivo .env con tu API key.")
     model = None
 else:
-    genai.configure(api_key=gemini_api_key)
-    model = genai.GenerativeModel('gemini-2.0-flash')
-
-# Constantes de optimización
-SYSTEM_PROMPT = "Asistente experto en viajes. Respuestas prácticas y concisas."
-RESPONSE_FORMAT = """Formato obligatorio (5 secciones con saltos de línea):
-» ALOJAMIENTO: [recomendaciones]
-Þ COMIDA LOCAL: [recomendaciones]
- LUGARES IMPERDIBLES: [recomendaciones]
-ä CONSEJOS LOCALES: [tips]
-ø ESTIMACIÓN DE COSTOS: [breakdown]"""
-MAX_QUESTION_LENGTH = 500
-MIN_QUESTION_LENGTH = 10
+    genai.configure(api_key=gemini_api_key, **opciones_cliente_gemini())
+    # Prefijo fijo como system_instruction (y en la caché de contexto de Gemini si se puede)
+    model = crear_modelo(GEMINI_MODEL, INSTRUCCION_SISTEMA)
+
+# Hilos compartidos para el enriquecimiento (clima → tipo de cambio, fotos)
+ENRICHMENT_WORKERS = int(os.getenv('ENRICHMENT_WORKERS', '16'))
+enrichment_executor = ThreadPoolExecutor(
+    max_workers=ENRICHMENT_WORKERS,
+    thread_name_prefix='enriquecimiento'
+)
+
+# Hilos para las consultas a Gemini de los lotes (/api/planificar/batch)
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '8'))
+batch_executor = ThreadPoolExecutor(
+    max_workers=BATCH_WORKERS,
+    thread_name_prefix='lote'
+)
 
 # Inicializar OpenWeatherMap API
-openweather_api_key = os.getenv('OPENWEATHER_API_KEY')
 if not openweather_api_key:
-    print("⚠️  ADVERTENCIA: OPENWEATHER_API_KEY no está configurada. La funcionalidad del clima no estará disponible.")
+    logger.warning("OPENWEATHER_API_KEY no está configurada. La funcionalidad del clima no estará disponible.")
 
 # Inicializar Unsplash API
-unsplash_api_key = os.getenv('UNSPLASH_API_KEY')
 if not unsplash_api_key:
-    print("⚠️  ADVERTENCIA: UNSPLASH_API_KEY no está configurada. Las fotos no estarán disponibles.")
+    logger.warning("UNSPLASH_API_KEY no está configurada. Las fotos no estarán disponibles.")
+
+# Clientes HTTP con conexiones persistentes (uno por upstream)
+cliente_clima = ClienteUpstream('openweather', OPENWEATHER_URL)
+cliente_cambio = ClienteUpstream('exchangerate', EXCHANGERATE_URL)
+cliente_fotos = ClienteUpstream(
+    'unsplash', UNSPLASH_URL,
+    headers={'Authorization': f'Client-ID {unsplash_api_key}'} if unsplash_api_key else None
+)
 
 def obtener_clima_ciudad(nombre_ciudad):
     """
-    Obtiene el clima actual de una ciudad usando OpenWeatherMap API
+    Obtiene el clima actual de una ciudad (con caché de WEATHER_CACHE_TTL)
     """
     if not openweather_api_key:
         return None
-    
+
+    with medir('clima'):
+        return cache_clima.obtener_o_calcular(
+            clave_destino(nombre_ciudad),
+            lambda: _consultar_clima(nombre_ciudad)
+        )
+
+def _consultar_clima(nombre_ciudad):
+    """
+    Obtiene el clima actual de una ciudad usando OpenWeatherMap API
+    """
     try:
-        # URL de la API de OpenWeatherMap
-        url = f"http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            'q': nombre_ciudad,
-            'appid': openweather_api_key,
-            'units': 'metric',  # Para obtener temperatura en Celsius
-            'lang': 'es'  # Respuestas en español
-        }
-        
-        response = requests.get(url, params=params, timeout=5)
+        response = cliente_clima.get('/data/2.5/weather', params=parametros_clima(nombre_ciudad))
         
         if response.status_code == 200:
-            data = response.json()
-            
-            # Obtener zona horaria (offset en segundos)
-            timezone_offset = data.get('timezone', 0)  # Offset en segundos
-            
-            # Extraer información relevante
-            clima_info = {
-                'ciudad': data['name'],
-                'pais': data['sys']['country'],
-                'temperatura': round(data['main']['temp']),
-                'sensacion_termica': round(data['main']['feels_like']),
-                'descripcion': data['weather'][0]['description'].capitalize(),
-                'humedad': data['main']['humidity'],
-                'viento': round(data['wind']['speed'] * 3.6),  # Convertir m/s a km/h
-                'presion': data['main']['pressure'],
-                'visibilidad': data.get('visibility', 0) / 1000 if data.get('visibility') else None,  # Convertir a km
-                'timezone_offset': timezone_offset  # Offset en segundos
-            }
-            return clima_info
+            return parsear_clima(response.json())
         else:
-            print(f"Error al obtener clima: {response.status_code}")
+            logger.warning("Error al obtener clima: %s", response.status_code)
             return None
             
     except Exception as e:
-        print(f"Error al obtener clima: {str(e)}")
+        logger.warning("Error al obtener clima: %s", e)
         return None
 
 def obtener_tipo_cambio(base_currency='USD', target_currency='EUR'):
     """
-    Obtiene el tipo de cambio usando exchangerate-api.com (gratis, no requiere API key)
+    Obtiene el tipo de cambio entre dos monedas.
+    Usa la tabla completa de la moneda base, cacheada durante FX_CACHE_TTL.
+    """
+    with medir('tipo_cambio'):
+        return tipo_cambio_desde_tabla(obtener_tabla_cambio(base_currency), target_currency)
+
+def obtener_tabla_cambio(base_currency='USD'):
+    """
+    Obtiene todas las tasas de una moneda base (con caché): una sola descarga
+    sirve para cualquier moneda de destino.
+
+    Returns:
+        dict: { 'base': str, 'rates': {moneda: tasa}, 'fecha': str } o None
+    """
+    return cache_tipo_cambio.obtener_o_calcular(
+        base_currency.upper(),
+        lambda: _consultar_tabla_cambio(base_currency.upper())
+    )
+
+def _consultar_tabla_cambio(base_currency):
+    """
+    Descarga la tabla de tipos de cambio usando exchangerate-api.com (gratis, no requiere API key)
     """
     try:
-        url = f"https://api.exchangerate-api.com/v4/latest/{base_currency}"
-        response = requests.get(url, timeout=5)
+        response = cliente_cambio.get(f'/v4/latest/{base_currency}')
         
         if response.status_code == 200:
-            data = response.json()
-            rates = data.get('rates', {})
-            
-            if target_currency in rates:
-                return {
-                    'base': base_currency,
-                    'target': target_currency,
-                    'rate': rates[target_currency],
-                    'fecha': data.get('date', '')
-                }
+            return parsear_tabla_cambio(response.json(), base_currency)
         return None
     except Exception as e:
-        print(f"Error al obtener tipo de cambio: {str(e)}")
+        logger.warning("Error al obtener tipo de cambio: %s", e)
         return None
 
-def obtener_moneda_pais(codigo_pais):
+def obtener_fotos_destino(nombre_destino, cantidad=3):
     """
-    Mapea códigos de país a sus monedas principales
+    Obtiene fotos de un destino (con caché de PHOTOS_CACHE_TTL)
     """
-    monedas_paises = {
-        'US': 'USD', 'MX': 'MXN', 'AR': 'ARS', 'CL': 'CLP', 'CO': 'COP', 'PE': 'PEN',
-        'BR': 'BRL', 'ES': 'EUR', 'FR': 'EUR', 'IT': 'EUR', 'DE': 'EUR', 'GB': 'GBP',
-        'JP': 'JPY', 'CN': 'CNY', 'IN': 'INR', 'AU': 'AUD', 'CA': 'CAD', 'CH': 'CHF',
-        'NZ': 'NZD', 'KR': 'KRW', 'TH': 'THB', 'SG': 'SGD', 'MY': 'MYR', 'ID': 'IDR',
-        'PH': 'PHP', 'VN': 'VND', 'TR': 'TRY', 'EG': 'EGP', 'ZA': 'ZAR', 'AE': 'AED',
-        'SA': 'SAR', 'IL': 'ILS', 'RU': 'RUB', 'PL': 'PLN', 'NL': 'EUR', 'BE': 'EUR',
-        'PT': 'EUR', 'GR': 'EUR', 'IE': 'EUR', 'AT': 'EUR', 'FI': 'EUR', 'SE': 'SEK',
-        'NO': 'NOK', 'DK': 'DKK', 'CZ': 'CZK', 'HU': 'HUF', 'RO': 'RON', 'BG': 'BGN'
-    }
-    return monedas_paises.get(codigo_pais.upper(), 'USD')
+    if not unsplash_api_key:
+        return []
 
-def obtener_fotos_destino(nombre_destino, cantidad=3):
+    with medir('fotos'):
+        return cache_fotos.obtener_o_calcular(
+            (clave_destino(nombre_destino), cantidad),
+            lambda: _consultar_fotos(nombre_destino, cantidad)
+        )
+
+def _consultar_fotos(nombre_destino, cantidad):
     """
     Obtiene fotos hermosas de un destino usando Unsplash API
     """
-    if not unsplash_api_key:
-        return []
-    
     try:
-        # URL de la API de Unsplash
-        url = "https://api.unsplash.com/search/photos"
-        headers = {
-            'Authorization': f'Client-ID {unsplash_api_key}'
-        }
-        params = {
-            'query': nombre_destino,
-            'per_page': cantidad,
-            'orientation': 'landscape',  # Fotos horizontales
-            'order_by': 'popularity'  # Las más populares
-        }
-        
-        response = requests.get(url, headers=headers, params=params, timeout=5)
+        response = cliente_fotos.get('/search/photos', params=parametros_fotos(nombre_destino, cantidad))
         
         if response.status_code == 200:
-            data = response.json()
-            fotos = []
-            
-            for photo in data.get('results', [])[:cantidad]:
-                fotos.append({
-                    'url': photo['urls']['regular'],  # Tamaño regular (buena calidad)
-                    'url_pequeña': photo['urls']['small'],  # Para carga rápida
-                    'url_grande': photo['urls']['full'],  # Para ver en grande
-                    'autor': photo['user']['name'],
-                    'descripcion': photo.get('description', '') or photo.get('alt_description', '')
-                })
-            
-            return fotos
+            return parsear_fotos(response.json(), cantidad)
         else:
-            print(f"Error al obtener fotos de Unsplash: {response.status_code}")
+            logger.warning("Error al obtener fotos de Unsplash: %s", response.status_code)
             return []
             
     except Exception as e:
-        print(f"Error al obtener fotos: {str(e)}")
+        logger.warning("Error al obtener fotos: %s", e)
         return []
 
+# Precarga de los destinos populares: clima, fotos y la tabla de cambio en USD
+precargador = crear_precargador(clave_destino, fuentes_precarga(
+    _consultar_clima, _consultar_fotos, _consultar_tabla_cambio,
+    con_clima=bool(openweather_api_key), con_fotos=bool(unsplash_api_key)
+), disco=cache_disco)
+precargador.cargar_popularidad()
+atexit.register(precargador.detener)
+
+def _clima_y_cambio(destino, futuro_clima):
+    """
+    Cadena clima → tipo de cambio (la moneda depende del país que devuelve el clima).
+    El clima se publica en `futuro_clima` apenas llega, sin esperar al tipo de cambio.
+    """
+    info_clima = None
+    try:
+        logger.debug("Buscando clima para: %s", destino)
+        info_clima = obtener_clima_ciudad(destino)
+    finally:
+        futuro_clima.set_result(info_clima)
+
+    if not info_clima:
+        logger.info("No se pudo obtener el clima para: %s", destino)
+        return None
+
+    logger.debug("Clima obtenido para %s: %s°C", info_clima['ciudad'], info_clima['temperatura'])
+    return obtener_tipo_cambio('USD', obtener_moneda_pais(info_clima['pais']))
+
+def iniciar_panel(destino):
+    """
+    Lanza las consultas del panel lateral de un destino (clima y tipo de cambio).
+
+    Returns:
+        dict: { 'clima': Future, 'tipo_cambio': Future }
+    """
+    pais = pais_destino(destino)
+    if pais:
+        # El índice ya sabe el país: el tipo de cambio va en paralelo con el clima
+        return {
+            'clima': enrichment_executor.submit(obtener_clima_ciudad, destino),
+            'tipo_cambio': enrichment_executor.submit(obtener_tipo_cambio, 'USD', obtener_moneda_pais(pais))
+        }
+    futuro_clima = Future()
+    return {
+        'clima': futuro_clima,
+        'tipo_cambio': enrichment_executor.submit(_clima_y_cambio, destino, futuro_clima)
+    }
+
+def iniciar_enriquecimiento(destino):
+    """
+    Lanza en paralelo las consultas de enriquecimiento de un destino.
+
+    Returns:
+        dict: { 'clima': Future, 'tipo_cambio': Future, 'fotos': Future }
+    """
+    precargador.registrar(destino)
+    logger.debug("Buscando fotos para: %s", destino)
+    futuros = {'fotos': enrichment_executor.submit(obtener_fotos_destino, destino, 3)}
+    futuros.update(iniciar_panel(destino))
+    return futuros
+
+def esperar_resultado(futuro, limite, por_defecto):
+    """
+    Espera el resultado de una consulta como mucho hasta `limite` (time.monotonic()).
+    Si el upstream es lento o falla, devuelve `por_defecto` (resultado parcial).
+    """
+    if futuro is None:
+        return por_defecto
+    try:
+        return futuro.result(timeout=max(0.0, limite - time.monotonic()))
+    except FuturesTimeoutError:
+        return por_defecto
+    except Exception as e:
+        logger.warning("Error en enriquecimiento: %s", e)
+        return por_defecto
+
+def responder(resultado):
+    """Respuesta JSON para un resultado de consultas.py: (datos, status[, cabeceras])."""
+    datos, *resto = resultado
+    return (jsonify(datos), *resto)
+
+def leer_json():
+    """
+    JSON del cuerpo de la consulta (puede venir comprimido con gzip o br).
+
+    Returns:
+        tuple: (datos, None) o (None, (respuesta_error, status))
+    """
+    data, error = leer_cuerpo(request.get_data(), request.headers.get('Content-Encoding'))
+    if error:
+        return None, responder(error)
+    return data, None
+
+def identificar_consulta(data):
+    """Quién hace la consulta: (usuario_id, clase, equidad); ver consultas.identidad_consulta."""
+    return identidad_consulta(data, identificar_usuario(request.headers.get('Authorization')), request.remote_addr)
+
+def preparar_solicitud():
+    """
+    Lee el cuerpo, aplica las validaciones comunes a una consulta de
+    planificación y, si es válida, reserva el cupo del usuario (rate limiting).
+    Si la consulta falla después, el cupo se devuelve con liberar_solicitud.
+
+    Returns:
+        tuple: (solicitud, None) si es válida, o (None, (respuesta_error, status))
+    """
+    data, error = leer_json()
+    if error:
+        return None, error
+    solicitud, error = armar_solicitud(data, identificar_consulta(data), model is not None)
+    if error:
+        return None, responder(error)
+
+    # 🔒 SEGURIDAD: Rate Limiting - Verificar límites y reservar el cupo (operación atómica)
+    limite_check = reservar_request(solicitud['usuario_id'])
+    if not limite_check['allowed']:
+        return None, responder(error_rate_limit(limite_check))
+    solicitud['reserva'] = limite_check['reserva']
+
+    try:
+        cargar_contexto(solicitud)
+    except BaseException:
+        liberar_solicitud(solicitud)
+        raise
+    return solicitud, None
+
+def esperar_turno_gemini(solicitud, prompt):
+    """
+    Espera en la cola de admisión un turno para llamar a Gemini con `prompt`.
+    Se devuelve con cola_gemini.liberar.
+
+    Raises:
+        ServidorSaturado: si no va a haber turno dentro del plazo de la clase
+    """
+    with medir('cola_gemini'):
+        return cola_gemini.pedir(solicitud['equidad'], solicitud['clase'], costo_prompt(prompt))
+
+def liberar_solicitud(solicitud):
+    """
+    Devuelve el cupo reservado de una consulta que no llegó a completarse
+    (solo cuentan las consultas exitosas).
+    """
+    if solicitud:
+        # pop: la misma reserva nunca se devuelve dos veces
+        liberar_request(solicitud['usuario_id'], solicitud.pop('reserva', None))
+
+def iniciar_planificacion(solicitud):
+    """
+    Detecta el destino y lanza el enriquecimiento en segundo plano.
+
+    Returns:
+        dict: { 'destino', 'futuros', 'limite', 'info_clima', 'zona_cliente' }
+    """
+    destino = destino_solicitud(solicitud)
+
+    # Lanzar clima → tipo de cambio y fotos en paralelo, con un plazo total
+    futuros = iniciar_enriquecimiento(destino) if destino else {}
+    return nuevo_plan(destino, futuros, solicitud['zona_horaria'])
+
+def preparar_prompt(plan, solicitud):
+    """
+    Arma el prompt de Gemini para un plan ya iniciado.
+    El clima solo entra al prompt si llega rápido; Gemini no lo espera más.
+    """
+    with medir('prompt'):
+        espera_clima = min(plan['limite'], time.monotonic() + PROMPT_WEATHER_WAIT)
+        plan['info_clima'] = esperar_resultado(plan['futuros'].get('clima'), espera_clima, None)
+        return construir_prompt(
+            solicitud['pregunta'], solicitud['datos_viaje'], plan['destino'],
+            plan['info_clima'], solicitud['contexto']
+        )
+
+def generar_respuesta(solicitud, plan):
+    """
+    Respuesta de Gemini para una consulta que no estaba en la caché.
+    Si una consulta idéntica ya la está generando, espera y comparte su resultado.
+    """
+    generacion, nueva = generaciones.unirse(clave_generacion(solicitud, plan['destino']))
+    if not nueva:
+        respuesta = generacion.resultado()
+        registrar_turno(solicitud, respuesta)
+        return respuesta
+
+    try:
+        prompt = preparar_prompt(plan, solicitud)
+        turno = esperar_turno_gemini(solicitud, prompt)
+        # Generar respuesta con Gemini
+        response = error_gemini = None
+        try:
+            with medir('gemini'):
+                response = model.generate_content(
+                    prompt.texto,
+                    generation_config=prompt.config
+                )
+        except BaseException as error:
+            error_gemini = error
+            raise
+        finally:
+            cola_gemini.liberar(turno, response, error=error_gemini)
+        registrar_uso(prompt, response)
+
+        # Extraer la respuesta de Gemini
+        respuesta = response.text
+        guardar_respuesta(solicitud, plan['destino'], respuesta)
+    except BaseException as error:
+        generacion.fallar(error)
+        raise
+    generacion.terminar(respuesta)
+    return respuesta
+
+def recoger_info_destino(plan):
+    """Espera (dentro del plazo) la cadena clima → tipo de cambio y arma el panel."""
+    futuros = plan['futuros']
+    info_clima = plan['info_clima'] or esperar_resultado(futuros.get('clima'), plan['limite'], None)
+    tipo_cambio = esperar_resultado(futuros.get('tipo_cambio'), plan['limite'], None)
+    return construir_info_destino(info_clima, tipo_cambio, plan['destino'], plan['zona_cliente'])
+
+def recoger_fotos(plan):
+    """Espera (dentro del plazo) las fotos del destino."""
+    fotos_destino = esperar_resultado(plan['futuros'].get('fotos'), plan['limite'], [])
+    if fotos_destino:
+        logger.debug("%d fotos obtenidas para %s", len(fotos_destino), plan['destino'])
+    elif plan['futuros']:
+        logger.info("No se pudieron obtener fotos para: %s", plan['destino'])
+    return fotos_destino
+
 @app.route('/api/planificar', methods=['POST'])
 def planificar_viaje():
+    solicitud = None
     try:
-        data = request.get_json()
-        pregunta = data.get('pregunta', '')
-        datos_viaje = data.get('datosViaje', {})
-        historial_conversaciones = data.get('historial', [])
-        usuario_id = data.get('usuarioId', request.remote_addr)  # Usar IP si no hay usuarioId
-        
-        # 🔒 SEGURIDAD: Rate Limiting - Verificar límites de uso
-        limite_check = verificar_limite(usuario_id)
-        if not limite_check['allowed']:
-            return jsonify({
-                'error': limite_check['reason'],
-                'retry_after': limite_check['retry_after'],
-                'limit_type': limite_check['limit_type']
-            }), 429  # 429 = Too Many Requests
-        
-        # 🔒 SEGURIDAD: Validar pregunta
-        es_valida, mensaje_error = validar_pregunta(pregunta)
-        if not es_valida:
-            return jsonify({'error': mensaje_error}), 400
-        
-        # 🔒 SEGURIDAD: Sanitizar pregunta antes de procesarla
-        pregunta = sanitizar_texto(pregunta.strip())
-        
-        # 🔒 SEGURIDAD: Validar datos del viaje si están presentes
-        if datos_viaje:
-            destino = datos_viaje.get('destino', '')
-            fecha = datos_viaje.get('fecha', '')
-            
-            if destino:
-                es_valido, mensaje = validar_destino(destino)
-                if not es_valido:
-                    return jsonify({'error': mensaje}), 400
-            
-            if fecha:
-                es_valida, mensaje = validar_fecha(fecha)
-                if not es_valida:
-                    return jsonify({'error': mensaje}), 400
-        
-        # Verificar que Gemini esté configurado
-        if not model:
-            return jsonify({
-                'error': 'Gemini no está configurado. Por favor, crea un archivo .env con tu GEMINI_API_KEY.'
-            }), 500
+        with medir('validacion'):
+            solicitud, error = preparar_solicitud()
+        if error:
+            return error
         
         # Llamar a la API de Gemini
         try:
-            # Obtener el destino (de datos_viaje o intentar extraerlo de la pregunta)
-            destino = datos_viaje.get('destino', '') if datos_viaje else ''
-            
-            # Si no hay destino en datos_viaje, intentar extraerlo de la pregunta
-            if not destino:
-                # Buscar nombres de ciudades comunes en la pregunta (esto es básico, se puede mejorar)
-                palabras = pregunta.split()
-                # Si la pregunta menciona "viaje a", "ir a", "visitar", etc.
-                for i, palabra in enumerate(palabras):
-                    if palabra.lower() in ['a', 'a:', 'viaje', 'viajar', 'visitar', 'ir'] and i + 1 < len(palabras):
-                        destino = palabras[i + 1].strip('.,!?')
-                        break
-            
-            # Debug: imprimir el destino detectado
-            print(f"🔍 Destino detectado: {destino}")
-            
-            # Obtener información del clima si hay un destino
-            info_clima = None
-            info_destino = None  # Información completa del destino para el panel lateral
-            if destino and destino.strip():
-                print(f"🌤️ Buscando clima para: {destino}")
-                info_clima = obtener_clima_ciudad(destino)
-                if info_clima:
-                    print(f"✅ Clima obtenido para {info_clima['ciudad']}: {info_clima['temperatura']}°C")
-                    
-                    # Preparar información para el panel lateral
-                    # Calcular diferencia horaria
-                    destino_offset = info_clima.get('timezone_offset', 0)  # Offset del destino en segundos desde UTC
-                    
-                    # Obtener offset local desde UTC (en segundos)
-                    local_utc_offset = -time.timezone if time.daylight == 0 else -time.altzone
-                    
-                    # Calcular diferencia entre destino y local
-                    diferencia_segundos = destino_offset - local_utc_offset
-                    diferencia_horas = diferencia_segundos / 3600
-                    
-                    # Calcular hora del destino (UTC + offset del destino)
-                    hora_utc = datetime.now(timezone.utc)
-                    hora_destino = hora_utc + timedelta(seconds=destino_offset)
-                    
-                    # Obtener tipo de cambio
-                    moneda_destino = obtener_moneda_pais(info_clima['pais'])
-                    tipo_cambio = obtener_tipo_cambio('USD', moneda_destino)
-                    
-                    info_destino = {
-                        'ciudad': info_clima['ciudad'],
-                        'pais': info_clima['pais'],
-                        'temperatura': info_clima['temperatura'],
-                        'descripcion': info_clima['descripcion'],
-                        'diferencia_horaria': round(diferencia_horas, 1),
-                        'hora_destino': hora_destino.strftime('%H:%M'),
-                        'moneda': moneda_destino,
-                        'tipo_cambio': tipo_cambio['rate'] if tipo_cambio else None,
-                        'simbolo_moneda': tipo_cambio['target'] if tipo_cambio else moneda_destino
-                    }
-                else:
-                    print(f"⚠️ No se pudo obtener el clima para: {destino}")
-            
-            # Obtener fotos del destino
-            fotos_destino = []
-            if destino and destino.strip():
-                print(f"📸 Buscando fotos para: {destino}")
-                fotos_destino = obtener_fotos_destino(destino, cantidad=3)
-                if fotos_destino:
-                    print(f"✅ {len(fotos_destino)} fotos obtenidas para {destino}")
-                else:
-                    print(f"⚠️ No se pudieron obtener fotos para: {destino}")
-            
-            # Construir contexto optimizado (solo información esencial)
-            contexto = []
+            plan = iniciar_planificacion(solicitud)
             
-            # Datos del viaje (solo si existen)
-            if datos_viaje and (destino or datos_viaje.get('fecha') or datos_viaje.get('presupuesto')):
-                viaje_info = []
-                if destino:
-                    viaje_info.append(f"Destino: {destino}")
-                if datos_viaje.get('fecha'):
-                    viaje_info.append(f"Fecha: {datos_viaje['fecha']}")
-                if datos_viaje.get('presupuesto'):
-                    viaje_info.append(f"Presupuesto: {datos_viaje['presupuesto']}")
-                if viaje_info:
-                    contexto.append("Viaje: " + " | ".join(viaje_info))
-            
-            # Clima (solo datos esenciales)
-            if info_clima:
-                contexto.append(f"Clima: {info_clima['temperatura']}°C, {info_clima['descripcion']}")
-            
-            # Historial (solo última conversación relevante)
-            if historial_conversaciones:
-                ultima = historial_conversaciones[-1]
-                contexto.append(f"Contexto previo: {ultima.get('pregunta', '')[:50]}...")
-            
-            # Construir prompt optimizado: sistema + formato + contexto + pregunta
-            contexto_texto = "\n".join(contexto) if contexto else ""
-            prompt = f"{SYSTEM_PROMPT}\n\n{RESPONSE_FORMAT}"
-            if contexto_texto:
-                prompt += f"\n\nContexto:\n{contexto_texto}"
-            prompt += f"\n\nPregunta: {pregunta}\n\nResponde usando el formato especificado con saltos de línea entre secciones."
-            
-            # Generar respuesta con Gemini
-            response = model.generate_content(
-                prompt,
-                generation_config=genai.types.GenerationConfig(
-                    max_output_tokens=800,
-                    temperature=0.8,  # Un poco más creativo para ser más entusiasta
-                )
-            )
-            
-            # Extraer la respuesta de Gemini
-            respuesta = response.text
+            respuesta = buscar_respuesta_cacheada(solicitud, plan['destino'])
+            if respuesta is None:
+                respuesta = generar_respuesta(solicitud, plan)
+
+            # Recoger el enriquecimiento dentro del plazo; lo que no llegó queda vacío
+            with medir('enriquecimiento'):
+                info_destino = recoger_info_destino(plan)
+                fotos_destino = recoger_fotos(plan)
             
+        except ServidorSaturado as saturado:
+            liberar_solicitud(solicitud)
+            return responder(error_saturado(saturado))
         except Exception as gemini_error:
-            error_msg = str(gemini_error)
-            # Mensajes más amigables para errores comunes
-            if "quota" in error_msg.lower() or "quota_exceeded" in error_msg.lower():
-                error_msg = "Has excedido la cuota de la API de Gemini. Por favor, verifica tu plan en https://makersuite.google.com/app/apikey"
-            elif "invalid_api_key" in error_msg.lower() or "authentication" in error_msg.lower() or "API_KEY_INVALID" in error_msg:
-                error_msg = "La API key de Gemini no es válida. Por favor, verifica tu archivo .env"
-            elif "rate_limit" in error_msg.lower() or "RESOURCE_EXHAUSTED" in error_msg:
-                error_msg = "Has excedido el límite de solicitudes. Por favor, espera un momento e intenta de nuevo."
-            
-            return jsonify({
-                'error': f'Error con Gemini: {error_msg}'
-            }), 500
+            incrementar('viajeia_gemini_errores_total')
+            liberar_solicitud(solicitud)
+            return responder(error_consulta(mensaje_error_gemini(gemini_error), 500))
         
-        # 🔒 SEGURIDAD: Registrar que el usuario hizo una consulta (después de éxito)
-        registrar_request(usuario_id)
-        
-        return jsonify({
-            'respuesta': respuesta,
-            'fotos': fotos_destino,
-            'info_destino': info_destino  # Información para el panel lateral
-        }), 200
+        with medir('serializacion'):
+            return jsonify(armar_respuesta(solicitud, respuesta, fotos_destino, info_destino)), 200
         
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        liberar_solicitud(solicitud)
+        return responder(error_consulta(str(e), 500))
+
+def _producir_tokens(solicitud, plan, prompt, generacion, turno):
+    """
+    Recorre la respuesta de Gemini en streaming y publica cada fragmento en
+    la generación (la siguen esta consulta y las idénticas que se sumen).
+    Corre en su propio hilo para que el panel y las fotos no esperen al primer token.
+    Si todos los clientes se desconectan, deja de generar. Al terminar
+    devuelve el turno de Gemini.
+    """
+    response = error = None
+    try:
+        inicio = time.perf_counter()
+        with medir('gemini'):
+            response = model.generate_content(
+                prompt.texto,
+                generation_config=prompt.config,
+                stream=True
+            )
+            for chunk in response:
+                if generacion.cancelar_si_abandonada():
+                    return
+                texto = chunk.text
+                if texto:
+                    if not generacion.fragmentos:
+                        observar('viajeia_etapa_segundos', time.perf_counter() - inicio, etapa='gemini_primer_token')
+                    generacion.publicar(texto)
+        registrar_uso(prompt, response)
+        guardar_respuesta(solicitud, plan['destino'], generacion.texto)
+        generacion.terminar()
+    except BaseException as gemini_error:
+        error = gemini_error
+        incrementar('viajeia_gemini_errores_total')
+        generacion.fallar(gemini_error)
+    finally:
+        cola_gemini.liberar(turno, response, error=error)
+
+def respuesta_sse(eventos, cerrar):
+    """
+    Respuesta SSE que llama a `cerrar` cuando el servidor la cierra. Lo que
+    el stream libera al terminar no puede quedar solo en el finally del
+    generador: si el cliente se desconecta antes de que se empiece a
+    recorrer, el generador nunca corre. `cerrar` debe ser idempotente.
+    """
+    respuesta = Response(stream_with_context(eventos), mimetype='text/event-stream', headers=CABECERAS_SSE)
+    respuesta.call_on_close(cerrar)
+    return respuesta
+
+@app.route('/api/planificar/stream', methods=['POST'])
+def planificar_viaje_stream():
+    """
+    Igual que /api/planificar, pero responde con Server-Sent Events:
+    - info_destino: panel lateral, apenas están el clima y el tipo de cambio
+    - fotos: fotos del destino, apenas llegan
+    - token: cada fragmento de texto de Gemini, en cuanto se genera
+    - fin / error: cierre del stream
+    Si la cola de Gemini está saturada, responde 503 antes de abrir el stream.
+    """
+    solicitud = None
+    try:
+        with medir('validacion'):
+            solicitud, error = preparar_solicitud()
+        if error:
+            return error
+        plan = iniciar_planificacion(solicitud)
+
+        respuesta_cacheada = buscar_respuesta_cacheada(solicitud, plan['destino'])
+        generacion = prompt = turno = None
+        nueva = False
+        if respuesta_cacheada is None:
+            # Si una consulta idéntica ya se está generando, este stream la sigue
+            generacion, nueva = generaciones.unirse(clave_generacion(solicitud, plan['destino']))
+        if nueva:
+            try:
+                prompt = preparar_prompt(plan, solicitud)
+                turno = esperar_turno_gemini(solicitud, prompt)
+            except BaseException as error:
+                generacion.fallar(error)
+                raise
+    except ServidorSaturado as saturado:
+        liberar_solicitud(solicitud)
+        return responder(error_saturado(saturado))
+    except Exception as e:
+        liberar_solicitud(solicitud)
+        return responder(error_consulta(str(e), 500))
+
+    cola = queue.Queue()
+    futuros = plan['futuros']
+
+    def oyente(tipo, dato):
+        """Pasa los eventos de la generación (propia o compartida) a la cola del stream."""
+        cola.put(evento_generacion(tipo, dato))
+
+    # El panel y las fotos se publican en la cola en cuanto terminan
+    if futuros:
+        futuros['tipo_cambio'].add_done_callback(lambda _: cola.put(('info_destino', None)))
+        futuros['fotos'].add_done_callback(lambda _: cola.put(('fotos', None)))
+
+    if respuesta_cacheada is not None:
+        cola.put(('token', respuesta_cacheada))
+        cola.put(('gemini_fin', None))
+    else:
+        generacion.escuchar(oyente)
+        if nueva:
+            threading.Thread(
+                target=_producir_tokens,
+                args=(solicitud, plan, prompt, generacion, turno),
+                daemon=True
+            ).start()
+
+    completado = cerrado = False
+
+    def cerrar():
+        """Deja la generación y, si la consulta no terminó, libera su cupo."""
+        nonlocal cerrado
+        if cerrado:
+            return
+        cerrado = True
+        if generacion is not None:
+            generacion.dejar(oyente)
+        # Si Gemini falló o el cliente se desconectó, la consulta no cuenta
+        if not completado:
+            liberar_solicitud(solicitud)
+
+    def eventos():
+        nonlocal completado
+        pendientes = {'info_destino', 'fotos'} if futuros else set()
+        gemini_terminado = False
+        try:
+            while not gemini_terminado or pendientes:
+                if gemini_terminado:
+                    # Gemini ya respondió: el enriquecimiento solo espera hasta el plazo
+                    restante = plan['limite'] - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        tipo, dato = cola.get(timeout=restante)
+                    except queue.Empty:
+                        break
+                else:
+                    try:
+                        tipo, dato = cola.get(timeout=GEMINI_RESPONSE_TIMEOUT)
+                    except queue.Empty:
+                        yield evento_demorado()
+                        return
+
+                if tipo == 'token':
+                    yield evento_sse('token', {'texto': dato})
+                elif tipo == 'gemini_fin':
+                    gemini_terminado = True
+                    if generacion is not None and not nueva:
+                        # Respuesta compartida: el turno se suma también a esta conversación
+                        registrar_turno(solicitud, generacion.texto)
+                elif tipo == 'gemini_error':
+                    yield evento_sse('error', {'error': dato})
+                    return
+                elif tipo in pendientes:
+                    pendientes.discard(tipo)
+                    if tipo == 'info_destino':
+                        yield evento_info_destino(solicitud, recoger_info_destino(plan))
+                    else:
+                        yield evento_fotos(solicitud, recoger_fotos(plan))
+
+            # Lo que no llegó dentro del plazo se envía parcial o vacío
+            if 'info_destino' in pendientes:
+                yield evento_info_destino(solicitud, recoger_info_destino(plan))
+            if 'fotos' in pendientes:
+                yield evento_fotos(solicitud, [])
+
+            completado = True
+            yield evento_sse('fin', {})
+        finally:
+            cerrar()
+
+    return respuesta_sse(eventos(), cerrar)
+
+def preparar_lote(data):
+    """
+    Valida un lote y reserva el cupo de todas sus consultas válidas en un
+    solo paso (se reservan todas o ninguna). Las consultas inválidas no
+    ocupan cupo y quedan como resultado con error.
+
+    Returns:
+        tuple: (lote, None) si se puede procesar, o (None, (respuesta_error, status))
+    """
+    lote, error = armar_lote(data, identificar_consulta(data), model is not None)
+    if error:
+        return None, responder(error)
+    if not lote['solicitudes']:
+        return lote, None
+
+    # 🔒 SEGURIDAD: Rate Limiting - todo el lote en una sola operación atómica
+    limite_check = reservar_requests(lote['usuario_id'], len(lote['solicitudes']))
+    if not limite_check['allowed']:
+        return None, responder(error_rate_limit(limite_check))
+    asignar_reservas(lote, limite_check['reservas'])
+    return lote, None
+
+def iniciar_lote(lote):
+    """
+    Lanza el enriquecimiento una sola vez por destino distinto (ver consultas.planes_lote).
+
+    Returns:
+        list: [(indice, solicitud, plan)]
+    """
+    tareas = planes_lote(lote, iniciar_enriquecimiento)
+    logger.debug("Lote de %d consultas, %d destinos distintos", len(tareas),
+                 len({clave_destino(plan['destino']) for _, _, plan in tareas if plan['destino']}))
+    return tareas
+
+def _planificar_item(indice, solicitud, plan):
+    """Responde una consulta del lote (caché o Gemini) con el enriquecimiento de su destino."""
+    try:
+        respuesta = buscar_respuesta_cacheada(solicitud, plan['destino'])
+        if respuesta is None:
+            respuesta = generar_respuesta(solicitud, plan)
+    except ServidorSaturado as saturado:
+        liberar_solicitud(solicitud)
+        return resultado_error_item(indice, str(saturado), 503)
+    except Exception as gemini_error:
+        incrementar('viajeia_gemini_errores_total')
+        liberar_solicitud(solicitud)
+        return error_item_gemini(indice, gemini_error)
+
+    return armar_item(indice, solicitud, respuesta, recoger_fotos(plan), recoger_info_destino(plan))
+
+def resultados_lote(tareas):
+    """
+    Ejecuta las consultas del lote en paralelo y entrega cada resultado
+    en cuanto termina. Las que no terminan dentro de BATCH_DEADLINE se
+    entregan con error 504 (y no cuentan para el rate limit).
+    """
+    futuros = {
+        batch_executor.submit(_planificar_item, indice, solicitud, plan): (indice, solicitud)
+        for indice, solicitud, plan in tareas
+    }
+    pendientes = dict(futuros)
+    try:
+        for futuro in as_completed(futuros, timeout=BATCH_DEADLINE):
+            pendientes.pop(futuro)
+            yield futuro.result()
+    except FuturesTimeoutError:
+        pass
+    finally:
+        for indice, solicitud in pendientes.values():
+            liberar_solicitud(solicitud)
+
+    yield from errores_vencidos(indice for indice, _ in pendientes.values())
+
+@app.route('/api/planificar/batch', methods=['POST'])
+def planificar_lote():
+    """
+    Planifica varias consultas (por ejemplo, las ciudades de un viaje con escalas)
+    en una sola llamada:
+      { "items": [{ "pregunta", "datosViaje" }, ...], "usuarioId", "stream": false }
+
+    - Todo el lote cuenta para el rate limit en un solo paso
+    - Clima, tipo de cambio y fotos se piden una vez por destino distinto
+    - Las consultas corren en paralelo con un plazo compartido
+
+    Responde { "resultados": [...] } ordenados por índice, o con "stream": true,
+    un evento SSE `item` por consulta en cuanto termina y `fin` al final.
+    Cada resultado lleva su "indice" y, si falló, "error" y "status".
+    """
+    lote = None
+    try:
+        data, error = leer_json()
+        if error:
+            return error
+        with medir('validacion'):
+            lote, error = preparar_lote(data)
+        if error:
+            return error
+        tareas = iniciar_lote(lote)
+    except Exception as e:
+        for _, solicitud in (lote or {}).get('solicitudes', []):
+            liberar_solicitud(solicitud)
+        return responder(error_consulta(str(e), 500))
+
+    if not data.get('stream'):
+        return jsonify(armar_resultados(lote['errores'] + list(resultados_lote(tareas)))), 200
+
+    iniciado = False
+
+    def cerrar():
+        """Si el stream no llegó a empezar, devuelve el cupo de todo el lote."""
+        if not iniciado:
+            for _, solicitud in lote['solicitudes']:
+                liberar_solicitud(solicitud)
+
+    def eventos():
+        nonlocal iniciado
+        iniciado = True
+        for resultado in lote['errores']:
+            yield evento_sse('item', resultado)
+        for resultado in resultados_lote(tareas):
+            yield evento_sse('item', resultado)
+        yield evento_sse('fin', {})
+
+    return respuesta_sse(eventos(), cerrar)
+
+def reservar_consulta_destino():
+    """
+    Cuenta una consulta GET /api/destino en su propio cupo, por usuario o
+    IP (ver rate_limiter.VENTANAS_DESTINO): no usa el de planificación.
+
+    Returns:
+        None si hay cupo, o (respuesta_error, status) con el 429
+    """
+    usuario_id, _, _ = identificar_consulta({})
+    limite_check = reservar_request_destino(usuario_id)
+    if not limite_check['allowed']:
+        return responder(error_rate_limit(limite_check))
+    return None
+
+@app.route('/api/destino/<nombre>', methods=['GET'])
+def consultar_destino(nombre):
+    """
+    Panel lateral de un destino del índice (clima, hora local, moneda y
+    tipo de cambio) sin pasar por Gemini.
+    """
+    consulta, error = validar_consulta_destino(nombre, request.args)
+    if error:
+        return responder(error_consulta(*error))
+    # 🔒 SEGURIDAD: Rate Limiting (cupo propio de /api/destino, no gasta consultas a Alex)
+    error = reservar_consulta_destino()
+    if error:
+        return error
+
+    plan = nuevo_plan(consulta['destino'], iniciar_panel(consulta['destino']), consulta['zona_horaria'])
+    return responder(respuesta_destino(consulta, recoger_info_destino(plan)))
+
+@app.route('/api/destino/<nombre>/fotos', methods=['GET'])
+def consultar_fotos_destino(nombre):
+    """Fotos de un destino (las mismas que acompañan a la respuesta de Gemini)."""
+    consulta, error = validar_consulta_destino(nombre, request.args)
+    if error:
+        return responder(error_consulta(*error))
+    # 🔒 SEGURIDAD: Rate Limiting (cupo propio de /api/destino, no gasta consultas a Alex)
+    error = reservar_consulta_destino()
+    if error:
+        return error
+
+    plan = nuevo_plan(consulta['destino'], {
+        'fotos': enrichment_executor.submit(obtener_fotos_destino, consulta['destino'], 3)
+    }, consulta['zona_horaria'])
+    return responder(respuesta_fotos_destino(consulta, recoger_fotos(plan)))
 
 @app.route('/', methods=['GET'])
 def root():
@@ -373,15 +803,64 @@ def root():
         'status': 'ok',
         'message': 'ViajeIA Backend API',
         'version': '1.0.0',
-        'endpoints': {
-            'health': '/api/health',
-            'planificar': '/api/planificar (POST)'
-        }
+        'endpoints': ENDPOINTS
     }), 200
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
-    return jsonify({'status': 'ok', 'message': 'Backend funcionando correctamente'}), 200
+    return jsonify(estado_backend(precargador, model)), 200
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Métricas del proceso en formato Prometheus.
+    Con ?formato=json devuelve un resumen legible con p50/p95/p99 por etapa.
+    """
+    if request.args.get('formato') == 'json':
+        return jsonify(registro.resumen()), 200
+    return Response(registro.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+def iniciar_medicion():
+    g.inicio_request = time.perf_counter()
+    # El hilo de precarga arranca con la primera consulta de cada worker
+    precargador.iniciar()
+
+@app.after_request
+def optimizar_respuesta(response):
+    """
+    GET condicional (ETag y 304) y compresión negociada de las respuestas.
+    Los streams SSE se envían tal cual.
+    """
+    if response.is_streamed or response.direct_passthrough:
+        return response
+    if request.method == 'GET' and response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(request)
+    comprimido, codificacion = comprimir_respuesta(
+        response.get_data(), response.mimetype,
+        response.headers.get('Content-Encoding'), request.headers.get('Accept-Encoding')
+    )
+    if codificacion:
+        response.set_data(comprimido)
+        response.headers['Content-Encoding'] = codificacion
+        # El ETag describe el contenido sin comprimir: pasa a ser débil
+        etag, debil = response.get_etag()
+        if etag and not debil:
+            response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+def terminar_medicion(response):
+    # En los streams SSE esto mide hasta enviar los encabezados, no hasta el último evento
+    inicio = g.pop('inicio_request', None)
+    if inicio is not None and request.endpoint:
+        observar(
+            'viajeia_request_segundos', time.perf_counter() - inicio,
+            endpoint=request.endpoint, status=response.status_code
+        )
+    return response
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
@@ -0,0 +1,1030 @@
+"""
+============================================
+BACKEND ASÍNCRONO (QUART) - VIAJEIA
+============================================
+
+Misma API que app.py (/api/planificar, /api/planificar/stream,
+/api/planificar/batch, /api/health),
+pero con handlers asíncronos: las consultas a Gemini, OpenWeatherMap,
+exchangerate-api y Unsplash no ocupan un hilo mientras esperan.
+La validación de las consultas y el armado de las respuestas están en
+consultas.py, compartido con app.py: acá solo cambia la entrada/salida.
+
+Uso:
+    hypercorn app_async:app --bind 0.0.0.0:5001
+
+¿Por qué es importante?
+- Casi todo el tiempo de una consulta es espera de red: un solo proceso
+  mantiene cientos de consultas en curso con poca memoria
+- Control de carga: las llamadas a Gemini esperan turno en la cola de
+  admisión (admision.py) y, si el servidor está saturado, la consulta
+  recibe un 503 claro con Retry-After en lugar de quedarse colgada
+"""
+
+from quart import Quart, Response, g, request, jsonify
+from quart.wrappers.response import DataBody
+from quart_cors import cors
+import google.generativeai as genai
+import asyncio
+import logging
+import os
+import time
+from dotenv import load_dotenv
+
+# Cargar variables de entorno desde el archivo .env
+# (antes de importar los módulos del proyecto, que leen su configuración al importarse)
+load_dotenv()
+
+from metricas import configurar_logging, incrementar, medir, observar, registro
+
+configurar_logging()
+logger = logging.getLogger('viajeia.app_async')
+
+# 🔒 SEGURIDAD: Importar módulos de seguridad
+from rate_limiter import reservar_request, reservar_requests, reservar_request_destino, liberar_request
+from http_cliente import ClienteUpstreamAsync
+from precarga import crear_precargador
+from prompts import INSTRUCCION_SISTEMA, registrar_uso
+from gemini_cliente import crear_modelo
+from coalescencia import GEMINI_RESPONSE_TIMEOUT, generaciones
+from admision import ServidorSaturado, cola_gemini, costo_prompt
+from autenticacion import identificar_usuario
+from transporte import comprimir_respuesta
+from planificacion import (
+    GEMINI_MODEL, GEMINI_API_ENDPOINT, PROMPT_WEATHER_WAIT, opciones_cliente_gemini,
+    OPENWEATHER_URL, EXCHANGERATE_URL, UNSPLASH_URL, openweather_api_key, unsplash_api_key,
+    cache_clima, cache_tipo_cambio, cache_fotos, cache_disco, clave_destino,
+    parametros_clima, parsear_clima, parsear_tabla_cambio, tipo_cambio_desde_tabla,
+    parametros_fotos, parsear_fotos, pais_destino, obtener_moneda_pais, construir_info_destino,
+    construir_prompt, mensaje_error_gemini,
+    buscar_respuesta_cacheada, guardar_respuesta, registrar_turno, clave_generacion,
+    BATCH_DEADLINE, resultado_error_item, validar_consulta_destino
+)
+from consultas import (
+    CABECERAS_SSE, ENDPOINTS, leer_cuerpo, identidad_consulta, armar_solicitud, cargar_contexto,
+    armar_lote, asignar_reservas, error_consulta, error_rate_limit, error_saturado,
+    nuevo_plan, destino_solicitud, planes_lote, fuentes_precarga,
+    armar_respuesta, armar_item, error_item_gemini, errores_vencidos, armar_resultados,
+    evento_sse, evento_generacion, evento_info_destino, evento_fotos, evento_demorado,
+    respuesta_destino, respuesta_fotos_destino, estado_backend
+)
+
+app = Quart(__name__)
+# Configurar CORS para permitir peticiones desde el frontend
+cors_origins = os.getenv('CORS_ORIGINS', '*').split(',')
+app = cors(app, allow_origin='*' if '*' in cors_origins else cors_origins)
+# Las respuestas de Gemini (y los streams SSE) pueden tardar bastante
+app.config['RESPONSE_TIMEOUT'] = int(os.getenv('ASYNC_RESPONSE_TIMEOUT', '120'))
+
+# Inicializar el cliente de Gemini
+gemini_api_key = os.getenv('GEMINI_API_KEY')
+if not gemini_api_key:
+    logger.warning("GEMINI_API_KEY no está configurada. Asegúrate de crear un archivo .env con tu API key.")
+    model = None
+else:
+    genai.configure(api_key=gemini_api_key, **opciones_cliente_gemini())
+    # Prefijo fijo como system_instruction (y en la caché de contexto de Gemini si se puede)
+    model = crear_modelo(GEMINI_MODEL, INSTRUCCION_SISTEMA)
+
+if not openweather_api_key:
+    logger.warning("OPENWEATHER_API_KEY no está configurada. La funcionalidad del clima no estará disponible.")
+if not unsplash_api_key:
+    logger.warning("UNSPLASH_API_KEY no está configurada. Las fotos no estarán disponibles.")
+
+# Clientes HTTP asíncronos con conexiones persistentes (uno por upstream)
+cliente_clima = ClienteUpstreamAsync('openweather', OPENWEATHER_URL)
+cliente_cambio = ClienteUpstreamAsync('exchangerate', EXCHANGERATE_URL)
+cliente_fotos = ClienteUpstreamAsync(
+    'unsplash', UNSPLASH_URL,
+    headers={'Authorization': f'Client-ID {unsplash_api_key}'} if unsplash_api_key else None
+)
+CLIENTES = (cliente_clima, cliente_cambio, cliente_fotos)
+
+# ============================================
+# CONTROL DE CARGA
+# ============================================
+
+# Consultas de planificación en curso que admite el proceso; por encima, 503 inmediato
+ASYNC_MAX_IN_FLIGHT = int(os.getenv('ASYNC_MAX_IN_FLIGHT', '500'))
+# Segundos que se sugieren al cliente en la cabecera Retry-After (si la cola de Gemini no estima otros)
+SATURATION_RETRY_AFTER = int(os.getenv('SATURATION_RETRY_AFTER', '5'))
+
+# El semáforo se crea en before_serving, dentro del event loop del servidor
+cupo_consultas = None
+tarea_precarga = None
+carga = {
+    'consultas_en_curso': 0,
+    'rechazadas_saturacion': 0
+}
+
+
+def _muestras_carga():
+    """Estado del control de carga para /api/metrics."""
+    return [
+        (f'viajeia_{nombre}_total' if nombre.startswith('rechazadas') else f'viajeia_{nombre}',
+         'counter' if nombre.startswith('rechazadas') else 'gauge', {}, valor)
+        for nombre, valor in carga.items()
+    ]
+
+
+registro.agregar_colector(_muestras_carga)
+
+
+@app.before_serving
+async def iniciar_servidor():
+    global cupo_consultas, tarea_precarga
+    cupo_consultas = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+    for cliente in CLIENTES:
+        await cliente.abrir()
+    tarea_precarga = asyncio.ensure_future(precargador.bucle_async())
+
+
+@app.after_serving
+async def detener_servidor():
+    if tarea_precarga is not None:
+        tarea_precarga.cancel()
+    precargador.detener()
+    for cliente in CLIENTES:
+        await cliente.cerrar()
+
+
+async def admitir_consulta():
+    """
+    Ocupa un lugar para una consulta de planificación.
+
+    Raises:
+        ServidorSaturado: si ya hay ASYNC_MAX_IN_FLIGHT consultas en curso
+    """
+    if cupo_consultas.locked():
+        carga['rechazadas_saturacion'] += 1
+        raise ServidorSaturado('El servidor está atendiendo demasiadas consultas. Intenta de nuevo en unos segundos.')
+    await cupo_consultas.acquire()
+    carga['consultas_en_curso'] += 1
+
+
+def terminar_consulta():
+    """Libera el lugar ocupado con admitir_consulta."""
+    carga['consultas_en_curso'] -= 1
+    cupo_consultas.release()
+
+
+# Lo que un stream SSE libera al terminar (el lugar en curso, el cupo del rate
+# limit, el oyente de la generación) no puede quedar solo en el finally del
+# generador: si el cliente se desconecta antes de que Quart empiece a
+# recorrerlo, el generador nunca corre. Se registra también con al_cerrar.
+CLAVE_AL_CERRAR = 'viajeia.al_cerrar'
+
+
+def al_cerrar(funcion):
+    """
+    Registra una corrutina sin argumentos que se espera cuando termina la
+    conexión de la consulta actual, se haya enviado o no la respuesta.
+    Puede correr además de otro cierre: debe ser idempotente.
+    """
+    request.scope.setdefault(CLAVE_AL_CERRAR, []).append(funcion)
+
+
+def con_cierre(asgi_app):
+    """Envuelve la app ASGI para esperar lo registrado con al_cerrar."""
+    async def envuelta(scope, receive, send):
+        try:
+            await asgi_app(scope, receive, send)
+        finally:
+            for funcion in scope.pop(CLAVE_AL_CERRAR, ()):
+                await funcion()
+    return envuelta
+
+
+app.asgi_app = con_cierre(app.asgi_app)
+
+
+async def esperar_turno_gemini(solicitud, prompt):
+    """
+    Espera en la cola de admisión un turno para llamar a Gemini con `prompt`.
+    Se devuelve con cola_gemini.liberar.
+
+    Raises:
+        ServidorSaturado: si no va a haber turno dentro del plazo de la clase
+    """
+    return await cola_gemini.pedir_async(solicitud['equidad'], solicitud['clase'], costo_prompt(prompt))
+
+
+def responder(resultado):
+    """Respuesta JSON para un resultado de consultas.py: (datos, status[, cabeceras])."""
+    datos, *resto = resultado
+    return (jsonify(datos), *resto)
+
+
+def respuesta_saturado(error):
+    """Respuesta 503 con Retry-After para un ServidorSaturado."""
+    return responder(error_saturado(error, SATURATION_RETRY_AFTER))
+
+# ============================================
+# APIS EXTERNAS
+# ============================================
+
+async def obtener_clima_ciudad(nombre_ciudad):
+    """
+    Obtiene el clima actual de una ciudad (con caché de WEATHER_CACHE_TTL)
+    """
+    if not openweather_api_key:
+        return None
+
+    with medir('clima'):
+        return await cache_clima.obtener_o_calcular_async(
+            clave_destino(nombre_ciudad),
+            lambda: _consultar_clima(nombre_ciudad)
+        )
+
+async def _consultar_clima(nombre_ciudad):
+    """
+    Obtiene el clima actual de una ciudad usando OpenWeatherMap API
+    """
+    try:
+        response = await cliente_clima.get('/data/2.5/weather', params=parametros_clima(nombre_ciudad))
+
+        if response.status_code == 200:
+            return parsear_clima(response.json())
+        else:
+            logger.warning("Error al obtener clima: %s", response.status_code)
+            return None
+
+    except Exception as e:
+        logger.warning("Error al obtener clima: %s", e)
+        return None
+
+async def obtener_tipo_cambio(base_currency='USD', target_currency='EUR'):
+    """
+    Obtiene el tipo de cambio entre dos monedas (tabla de la moneda base cacheada).
+    """
+    with medir('tipo_cambio'):
+        tabla = await cache_tipo_cambio.obtener_o_calcular_async(
+            base_currency.upper(),
+            lambda: _consultar_tabla_cambio(base_currency.upper())
+        )
+    return tipo_cambio_desde_tabla(tabla, target_currency)
+
+async def _consultar_tabla_cambio(base_currency):
+    """
+    Descarga la tabla de tipos de cambio usando exchangerate-api.com (gratis, no requiere API key)
+    """
+    try:
+        response = await cliente_cambio.get(f'/v4/latest/{base_currency}')
+
+        if response.status_code == 200:
+            return parsear_tabla_cambio(response.json(), base_currency)
+        return None
+    except Exception as e:
+        logger.warning("Error al obtener tipo de cambio: %s", e)
+        return None
+
+async def obtener_fotos_destino(nombre_destino, cantidad=3):
+    """
+    Obtiene fotos de un destino (con caché de PHOTOS_CACHE_TTL)
+    """
+    if not unsplash_api_key:
+        return []
+
+    with medir('fotos'):
+        return await cache_fotos.obtener_o_calcular_async(
+            (clave_destino(nombre_destino), cantidad),
+            lambda: _consultar_fotos(nombre_destino, cantidad)
+        )
+
+async def _consultar_fotos(nombre_destino, cantidad):
+    """
+    Obtiene fotos hermosas de un destino usando Unsplash API
+    """
+    try:
+        response = await cliente_fotos.get('/search/photos', params=parametros_fotos(nombre_destino, cantidad))
+
+        if response.status_code == 200:
+            return parsear_fotos(response.json(), cantidad)
+        else:
+            logger.warning("Error al obtener fotos de Unsplash: %s", response.status_code)
+            return []
+
+    except Exception as e:
+        logger.warning("Error al obtener fotos: %s", e)
+        return []
+
+# Precarga de los destinos populares: clima, fotos y la tabla de cambio en USD
+precargador = crear_precargador(clave_destino, fuentes_precarga(
+    _consultar_clima, _consultar_fotos, _consultar_tabla_cambio,
+    con_clima=bool(openweather_api_key), con_fotos=bool(unsplash_api_key)
+), disco=cache_disco)
+precargador.cargar_popularidad()
+
+# ============================================
+# ENRIQUECIMIENTO
+# ============================================
+
+async def _tipo_cambio_destino(tarea_clima):
+    """Cadena clima → tipo de cambio (la moneda depende del país que devuelve el clima)."""
+    info_clima = await tarea_clima
+    if not info_clima:
+        return None
+    return await obtener_tipo_cambio('USD', obtener_moneda_pais(info_clima['pais']))
+
+def iniciar_enriquecimiento(destino):
+    """
+    Lanza en paralelo las consultas de enriquecimiento de un destino.
+
+    Returns:
+        dict: { 'clima': Task, 'tipo_cambio': Task, 'fotos': Task }
+    """
+    precargador.registrar(destino)
+    logger.debug("Buscando clima y fotos para: %s", destino)
+    return {**iniciar_panel(destino), 'fotos': asyncio.ensure_future(obtener_fotos_destino(destino, 3))}
+
+def iniciar_panel(destino):
+    """
+    Lanza las consultas del panel lateral de un destino (clima y tipo de cambio).
+
+    Returns:
+        dict: { 'clima': Task, 'tipo_cambio': Task }
+    """
+    tarea_clima = asyncio.ensure_future(obtener_clima_ciudad(destino))
+    pais = pais_destino(destino)
+    if pais:
+        # El índice ya sabe el país: el tipo de cambio va en paralelo con el clima
+        tarea_cambio = asyncio.ensure_future(obtener_tipo_cambio('USD', obtener_moneda_pais(pais)))
+    else:
+        tarea_cambio = asyncio.ensure_future(_tipo_cambio_destino(tarea_clima))
+    return {'clima': tarea_clima, 'tipo_cambio': tarea_cambio}
+
+async def esperar_resultado(tarea, limite, por_defecto):
+    """
+    Espera el resultado de una consulta como mucho hasta `limite` (time.monotonic()).
+    Si el upstream es lento o falla, devuelve `por_defecto` (resultado parcial).
+    La consulta no se cancela: si termina más tarde, igual queda en la caché.
+    """
+    if tarea is None:
+        return por_defecto
+    try:
+        return await asyncio.wait_for(asyncio.shield(tarea), max(0.0, limite - time.monotonic()))
+    except asyncio.TimeoutError:
+        return por_defecto
+    except Exception as e:
+        logger.warning("Error en enriquecimiento: %s", e)
+        return por_defecto
+
+# ============================================
+# SOLICITUDES
+# ============================================
+
+async def leer_json():
+    """
+    JSON del cuerpo de la consulta (puede venir comprimido con gzip o br).
+
+    Returns:
+        tuple: (datos, None) o (None, (respuesta_error, status))
+    """
+    data, error = leer_cuerpo(await request.get_data(), request.headers.get('Content-Encoding'))
+    if error:
+        return None, responder(error)
+    return data, None
+
+async def identificar_consulta(data):
+    """Quién hace la consulta: (usuario_id, clase, equidad); ver consultas.identidad_consulta."""
+    autorizacion = request.headers.get('Authorization')
+    # La verificación puede descargar las claves de Google: en un hilo
+    uid = await asyncio.to_thread(identificar_usuario, autorizacion) if autorizacion else None
+    return identidad_consulta(data, uid, request.remote_addr)
+
+async def preparar_solicitud():
+    """
+    Lee el cuerpo, aplica las validaciones comunes a una consulta de
+    planificación y, si es válida, reserva el cupo del usuario (rate limiting).
+    Si la consulta falla después, el cupo se devuelve con liberar_solicitud.
+
+    Returns:
+        tuple: (solicitud, None) si es válida, o (None, (respuesta_error, status))
+    """
+    data, error = await leer_json()
+    if error:
+        return None, error
+    solicitud, error = armar_solicitud(data, await identificar_consulta(data), model is not None)
+    if error:
+        return None, responder(error)
+
+    # 🔒 SEGURIDAD: Rate Limiting (en un hilo: los almacenes SQLite y Redis hacen I/O)
+    limite_check = await asyncio.to_thread(reservar_request, solicitud['usuario_id'])
+    if not limite_check['allowed']:
+        return None, responder(error_rate_limit(limite_check))
+    solicitud['reserva'] = limite_check['reserva']
+
+    try:
+        cargar_contexto(solicitud)
+    except BaseException:
+        await liberar_solicitud(solicitud)
+        raise
+    return solicitud, None
+
+async def liberar_solicitud(solicitud):
+    """
+    Devuelve el cupo reservado de una consulta que no llegó a completarse
+    (solo cuentan las consultas exitosas).
+    """
+    if solicitud:
+        # pop: la misma reserva nunca se devuelve dos veces
+        await asyncio.to_thread(liberar_request, solicitud['usuario_id'], solicitud.pop('reserva', None))
+
+def iniciar_planificacion(solicitud):
+    """
+    Detecta el destino y lanza el enriquecimiento en segundo plano.
+
+    Returns:
+        dict: { 'destino', 'futuros', 'limite', 'info_clima', 'zona_cliente' }
+    """
+    destino = destino_solicitud(solicitud)
+    futuros = iniciar_enriquecimiento(destino) if destino else {}
+    return nuevo_plan(destino, futuros, solicitud['zona_horaria'])
+
+async def preparar_prompt(plan, solicitud):
+    """
+    Arma el prompt de Gemini para un plan ya iniciado.
+    El clima solo entra al prompt si llega rápido; Gemini no lo espera más.
+    """
+    with medir('prompt'):
+        espera_clima = min(plan['limite'], time.monotonic() + PROMPT_WEATHER_WAIT)
+        plan['info_clima'] = await esperar_resultado(plan['futuros'].get('clima'), espera_clima, None)
+        return construir_prompt(
+            solicitud['pregunta'], solicitud['datos_viaje'], plan['destino'],
+            plan['info_clima'], solicitud['contexto']
+        )
+
+async def generar_respuesta(solicitud, plan):
+    """
+    Respuesta de Gemini para una consulta que no estaba en la caché.
+    Si una consulta idéntica ya la está generando, espera y comparte su
+    resultado (sin ocupar un turno de Gemini).
+    """
+    generacion, nueva = generaciones.unirse(clave_generacion(solicitud, plan['destino']))
+    if not nueva:
+        respuesta = await generacion.resultado_async()
+        registrar_turno(solicitud, respuesta)
+        return respuesta
+
+    try:
+        prompt = await preparar_prompt(plan, solicitud)
+        with medir('cola_gemini'):
+            turno = await esperar_turno_gemini(solicitud, prompt)
+        response = error_gemini = None
+        try:
+            with medir('gemini'):
+                response = await generar_contenido(prompt)
+        except BaseException as error:
+            error_gemini = error
+            raise
+        finally:
+            cola_gemini.liberar(turno, response, error=error_gemini)
+        registrar_uso(prompt, response)
+
+        respuesta = response.text
+        guardar_respuesta(solicitud, plan['destino'], respuesta)
+    except BaseException as error:
+        generacion.fallar(error)
+        raise
+    generacion.terminar(respuesta)
+    return respuesta
+
+async def recoger_info_destino(plan):
+    """Espera (dentro del plazo) la cadena clima → tipo de cambio y arma el panel."""
+    futuros = plan['futuros']
+    info_clima = plan['info_clima'] or await esperar_resultado(futuros.get('clima'), plan['limite'], None)
+    tipo_cambio = await esperar_resultado(futuros.get('tipo_cambio'), plan['limite'], None)
+    return construir_info_destino(info_clima, tipo_cambio, plan['destino'], plan['zona_cliente'])
+
+async def recoger_fotos(plan):
+    """Espera (dentro del plazo) las fotos del destino."""
+    fotos_destino = await esperar_resultado(plan['futuros'].get('fotos'), plan['limite'], [])
+    if fotos_destino:
+        logger.debug("%d fotos obtenidas para %s", len(fotos_destino), plan['destino'])
+    elif plan['futuros']:
+        logger.info("No se pudieron obtener fotos para: %s", plan['destino'])
+    return fotos_destino
+
+# ============================================
+# ENDPOINTS
+# ============================================
+
+@app.route('/api/planificar', methods=['POST'])
+async def planificar_viaje():
+    try:
+        await admitir_consulta()
+    except ServidorSaturado as saturado:
+        return respuesta_saturado(saturado)
+
+    solicitud = None
+    try:
+        with medir('validacion'):
+            solicitud, error = await preparar_solicitud()
+        if error:
+            return error
+
+        try:
+            plan = iniciar_planificacion(solicitud)
+
+            respuesta = buscar_respuesta_cacheada(solicitud, plan['destino'])
+            if respuesta is None:
+                respuesta = await generar_respuesta(solicitud, plan)
+
+            # Recoger el enriquecimiento dentro del plazo; lo que no llegó queda vacío
+            with medir('enriquecimiento'):
+                info_destino, fotos_destino = await asyncio.gather(
+                    recoger_info_destino(plan),
+                    recoger_fotos(plan)
+                )
+
+        except ServidorSaturado as saturado:
+            await liberar_solicitud(solicitud)
+            return respuesta_saturado(saturado)
+        except Exception as gemini_error:
+            incrementar('viajeia_gemini_errores_total')
+            await liberar_solicitud(solicitud)
+            return responder(error_consulta(mensaje_error_gemini(gemini_error), 500))
+
+        with medir('serializacion'):
+            return jsonify(armar_respuesta(solicitud, respuesta, fotos_destino, info_destino)), 200
+
+    except Exception as e:
+        await liberar_solicitud(solicitud)
+        return responder(error_consulta(str(e), 500))
+    finally:
+        terminar_consulta()
+
+async def generar_contenido(prompt):
+    """
+    Llama a Gemini (con la configuración de generación del Prompt) sin
+    bloquear el event loop. Con GEMINI_API_ENDPOINT la biblioteca usa el
+    transporte REST, que no tiene cliente asíncrono: en ese caso la llamada
+    síncrona corre en un hilo.
+    """
+    if GEMINI_API_ENDPOINT:
+        return await asyncio.to_thread(model.generate_content, prompt.texto, generation_config=prompt.config)
+    return await model.generate_content_async(prompt.texto, generation_config=prompt.config)
+
+async def generar_contenido_stream(prompt):
+    """
+    Igual que generar_contenido, pero en streaming.
+
+    Returns:
+        tuple: (response, fragmentos) donde fragmentos se recorre con `async for`
+    """
+    if not GEMINI_API_ENDPOINT:
+        response = await model.generate_content_async(prompt.texto, generation_config=prompt.config, stream=True)
+        return response, response
+    response = await asyncio.to_thread(
+        model.generate_content, prompt.texto, generation_config=prompt.config, stream=True
+    )
+    return response, _recorrer_en_hilo(iter(response))
+
+async def _recorrer_en_hilo(iterador):
+    """Recorre un iterador bloqueante pidiendo cada elemento en un hilo."""
+    while True:
+        elemento = await asyncio.to_thread(next, iterador, None)
+        if elemento is None:
+            return
+        yield elemento
+
+async def _producir_tokens(solicitud, plan, prompt, generacion, turno):
+    """
+    Recorre la respuesta de Gemini en streaming y publica cada fragmento en
+    la generación (la siguen esta consulta y las idénticas que se sumen).
+    Si todos los clientes se desconectan, deja de generar. Al terminar
+    devuelve el turno de Gemini.
+    """
+    response = error = None
+    try:
+        inicio = time.perf_counter()
+        with medir('gemini'):
+            response, chunks = await generar_contenido_stream(prompt)
+            async for chunk in chunks:
+                if generacion.cancelar_si_abandonada():
+                    return
+                texto = chunk.text
+                if texto:
+                    if not generacion.fragmentos:
+                        observar('viajeia_etapa_segundos', time.perf_counter() - inicio, etapa='gemini_primer_token')
+                    generacion.publicar(texto)
+        registrar_uso(prompt, response)
+        guardar_respuesta(solicitud, plan['destino'], generacion.texto)
+        generacion.terminar()
+    except Exception as gemini_error:
+        error = gemini_error
+        incrementar('viajeia_gemini_errores_total')
+        generacion.fallar(gemini_error)
+    except BaseException as cancelacion:
+        generacion.fallar(cancelacion)
+        raise
+    finally:
+        cola_gemini.liberar(turno, response, error=error)
+
+@app.route('/api/planificar/stream', methods=['POST'])
+async def planificar_viaje_stream():
+    """
+    Igual que /api/planificar, pero responde con Server-Sent Events
+    (info_destino, fotos, token, fin / error), como en app.py.
+    Si el servidor está saturado, responde 503 antes de abrir el stream.
+    """
+    try:
+        await admitir_consulta()
+    except ServidorSaturado as saturado:
+        return respuesta_saturado(saturado)
+
+    solicitud = generacion = productor = None
+    completado = cerrado = False
+    cola = asyncio.Queue()
+
+    def oyente(tipo, dato):
+        """Pasa los eventos de la generación (propia o compartida) a la cola del stream."""
+        cola.put_nowait(evento_generacion(tipo, dato))
+
+    async def cerrar():
+        """Deja la generación y libera el lugar en curso y, si la consulta no terminó, su cupo."""
+        nonlocal cerrado
+        if cerrado:
+            return
+        cerrado = True
+        # Si ya ningún cliente espera la respuesta, se deja de generar (y se libera el turno de Gemini)
+        if generacion is not None:
+            generacion.dejar(oyente)
+            if productor is not None and generacion.cancelar_si_abandonada():
+                productor.cancel()
+        terminar_consulta()
+        # Si Gemini falló o el cliente se desconectó, la consulta no cuenta
+        if not completado:
+            await liberar_solicitud(solicitud)
+
+    # Desde acá, pase lo que pase con la conexión, cerrar() corre al terminarla
+    al_cerrar(cerrar)
+
+    try:
+        with medir('validacion'):
+            solicitud, error = await preparar_solicitud()
+        if error:
+            await cerrar()
+            return error
+        plan = iniciar_planificacion(solicitud)
+
+        respuesta_cacheada = buscar_respuesta_cacheada(solicitud, plan['destino'])
+        prompt = turno = None
+        nueva = False
+        if respuesta_cacheada is None:
+            # Si una consulta idéntica ya se está generando, este stream la sigue
+            generacion, nueva = generaciones.unirse(clave_generacion(solicitud, plan['destino']))
+        if nueva:
+            try:
+                prompt = await preparar_prompt(plan, solicitud)
+                with medir('cola_gemini'):
+                    turno = await esperar_turno_gemini(solicitud, prompt)
+            except BaseException as error:
+                generacion.fallar(error)
+                raise
+    except ServidorSaturado as saturado:
+        await cerrar()
+        return respuesta_saturado(saturado)
+    except Exception as e:
+        await cerrar()
+        return responder(error_consulta(str(e), 500))
+
+    futuros = plan['futuros']
+
+    # El panel y las fotos se publican en la cola en cuanto terminan
+    if futuros:
+        futuros['tipo_cambio'].add_done_callback(lambda _: cola.put_nowait(('info_destino', None)))
+        futuros['fotos'].add_done_callback(lambda _: cola.put_nowait(('fotos', None)))
+
+    if respuesta_cacheada is not None:
+        cola.put_nowait(('token', respuesta_cacheada))
+        cola.put_nowait(('gemini_fin', None))
+    else:
+        generacion.escuchar(oyente)
+        if nueva:
+            productor = asyncio.ensure_future(_producir_tokens(solicitud, plan, prompt, generacion, turno))
+            # Que la tarea arranque ya: cancelada antes de su primer paso, no correría
+            # el finally que devuelve el turno de Gemini
+            await asyncio.sleep(0)
+
+    async def eventos():
+        nonlocal completado
+        pendientes = {'info_destino', 'fotos'} if futuros else set()
+        gemini_terminado = False
+        try:
+            while not gemini_terminado or pendientes:
+                if gemini_terminado:
+                    # Gemini ya respondió: el enriquecimiento solo espera hasta el plazo
+                    restante = plan['limite'] - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        tipo, dato = await asyncio.wait_for(cola.get(), restante)
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    try:
+                        tipo, dato = await asyncio.wait_for(cola.get(), GEMINI_RESPONSE_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        yield evento_demorado()
+                        return
+
+                if tipo == 'token':
+                    yield evento_sse('token', {'texto': dato})
+                elif tipo == 'gemini_fin':
+                    gemini_terminado = True
+                    if generacion is not None and not nueva:
+                        # Respuesta compartida: el turno se suma también a esta conversación
+                        registrar_turno(solicitud, generacion.texto)
+                elif tipo == 'gemini_error':
+                    yield evento_sse('error', {'error': dato})
+                    return
+                elif tipo in pendientes:
+                    pendientes.discard(tipo)
+                    if tipo == 'info_destino':
+                        yield evento_info_destino(solicitud, await recoger_info_destino(plan))
+                    else:
+                        yield evento_fotos(solicitud, await recoger_fotos(plan))
+
+            # Lo que no llegó dentro del plazo se envía parcial o vacío
+            if 'info_destino' in pendientes:
+                yield evento_info_destino(solicitud, await recoger_info_destino(plan))
+            if 'fotos' in pendientes:
+                yield evento_fotos(solicitud, [])
+
+            completado = True
+            yield evento_sse('fin', {})
+        finally:
+            await cerrar()
+
+    return Response(eventos(), mimetype='text/event-stream', headers=CABECERAS_SSE)
+
+async def preparar_lote(data):
+    """
+    Valida un lote y reserva el cupo de todas sus consultas válidas en un
+    solo paso (ver app.py). Las consultas inválidas no ocupan cupo y quedan como error.
+
+    Returns:
+        tuple: (lote, None) si se puede procesar, o (None, (respuesta_error, status))
+    """
+    lote, error = armar_lote(data, await identificar_consulta(data), model is not None)
+    if error:
+        return None, responder(error)
+    if not lote['solicitudes']:
+        return lote, None
+
+    # 🔒 SEGURIDAD: Rate Limiting - todo el lote en una sola operación atómica
+    limite_check = await asyncio.to_thread(reservar_requests, lote['usuario_id'], len(lote['solicitudes']))
+    if not limite_check['allowed']:
+        return None, responder(error_rate_limit(limite_check))
+    asignar_reservas(lote, limite_check['reservas'])
+    return lote, None
+
+def iniciar_lote(lote):
+    """
+    Lanza el enriquecimiento una sola vez por destino distinto (ver consultas.planes_lote).
+
+    Returns:
+        list: [(indice, solicitud, plan)]
+    """
+    tareas = planes_lote(lote, iniciar_enriquecimiento)
+    logger.debug("Lote de %d consultas, %d destinos distintos", len(tareas),
+                 len({clave_destino(plan['destino']) for _, _, plan in tareas if plan['destino']}))
+    return tareas
+
+async def _planificar_item(indice, solicitud, plan):
+    """Responde una consulta del lote (caché o Gemini) con el enriquecimiento de su destino."""
+    try:
+        respuesta = buscar_respuesta_cacheada(solicitud, plan['destino'])
+        if respuesta is None:
+            respuesta = await generar_respuesta(solicitud, plan)
+    except ServidorSaturado as saturado:
+        await liberar_solicitud(solicitud)
+        return resultado_error_item(indice, str(saturado), 503)
+    except Exception as gemini_error:
+        incrementar('viajeia_gemini_errores_total')
+        await liberar_solicitud(solicitud)
+        return error_item_gemini(indice, gemini_error)
+
+    info_destino, fotos_destino = await asyncio.gather(
+        recoger_info_destino(plan),
+        recoger_fotos(plan)
+    )
+    return armar_item(indice, solicitud, respuesta, fotos_destino, info_destino)
+
+async def resultados_lote(tareas):
+    """
+    Ejecuta las consultas del lote en paralelo y entrega cada resultado en
+    cuanto termina. Las que no terminan dentro de BATCH_DEADLINE se cancelan
+    y se entregan con error 504 (no cuentan para el rate limit).
+    """
+    pendientes = {
+        asyncio.ensure_future(_planificar_item(indice, solicitud, plan)): (indice, solicitud)
+        for indice, solicitud, plan in tareas
+    }
+    limite = time.monotonic() + BATCH_DEADLINE
+    try:
+        while pendientes:
+            listas, _ = await asyncio.wait(
+                pendientes, timeout=max(0.0, limite - time.monotonic()),
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if not listas:
+                break
+            for tarea in listas:
+                pendientes.pop(tarea)
+                yield tarea.result()
+    finally:
+        for tarea in pendientes:
+            tarea.cancel()
+        for indice, solicitud in pendientes.values():
+            await liberar_solicitud(solicitud)
+
+    for resultado in errores_vencidos(indice for indice, _ in pendientes.values()):
+        yield resultado
+
+@app.route('/api/planificar/batch', methods=['POST'])
+async def planificar_lote():
+    """
+    Planifica varias consultas en una sola llamada (mismo formato que app.py):
+    { "items": [{ "pregunta", "datosViaje" }, ...], "usuarioId", "stream": false }
+    """
+    try:
+        await admitir_consulta()
+    except ServidorSaturado as saturado:
+        return respuesta_saturado(saturado)
+
+    lote = None
+    iniciado = cerrado = False
+
+    async def cerrar():
+        """Libera el lugar en curso y, si el lote no llegó a empezar, el cupo de todas sus consultas."""
+        nonlocal cerrado
+        if cerrado:
+            return
+        cerrado = True
+        terminar_consulta()
+        if not iniciado:
+            for _, solicitud in (lote or {}).get('solicitudes', []):
+                await liberar_solicitud(solicitud)
+
+    # Desde acá, pase lo que pase con la conexión, cerrar() corre al terminarla
+    al_cerrar(cerrar)
+
+    try:
+        data, error = await leer_json()
+        if error:
+            await cerrar()
+            return error
+        with medir('validacion'):
+            lote, error = await preparar_lote(data)
+        if error:
+            await cerrar()
+            return error
+        tareas = iniciar_lote(lote)
+    except Exception as e:
+        await cerrar()
+        return responder(error_consulta(str(e), 500))
+
+    if not data.get('stream'):
+        iniciado = True
+        try:
+            resultados = lote['errores'] + [resultado async for resultado in resultados_lote(tareas)]
+        finally:
+            await cerrar()
+        return jsonify(armar_resultados(resultados)), 200
+
+    async def eventos():
+        nonlocal iniciado
+        iniciado = True
+        try:
+            for resultado in lote['errores']:
+                yield evento_sse('item', resultado)
+            async for resultado in resultados_lote(tareas):
+                yield evento_sse('item', resultado)
+            yield evento_sse('fin', {})
+        finally:
+            await cerrar()
+
+    return Response(eventos(), mimetype='text/event-stream', headers=CABECERAS_SSE)
+
+
+async def reservar_consulta_destino():
+    """
+    Cuenta una consulta GET /api/destino en su propio cupo (ver app.py).
+
+    Returns:
+        None si hay cupo, o (respuesta_error, status) con el 429
+    """
+    usuario_id, _, _ = await identificar_consulta({})
+    limite_check = await asyncio.to_thread(reservar_request_destino, usuario_id)
+    if not limite_check['allowed']:
+        return responder(error_rate_limit(limite_check))
+    return None
+
+@app.route('/api/destino/<nombre>', methods=['GET'])
+async def consultar_destino(nombre):
+    """
+    Panel lateral de un destino del índice (clima, hora local, moneda y
+    tipo de cambio) sin pasar por Gemini.
+    """
+    consulta, error = validar_consulta_destino(nombre, request.args)
+    if error:
+        return responder(error_consulta(*error))
+    # 🔒 SEGURIDAD: Rate Limiting (cupo propio de /api/destino, no gasta consultas a Alex)
+    error = await reservar_consulta_destino()
+    if error:
+        return error
+
+    plan = nuevo_plan(consulta['destino'], iniciar_panel(consulta['destino']), consulta['zona_horaria'])
+    return responder(respuesta_destino(consulta, await recoger_info_destino(plan)))
+
+@app.route('/api/destino/<nombre>/fotos', methods=['GET'])
+async def consultar_fotos_destino(nombre):
+    """Fotos de un destino (las mismas que acompañan a la respuesta de Gemini)."""
+    consulta, error = validar_consulta_destino(nombre, request.args)
+    if error:
+        return responder(error_consulta(*error))
+    # 🔒 SEGURIDAD: Rate Limiting (cupo propio de /api/destino, no gasta consultas a Alex)
+    error = await reservar_consulta_destino()
+    if error:
+        return error
+
+    plan = nuevo_plan(consulta['destino'], {
+        'fotos': asyncio.ensure_future(obtener_fotos_destino(consulta['destino'], 3))
+    }, consulta['zona_horaria'])
+    return responder(respuesta_fotos_destino(consulta, await recoger_fotos(plan)))
+
+@app.route('/', methods=['GET'])
+async def root():
+    return jsonify({
+        'status': 'ok',
+        'message': 'ViajeIA Backend API (async)',
+        'version': '1.0.0',
+        'endpoints': ENDPOINTS
+    }), 200
+
+@app.route('/api/health', methods=['GET'])
+async def health_check():
+    return jsonify({
+        **estado_backend(precargador, model),
+        'carga': {
+            **carga,
+            'max_consultas': ASYNC_MAX_IN_FLIGHT
+        }
+    }), 200
+
+@app.route('/api/metrics', methods=['GET'])
+async def metrics():
+    """
+    Métricas del proceso en formato Prometheus.
+    Con ?formato=json devuelve un resumen legible con p50/p95/p99 por etapa.
+    """
+    if request.args.get('formato') == 'json':
+        return jsonify(registro.resumen()), 200
+    return Response(registro.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.before_request
+async def iniciar_medicion():
+    g.inicio_request = time.perf_counter()
+
+@app.after_request
+async def optimizar_respuesta(response):
+    """
+    GET condicional (ETag y 304) y compresión negociada de las respuestas,
+    como en app.py. Los streams SSE se envían tal cual.
+    """
+    if not isinstance(response.response, DataBody):
+        return response
+    if request.method == 'GET' and response.status_code == 200:
+        await response.add_etag()
+        await response.make_conditional(request)
+    comprimido, codificacion = comprimir_respuesta(
+        await response.get_data(), response.mimetype,
+        response.headers.get('Content-Encoding'), request.headers.get('Accept-Encoding')
+    )
+    if codificacion:
+        response.set_data(comprimido)
+        response.headers['Content-Encoding'] = codificacion
+        # El ETag describe el contenido sin comprimir: pasa a ser débil
+        etag, debil = response.get_etag()
+        if etag and not debil:
+            response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.after_request
+async def terminar_medicion(response):
+    # En los streams SSE esto mide hasta enviar los encabezados, no hasta el último evento
+    inicio = g.pop('inicio_request', None)
+    if inicio is not None and request.endpoint:
+        observar(
+            'viajeia_request_segundos', time.perf_counter() - inicio,
+            endpoint=request.endpoint, status=response.status_code
+        )
+    return response
+
+if __name__ == '__main__':
+    port = int(os.getenv('PORT', 5001))
+    debug = os.getenv('FLASK_ENV') == 'development'
+    app.run(debug=debug, host='0.0.0.0', port=port)
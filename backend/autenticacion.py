@@ -0,0 +1,128 @@
+"""
+============================================
+USUARIOS AUTENTICADOS CON FIREBASE - VIAJEIA
+============================================
+
+El frontend manda el ID token de Firebase del usuario que inició sesión
+(Authorization: Bearer <token>). Si la firma, el proyecto y el
+vencimiento son válidos, la consulta se identifica con el uid del usuario
+y entra a la cola de Gemini con la prioridad de los usuarios autenticados
+(admision.py). Sin token, o con uno inválido, la consulta sigue siendo
+anónima: se identifica por la IP, como hasta ahora.
+
+La verificación usa google-auth (ya lo instala google-generativeai):
+- Las claves públicas de Google se descargan una vez por hora.
+- Cada token ya verificado se recuerda hasta que vence (como mucho
+  TOKEN_CACHE_TTL segundos): las consultas siguientes del mismo usuario
+  no repiten la verificación.
+
+¿Por qué es importante?
+- Un usuarioId en el cuerpo lo puede inventar cualquiera; un token firmado no
+- Los usuarios registrados no quedan detrás de las ráfagas anónimas
+- Sin FIREBASE_PROJECT_ID todo sigue funcionando, con todas las consultas anónimas
+"""
+
+import logging
+import os
+import threading
+import time
+
+import requests
+from google.auth import exceptions as errores_auth
+from google.auth.transport import requests as transporte_auth
+from google.oauth2 import id_token
+
+from cache import CacheTTL
+from metricas import incrementar
+
+logger = logging.getLogger('viajeia.autenticacion')
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Proyecto de Firebase (el mismo que VITE_FIREBASE_PROJECT_ID del frontend); vacío = sin verificación
+FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID', '')
+# Segundos que se recuerda un token ya verificado (nunca más allá de su vencimiento)
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', '300'))
+
+# Segundos que se reutilizan las claves públicas de Google
+CLAVES_TTL = 3600
+# Un ID token de Firebase ocupa ~1 KB; algo mucho más largo no es un token
+MAX_LARGO_TOKEN = 4096
+
+# Clases de consultas para la cola de Gemini
+CLASE_AUTENTICADO = 'autenticado'
+CLASE_ANONIMO = 'anonimo'
+
+
+class _PeticionConClaves(transporte_auth.Request):
+    """Transporte de google-auth que reutiliza la descarga de las claves públicas."""
+
+    def __init__(self):
+        super().__init__(session=requests.Session())
+        self._lock = threading.Lock()
+        self._respuestas = {}  # { url: (vence_en, respuesta) }
+
+    def __call__(self, url, method='GET', body=None, headers=None, timeout=None, **kwargs):
+        if method != 'GET':
+            return super().__call__(url, method, body, headers, timeout or 10, **kwargs)
+        with self._lock:
+            guardada = self._respuestas.get(url)
+        if guardada and guardada[0] > time.monotonic():
+            return guardada[1]
+        respuesta = super().__call__(url, method, body, headers, timeout or 10, **kwargs)
+        if respuesta.status == 200:
+            with self._lock:
+                self._respuestas[url] = (time.monotonic() + CLAVES_TTL, respuesta)
+        return respuesta
+
+
+_peticion = _PeticionConClaves()
+# { token: uid } de los tokens ya verificados
+_tokens = CacheTTL('tokens', TOKEN_CACHE_TTL, max_entradas=10000)
+
+
+def token_de_cabecera(autorizacion):
+    """El token de una cabecera 'Authorization: Bearer <token>', o None."""
+    if not autorizacion or not FIREBASE_PROJECT_ID:
+        return None
+    tipo, _, token = autorizacion.partition(' ')
+    token = token.strip()
+    if tipo.lower() != 'bearer' or not token or len(token) > MAX_LARGO_TOKEN:
+        return None
+    return token
+
+
+def verificar_token(token):
+    """
+    uid del usuario de un ID token de Firebase válido, o None.
+    La primera verificación de cada token hace I/O (claves de Google):
+    en app_async se llama en un hilo.
+    """
+    uid = _tokens.obtener(token)
+    if uid is not None:
+        return uid
+    try:
+        datos = id_token.verify_firebase_token(token, _peticion, audience=FIREBASE_PROJECT_ID)
+    except (ValueError, errores_auth.GoogleAuthError) as e:
+        incrementar('viajeia_tokens_invalidos_total')
+        logger.info("Token de Firebase no válido: %s", e)
+        return None
+    uid = (datos or {}).get('sub')
+    if not uid:
+        return None
+    restante = float(datos.get('exp', 0)) - time.time()
+    if restante > 0:
+        _tokens.guardar(token, uid, ttl=min(TOKEN_CACHE_TTL, restante))
+    return uid
+
+
+def identificar_usuario(autorizacion):
+    """
+    uid del usuario autenticado según la cabecera Authorization, o None (anónimo).
+    """
+    token = token_de_cabecera(autorizacion)
+    if token is None:
+        return None
+    return verificar_token(token)
@@ -0,0 +1,199 @@
+"""
+============================================
+PRUEBA DE CARGA DEL BACKEND - VIAJEIA
+============================================
+
+Levanta los servidores falsos (Gemini, OpenWeatherMap, exchangerate-api y
+Unsplash), arranca app.py en un servidor local apuntando a ellos y manda
+consultas a /api/planificar con una concurrencia fija. Al final muestra
+throughput, percentiles de latencia, códigos de respuesta, memoria y el
+desglose por etapa que publica /api/metrics.
+
+Uso (desde backend/):
+    pip install -r requirements-dev.txt
+    python benchmarks/carga.py
+    python benchmarks/carga.py --concurrencia 32 --consultas 500
+    python benchmarks/carga.py --latencia gemini=300:50 --errores unsplash=0.1
+    python benchmarks/carga.py --cache-respuestas   # deja activa la caché de respuestas
+
+¿Por qué es importante?
+- Los resultados son reproducibles: no dependen de la red ni de la cuota
+- Se puede simular un upstream lento o con errores y ver cómo responde el backend
+- Sirve para comparar antes y después de un cambio de rendimiento
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.servidores_falsos import ServidorFalso, agregar_argumentos, leer_perfiles  # noqa: E402
+
+# Una fecha futura fija durante la corrida (las fechas pasadas se rechazan con 400)
+FECHA_VIAJE = (datetime.date.today() + datetime.timedelta(days=60)).isoformat()
+
+DESTINOS = ['París', 'Roma', 'Madrid', 'Tokio', 'Cancún', 'Buenos Aires', 'Lima', 'Bogotá', 'Londres', 'Kioto']
+
+PREGUNTAS = [
+    '¿Qué lugares imperdibles hay en {destino} para un viaje de 5 días?',
+    'Busco alojamiento económico y comida local en {destino}',
+    'Dame un itinerario de 3 días en {destino} con museos y restaurantes',
+    '¿Qué actividades recomiendas en {destino} para viajar en familia?',
+]
+
+
+def consulta(i):
+    """La consulta número i (determinista: misma secuencia en cada corrida)."""
+    destino = DESTINOS[i % len(DESTINOS)]
+    return {
+        'pregunta': PREGUNTAS[(i // len(DESTINOS)) % len(PREGUNTAS)].format(destino=destino),
+        'datosViaje': {'destino': destino, 'fecha': FECHA_VIAJE, 'presupuesto': 'Medio'},
+        # Un usuario por consulta: se mide el backend, no el rate limit
+        'usuarioId': f'carga-{i}'
+    }
+
+
+def percentil(valores, p):
+    """Percentil p (0 a 1) de una lista ordenada, por el método del rango más cercano."""
+    if not valores:
+        return 0.0
+    return valores[min(len(valores) - 1, int(p * len(valores)))]
+
+
+def memoria_mb():
+    """(RSS actual, RSS máximo) del proceso en MB. Incluye el servidor falso."""
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open('/proc/self/statm') as f:
+            actual = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except OSError:
+        actual = maximo
+    return actual, maximo
+
+
+def levantar_backend(servidor_falso, cache_respuestas):
+    """Importa app.py con las variables apuntando al servidor falso y lo sirve en un hilo."""
+    os.environ.update(servidor_falso.variables_entorno())
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Sin precarga: no debe escribir en la foto de las cachés de un backend real
+    os.environ.setdefault('PREFETCH_ENABLED', 'false')
+    if not cache_respuestas:
+        os.environ['RESPONSE_CACHE_TTL'] = '0'
+
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    import app as backend
+
+    servidor = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    return servidor, f'http://127.0.0.1:{servidor.server_port}'
+
+
+def ejecutar(url, concurrencia, total, timeout):
+    """Manda `total` consultas con `concurrencia` hilos. Devuelve (latencias, códigos, segundos)."""
+    latencias = []
+    codigos = Counter()
+    lock = threading.Lock()
+    local = threading.local()
+
+    def enviar(i):
+        if not hasattr(local, 'sesion'):
+            local.sesion = requests.Session()
+        inicio = time.perf_counter()
+        try:
+            codigo = local.sesion.post(f'{url}/api/planificar', json=consulta(i), timeout=timeout).status_code
+        except requests.RequestException as e:
+            codigo = type(e).__name__
+        duracion = time.perf_counter() - inicio
+        with lock:
+            latencias.append(duracion)
+            codigos[codigo] += 1
+
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrencia) as executor:
+        list(executor.map(enviar, range(total)))
+    return sorted(latencias), codigos, time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrencia', type=int, default=16, help='Consultas simultáneas')
+    parser.add_argument('--consultas', type=int, default=200, help='Total de consultas')
+    parser.add_argument('--calentamiento', type=int, default=10, help='Consultas previas que no se cuentan')
+    parser.add_argument('--timeout', type=float, default=60, help='Timeout de cada consulta (s)')
+    parser.add_argument('--cache-respuestas', action='store_true',
+                        help='No desactivar la caché de respuestas de Gemini')
+    parser.add_argument('--json', action='store_true', help='Imprimir el resultado como JSON')
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    falso = ServidorFalso(leer_perfiles(args.latencia, args.errores)).iniciar()
+    servidor, url = levantar_backend(falso, args.cache_respuestas)
+
+    from metricas import registro
+
+    if args.calentamiento:
+        ejecutar(url, args.concurrencia, args.calentamiento, args.timeout)
+    registro.limpiar()
+    memoria_inicial, _ = memoria_mb()
+
+    latencias, codigos, segundos = ejecutar(url, args.concurrencia, args.consultas, args.timeout)
+    memoria_final, memoria_maxima = memoria_mb()
+    metricas = requests.get(f'{url}/api/metrics', params={'formato': 'json'}, timeout=10).json()
+
+    servidor.shutdown()
+    falso.detener()
+
+    resultado = {
+        'concurrencia': args.concurrencia,
+        'consultas': args.consultas,
+        'segundos': round(segundos, 2),
+        'consultas_por_segundo': round(args.consultas / segundos, 2),
+        'latencia_ms': {
+            nombre: round(1000 * percentil(latencias, p), 1)
+            for nombre, p in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99), ('max', 1.0))
+        },
+        'codigos': {str(codigo): cantidad for codigo, cantidad in sorted(codigos.items(), key=str)},
+        'memoria_mb': {
+            'inicial': round(memoria_inicial, 1),
+            'final': round(memoria_final, 1),
+            'maxima': round(memoria_maxima, 1)
+        },
+        'upstreams': falso.solicitudes,
+        # Veces que Gemini recibió el prefijo fijo (con la caché de contexto, una por vida de la caché)
+        'instrucciones_gemini': falso.instrucciones,
+        'etapas': {
+            serie: valores for serie, valores in metricas['histogramas'].items()
+            if serie.startswith('viajeia_etapa_segundos')
+        }
+    }
+
+    if args.json:
+        print(json.dumps(resultado, indent=2, ensure_ascii=False))
+        return
+
+    print(f"{args.consultas} consultas, concurrencia {args.concurrencia}: "
+          f"{resultado['consultas_por_segundo']} consultas/s en {resultado['segundos']} s")
+    print("Latencia (ms): " + ', '.join(f'{k} {v}' for k, v in resultado['latencia_ms'].items()))
+    print("Códigos: " + ', '.join(f'{k}: {v}' for k, v in resultado['codigos'].items()))
+    print("Memoria (MB): " + ', '.join(f'{k} {v}' for k, v in resultado['memoria_mb'].items()))
+    print("Llamadas a upstreams: " + ', '.join(f'{k} {v}' for k, v in falso.solicitudes.items()))
+    print(f"Prefijo del prompt enviado a Gemini: {falso.instrucciones} veces")
+    print(f"\n{'etapa':<55} {'n':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for serie, valores in resultado['etapas'].items():
+        print(f"{serie:<55} {valores['cantidad']:>6} {valores['p50_ms']:>8} {valores['p95_ms']:>8} {valores['p99_ms']:>8}")
+
+
+if __name__ == '__main__':
+    main()
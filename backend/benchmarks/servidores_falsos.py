@@ -0,0 +1,371 @@
+"""
+============================================
+SERVIDORES FALSOS DE LAS APIS EXTERNAS - VIAJEIA
+============================================
+
+Un servidor HTTP local que imita a Gemini (REST), OpenWeatherMap,
+exchangerate-api y Unsplash, con latencia y tasa de errores configurables
+por upstream. Lo usan los benchmarks para medir el backend sin depender
+de la red ni gastar cuota.
+
+Uso como módulo:
+    servidor = ServidorFalso(perfiles)
+    servidor.iniciar()
+    os.environ.update(servidor.variables_entorno())   # antes de importar app
+
+Uso suelto (para apuntar un backend ya levantado):
+    python benchmarks/servidores_falsos.py --puerto 8089 --latencia gemini=800:200
+
+¿Qué imita?
+- POST /v1beta/models/<modelo>:generateContent y :streamGenerateContent
+- POST /v1beta/cachedContents (caché de contexto de Gemini)
+- GET  /data/2.5/weather, /v4/latest/<moneda>, /search/photos
+
+`instrucciones` cuenta cuántas veces llegó la instrucción de sistema (el
+prefijo fijo del prompt), sea en una consulta o al crear una caché: con
+la caché de contexto debería ser una vez por vida de la caché, no una
+por consulta.
+"""
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+UPSTREAMS = ('gemini', 'openweather', 'exchangerate', 'unsplash')
+
+# Latencias típicas observadas (ms): media y desviación
+PERFILES_POR_DEFECTO = {
+    'gemini': {'media_ms': 1500, 'desvio_ms': 400, 'errores': 0.0},
+    'openweather': {'media_ms': 120, 'desvio_ms': 40, 'errores': 0.0},
+    'exchangerate': {'media_ms': 150, 'desvio_ms': 50, 'errores': 0.0},
+    'unsplash': {'media_ms': 250, 'desvio_ms': 80, 'errores': 0.0},
+}
+
+# Mínimo de tokens de una caché de contexto en la API real (modelos Flash de Gemini)
+CACHE_MIN_TOKENS = 1024
+
+RESPUESTA_GEMINI = (
+    "» ALOJAMIENTO: Hoteles boutique en el centro histórico.\n\n"
+    "Þ COMIDA LOCAL: Mercados y platos típicos de la zona.\n\n"
+    " LUGARES IMPERDIBLES: El casco antiguo, los miradores y el museo principal.\n\n"
+    "ä CONSEJOS LOCALES: Reserva con anticipación y usa transporte público.\n\n"
+    "ø ESTIMACIÓN DE COSTOS: Alojamiento 80 USD/noche, comida 30 USD/día."
+)
+
+PAISES = ('FR', 'IT', 'ES', 'JP', 'MX', 'AR', 'US', 'GB', 'PE', 'CO')
+
+
+def perfiles(latencias=None, errores=None):
+    """
+    Construye los perfiles de los upstreams a partir de los valores por defecto.
+
+    Args:
+        latencias: { upstream: (media_ms, desvio_ms) }
+        errores: { upstream: fracción de respuestas 503 (0 a 1) }
+    """
+    resultado = {nombre: dict(perfil) for nombre, perfil in PERFILES_POR_DEFECTO.items()}
+    for nombre, (media, desvio) in (latencias or {}).items():
+        resultado[nombre].update(media_ms=media, desvio_ms=desvio)
+    for nombre, fraccion in (errores or {}).items():
+        resultado[nombre]['errores'] = fraccion
+    return resultado
+
+
+class ServidorFalso:
+    """
+    Servidor local con los cuatro upstreams (un solo puerto, distinguidos por la ruta).
+
+    Args:
+        perfiles: { upstream: { 'media_ms', 'desvio_ms', 'errores' } }
+        puerto: 0 elige uno libre
+        semilla: Semilla del generador aleatorio (resultados reproducibles)
+        cache_min_tokens: Tokens mínimos para crear una caché de contexto
+                          (como la API real, 1024 por defecto; None la rechaza siempre)
+    """
+
+    def __init__(self, perfiles=PERFILES_POR_DEFECTO, puerto=0, semilla=1234, cache_min_tokens=CACHE_MIN_TOKENS):
+        self.perfiles = perfiles
+        self.cache_min_tokens = cache_min_tokens
+        self._aleatorio = random.Random(semilla)
+        self._lock = threading.Lock()
+        self.solicitudes = {nombre: 0 for nombre in UPSTREAMS}
+        self.errores = {nombre: 0 for nombre in UPSTREAMS}
+        # Caché de contexto: { nombre: (instrucción, vence_en) }
+        self.caches = {}
+        self._ids_cache = itertools.count(1)
+        self.instrucciones = 0
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', puerto), self._crear_handler())
+        self._servidor.daemon_threads = True
+        self.puerto = self._servidor.server_port
+        self.url = f'http://127.0.0.1:{self.puerto}'
+
+    def iniciar(self):
+        threading.Thread(target=self._servidor.serve_forever, daemon=True).start()
+        return self
+
+    def detener(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def variables_entorno(self):
+        """Variables para que el backend use este servidor en lugar de las APIs reales."""
+        return {
+            'GEMINI_API_KEY': 'clave-falsa',
+            'GEMINI_API_ENDPOINT': self.url,
+            'OPENWEATHER_API_KEY': 'clave-falsa',
+            'OPENWEATHER_URL': self.url,
+            'EXCHANGERATE_URL': self.url,
+            'UNSPLASH_API_KEY': 'clave-falsa',
+            'UNSPLASH_URL': self.url,
+            # Las respuestas falsas no deben quedar en la caché en disco del backend real
+            'CACHE_DISK_PATH': '',
+        }
+
+    def _sortear(self, upstream):
+        """Devuelve (segundos de espera, si responde con error) según el perfil."""
+        perfil = self.perfiles[upstream]
+        with self._lock:
+            self.solicitudes[upstream] += 1
+            espera = max(0.0, self._aleatorio.gauss(perfil['media_ms'], perfil['desvio_ms'])) / 1000
+            falla = self._aleatorio.random() < perfil['errores']
+            if falla:
+                self.errores[upstream] += 1
+        return espera, falla
+
+    def crear_cache(self, cuerpo):
+        """
+        Crea una caché de contexto.
+
+        Returns:
+            tuple: (status, datos)
+        """
+        instruccion = _texto(cuerpo.get('systemInstruction'))
+        tokens = len(instruccion.split())
+        with self._lock:
+            self.instrucciones += 1
+            if self.cache_min_tokens is None or tokens < self.cache_min_tokens:
+                return 400, {'error': {
+                    'code': 400, 'status': 'INVALID_ARGUMENT',
+                    'message': f'Cached content is too small. total_token_count={tokens}, min_total_token_count={self.cache_min_tokens}'
+                }}
+            nombre = f'cachedContents/falsa{next(self._ids_cache)}'
+            ttl = float(cuerpo.get('ttl', '3600s').rstrip('s'))
+            self.caches[nombre] = (instruccion, time.time() + ttl)
+        vence = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() + ttl))
+        return 200, {
+            'name': nombre, 'model': cuerpo.get('model'), 'displayName': cuerpo.get('displayName', ''),
+            'createTime': vence, 'updateTime': vence, 'expireTime': vence,
+            'usageMetadata': {'totalTokenCount': tokens}
+        }
+
+    def instruccion_consulta(self, cuerpo):
+        """
+        Instrucción de sistema de una consulta (propia o de su caché).
+
+        Returns:
+            tuple: (instrucción, si vino de la caché) o None si la caché no existe o venció
+        """
+        with self._lock:
+            if 'cachedContent' in cuerpo:
+                instruccion, vence_en = self.caches.get(cuerpo['cachedContent'], ('', 0))
+                if vence_en <= time.time():
+                    return None
+                return instruccion, True
+            instruccion = _texto(cuerpo.get('systemInstruction'))
+            if instruccion:
+                self.instrucciones += 1
+            return instruccion, False
+
+    def _crear_handler(self):
+        servidor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _enviar(self, status, datos):
+                cuerpo = json.dumps(datos, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(cuerpo)))
+                self.end_headers()
+                self.wfile.write(cuerpo)
+
+            def _responder(self, upstream, generar):
+                espera, falla = servidor._sortear(upstream)
+                time.sleep(espera)
+                if falla:
+                    self._enviar(503, {'error': {'code': 503, 'message': 'servicio no disponible', 'status': 'UNAVAILABLE'}})
+                else:
+                    generar()
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {clave: valores[0] for clave, valores in parse_qs(url.query).items()}
+                if url.path == '/data/2.5/weather':
+                    self._responder('openweather', lambda: self._enviar(200, _clima(query)))
+                elif url.path.startswith('/v4/latest/'):
+                    self._responder('exchangerate', lambda: self._enviar(200, _tabla_cambio(url.path.rsplit('/', 1)[-1])))
+                elif url.path == '/search/photos':
+                    self._responder('unsplash', lambda: self._enviar(200, _fotos(query.get('query', ''), int(query.get('per_page', 3)))))
+                else:
+                    self._enviar(404, {'error': 'ruta desconocida'})
+
+            def do_POST(self):
+                longitud = int(self.headers.get('Content-Length', 0))
+                cuerpo = json.loads(self.rfile.read(longitud) or b'{}')
+                url = urlparse(self.path)
+                if url.path == '/v1beta/cachedContents':
+                    self._enviar(*servidor.crear_cache(cuerpo))
+                    return
+                if not re.search(r':(stream)?[gG]enerateContent$', url.path):
+                    self._enviar(404, {'error': 'ruta desconocida'})
+                    return
+                instruccion = servidor.instruccion_consulta(cuerpo)
+                if instruccion is None:
+                    self._enviar(404, {'error': {'code': 404, 'message': 'CachedContent not found', 'status': 'NOT_FOUND'}})
+                elif url.path.endswith(':generateContent'):
+                    self._responder('gemini', lambda: self._enviar(200, _respuesta_gemini(cuerpo, RESPUESTA_GEMINI, instruccion)))
+                else:
+                    self._responder('gemini', lambda: self._stream_gemini(cuerpo, instruccion))
+
+            def _stream_gemini(self, cuerpo, instruccion):
+                # El transporte REST espera un arreglo JSON que llega por partes
+                fragmentos = RESPUESTA_GEMINI.split('\n\n')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                for i, fragmento in enumerate(fragmentos):
+                    texto = fragmento + ('\n\n' if i < len(fragmentos) - 1 else '')
+                    datos = json.dumps(_respuesta_gemini(cuerpo, texto, instruccion), ensure_ascii=False)
+                    parte = ('[' if i == 0 else ',\n') + datos + (']' if i == len(fragmentos) - 1 else '')
+                    self._chunk(parte.encode('utf-8'))
+                    time.sleep(0.02)
+                self._chunk(b'')
+
+            def _chunk(self, datos):
+                self.wfile.write(f'{len(datos):X}\r\n'.encode() + datos + b'\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+
+def _clima(query):
+    # q puede ser "Ciudad" o "Ciudad,PAÍS"; para un país se consulta por lat/lon
+    ciudad, _, pais = query.get('q', f"{query.get('lat')},{query.get('lon')}").partition(',')
+    if not pais or not pais.isalpha():
+        pais = PAISES[sum(map(ord, ciudad)) % len(PAISES)]
+    return {
+        'name': ciudad.title(),
+        'sys': {'country': pais},
+        'main': {'temp': 21.4, 'feels_like': 20.8, 'humidity': 55, 'pressure': 1013},
+        'weather': [{'description': 'cielo despejado'}],
+        'wind': {'speed': 3.2},
+        'visibility': 10000,
+        'timezone': 3600
+    }
+
+
+def _tabla_cambio(base):
+    return {
+        'base': base,
+        'date': '2024-01-01',
+        'rates': {'USD': 1.0, 'EUR': 0.92, 'GBP': 0.79, 'JPY': 148.1, 'MXN': 17.1,
+                  'ARS': 808.5, 'PEN': 3.7, 'COP': 3950.0}
+    }
+
+
+def _fotos(consulta, cantidad):
+    return {
+        'results': [
+            {
+                'urls': {
+                    'regular': f'https://images.example/{consulta}/{i}/regular.jpg',
+                    'small': f'https://images.example/{consulta}/{i}/small.jpg',
+                    'full': f'https://images.example/{consulta}/{i}/full.jpg'
+                },
+                'user': {'name': f'Fotógrafo {i}'},
+                'description': f'{consulta} {i}'
+            }
+            for i in range(cantidad)
+        ]
+    }
+
+
+def _texto(contenido):
+    """Texto de un Content de Gemini ({'parts': [{'text': ...}]})."""
+    return ''.join(parte.get('text', '') for parte in (contenido or {}).get('parts', []))
+
+
+def _respuesta_gemini(cuerpo, texto, instruccion=('', False)):
+    instruccion, cacheada = instruccion
+    palabras_instruccion = len(instruccion.split())
+    palabras_prompt = palabras_instruccion + sum(
+        len(_texto(contenido).split()) for contenido in cuerpo.get('contents', [])
+    )
+    respuesta = {
+        'candidates': [{
+            'content': {'parts': [{'text': texto}], 'role': 'model'},
+            'finishReason': 'STOP',
+            'index': 0
+        }],
+        'usageMetadata': {
+            'promptTokenCount': palabras_prompt,
+            'candidatesTokenCount': len(texto.split()),
+            'totalTokenCount': palabras_prompt + len(texto.split())
+        }
+    }
+    if cacheada:
+        respuesta['usageMetadata']['cachedContentTokenCount'] = palabras_instruccion
+    return respuesta
+
+
+def leer_perfiles(args_latencia, args_errores):
+    """Interpreta 'gemini=800:200' y 'unsplash=0.05' de la línea de comandos."""
+    latencias = {}
+    for valor in args_latencia or []:
+        nombre, tiempos = valor.split('=')
+        media, _, desvio = tiempos.partition(':')
+        latencias[nombre] = (float(media), float(desvio or 0))
+    errores = {}
+    for valor in args_errores or []:
+        nombre, fraccion = valor.split('=')
+        errores[nombre] = float(fraccion)
+    return perfiles(latencias, errores)
+
+
+def agregar_argumentos(parser):
+    parser.add_argument('--latencia', nargs='*', metavar='UPSTREAM=MEDIA_MS:DESVIO_MS',
+                        help='Latencia de cada upstream, por ejemplo gemini=800:200')
+    parser.add_argument('--errores', nargs='*', metavar='UPSTREAM=FRACCION',
+                        help='Fracción de respuestas 503, por ejemplo unsplash=0.05')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--puerto', type=int, default=8089)
+    agregar_argumentos(parser)
+    args = parser.parse_args()
+
+    servidor = ServidorFalso(leer_perfiles(args.latencia, args.errores), puerto=args.puerto).iniciar()
+    print(f"Servidores falsos en {servidor.url}. Variables para el backend:")
+    for clave, valor in servidor.variables_entorno().items():
+        print(f"  {clave}={valor}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        servidor.detener()
+
+
+if __name__ == '__main__':
+    main()
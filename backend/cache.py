@@ -0,0 +1,387 @@
+"""
+============================================
+CACHÉ EN MEMORIA - VIAJEIA
+============================================
+
+Este módulo guarda en memoria las respuestas de las APIs externas
+(clima, tipo de cambio, fotos) durante un tiempo limitado.
+
+¿Por qué es importante?
+- La mayoría de las consultas piden los mismos destinos
+- Evita repetir llamadas lentas a OpenWeatherMap, exchangerate-api y Unsplash
+- Cuida las cuotas gratuitas de esas APIs
+- Si un upstream está caído, sirve el último valor conocido (marcado como
+  obsoleto) y lo actualiza en segundo plano cuando el upstream vuelve
+- Opcionalmente, cada caché se apoya en la caché en disco (cache_disco.py),
+  que sobrevive a los reinicios y comparten los workers del servidor
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger('viajeia.cache')
+
+# Marca interna para distinguir "no está en caché" de un valor guardado
+_AUSENTE = object()
+
+# Hilos para actualizar en segundo plano las entradas vencidas (backend Flask)
+_revalidacion = ThreadPoolExecutor(max_workers=4, thread_name_prefix='revalidacion')
+
+
+class CacheTTL:
+    """
+    Caché acotada con expiración por entrada (TTL) y desalojo LRU.
+
+    - Cada entrada vence `ttl` segundos después de guardarse.
+    - Si se supera `max_entradas`, se desaloja la usada hace más tiempo.
+    - Si varias consultas piden la misma clave a la vez y no está en caché,
+      solo la primera llama al upstream; las demás esperan y comparten su resultado.
+    - Con `ttl_obsoleto`, una entrada vencida se conserva ese tiempo extra
+      (stale-while-revalidate): obtener_o_calcular la devuelve al instante,
+      pasada por `marcar_obsoleto`, y la actualiza en segundo plano. Si el
+      upstream falla, la entrada vieja sigue ahí para la próxima consulta.
+    - Con `disco`, lo que se guarda también va a la caché en disco y, si una
+      clave no está vigente en memoria, se busca ahí antes de ir al upstream.
+
+    Args:
+        marcar_obsoleto: Función que recibe un valor vencido y devuelve la
+                         versión que se entrega (por ejemplo, con 'obsoleto': True)
+        disco: CacheDisco compartida por los procesos (None = solo memoria)
+    """
+
+    def __init__(self, nombre, ttl, max_entradas=500, ttl_obsoleto=0, marcar_obsoleto=None, disco=None):
+        self.nombre = nombre
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self.ttl_obsoleto = ttl_obsoleto
+        self._marcar_obsoleto = marcar_obsoleto or (lambda valor: valor)
+        self.disco = disco
+        self._datos = OrderedDict()  # { clave: (expira_en, valor) }
+        self._en_vuelo = {}  # { clave: Future } consultas en curso
+        self._en_vuelo_async = {}  # { clave: asyncio.Future } consultas en curso (app_async)
+        self._revalidaciones_async = set()  # Tareas en segundo plano (para que no las borre el GC)
+        self._lock = threading.Lock()
+
+        # Contadores
+        self.aciertos = 0
+        self.fallos = 0
+        self.compartidos = 0
+        self.desalojos = 0
+        self.obsoletos = 0
+        self.aciertos_disco = 0
+
+    def _leer(self, clave, ahora):
+        """Devuelve el valor vigente o _AUSENTE. Debe llamarse con el lock tomado."""
+        entrada = self._datos.get(clave)
+        if entrada is None:
+            return _AUSENTE
+
+        expira_en, valor = entrada
+        if expira_en <= ahora:
+            if expira_en + self.ttl_obsoleto <= ahora:
+                del self._datos[clave]
+            return _AUSENTE
+
+        self._datos.move_to_end(clave)
+        return valor
+
+    def _leer_obsoleto(self, clave, ahora):
+        """
+        Devuelve el valor vencido que todavía se conserva, o _AUSENTE.
+        Debe llamarse con el lock tomado, después de que _leer no encontró uno vigente.
+        """
+        entrada = self._datos.get(clave)
+        if entrada is None or entrada[0] + self.ttl_obsoleto <= ahora:
+            return _AUSENTE
+        self._datos.move_to_end(clave)
+        return entrada[1]
+
+    def _escribir(self, clave, valor, ttl, ahora):
+        """Guarda una entrada y desaloja las más antiguas. Debe llamarse con el lock tomado."""
+        self._datos[clave] = (ahora + (self.ttl if ttl is None else ttl), valor)
+        self._datos.move_to_end(clave)
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
+
+    def _falta_en_memoria(self, clave):
+        """True si la clave no tiene una entrada vigente en memoria."""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            return entrada is None or entrada[0] <= time.monotonic()
+
+    def _subir_de_disco(self, clave):
+        """
+        Trae a memoria la entrada de la caché en disco (la pudo guardar otro
+        worker o el proceso anterior), si es más nueva que la que hay.
+        """
+        guardada = self.disco.leer(self.nombre, clave)
+        if guardada is None:
+            return
+        valor, vence_en = guardada
+        with self._lock:
+            ahora = time.monotonic()
+            expira_en = vence_en - (time.time() - ahora)
+            entrada = self._datos.get(clave)
+            if entrada is not None and entrada[0] >= expira_en:
+                return
+            self._escribir(clave, valor, expira_en - ahora, ahora)
+            self.aciertos_disco += 1
+
+    def _guardar_en_disco(self, clave, valor, ttl):
+        """Encola la entrada para la caché en disco, con el mismo vencimiento."""
+        if self.disco is None:
+            return
+        vence_en = time.time() + (self.ttl if ttl is None else ttl)
+        self.disco.guardar(self.nombre, clave, valor, vence_en, vence_en + self.ttl_obsoleto)
+
+    def obtener(self, clave, por_defecto=None):
+        """Devuelve el valor guardado si sigue vigente."""
+        if self.disco is not None and self._falta_en_memoria(clave):
+            self._subir_de_disco(clave)
+        with self._lock:
+            valor = self._leer(clave, time.monotonic())
+            if valor is _AUSENTE:
+                self.fallos += 1
+                return por_defecto
+            self.aciertos += 1
+            return valor
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda un valor con el TTL de la caché (o uno específico)."""
+        with self._lock:
+            self._escribir(clave, valor, ttl, time.monotonic())
+        self._guardar_en_disco(clave, valor, ttl)
+
+    def obtener_o_calcular(self, clave, calcular, es_cacheable=bool):
+        """
+        Devuelve el valor de la caché o lo calcula con `calcular()`.
+
+        Args:
+            clave: Clave de la entrada
+            calcular: Función sin argumentos que consulta el upstream
+            es_cacheable: Decide si un resultado se guarda (por defecto, solo los no vacíos)
+
+        Returns:
+            El valor guardado, el recién calculado o uno vencido marcado como obsoleto
+        """
+        if self.disco is not None and self._falta_en_memoria(clave):
+            self._subir_de_disco(clave)
+        with self._lock:
+            ahora = time.monotonic()
+            valor = self._leer(clave, ahora)
+            if valor is not _AUSENTE:
+                self.aciertos += 1
+                return valor
+
+            obsoleto = self._leer_obsoleto(clave, ahora)
+            futuro = self._en_vuelo.get(clave)
+            propietario = futuro is None
+            if propietario:
+                futuro = Future()
+                self._en_vuelo[clave] = futuro
+            if obsoleto is not _AUSENTE:
+                self.obsoletos += 1
+            elif propietario:
+                self.fallos += 1
+            else:
+                self.compartidos += 1
+
+        if obsoleto is not _AUSENTE:
+            if propietario:
+                _revalidacion.submit(self._revalidar, clave, calcular, es_cacheable, futuro)
+            return self._marcar_obsoleto(obsoleto)
+
+        if not propietario:
+            return futuro.result()
+        return self._calcular(clave, calcular, es_cacheable, futuro)
+
+    def _calcular(self, clave, calcular, es_cacheable, futuro):
+        """Llama al upstream, guarda el resultado y lo publica en `futuro`."""
+        try:
+            valor = calcular()
+        except BaseException as e:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            futuro.set_exception(e)
+            raise
+
+        with self._lock:
+            cacheable = es_cacheable(valor)
+            if cacheable:
+                self._escribir(clave, valor, None, time.monotonic())
+            self._en_vuelo.pop(clave, None)
+        if cacheable:
+            self._guardar_en_disco(clave, valor, None)
+        futuro.set_result(valor)
+        return valor
+
+    def _revalidar(self, clave, calcular, es_cacheable, futuro):
+        """Actualiza una entrada vencida en segundo plano (el resultado nadie lo espera)."""
+        try:
+            self._calcular(clave, calcular, es_cacheable, futuro)
+        except Exception as e:
+            logger.warning("Error al actualizar la caché %s: %s", self.nombre, e)
+
+    async def obtener_o_calcular_async(self, clave, calcular, es_cacheable=bool):
+        """
+        Versión asíncrona de obtener_o_calcular (backend app_async.py).
+
+        Args:
+            clave: Clave de la entrada
+            calcular: Corrutina sin argumentos (async def) que consulta el upstream
+            es_cacheable: Decide si un resultado se guarda (por defecto, solo los no vacíos)
+
+        Returns:
+            El valor guardado, el recién calculado o uno vencido marcado como obsoleto
+        """
+        if self.disco is not None and self._falta_en_memoria(clave):
+            await asyncio.to_thread(self._subir_de_disco, clave)
+        with self._lock:
+            ahora = time.monotonic()
+            valor = self._leer(clave, ahora)
+            if valor is not _AUSENTE:
+                self.aciertos += 1
+                return valor
+
+            obsoleto = self._leer_obsoleto(clave, ahora)
+            futuro = self._en_vuelo_async.get(clave)
+            propietario = futuro is None
+            if propietario:
+                futuro = asyncio.get_running_loop().create_future()
+                self._en_vuelo_async[clave] = futuro
+            if obsoleto is not _AUSENTE:
+                self.obsoletos += 1
+            elif propietario:
+                self.fallos += 1
+            else:
+                self.compartidos += 1
+
+        if obsoleto is not _AUSENTE:
+            if propietario:
+                tarea = asyncio.ensure_future(self._revalidar_async(clave, calcular, es_cacheable, futuro))
+                self._revalidaciones_async.add(tarea)
+                tarea.add_done_callback(self._revalidaciones_async.discard)
+            return self._marcar_obsoleto(obsoleto)
+
+        if not propietario:
+            # shield: si se cancela quien espera, la consulta compartida sigue
+            return await asyncio.shield(futuro)
+        return await self._calcular_async(clave, calcular, es_cacheable, futuro)
+
+    async def _calcular_async(self, clave, calcular, es_cacheable, futuro):
+        """Versión asíncrona de _calcular."""
+        try:
+            valor = await calcular()
+        except BaseException as e:
+            with self._lock:
+                self._en_vuelo_async.pop(clave, None)
+            if isinstance(e, asyncio.CancelledError):
+                futuro.cancel()
+            else:
+                futuro.set_exception(e)
+                futuro.exception()  # Evita el aviso "exception was never retrieved"
+            raise
+
+        with self._lock:
+            cacheable = es_cacheable(valor)
+            if cacheable:
+                self._escribir(clave, valor, None, time.monotonic())
+            self._en_vuelo_async.pop(clave, None)
+        if cacheable:
+            self._guardar_en_disco(clave, valor, None)
+        futuro.set_result(valor)
+        return valor
+
+    async def _revalidar_async(self, clave, calcular, es_cacheable, futuro):
+        """Versión asíncrona de _revalidar."""
+        try:
+            await self._calcular_async(clave, calcular, es_cacheable, futuro)
+        except Exception as e:
+            logger.warning("Error al actualizar la caché %s: %s", self.nombre, e)
+
+    def restante(self, clave):
+        """
+        Segundos que le quedan a una entrada antes de vencer (negativo si ya
+        venció pero se conserva como obsoleta), o None si no está.
+        """
+        with self._lock:
+            entrada = self._datos.get(clave)
+            return None if entrada is None else entrada[0] - time.monotonic()
+
+    def exportar(self):
+        """
+        Entradas que todavía se pueden servir, para guardarlas en disco.
+
+        Returns:
+            list: [(clave, valor, vence_en)] con vence_en en tiempo de reloj (time.time())
+        """
+        ahora = time.monotonic()
+        desfase = time.time() - ahora
+        with self._lock:
+            return [
+                (clave, valor, expira_en + desfase)
+                for clave, (expira_en, valor) in self._datos.items()
+                if expira_en + self.ttl_obsoleto > ahora
+            ]
+
+    def importar(self, entradas):
+        """
+        Carga entradas guardadas con exportar() (se descartan las que ya no sirven).
+
+        Returns:
+            int: entradas cargadas
+        """
+        ahora = time.monotonic()
+        desfase = time.time() - ahora
+        cargadas = 0
+        with self._lock:
+            for clave, valor, vence_en in entradas:
+                expira_en = vence_en - desfase
+                if expira_en + self.ttl_obsoleto <= ahora:
+                    continue
+                self._escribir(clave, valor, expira_en - ahora, ahora)
+                cargadas += 1
+        return cargadas
+
+    def invalidar(self, clave):
+        """Elimina una entrada (también de la caché en disco)."""
+        with self._lock:
+            self._datos.pop(clave, None)
+        if self.disco is not None:
+            self.disco.borrar(self.nombre, clave)
+
+    def limpiar(self):
+        """Vacía la caché (también su parte de la caché en disco)."""
+        with self._lock:
+            self._datos.clear()
+        if self.disco is not None:
+            self.disco.borrar(self.nombre)
+
+    def estadisticas(self):
+        """
+        Obtiene los contadores de uso de la caché.
+
+        Returns:
+            dict: { 'entradas', 'aciertos', 'fallos', 'compartidos', 'desalojos', 'obsoletos',
+                    'tasa_aciertos' } y, con caché en disco, 'aciertos_disco'
+        """
+        with self._lock:
+            consultas = self.aciertos + self.fallos + self.compartidos + self.obsoletos
+            estadisticas = {
+                'entradas': len(self._datos),
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'compartidos': self.compartidos,
+                'desalojos': self.desalojos,
+                'obsoletos': self.obsoletos,
+                'tasa_aciertos': round(self.aciertos / consultas, 3) if consultas else 0.0
+            }
+            if self.disco is not None:
+                # Entradas que se trajeron del disco (cuentan también como aciertos u obsoletas)
+                estadisticas['aciertos_disco'] = self.aciertos_disco
+            return estadisticas
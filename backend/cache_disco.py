@@ -0,0 +1,386 @@
+"""
+============================================
+CACHÉ EN DISCO - VIAJEIA
+============================================
+
+Un nivel de caché debajo de las cachés en memoria (CacheTTL), guardado
+en un archivo SQLite en modo WAL. Guarda las respuestas de Gemini, las
+fotos y las tablas de tipo de cambio con su vencimiento.
+
+- Cuando una entrada no está en memoria, se busca en el disco: la pudo
+  haber guardado otro worker del mismo servidor o el proceso anterior
+  (antes de un deploy o de que gunicorn recicle el worker).
+- En WAL varios procesos leen a la vez sin esperar a quien escribe.
+  Leer es una búsqueda por clave primaria.
+- Las escrituras no bloquean la consulta: van a una cola y un hilo por
+  proceso las graba en lotes, en una sola transacción.
+- Compactación: cada CACHE_DISK_COMPACT_INTERVAL segundos uno de los
+  procesos (el primero que la toma) borra lo vencido y, si el archivo
+  pasa de CACHE_DISK_MAX_MB, desaloja las entradas usadas hace más tiempo.
+  Después devuelve al sistema las páginas libres y vacía el WAL.
+  También se puede correr a mano o desde cron:
+      python cache_disco.py --compactar
+
+¿Por qué es importante?
+- Un deploy o un worker nuevo no empiezan con la caché vacía
+- Lo que trajo un worker lo aprovechan los demás: menos llamadas a Gemini,
+  OpenWeatherMap y Unsplash, y menos cuota gastada
+- El archivo tiene un tamaño acotado y no crece sin límite
+"""
+
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+logger = logging.getLogger('viajeia.cache_disco')
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Archivo de la caché en disco (vacío = desactivada)
+CACHE_DISK_PATH = os.getenv('CACHE_DISK_PATH', 'cache.sqlite3')
+# Tamaño máximo de los datos guardados (MB)
+CACHE_DISK_MAX_MB = float(os.getenv('CACHE_DISK_MAX_MB', '64'))
+# Segundos entre compactaciones
+CACHE_DISK_COMPACT_INTERVAL = int(os.getenv('CACHE_DISK_COMPACT_INTERVAL', '600'))
+
+# Escrituras que se graban como mucho en una misma transacción
+MAX_LOTE = 200
+# Escrituras pendientes como mucho: si el disco no da abasto, se descartan (es solo caché)
+MAX_PENDIENTES = 10000
+# Al desalojar por tamaño se baja hasta esta fracción del máximo (para no desalojar en cada ciclo)
+FRACCION_TRAS_DESALOJO = 0.9
+
+_ESQUEMA = (
+    '''CREATE TABLE IF NOT EXISTS cache (
+        espacio TEXT NOT NULL,
+        clave TEXT NOT NULL,
+        valor BLOB NOT NULL,
+        vence_en REAL NOT NULL,
+        borrar_en REAL NOT NULL,
+        guardado_en REAL NOT NULL,
+        usado_en REAL NOT NULL,
+        tamano INTEGER NOT NULL,
+        PRIMARY KEY (espacio, clave)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS cache_borrar_en ON cache (borrar_en)',
+    'CREATE INDEX IF NOT EXISTS cache_usado_en ON cache (usado_en)',
+    'CREATE TABLE IF NOT EXISTS mantenimiento (tarea TEXT PRIMARY KEY, ts REAL NOT NULL)',
+)
+
+
+def serializar_clave(clave):
+    """Clave de una CacheTTL como texto (las tuplas quedan como listas JSON)."""
+    return json.dumps(clave, ensure_ascii=False, separators=(',', ':'))
+
+
+class CacheDisco:
+    """
+    Entradas de varias cachés en un archivo SQLite compartido por los
+    procesos del servidor. Cada caché usa su propio `espacio` (su nombre).
+
+    Cada entrada guarda:
+    - vence_en: hasta cuándo está vigente (tiempo de reloj, time.time())
+    - borrar_en: hasta cuándo se conserva para servirla como obsoleta
+    - usado_en: última vez que se leyó (para desalojar las menos usadas)
+    - tamano: bytes del valor (JSON comprimido con zlib)
+
+    Args:
+        ruta: Archivo SQLite
+        max_bytes: Tamaño máximo de los valores guardados
+        intervalo_compactacion: Segundos entre compactaciones (0 = solo a mano)
+    """
+
+    def __init__(self, ruta=CACHE_DISK_PATH, max_bytes=int(CACHE_DISK_MAX_MB * 1024 * 1024),
+                 intervalo_compactacion=CACHE_DISK_COMPACT_INTERVAL):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.intervalo_compactacion = intervalo_compactacion
+        self._local = threading.local()
+        self._pendientes = queue.Queue(maxsize=MAX_PENDIENTES)
+        self._lock = threading.Lock()
+        self._hilo_pid = None
+
+        # Contadores (de este proceso)
+        self.aciertos = 0
+        self.fallos = 0
+        self.escrituras = 0
+        self.descartadas = 0
+        self.errores = 0
+        self.compactaciones = 0
+        self.desalojos = 0
+
+        conexion = self._conexion()
+        # auto_vacuum solo se puede elegir antes de crear las tablas
+        conexion.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conexion.execute('PRAGMA journal_mode=WAL')
+        for sentencia in _ESQUEMA:
+            conexion.execute(sentencia)
+        # No dejar conexiones abiertas heredables si gunicorn hace fork después (preload_app)
+        conexion.close()
+        self._local.conexion = None
+
+    def _conexion(self):
+        """Una conexión por hilo y por proceso (sqlite3 no las comparte)."""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None or self._local.pid != os.getpid():
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conexion.execute('PRAGMA busy_timeout=5000')
+            conexion.execute('PRAGMA synchronous=NORMAL')
+            self._local.conexion = conexion
+            self._local.pid = os.getpid()
+        return conexion
+
+    # ============================================
+    # LECTURA Y ESCRITURA
+    # ============================================
+
+    def leer(self, espacio, clave):
+        """
+        Entrada guardada que todavía se puede servir (vigente u obsoleta).
+
+        Returns:
+            tuple: (valor, vence_en) o None
+        """
+        ahora = time.time()
+        clave = serializar_clave(clave)
+        try:
+            fila = self._conexion().execute(
+                'SELECT valor, vence_en FROM cache WHERE espacio = ? AND clave = ? AND borrar_en > ?',
+                (espacio, clave, ahora)
+            ).fetchone()
+            if fila is None:
+                self.fallos += 1
+                return None
+            valor = json.loads(zlib.decompress(fila[0]))
+        except (sqlite3.Error, zlib.error, ValueError) as e:
+            self.errores += 1
+            logger.warning("No se pudo leer la caché en disco (%s): %s", espacio, e)
+            return None
+        self.aciertos += 1
+        self._encolar(('tocar', espacio, clave, ahora))
+        return valor, fila[1]
+
+    def guardar(self, espacio, clave, valor, vence_en, borrar_en):
+        """Encola una entrada para guardarla (la graba el hilo de escritura)."""
+        try:
+            datos = zlib.compress(json.dumps(valor, ensure_ascii=False).encode('utf-8'))
+        except (TypeError, ValueError) as e:
+            logger.debug("Valor de %s que no se puede guardar en disco: %s", espacio, e)
+            return
+        self._encolar(('guardar', espacio, serializar_clave(clave), datos, vence_en, borrar_en))
+
+    def borrar(self, espacio, clave=None):
+        """Encola el borrado de una entrada (o de todo el espacio si no hay clave)."""
+        self._encolar(('borrar', espacio, None if clave is None else serializar_clave(clave)))
+
+    def _encolar(self, operacion):
+        self.iniciar()
+        try:
+            self._pendientes.put_nowait(operacion)
+        except queue.Full:
+            self.descartadas += 1
+
+    # ============================================
+    # HILO DE ESCRITURA
+    # ============================================
+
+    def iniciar(self):
+        """
+        Arranca el hilo de escritura si no corre en este proceso. Con
+        preload_app, gunicorn importa la app en el proceso maestro y los
+        hilos no pasan a los workers: se crea en cada worker con su primer uso.
+        """
+        if self._hilo_pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo_pid == os.getpid():
+                return
+            self._hilo_pid = os.getpid()
+            # Lo que quedó encolado en el proceso maestro no es de este worker
+            self._pendientes = queue.Queue(maxsize=MAX_PENDIENTES)
+            threading.Thread(target=self._bucle, name='cache-disco', daemon=True).start()
+
+    def _bucle(self):
+        pendientes = self._pendientes
+        proxima_compactacion = time.monotonic() + self.intervalo_compactacion
+        while True:
+            espera = proxima_compactacion - time.monotonic() if self.intervalo_compactacion else None
+            try:
+                lote = [pendientes.get(timeout=max(0.0, espera) if espera is not None else None)]
+            except queue.Empty:
+                lote = []
+            while lote and len(lote) < MAX_LOTE and not pendientes.empty():
+                lote.append(pendientes.get_nowait())
+            if lote:
+                self._grabar(lote)
+                for _ in lote:
+                    pendientes.task_done()
+            if self.intervalo_compactacion and time.monotonic() >= proxima_compactacion:
+                proxima_compactacion = time.monotonic() + self.intervalo_compactacion
+                try:
+                    self.compactar()
+                except sqlite3.Error as e:
+                    logger.warning("No se pudo compactar la caché en disco: %s", e)
+
+    def _grabar(self, lote):
+        """Graba un lote de operaciones en una transacción."""
+        conexion = self._conexion()
+        ahora = time.time()
+        try:
+            conexion.execute('BEGIN IMMEDIATE')
+            try:
+                for operacion in lote:
+                    tipo = operacion[0]
+                    if tipo == 'guardar':
+                        _, espacio, clave, datos, vence_en, borrar_en = operacion
+                        conexion.execute(
+                            'INSERT OR REPLACE INTO cache '
+                            '(espacio, clave, valor, vence_en, borrar_en, guardado_en, usado_en, tamano) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                            (espacio, clave, datos, vence_en, borrar_en, ahora, ahora, len(datos))
+                        )
+                        self.escrituras += 1
+                    elif tipo == 'tocar':
+                        _, espacio, clave, usado_en = operacion
+                        conexion.execute(
+                            'UPDATE cache SET usado_en = ? WHERE espacio = ? AND clave = ? AND usado_en < ?',
+                            (usado_en, espacio, clave, usado_en)
+                        )
+                    elif operacion[2] is None:
+                        conexion.execute('DELETE FROM cache WHERE espacio = ?', (operacion[1],))
+                    else:
+                        conexion.execute('DELETE FROM cache WHERE espacio = ? AND clave = ?', operacion[1:])
+                conexion.execute('COMMIT')
+            except Exception:
+                conexion.execute('ROLLBACK')
+                raise
+        except sqlite3.Error as e:
+            self.errores += 1
+            logger.warning("No se pudieron grabar %d operaciones en la caché en disco: %s", len(lote), e)
+
+    def esperar_escrituras(self, plazo=5.0):
+        """Espera (hasta `plazo` segundos) a que se graben las escrituras encoladas."""
+        limite = time.monotonic() + plazo
+        while self._pendientes.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.01)
+
+    # ============================================
+    # COMPACTACIÓN
+    # ============================================
+
+    def compactar(self, forzar=False):
+        """
+        Borra las entradas que ya no se pueden servir, desaloja las usadas hace
+        más tiempo si los datos pasan de max_bytes, devuelve las páginas libres
+        al sistema y vacía el WAL. Si otro proceso compactó hace menos de
+        intervalo_compactacion segundos, no hace nada (salvo con `forzar`).
+
+        Returns:
+            dict: { 'vencidas', 'desalojadas', 'bytes' } o None si no compactó
+        """
+        conexion = self._conexion()
+        ahora = time.time()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            fila = conexion.execute("SELECT ts FROM mantenimiento WHERE tarea = 'compactar'").fetchone()
+            if not forzar and fila is not None and ahora - fila[0] < self.intervalo_compactacion * 0.9:
+                conexion.execute('ROLLBACK')
+                return None
+            conexion.execute("INSERT OR REPLACE INTO mantenimiento (tarea, ts) VALUES ('compactar', ?)", (ahora,))
+
+            vencidas = conexion.execute('DELETE FROM cache WHERE borrar_en <= ?', (ahora,)).rowcount
+            total = conexion.execute('SELECT COALESCE(SUM(tamano), 0) FROM cache').fetchone()[0]
+            desalojadas = 0
+            if total > self.max_bytes:
+                # Límite de usado_en hasta el que hay que borrar para bajar a FRACCION_TRAS_DESALOJO
+                sobrante = total - self.max_bytes * FRACCION_TRAS_DESALOJO
+                corte = None
+                for usado_en, tamano in conexion.execute('SELECT usado_en, tamano FROM cache ORDER BY usado_en'):
+                    corte = usado_en
+                    sobrante -= tamano
+                    if sobrante <= 0:
+                        break
+                desalojadas = conexion.execute('DELETE FROM cache WHERE usado_en <= ?', (corte,)).rowcount
+                total = conexion.execute('SELECT COALESCE(SUM(tamano), 0) FROM cache').fetchone()[0]
+            conexion.execute('COMMIT')
+        except Exception:
+            conexion.execute('ROLLBACK')
+            raise
+
+        # Fuera de la transacción: devolver las páginas libres y vaciar el WAL
+        # executescript corre el pragma hasta el final (execute libera una sola página)
+        conexion.executescript('PRAGMA incremental_vacuum;')
+        conexion.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        self.compactaciones += 1
+        self.desalojos += desalojadas
+        logger.info("Caché en disco compactada: %d vencidas, %d desalojadas, %d bytes",
+                    vencidas, desalojadas, total)
+        return {'vencidas': vencidas, 'desalojadas': desalojadas, 'bytes': total}
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'entradas', 'bytes', 'archivo_bytes', 'aciertos', 'fallos', 'escrituras', ... }
+        """
+        try:
+            entradas, total = self._conexion().execute(
+                'SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM cache'
+            ).fetchone()
+        except sqlite3.Error:
+            entradas = total = None
+        archivo = 0
+        for sufijo in ('', '-wal'):
+            try:
+                archivo += os.path.getsize(self.ruta + sufijo)
+            except OSError:
+                pass
+        return {
+            'entradas': entradas,
+            'bytes': total,
+            'archivo_bytes': archivo,
+            'max_bytes': self.max_bytes,
+            'aciertos': self.aciertos,
+            'fallos': self.fallos,
+            'escrituras': self.escrituras,
+            'pendientes': self._pendientes.qsize(),
+            'descartadas': self.descartadas,
+            'errores': self.errores,
+            'compactaciones': self.compactaciones,
+            'desalojos': self.desalojos
+        }
+
+
+def crear_cache_disco(ruta=CACHE_DISK_PATH):
+    """
+    Abre la caché en disco, o devuelve None si está desactivada o no se pudo
+    abrir (el backend sigue funcionando solo con las cachés en memoria).
+    """
+    if not ruta:
+        return None
+    try:
+        return CacheDisco(ruta)
+    except sqlite3.Error as e:
+        logger.warning("No se pudo abrir la caché en disco %s: %s", ruta, e)
+        return None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Mantenimiento de la caché en disco de ViajeIA')
+    parser.add_argument('--ruta', default=CACHE_DISK_PATH, help='Archivo SQLite (CACHE_DISK_PATH)')
+    parser.add_argument('--compactar', action='store_true', help='Compacta aunque otro proceso lo haya hecho hace poco')
+    argumentos = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    cache = CacheDisco(argumentos.ruta)
+    if argumentos.compactar:
+        cache.compactar(forzar=True)
+    print(json.dumps(cache.estadisticas(), indent=2))
@@ -0,0 +1,207 @@
+"""
+============================================
+CACHÉ DE RESPUESTAS DE GEMINI - VIAJEIA
+============================================
+
+Este módulo reutiliza respuestas de Gemini para preguntas repetidas.
+
+Muchas preguntas solo cambian en mayúsculas, acentos, puntuación o
+palabras de relleno ("qué hacer en Paris 3 días" y "Que hacer en París
+por 3 dias"). Normalizamos la pregunta y el contexto del viaje para que
+caigan en la misma entrada, y opcionalmente buscamos preguntas casi
+iguales por similitud de trigramas.
+
+¿Por qué es importante?
+- Cada respuesta cacheada es una llamada menos a Gemini (latencia y cuota)
+- Reduce los errores "Has excedido la cuota"
+"""
+
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from cache import CacheTTL
+
+# Palabras que no cambian el sentido de una consulta de viaje
+PALABRAS_VACIAS = frozenset([
+    'a', 'al', 'algo', 'con', 'de', 'del', 'el', 'en', 'es', 'la', 'las', 'lo', 'los',
+    'me', 'mi', 'mis', 'para', 'por', 'puedo', 'que', 'se', 'su', 'sus', 'te', 'tu',
+    'un', 'una', 'unos', 'unas', 'y', 'o', 'hay', 'cual', 'cuales', 'como', 'muy',
+    'favor', 'porfa', 'hola', 'gracias', 'quiero', 'quisiera', 'podrias', 'puedes'
+])
+
+# Rangos de presupuesto (los mismos del formulario del frontend, en USD)
+RANGOS_PRESUPUESTO = (
+    (500, 'economico'),
+    (1500, 'medio'),
+    (3000, 'alto'),
+)
+
+
+def normalizar_texto(texto):
+    """
+    Quita acentos, mayúsculas, puntuación y palabras vacías.
+
+    Returns:
+        list: Palabras significativas en su orden original
+    """
+    if not texto:
+        return []
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    palabras = re.findall(r'[a-z0-9ñ]+', texto)
+    return [p for p in palabras if p not in PALABRAS_VACIAS]
+
+
+def rango_presupuesto(presupuesto):
+    """
+    Agrupa el presupuesto en los rangos del formulario
+    ('economico', 'medio', 'alto', 'premium'). Acepta el rango o un monto.
+    """
+    if not presupuesto:
+        return ''
+    texto = ' '.join(normalizar_texto(str(presupuesto)))
+    montos = re.findall(r'\d+', texto.replace(',', '').replace('.', ''))
+    if not montos:
+        return texto
+    monto = int(montos[0])
+    for tope, nombre in RANGOS_PRESUPUESTO:
+        if monto < tope:
+            return nombre
+    return 'premium'
+
+
+def trigramas(texto):
+    """Trigramas de caracteres de un texto normalizado."""
+    texto = f' {texto} '
+    return frozenset(texto[i:i + 3] for i in range(len(texto) - 2))
+
+
+def similitud(a, b):
+    """Similitud de Jaccard entre dos conjuntos de trigramas."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class CacheRespuestas:
+    """
+    Caché de respuestas de Gemini en dos niveles:
+
+    1. Exacto: clave normalizada (pregunta, destino, mes del viaje, rango de presupuesto).
+    2. Similar (opcional): dentro del mismo contexto de viaje, una pregunta cuya
+       similitud de trigramas supere `umbral_similitud`. Los números de la pregunta
+       (días, personas...) deben coincidir exactamente.
+
+    Args:
+        ttl: Segundos que vive cada respuesta
+        max_entradas: Máximo de respuestas guardadas (LRU)
+        umbral_similitud: 0 desactiva el nivel de similitud
+        max_similares: Preguntas indexadas por contexto de viaje
+        disco: CacheDisco para las respuestas exactas (el índice de similitud es solo de memoria)
+    """
+
+    def __init__(self, ttl, max_entradas=1000, umbral_similitud=0.8, max_similares=50, disco=None):
+        self.nombre = 'respuestas'
+        self.respuestas = CacheTTL('respuestas', ttl, max_entradas, disco=disco)
+        self.umbral_similitud = umbral_similitud
+        self.max_similares = max_similares
+        # { contexto: OrderedDict{ pregunta_normalizada: trigramas } }
+        self._indice = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos_similares = 0
+
+    def _claves(self, pregunta, datos_viaje, destino):
+        """Devuelve (contexto, pregunta_normalizada) de una consulta."""
+        datos_viaje = datos_viaje or {}
+        contexto = (
+            ' '.join(normalizar_texto(destino or datos_viaje.get('destino', ''))),
+            (datos_viaje.get('fecha') or '')[:7],  # YYYY-MM
+            rango_presupuesto(datos_viaje.get('presupuesto'))
+        )
+        return contexto, ' '.join(normalizar_texto(pregunta))
+
+    def clave(self, pregunta, datos_viaje, destino):
+        """
+        Clave exacta de una consulta (la misma con la que se guarda su respuesta),
+        o None si la pregunta no tiene palabras significativas.
+        """
+        contexto, pregunta_norm = self._claves(pregunta, datos_viaje, destino)
+        return (contexto, pregunta_norm) if pregunta_norm else None
+
+    def buscar(self, pregunta, datos_viaje, destino):
+        """
+        Busca una respuesta cacheada para la consulta.
+
+        Returns:
+            str o None
+        """
+        contexto, pregunta_norm = self._claves(pregunta, datos_viaje, destino)
+        if not pregunta_norm:
+            return None
+
+        respuesta = self.respuestas.obtener((contexto, pregunta_norm))
+        if respuesta is not None or not self.umbral_similitud:
+            return respuesta
+
+        return self._buscar_similar(contexto, pregunta_norm)
+
+    def _buscar_similar(self, contexto, pregunta_norm):
+        objetivo = trigramas(pregunta_norm)
+        numeros = set(re.findall(r'\d+', pregunta_norm))
+
+        with self._lock:
+            candidatas = list(self._indice.get(contexto, {}).items())
+
+        mejor, mejor_similitud = None, self.umbral_similitud
+        for candidata, tri in candidatas:
+            if set(re.findall(r'\d+', candidata)) != numeros:
+                continue
+            valor = similitud(objetivo, tri)
+            if valor >= mejor_similitud:
+                mejor, mejor_similitud = candidata, valor
+
+        if mejor is None:
+            return None
+
+        respuesta = self.respuestas.obtener((contexto, mejor))
+        if respuesta is None:
+            # La respuesta expiró o fue desalojada: sacarla del índice
+            with self._lock:
+                self._indice.get(contexto, {}).pop(mejor, None)
+            return None
+
+        with self._lock:
+            self.aciertos_similares += 1
+        return respuesta
+
+    def guardar(self, pregunta, datos_viaje, destino, respuesta):
+        """Guarda una respuesta de Gemini para futuras consultas."""
+        if not respuesta:
+            return
+        contexto, pregunta_norm = self._claves(pregunta, datos_viaje, destino)
+        if not pregunta_norm:
+            return
+
+        self.respuestas.guardar((contexto, pregunta_norm), respuesta)
+
+        if not self.umbral_similitud:
+            return
+        with self._lock:
+            preguntas = self._indice.setdefault(contexto, OrderedDict())
+            self._indice.move_to_end(contexto)
+            preguntas[pregunta_norm] = trigramas(pregunta_norm)
+            preguntas.move_to_end(pregunta_norm)
+            while len(preguntas) > self.max_similares:
+                preguntas.popitem(last=False)
+            # El índice no necesita más contextos que respuestas caben en la caché
+            while len(self._indice) > self.respuestas.max_entradas:
+                self._indice.popitem(last=False)
+
+    def estadisticas(self):
+        """Contadores de la caché exacta más los aciertos por similitud."""
+        estadisticas = self.respuestas.estadisticas()
+        with self._lock:
+            estadisticas['aciertos_similares'] = self.aciertos_similares
+        return estadisticas
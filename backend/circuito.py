@@ -0,0 +1,167 @@
+"""
+============================================
+CIRCUIT BREAKER DE LOS UPSTREAMS - VIAJEIA
+============================================
+
+Cada upstream (OpenWeatherMap, exchangerate-api, Unsplash) tiene un
+circuito que cuenta los fallos seguidos. Cuando llegan a un umbral, el
+circuito se abre y las llamadas se rechazan al instante (CircuitoAbierto)
+en lugar de esperar el timeout. Pasado un tiempo, el circuito queda
+semiabierto: deja pasar una sola llamada de prueba y, si sale bien, se
+cierra otra vez.
+
+Estados:
+    cerrado     -> todo pasa; N fallos seguidos lo abren
+    abierto     -> se rechaza todo durante CIRCUIT_OPEN_SECONDS
+    semiabierto -> pasa una sola sonda; si responde se cierra, si falla se abre
+
+¿Por qué es importante?
+- Un upstream caído no deja a cada consulta esperando 5 segundos
+- Los hilos y conexiones no se acumulan detrás de un servicio que no responde
+- Mientras tanto las cachés sirven el último valor conocido (ver cache.py)
+"""
+
+import logging
+import threading
+import time
+
+from metricas import incrementar, registro
+
+logger = logging.getLogger('viajeia.circuito')
+
+CERRADO = 'cerrado'
+ABIERTO = 'abierto'
+SEMIABIERTO = 'semiabierto'
+
+# Valor de cada estado en la métrica viajeia_circuito_estado
+_VALOR_ESTADO = {CERRADO: 0, SEMIABIERTO: 1, ABIERTO: 2}
+
+# Registro de circuitos creados (para las métricas)
+_circuitos = {}
+
+
+class CircuitoAbierto(Exception):
+    """El upstream está marcado como caído: la llamada se rechaza sin intentarla."""
+
+
+class Circuito:
+    """
+    Circuit breaker de un upstream.
+
+    Args:
+        nombre: Nombre del upstream (para logs y métricas)
+        umbral_fallos: Fallos seguidos que abren el circuito (0 lo desactiva)
+        espera: Segundos que el circuito queda abierto antes de probar de nuevo
+    """
+
+    def __init__(self, nombre, umbral_fallos=5, espera=30.0):
+        self.nombre = nombre
+        self.umbral_fallos = umbral_fallos
+        self.espera = espera
+        self._lock = threading.Lock()
+        self._estado = CERRADO
+        self._fallos_seguidos = 0
+        self._abierto_desde = 0.0
+        self._sonda_desde = None  # Inicio de la sonda en curso (semiabierto)
+
+        # Contadores
+        self.aperturas = 0
+        self.rechazos = 0
+
+        _circuitos[nombre] = self
+
+    @property
+    def estado(self):
+        return self._estado
+
+    def permitir(self):
+        """
+        Decide si una llamada puede hacerse ahora.
+        En semiabierto pasa una sola sonda a la vez; si la sonda nunca
+        informa su resultado (por ejemplo, se canceló), se permite otra
+        pasados `espera` segundos.
+        """
+        if not self.umbral_fallos:
+            return True
+        with self._lock:
+            if self._estado == CERRADO:
+                return True
+
+            ahora = time.monotonic()
+            if self._estado == ABIERTO:
+                if ahora - self._abierto_desde < self.espera:
+                    return self._rechazar()
+                self._estado = SEMIABIERTO
+                self._sonda_desde = None
+
+            if self._sonda_desde is not None and ahora - self._sonda_desde < self.espera:
+                return self._rechazar()
+            self._sonda_desde = ahora
+            return True
+
+    def _rechazar(self):
+        """Cuenta un rechazo. Debe llamarse con el lock tomado."""
+        self.rechazos += 1
+        incrementar('viajeia_circuito_rechazos_total', upstream=self.nombre)
+        return False
+
+    def verificar(self):
+        """
+        Raises:
+            CircuitoAbierto: si la llamada no debe hacerse ahora
+        """
+        if not self.permitir():
+            raise CircuitoAbierto(f'{self.nombre} no disponible (circuito abierto)')
+
+    def registrar_exito(self):
+        """El upstream respondió: el circuito se cierra."""
+        with self._lock:
+            self._fallos_seguidos = 0
+            if self._estado != CERRADO:
+                logger.info("Circuito de %s cerrado: el upstream volvió a responder", self.nombre)
+                self._estado = CERRADO
+                self._sonda_desde = None
+
+    def registrar_fallo(self):
+        """El upstream falló: abre el circuito si falló la sonda o se llegó al umbral."""
+        if not self.umbral_fallos:
+            return
+        with self._lock:
+            self._fallos_seguidos += 1
+            if self._estado == SEMIABIERTO or (
+                self._estado == CERRADO and self._fallos_seguidos >= self.umbral_fallos
+            ):
+                logger.warning(
+                    "Circuito de %s abierto tras %d fallos seguidos; se reintenta en %g s",
+                    self.nombre, self._fallos_seguidos, self.espera
+                )
+                self._estado = ABIERTO
+                self._abierto_desde = time.monotonic()
+                self._sonda_desde = None
+                self.aperturas += 1
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'estado', 'fallos_seguidos', 'aperturas', 'rechazos' }
+        """
+        with self._lock:
+            return {
+                'estado': self._estado,
+                'fallos_seguidos': self._fallos_seguidos,
+                'aperturas': self.aperturas,
+                'rechazos': self.rechazos
+            }
+
+
+def _muestras_circuitos():
+    """Estado de los circuitos para /api/metrics (0 cerrado, 1 semiabierto, 2 abierto)."""
+    muestras = []
+    for nombre, circuito in list(_circuitos.items()):
+        etiquetas = {'upstream': nombre}
+        muestras.append(('viajeia_circuito_estado', 'gauge', etiquetas, _VALOR_ESTADO[circuito.estado]))
+        muestras.append(('viajeia_circuito_aperturas_total', 'counter', etiquetas, circuito.aperturas))
+    return muestras
+
+
+registro.agregar_colector(_muestras_circuitos)
@@ -0,0 +1,249 @@
+"""
+============================================
+CONSULTAS IDÉNTICAS EN CURSO - VIAJEIA
+============================================
+
+Si llega una consulta igual a otra que Gemini todavía está respondiendo
+(doble clic, un reintento del frontend o la misma pregunta popular de
+varios usuarios a la vez), no se genera otra respuesta: la consulta nueva
+se suma a la que está en curso y recibe el mismo resultado.
+
+Cada respuesta en curso es una Generacion que guarda los fragmentos ya
+generados. Quien se suma tarde recibe primero lo que ya se generó y
+después el resto a medida que llega, así que sirve igual para
+/api/planificar (espera el texto completo) que para el stream SSE.
+
+La clave es la misma clave normalizada de la caché de respuestas (más el
+contexto de la conversación, si lo hay): dos consultas que la caché
+consideraría iguales también comparten la generación en curso.
+
+¿Por qué es importante?
+- Un doble clic no cuesta dos respuestas de Gemini (ni dos veces la cuota)
+- Las preguntas populares que llegan juntas se responden una sola vez
+- Cada consulta que se suma sigue contando para el rate limit de su usuario
+"""
+
+import asyncio
+import os
+import threading
+
+from metricas import registro
+
+# Segundos que una consulta espera la respuesta de Gemini (la propia o la que
+# comparte) sin recibir nada nuevo; pasado ese tiempo recibe un error
+GEMINI_RESPONSE_TIMEOUT = float(os.getenv('GEMINI_RESPONSE_TIMEOUT', '60'))
+
+
+class GeneracionCancelada(Exception):
+    """La consulta que generaba la respuesta se canceló antes de terminar."""
+
+    def __init__(self):
+        super().__init__('La consulta que generaba esta respuesta se canceló. Intenta de nuevo.')
+
+
+class GeneracionDemorada(Exception):
+    """La respuesta de Gemini no llegó dentro de GEMINI_RESPONSE_TIMEOUT."""
+
+    def __init__(self):
+        super().__init__('Gemini está tardando demasiado en responder. Intenta de nuevo en unos segundos.')
+
+
+class Generacion:
+    """
+    Una respuesta de Gemini en curso que pueden seguir varias consultas.
+
+    Los oyentes son funciones oyente(tipo, dato) que se llaman con
+    ('token', texto) por cada fragmento, y al final con ('fin', texto completo)
+    o ('error', excepción). Se llaman con el lock tomado (para no desordenar
+    los fragmentos): solo deben dejar el evento en una cola.
+    """
+
+    def __init__(self, en_curso, clave):
+        self._en_curso = en_curso
+        self._lock = en_curso._lock
+        self.clave = clave
+        self.fragmentos = []
+        self.terminada = False
+        self.error = None
+        self.interesados = 0  # Consultas que esperan esta respuesta
+        self._oyentes = []
+
+    @property
+    def texto(self):
+        return ''.join(self.fragmentos)
+
+    # ============================================
+    # QUIEN GENERA
+    # ============================================
+
+    def publicar(self, texto):
+        """Agrega un fragmento y lo reparte a los oyentes."""
+        with self._lock:
+            self.fragmentos.append(texto)
+            for oyente in self._oyentes:
+                oyente('token', texto)
+
+    def terminar(self, texto=None):
+        """
+        Marca la respuesta como completa. Con `texto` (respuesta sin
+        streaming), ese es el único fragmento.
+        """
+        with self._lock:
+            if texto is not None and not self.fragmentos:
+                self.fragmentos.append(texto)
+                for oyente in self._oyentes:
+                    oyente('token', texto)
+            self._cerrar()
+            texto_completo = self.texto
+            for oyente in self._oyentes:
+                oyente('fin', texto_completo)
+            self._oyentes.clear()
+
+    def fallar(self, error):
+        """
+        Termina la generación con un error; cada oyente lo recibe. Una
+        cancelación (CancelledError, que no es Exception) llega como GeneracionCancelada.
+        """
+        if not isinstance(error, Exception):
+            error = GeneracionCancelada()
+        with self._lock:
+            self._cerrar()
+            self.error = error
+            for oyente in self._oyentes:
+                oyente('error', error)
+            self._oyentes.clear()
+
+    def cancelar_si_abandonada(self):
+        """
+        Si ya nadie espera la respuesta (los clientes se desconectaron),
+        la cancela y devuelve True: quien genera puede dejar de hacerlo.
+        """
+        with self._lock:
+            if self.interesados > 0 or self.terminada:
+                return False
+            self._cerrar()
+            self.error = GeneracionCancelada()
+            return True
+
+    def _cerrar(self):
+        """Saca la generación de las que están en curso. Debe llamarse con el lock tomado."""
+        self.terminada = True
+        if self.clave is not None and self._en_curso._generaciones.get(self.clave) is self:
+            del self._en_curso._generaciones[self.clave]
+
+    # ============================================
+    # QUIEN ESPERA
+    # ============================================
+
+    def escuchar(self, oyente):
+        """Recibe lo ya generado y, después, cada evento nuevo."""
+        with self._lock:
+            for fragmento in self.fragmentos:
+                oyente('token', fragmento)
+            if not self.terminada:
+                self._oyentes.append(oyente)
+            elif self.error is not None:
+                oyente('error', self.error)
+            else:
+                oyente('fin', self.texto)
+
+    def dejar(self, oyente=None):
+        """La consulta ya no espera la respuesta (terminó o el cliente se fue)."""
+        with self._lock:
+            self.interesados -= 1
+            if oyente in self._oyentes:
+                self._oyentes.remove(oyente)
+
+    def resultado(self, timeout=GEMINI_RESPONSE_TIMEOUT):
+        """
+        Espera (bloqueando el hilo) la respuesta completa.
+
+        Raises:
+            GeneracionDemorada: si no termina dentro de `timeout` segundos
+            El error con el que falló la generación
+        """
+        listo = threading.Event()
+        self.escuchar(lambda tipo, dato: tipo != 'token' and listo.set())
+        try:
+            if not listo.wait(timeout):
+                raise GeneracionDemorada()
+        finally:
+            self.dejar()
+        if self.error is not None:
+            raise self.error
+        return self.texto
+
+    async def resultado_async(self, timeout=GEMINI_RESPONSE_TIMEOUT):
+        """Versión asíncrona de resultado (la generación corre en el mismo event loop)."""
+        listo = asyncio.Event()
+        self.escuchar(lambda tipo, dato: tipo != 'token' and listo.set())
+        try:
+            await asyncio.wait_for(listo.wait(), timeout)
+        except asyncio.TimeoutError:
+            raise GeneracionDemorada() from None
+        finally:
+            self.dejar()
+        if self.error is not None:
+            raise self.error
+        return self.texto
+
+
+class GeneracionesEnCurso:
+    """Las generaciones en curso, por clave de consulta."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generaciones = {}
+
+        # Contadores
+        self.generadas = 0
+        self.compartidas = 0
+
+    def unirse(self, clave):
+        """
+        La generación en curso para `clave`, o una nueva si no hay.
+        Quien recibe una nueva (nueva=True) es quien debe generar la respuesta
+        y terminarla con terminar() o fallar(). Con clave None no se comparte.
+
+        Returns:
+            tuple: (Generacion, nueva)
+        """
+        with self._lock:
+            generacion = self._generaciones.get(clave) if clave is not None else None
+            nueva = generacion is None
+            if nueva:
+                generacion = Generacion(self, clave)
+                if clave is not None:
+                    self._generaciones[clave] = generacion
+                self.generadas += 1
+            else:
+                self.compartidas += 1
+            generacion.interesados += 1
+            return generacion, nueva
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'en_curso', 'generadas', 'compartidas' }
+        """
+        with self._lock:
+            return {
+                'en_curso': len(self._generaciones),
+                'generadas': self.generadas,
+                'compartidas': self.compartidas
+            }
+
+
+generaciones = GeneracionesEnCurso()
+
+
+def _muestras_generaciones():
+    """Generaciones en curso y consultas que compartieron una para /api/metrics."""
+    estadisticas = generaciones.estadisticas()
+    return [
+        ('viajeia_generaciones_en_curso', 'gauge', {}, estadisticas['en_curso']),
+        ('viajeia_generaciones_compartidas_total', 'counter', {}, estadisticas['compartidas']),
+    ]
+
+
+registro.agregar_colector(_muestras_generaciones)
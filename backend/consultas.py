@@ -0,0 +1,393 @@
+"""
+============================================
+CONSULTAS HTTP COMPARTIDAS - VIAJEIA
+============================================
+
+Lectura y validación de las consultas y armado de las respuestas de la
+API, comunes a los dos backends: app.py (Flask, con hilos) y app_async.py
+(Quart, asíncrono). Cada backend solo hace la entrada/salida: leer el
+cuerpo, verificar el token, reservar el cupo, consultar las APIs
+externas y a Gemini, y enviar la respuesta.
+
+Los errores se devuelven como (datos, status) o (datos, status, cabeceras),
+listos para que cada backend los pase a su jsonify.
+
+¿Por qué es importante?
+- Los dos backends validan, responden y fallan exactamente igual
+- Un cambio en el formato de la API se hace en un solo lugar
+"""
+
+import json
+import time
+
+from admision import cola_gemini
+from autenticacion import CLASE_ANONIMO, CLASE_AUTENTICADO
+from coalescencia import GeneracionDemorada, generaciones
+from http_cliente import obtener_estadisticas as obtener_estadisticas_http
+from paises import zona_horaria
+from planificacion import (
+    ENRICHMENT_DEADLINE, DESTINO_INFO_MAX_AGE, DESTINO_FOTOS_MAX_AGE,
+    cache_clima, cache_fotos, cache_tipo_cambio, cache_control_destino, clave_destino,
+    contexto_conversacion, detectar_destino, estadisticas_caches, mensaje_error_gemini,
+    resultado_error_item, validar_datos_solicitud, validar_lote
+)
+from precarga import Fuente
+from security import sanitizar_texto
+from sesiones import validar_conversacion_id
+from transporte import CuerpoInvalido, cargar_json, seleccionar_campos, validar_campos
+
+MENSAJE_SIN_GEMINI = 'Gemini no está configurado. Por favor, crea un archivo .env con tu GEMINI_API_KEY.'
+
+# Cabeceras de los streams Server-Sent Events
+CABECERAS_SSE = {
+    'Cache-Control': 'no-cache',
+    'X-Accel-Buffering': 'no'  # Evita que proxies (nginx) acumulen el stream
+}
+
+ENDPOINTS = {
+    'health': '/api/health',
+    'planificar': '/api/planificar (POST)',
+    'planificar_stream': '/api/planificar/stream (POST, text/event-stream)',
+    'planificar_batch': '/api/planificar/batch (POST)',
+    'destino': '/api/destino/<nombre> (GET, ?zonaHoraria=...)',
+    'destino_fotos': '/api/destino/<nombre>/fotos (GET)',
+    'metrics': '/api/metrics (formato Prometheus; ?formato=json para p50/p95/p99)'
+}
+
+
+def error_consulta(mensaje, status, **extra):
+    """Error de una consulta: ({'error': mensaje, ...extra}, status)."""
+    return {'error': mensaje, **extra}, status
+
+
+# ============================================
+# SOLICITUDES
+# ============================================
+
+def leer_cuerpo(crudo, codificacion=None):
+    """
+    Cuerpo JSON de una consulta (puede venir comprimido con gzip o br).
+    Un cuerpo vacío es un objeto vacío.
+
+    Returns:
+        tuple: (datos, None) o (None, error)
+    """
+    try:
+        data = cargar_json(crudo, codificacion)
+    except CuerpoInvalido as e:
+        return None, error_consulta(str(e), e.status)
+    if data is None:
+        return {}, None
+    if not isinstance(data, dict):
+        return None, error_consulta('El cuerpo debe ser un objeto JSON', 400)
+    return data, None
+
+
+def identidad_consulta(data, uid, ip):
+    """
+    Quién hace la consulta: con un ID token de Firebase válido (`uid`), el
+    usuario (clase autenticado); si no, el usuarioId del cuerpo o la IP
+    (clase anónimo, que en la cola de Gemini se reparte por IP).
+
+    Returns:
+        tuple: (usuario_id, clase, equidad)
+    """
+    if uid:
+        return uid, CLASE_AUTENTICADO, uid
+    return data.get('usuarioId', ip), CLASE_ANONIMO, ip  # Usar IP si no hay usuarioId
+
+
+def armar_solicitud(data, identidad, gemini_configurado=True):
+    """
+    Valida una consulta de planificación y arma la solicitud, todavía sin
+    cupo reservado. Todo se valida antes de reservar: una consulta inválida
+    no ocupa cupo.
+
+    Returns:
+        tuple: (solicitud, None) o (None, error)
+    """
+    usuario_id, clase, equidad = identidad
+    pregunta = data.get('pregunta', '')
+    datos_viaje = data.get('datosViaje', {})
+    # Campos de fotos e info_destino que el cliente quiere recibir (todos si no dice)
+    campos, error_campos = validar_campos(data.get('campos'))
+    if error_campos:
+        return None, error_consulta(error_campos, 400)
+
+    error = validar_datos_solicitud(pregunta, datos_viaje)
+    if error:
+        return None, error_consulta(*error)
+
+    # Verificar que Gemini esté configurado
+    if not gemini_configurado:
+        return None, error_consulta(MENSAJE_SIN_GEMINI, 500)
+
+    return {
+        # 🔒 SEGURIDAD: Sanitizar pregunta antes de procesarla
+        'pregunta': sanitizar_texto(pregunta.strip()),
+        'datos_viaje': datos_viaje,
+        'conversacion_id': validar_conversacion_id(data.get('conversacionId')),
+        # Se convierte en 'contexto' con cargar_contexto, una vez reservado el cupo
+        'historial': data.get('historial'),
+        'usuario_id': usuario_id,
+        'clase': clase,
+        'equidad': equidad,
+        'zona_horaria': zona_horaria(data.get('zonaHoraria')),
+        'campos': campos
+    }, None
+
+
+def cargar_contexto(solicitud):
+    """
+    Agrega a una solicitud ya admitida el contexto de su conversación.
+    Va después de reservar el cupo: solo una consulta admitida siembra o
+    lee la conversación del servidor.
+    """
+    solicitud['contexto'] = contexto_conversacion(solicitud['conversacion_id'], solicitud.pop('historial', None))
+
+
+def armar_lote(data, identidad, gemini_configurado=True):
+    """
+    Valida un lote de /api/planificar/batch y arma la solicitud de cada
+    consulta válida (sin cupo reservado). Las consultas inválidas quedan
+    como resultado con error y no ocupan cupo.
+
+    Returns:
+        tuple: ({ 'usuario_id', 'solicitudes': [(indice, solicitud)], 'errores': [...] }, None) o (None, error)
+    """
+    usuario_id, clase, equidad = identidad
+    items = data.get('items')
+
+    error = validar_lote(items)
+    if error:
+        return None, error_consulta(*error)
+    campos, error_campos = validar_campos(data.get('campos'))
+    if error_campos:
+        return None, error_consulta(error_campos, 400)
+
+    # Verificar que Gemini esté configurado
+    if not gemini_configurado:
+        return None, error_consulta(MENSAJE_SIN_GEMINI, 500)
+
+    zona_cliente = zona_horaria(data.get('zonaHoraria'))
+    solicitudes = []
+    errores = []
+    for indice, item in enumerate(items):
+        pregunta = item.get('pregunta', '')
+        datos_viaje = item.get('datosViaje', {})
+        error = validar_datos_solicitud(pregunta, datos_viaje)
+        if error:
+            errores.append(resultado_error_item(indice, *error))
+            continue
+        solicitudes.append((indice, {
+            # 🔒 SEGURIDAD: Sanitizar pregunta antes de procesarla
+            'pregunta': sanitizar_texto(pregunta.strip()),
+            'datos_viaje': datos_viaje,
+            # Las consultas de un lote no siguen una conversación del servidor
+            'conversacion_id': None,
+            'contexto': contexto_conversacion(None, item.get('historial')),
+            'usuario_id': usuario_id,
+            'clase': clase,
+            'equidad': equidad,
+            'zona_horaria': zona_cliente,
+            'campos': campos
+        }))
+    return {'usuario_id': usuario_id, 'solicitudes': solicitudes, 'errores': errores}, None
+
+
+def asignar_reservas(lote, reservas):
+    """Reparte las reservas de reservar_requests entre las consultas del lote."""
+    for (_, solicitud), reserva in zip(lote['solicitudes'], reservas):
+        solicitud['reserva'] = reserva
+
+
+def error_rate_limit(limite_check):
+    """Error 429 (Too Many Requests) para una reserva rechazada."""
+    return error_consulta(
+        limite_check['reason'], 429,
+        retry_after=limite_check['retry_after'],
+        limit_type=limite_check['limit_type']
+    )
+
+
+def error_saturado(saturado, retry_after=None):
+    """Error 503 con Retry-After para un ServidorSaturado."""
+    retry_after = saturado.retry_after or retry_after
+    datos, status = error_consulta(str(saturado), 503, retry_after=retry_after)
+    return datos, status, {'Retry-After': str(retry_after)}
+
+
+# ============================================
+# PLANES
+# ============================================
+
+def nuevo_plan(destino, futuros, zona_cliente, limite=None):
+    """
+    Estado de un plan con el enriquecimiento ya lanzado
+    (por defecto, con ENRICHMENT_DEADLINE de plazo).
+    """
+    return {
+        'destino': destino,
+        'futuros': futuros,
+        'limite': limite if limite is not None else time.monotonic() + ENRICHMENT_DEADLINE,
+        'info_clima': None,
+        'zona_cliente': zona_cliente
+    }
+
+
+def destino_solicitud(solicitud):
+    """Destino de la consulta ('' si no menciona ninguno: no hay enriquecimiento)."""
+    destino = detectar_destino(solicitud['pregunta'], solicitud['datos_viaje'])
+    return destino if destino and destino.strip() else ''
+
+
+def planes_lote(lote, iniciar_enriquecimiento):
+    """
+    Detecta el destino de cada consulta del lote y lanza el enriquecimiento
+    (con `iniciar_enriquecimiento(destino)`) una sola vez por destino
+    distinto: varias consultas sobre Roma comparten clima, cambio y fotos.
+    Todo el lote comparte el mismo plazo.
+
+    Returns:
+        list: [(indice, solicitud, plan)]
+    """
+    limite = time.monotonic() + ENRICHMENT_DEADLINE
+    planes = {}
+    tareas = []
+    for indice, solicitud in lote['solicitudes']:
+        destino = destino_solicitud(solicitud)
+        clave = clave_destino(destino) if destino else ''
+        plan = planes.get(clave)
+        if plan is None:
+            # Todas las consultas del lote vienen del mismo usuario (misma zona)
+            plan = planes[clave] = nuevo_plan(
+                destino, iniciar_enriquecimiento(destino) if clave else {}, solicitud['zona_horaria'], limite
+            )
+        tareas.append((indice, solicitud, plan))
+    return tareas
+
+
+def fuentes_precarga(consultar_clima, consultar_fotos, consultar_tabla_cambio, con_clima=True, con_fotos=True):
+    """
+    Lo que se precarga de los destinos populares: clima, fotos y la tabla de
+    cambio en USD, con las mismas claves de caché que usan las consultas.
+    """
+    fuentes = []
+    if con_clima:
+        fuentes.append(Fuente(cache_clima, clave_destino, consultar_clima))
+    if con_fotos:
+        fuentes.append(Fuente(
+            cache_fotos, lambda destino: (clave_destino(destino), 3), lambda destino: consultar_fotos(destino, 3)
+        ))
+    fuentes.append(Fuente(cache_tipo_cambio, lambda destino: 'USD', lambda destino: consultar_tabla_cambio('USD')))
+    return fuentes
+
+
+# ============================================
+# RESPUESTAS
+# ============================================
+
+def armar_respuesta(solicitud, respuesta, fotos, info_destino):
+    """Respuesta de /api/planificar con los campos que pidió el cliente."""
+    return seleccionar_campos({
+        'respuesta': respuesta,
+        'fotos': fotos,
+        'info_destino': info_destino  # Información para el panel lateral
+    }, solicitud['campos'])
+
+
+def armar_item(indice, solicitud, respuesta, fotos, info_destino):
+    """Resultado de una consulta del lote."""
+    return {'indice': indice, **armar_respuesta(solicitud, respuesta, fotos, info_destino)}
+
+
+def error_item_gemini(indice, error):
+    """Resultado de una consulta del lote que falló en Gemini."""
+    return resultado_error_item(indice, mensaje_error_gemini(error), 500)
+
+
+def errores_vencidos(pendientes):
+    """Resultados 504 de las consultas del lote que no terminaron a tiempo, por índice."""
+    return [
+        resultado_error_item(indice, 'La consulta no terminó dentro del plazo del lote', 504)
+        for indice in sorted(pendientes)
+    ]
+
+
+def armar_resultados(resultados):
+    """Respuesta de /api/planificar/batch sin stream: los resultados ordenados por índice."""
+    return {'resultados': sorted(resultados, key=lambda resultado: resultado['indice'])}
+
+
+def evento_sse(evento, datos):
+    """Formatea un evento Server-Sent Events con datos JSON."""
+    return f"event: {evento}\ndata: {json.dumps(datos, ensure_ascii=False)}\n\n"
+
+
+def evento_generacion(tipo, dato):
+    """
+    Evento de la cola de un stream para un evento de la generación de
+    Gemini (propia o compartida): token, gemini_fin o gemini_error.
+    """
+    if tipo == 'token':
+        return 'token', dato
+    if tipo == 'fin':
+        return 'gemini_fin', None
+    return 'gemini_error', mensaje_error_gemini(dato)
+
+
+def evento_info_destino(solicitud, info_destino):
+    """Evento SSE del panel lateral."""
+    return evento_sse('info_destino', seleccionar_campos({'info_destino': info_destino}, solicitud['campos']))
+
+
+def evento_fotos(solicitud, fotos):
+    """Evento SSE de las fotos del destino."""
+    return evento_sse('fotos', seleccionar_campos({'fotos': fotos}, solicitud['campos']))
+
+
+def evento_demorado():
+    """Evento SSE de error para un stream que dejó de recibir la respuesta de Gemini."""
+    return evento_sse('error', {'error': mensaje_error_gemini(GeneracionDemorada())})
+
+
+def respuesta_destino(consulta, info_destino):
+    """
+    Respuesta de GET /api/destino/<nombre>.
+
+    Returns:
+        tuple: (datos, status, cabeceras)
+    """
+    if not info_destino:
+        datos, status = error_consulta('No hay información disponible para este destino', 404)
+        return datos, status, {'Cache-Control': 'no-cache'}
+    return seleccionar_campos({'info_destino': info_destino}, consulta['campos']), 200, {
+        'Cache-Control': cache_control_destino(DESTINO_INFO_MAX_AGE, info_destino['datos_obsoletos'])
+    }
+
+
+def respuesta_fotos_destino(consulta, fotos):
+    """
+    Respuesta de GET /api/destino/<nombre>/fotos. Sin fotos (Unsplash caído
+    o sin resultados) no se guarda en caché: se vuelve a intentar.
+
+    Returns:
+        tuple: (datos, status, cabeceras)
+    """
+    return seleccionar_campos({'fotos': fotos}, consulta['campos']), 200, {
+        'Cache-Control': cache_control_destino(DESTINO_FOTOS_MAX_AGE, obsoleto=not fotos)
+    }
+
+
+def estado_backend(precargador, model):
+    """Estado del backend para /api/health."""
+    return {
+        'status': 'ok',
+        'message': 'Backend funcionando correctamente',
+        'cache': estadisticas_caches(),
+        'upstreams': obtener_estadisticas_http(),
+        'precarga': precargador.estadisticas(),
+        'gemini': model.estadisticas() if model else None,
+        'generaciones': generaciones.estadisticas(),
+        'admision': cola_gemini.estadisticas()
+    }
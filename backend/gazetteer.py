@@ -0,0 +1,192 @@
+"""
+============================================
+ÍNDICE DE DESTINOS (GAZETTEER) - VIAJEIA
+============================================
+
+Índice local de ciudades y países (data/lugares.tsv) para reconocer el
+destino de una pregunta sin llamar a ninguna API:
+"quiero ir a Buenos Aires en marzo" -> Buenos Aires (AR, -34.60, -58.38).
+
+Los nombres y alias se guardan en un trie de palabras normalizadas (sin
+mayúsculas ni acentos). La búsqueda recorre la pregunta una sola vez y en
+cada palabra sigue el camino del trie lo más lejos posible, así que se
+queda con la coincidencia más larga ("Ciudad de México" antes que "México")
+con un costo que depende del largo de la pregunta y no del tamaño del
+índice. El archivo se carga la primera vez que se usa.
+
+¿Por qué es importante?
+- Reconoce destinos de varias palabras ("Buenos Aires", "Nueva York")
+- No confunde "ir a las compras" con un destino: solo acepta lugares conocidos
+- Da el país del destino sin esperar a que responda la API del clima
+"""
+
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import namedtuple
+
+# Archivo del índice (se puede reemplazar por uno más grande con el mismo formato)
+GAZETTEER_PATH = os.getenv(
+    'GAZETTEER_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'lugares.tsv')
+)
+
+TIPO_CIUDAD = 'ciudad'
+TIPO_PAIS = 'pais'
+
+# nombre: canónico en español; pais: ISO 3166-1 alfa-2; lat/lon: de la capital si es un país
+Lugar = namedtuple('Lugar', ['nombre', 'tipo', 'pais', 'lat', 'lon'])
+
+_PATRON_PALABRA = re.compile(r'[a-z0-9]+')
+
+# Marca de fin de nombre dentro de un nodo del trie
+_FIN = None
+
+
+def normalizar(texto):
+    """
+    Quita mayúsculas y acentos y separa en palabras.
+
+    Returns:
+        list: ['ciudad', 'de', 'mexico'] para 'Ciudad de México'
+    """
+    texto = texto.lower()
+    if not texto.isascii():
+        # NFKD separa las tildes de las letras y el encode las descarta
+        texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    return _PATRON_PALABRA.findall(texto)
+
+
+class IndiceLugares:
+    """
+    Trie de palabras con los nombres y alias de cada lugar.
+
+    Args:
+        lugares: Iterable de (Lugar, [nombres]). Si dos lugares comparten
+                 un nombre, queda el primero.
+    """
+
+    def __init__(self, lugares):
+        self._trie = {}
+        self.cantidad = 0
+        for lugar, nombres in lugares:
+            self.cantidad += 1
+            for nombre in nombres:
+                palabras = normalizar(nombre)
+                if not palabras:
+                    continue
+                nodo = self._trie
+                for palabra in palabras:
+                    # intern: las palabras repetidas entre nombres ocupan memoria una sola vez
+                    nodo = nodo.setdefault(sys.intern(palabra), {})
+                nodo.setdefault(_FIN, lugar)
+
+    def coincidencias(self, texto):
+        """
+        Recorre el texto una vez y devuelve los lugares encontrados.
+
+        Returns:
+            tuple: ([(posicion, palabras, Lugar)], total de palabras del texto)
+        """
+        palabras = normalizar(texto or '')
+        encontradas = []
+        i = 0
+        while i < len(palabras):
+            nodo = self._trie
+            mejor = None
+            for j in range(i, len(palabras)):
+                nodo = nodo.get(palabras[j])
+                if nodo is None:
+                    break
+                if _FIN in nodo:
+                    mejor = (j + 1 - i, nodo[_FIN])
+            if mejor:
+                encontradas.append((i, mejor[0], mejor[1]))
+                i += mejor[0]
+            else:
+                i += 1
+        return encontradas, len(palabras)
+
+    def buscar(self, texto):
+        """
+        El lugar más específico mencionado en un texto libre: primero las
+        ciudades, después el nombre más largo y después el que aparece antes.
+
+        Returns:
+            Lugar o None
+        """
+        encontradas, _ = self.coincidencias(texto)
+        return _mas_especifico(encontradas)
+
+    def resolver(self, nombre):
+        """
+        Interpreta un destino escrito por el usuario ("Roma, Italia").
+        A diferencia de buscar, todas las palabras deben ser parte de un lugar
+        conocido: "San Juan de los Lagos" no se confunde con "San Juan".
+
+        Returns:
+            Lugar o None
+        """
+        encontradas, total = self.coincidencias(nombre)
+        if sum(largo for _, largo, _ in encontradas) != total:
+            return None
+        return _mas_especifico(encontradas)
+
+
+def _mas_especifico(encontradas):
+    """Entre varias coincidencias, la ciudad antes que el país, la más larga y la primera."""
+    if not encontradas:
+        return None
+    _, _, lugar = min(encontradas, key=lambda c: (c[2].tipo != TIPO_CIUDAD, -c[1], c[0]))
+    return lugar
+
+
+def cargar_lugares(ruta):
+    """
+    Lee el archivo del índice (columnas separadas por tabulador:
+    tipo, nombre, pais, lat, lon y alias opcionales separados por '|').
+    Las líneas vacías y las que empiezan con '#' se ignoran.
+
+    Returns:
+        list: [(Lugar, [nombre, alias...])]
+    """
+    lugares = []
+    with open(ruta, encoding='utf-8') as archivo:
+        for linea in archivo:
+            linea = linea.rstrip('\n')
+            if not linea.strip() or linea.startswith('#'):
+                continue
+            columnas = linea.split('\t')
+            tipo, nombre, pais, lat, lon = columnas[:5]
+            alias = [a for a in columnas[5].split('|') if a] if len(columnas) > 5 else []
+            lugar = Lugar(sys.intern(nombre), sys.intern(tipo), sys.intern(pais.upper()), float(lat), float(lon))
+            lugares.append((lugar, [nombre] + alias))
+    return lugares
+
+
+_indice = None
+_lock_indice = threading.Lock()
+
+
+def indice():
+    """El índice global, cargado la primera vez que se pide."""
+    global _indice
+    if _indice is None:
+        with _lock_indice:
+            if _indice is None:
+                _indice = IndiceLugares(cargar_lugares(GAZETTEER_PATH))
+    return _indice
+
+
+def buscar_lugar(texto):
+    """El lugar más específico mencionado en una pregunta, o None."""
+    return indice().buscar(texto)
+
+
+def resolver_lugar(nombre):
+    """El lugar que corresponde a un destino escrito por el usuario, o None."""
+    if not nombre:
+        return None
+    return indice().resolver(nombre)
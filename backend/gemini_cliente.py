@@ -0,0 +1,246 @@
+"""
+============================================
+CLIENTE DE GEMINI CON PREFIJO REUTILIZABLE - VIAJEIA
+============================================
+
+El prefijo del prompt (SYSTEM_PROMPT + RESPONSE_FORMAT) es igual en todas
+las consultas. En lugar de mandarlo como texto en cada llamada:
+
+- El modelo se crea una sola vez con ese prefijo como system_instruction.
+- Si GEMINI_CONTEXT_CACHE está activo (por defecto no), el prefijo se
+  sube una vez como contenido en caché de Gemini (CachedContent) y cada
+  consulta solo manda el contexto y la pregunta. La caché vence a los
+  GEMINI_CACHE_TTL segundos y se crea una nueva poco antes de que venza.
+- La API solo acepta cachés de al menos GEMINI_CACHE_MIN_TOKENS tokens: si
+  el prefijo es más corto, la caché ni se intenta. El prefijo actual de
+  ViajeIA es de unas decenas de tokens, por eso viene desactivada.
+- La caché se crea en un hilo aparte: ninguna consulta espera esa llamada.
+  Mientras tanto, o si la API la rechaza, se sigue con el modelo con
+  system_instruction y se vuelve a intentar pasados GEMINI_CACHE_RETRY
+  segundos.
+
+ModeloGemini tiene la misma interfaz que GenerativeModel para lo que usa
+el backend (generate_content y generate_content_async).
+
+¿Por qué es importante?
+- Con la caché, el prefijo se sube una vez por vida de la caché y no una vez por consulta
+- Los tokens en caché se cobran más barato y el modelo no los vuelve a procesar
+- Sin la caché el resultado es el mismo: nunca deja de responder por ella
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+import google.generativeai as genai
+from google.api_core import exceptions as errores_google
+from google.generativeai import caching
+
+from metricas import registro
+from prompts import contar_tokens
+
+logger = logging.getLogger('viajeia.gemini')
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Usar la caché de contexto de Gemini para el prefijo (si la API la permite)
+GEMINI_CONTEXT_CACHE = os.getenv('GEMINI_CONTEXT_CACHE', 'false').lower() in ('1', 'true', 'si', 'sí', 'yes')
+# Tokens mínimos de una caché de contexto según el modelo (con menos, la API la rechaza)
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv('GEMINI_CACHE_MIN_TOKENS', '1024'))
+# Vida de cada caché (segundos)
+GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL', '3600'))
+# Espera antes de volver a intentar crear la caché si la API la rechazó (segundos)
+GEMINI_CACHE_RETRY = int(os.getenv('GEMINI_CACHE_RETRY', '3600'))
+
+# Se crea una caché nueva cuando a la actual le queda menos que esto (segundos)
+MARGEN_RENOVACION = 60
+
+# Errores con los que Gemini indica que la caché ya no existe
+CACHE_RECHAZADA = (errores_google.NotFound, errores_google.PermissionDenied)
+
+
+class ModeloGemini:
+    """
+    Modelo de Gemini con el prefijo fijo como instrucción de sistema y,
+    si se puede, guardado en la caché de contexto de Gemini.
+
+    Args:
+        nombre_modelo: Modelo de Gemini (GEMINI_MODEL)
+        instruccion: Prefijo fijo del prompt
+        usar_cache: Intentar usar CachedContent para el prefijo
+        ttl: Segundos de vida de cada caché
+        reintento: Segundos de espera tras un error al crear la caché
+        min_tokens: Tokens mínimos que la API acepta en una caché
+    """
+
+    def __init__(self, nombre_modelo, instruccion, usar_cache=GEMINI_CONTEXT_CACHE,
+                 ttl=GEMINI_CACHE_TTL, reintento=GEMINI_CACHE_RETRY, min_tokens=GEMINI_CACHE_MIN_TOKENS):
+        self.nombre_modelo = nombre_modelo
+        self.instruccion = instruccion
+        self.usar_cache = usar_cache and ttl > 0
+        self.prefijo_corto = False
+        if self.usar_cache and contar_tokens(instruccion) < min_tokens:
+            # La API la rechazaría siempre: no vale la pena ni intentarlo
+            logger.info(
+                "El prefijo del prompt (~%d tokens) es más corto que el mínimo de la caché de contexto "
+                "(%d); se usa system_instruction", contar_tokens(instruccion), min_tokens
+            )
+            self.usar_cache = False
+            self.prefijo_corto = True
+        self.ttl = ttl
+        self.reintento = reintento
+        # Modelo con system_instruction: se usa cuando no hay caché vigente
+        self.modelo_base = genai.GenerativeModel(nombre_modelo, system_instruction=instruccion)
+
+        self._lock = threading.Lock()
+        self._modelo_cache = None
+        self._vence_en = 0.0  # time.monotonic() en que vence la caché actual
+        self._proximo_intento = 0.0
+        self._creando = False
+
+        # Contadores
+        self.caches_creadas = 0
+        self.errores_cache = 0
+
+    # ============================================
+    # SELECCIÓN DEL MODELO
+    # ============================================
+
+    def _necesita_cache(self, ahora):
+        """Si hay que crear una caché ahora. Debe llamarse con el lock tomado."""
+        return (
+            self.usar_cache and not self._creando
+            and self._vence_en - ahora < MARGEN_RENOVACION
+            and ahora >= self._proximo_intento
+        )
+
+    def _vigente(self, ahora):
+        """El modelo de la caché si no venció, o el modelo base. Debe llamarse con el lock tomado."""
+        if self._modelo_cache is not None and ahora < self._vence_en:
+            return self._modelo_cache
+        return self.modelo_base
+
+    def modelo(self):
+        """
+        El modelo a usar para una consulta. Si hace falta una caché nueva, la
+        crea en segundo plano (un hilo a la vez) y la consulta sigue con el
+        modelo vigente: crear la caché es una llamada a la API que no debe
+        demorar a nadie.
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            if self._necesita_cache(ahora):
+                self._creando = True
+                threading.Thread(target=self._crear_cache, name='gemini-cache', daemon=True).start()
+            return self._vigente(ahora)
+
+    def _crear_cache(self):
+        """Sube el prefijo como CachedContent. Si falla, sigue el modelo base."""
+        try:
+            cache = caching.CachedContent.create(
+                model=self.nombre_modelo,
+                display_name='viajeia-prefijo',
+                system_instruction=self.instruccion,
+                ttl=timedelta(seconds=self.ttl)
+            )
+            modelo = genai.GenerativeModel.from_cached_content(cache)
+        except Exception as error:
+            with self._lock:
+                self._creando = False
+                self._proximo_intento = time.monotonic() + self.reintento
+                self.errores_cache += 1
+            logger.warning(
+                "No se pudo crear la caché de contexto de Gemini (%s); se usa system_instruction "
+                "y se reintenta en %d s", error, self.reintento
+            )
+            return
+        with self._lock:
+            self._modelo_cache = modelo
+            self._vence_en = time.monotonic() + self.ttl
+            self._creando = False
+            self.caches_creadas += 1
+        logger.info("Caché de contexto de Gemini creada: %s (vence en %d s)", cache.name, self.ttl)
+
+    def _descartar_cache(self, modelo):
+        """
+        Gemini ya no reconoce la caché (se borró o venció antes de lo
+        esperado): se descarta y se crea otra en la próxima consulta.
+        """
+        with self._lock:
+            if self._modelo_cache is modelo:
+                self._modelo_cache = None
+                self._vence_en = 0.0
+        logger.warning("Gemini rechazó la caché de contexto; se descarta y se usa system_instruction")
+
+    # ============================================
+    # INTERFAZ DE GenerativeModel
+    # ============================================
+
+    def generate_content(self, contenido, **kwargs):
+        modelo = self.modelo()
+        try:
+            return modelo.generate_content(contenido, **kwargs)
+        except CACHE_RECHAZADA:
+            if modelo is self.modelo_base:
+                raise
+            self._descartar_cache(modelo)
+            return self.modelo_base.generate_content(contenido, **kwargs)
+
+    async def generate_content_async(self, contenido, **kwargs):
+        modelo = self.modelo()
+        try:
+            return await modelo.generate_content_async(contenido, **kwargs)
+        except CACHE_RECHAZADA:
+            if modelo is self.modelo_base:
+                raise
+            self._descartar_cache(modelo)
+            return await self.modelo_base.generate_content_async(contenido, **kwargs)
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'cache_contexto', 'caches_creadas', 'errores_cache', 'vence_en' }
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            vigente = self._modelo_cache is not None and ahora < self._vence_en
+            if self.prefijo_corto:
+                estado = 'prefijo corto'
+            elif not self.usar_cache:
+                estado = 'desactivada'
+            else:
+                estado = 'activa' if vigente else 'no disponible'
+            return {
+                'cache_contexto': estado,
+                'caches_creadas': self.caches_creadas,
+                'errores_cache': self.errores_cache,
+                'vence_en': round(self._vence_en - ahora) if vigente else None
+            }
+
+
+# Modelos creados (para las métricas)
+_modelos = []
+
+
+def crear_modelo(nombre_modelo, instruccion):
+    """Crea el ModeloGemini del proceso y lo registra para /api/metrics."""
+    modelo = ModeloGemini(nombre_modelo, instruccion)
+    _modelos.append(modelo)
+    return modelo
+
+
+def _muestras_modelos():
+    """Cachés de contexto creadas y rechazadas para /api/metrics."""
+    if not _modelos:
+        return []
+    return [
+        ('viajeia_gemini_caches_creadas_total', 'counter', {}, sum(m.caches_creadas for m in _modelos)),
+        ('viajeia_gemini_cache_errores_total', 'counter', {}, sum(m.errores_cache for m in _modelos)),
+    ]
+
+
+registro.agregar_colector(_muestras_modelos)
@@ -0,0 +1,53 @@
+"""
+============================================
+CONFIGURACIÓN DE PRODUCCIÓN (GUNICORN) - VIAJEIA
+============================================
+
+Uso:
+    gunicorn -c gunicorn.conf.py app:app
+
+¿Por qué no `python app.py`?
+- `app.run` es el servidor de desarrollo de Flask: un solo proceso
+- Cada llamada lenta a Gemini bloquea un hilo; aquí cada worker atiende
+  varias consultas a la vez con hilos (casi todo el tiempo es espera de red)
+- preload_app: `load_dotenv`, `genai.configure` y el GenerativeModel se
+  inicializan una sola vez en el proceso maestro y los workers los heredan
+"""
+
+import multiprocessing
+import os
+
+# Puerto (Render/Heroku lo definen en PORT)
+bind = f"0.0.0.0:{os.getenv('PORT', '5001')}"
+
+# Workers: uno por núcleo más uno de margen, con un tope para no agotar la memoria
+# (cada worker carga su propia copia de las cachés). WEB_CONCURRENCY lo fija a mano.
+_max_workers = int(os.getenv('GUNICORN_MAX_WORKERS', '4'))
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() + 1, _max_workers)))
+
+# Hilos por worker: las consultas pasan casi todo el tiempo esperando a Gemini
+# y a las APIs externas, así que muchos hilos por proceso rinden bien
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '16'))
+
+# Las respuestas de Gemini (y los streams SSE) pueden tardar bastante
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '120'))
+# Al reiniciar o desplegar, se deja terminar a las consultas en curso
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+
+# Inicializar la app una sola vez antes de crear los workers
+preload_app = True
+
+# Con varios workers, el rate limiting en memoria no se comparte entre procesos:
+# por defecto se usa el archivo SQLite (se puede cambiar con RATE_LIMIT_BACKEND)
+if workers > 1:
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'sqlite')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    server.log.info(f"ViajeIA listo: {workers} workers x {threads} hilos")
@@ -0,0 +1,318 @@
+"""
+============================================
+CLIENTE HTTP SALIENTE - VIAJEIA
+============================================
+
+Este módulo centraliza todas las llamadas a APIs externas
+(OpenWeatherMap, exchangerate-api, Unsplash). ClienteUpstream lo usa el
+backend Flask (app.py) y ClienteUpstreamAsync el asíncrono (app_async.py).
+
+¿Por qué es importante?
+- Reutiliza conexiones (keep-alive): no se repite el handshake TCP+TLS en cada consulta
+- Reintenta con espera exponencial ante 429 y errores 5xx
+- Cada upstream tiene su propio timeout y tamaño de pool
+- Mide latencia y conexiones nuevas para saber dónde se va el tiempo
+- Si un upstream falla seguido, su circuito se abre y se deja de esperarlo
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from circuito import Circuito
+from metricas import incrementar, observar
+
+# ============================================
+# CONFIGURACIÓN POR DEFECTO
+# ============================================
+# Se puede ajustar por upstream con variables de entorno:
+#   HTTP_POOL_SIZE_<NOMBRE>, HTTP_TIMEOUT_<NOMBRE>, HTTP_RETRIES_<NOMBRE>,
+#   CIRCUIT_FAILURES_<NOMBRE>, CIRCUIT_OPEN_SECONDS_<NOMBRE>
+# (por ejemplo HTTP_TIMEOUT_UNSPLASH=3)
+
+# Conexiones abiertas que se mantienen por upstream
+HTTP_POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', '10'))
+
+# Timeout de conexión y de lectura (segundos)
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '3.05'))
+HTTP_READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', '5'))
+
+# Reintentos ante 429/5xx y errores de conexión, con espera exponencial
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '2'))
+HTTP_BACKOFF = float(os.getenv('HTTP_BACKOFF', '0.3'))
+ESTADOS_REINTENTABLES = (429, 500, 502, 503, 504)
+
+# Circuit breaker: fallos seguidos que abren el circuito (0 lo desactiva)
+# y segundos que queda abierto antes de probar otra vez
+CIRCUIT_FAILURES = int(os.getenv('CIRCUIT_FAILURES', '5'))
+CIRCUIT_OPEN_SECONDS = float(os.getenv('CIRCUIT_OPEN_SECONDS', '30'))
+
+# Registro de clientes creados (para las estadísticas)
+_clientes = {}
+
+
+def _config(nombre, clave, por_defecto, tipo):
+    """Lee la configuración específica de un upstream, o usa la general."""
+    valor = os.getenv(f'{clave}_{nombre.upper()}')
+    return tipo(valor) if valor else por_defecto
+
+
+class _UpstreamBase:
+    """Configuración y métricas comunes a los clientes síncrono y asíncrono."""
+
+    def __init__(self, nombre, base_url):
+        self.nombre = nombre
+        self.base_url = base_url.rstrip('/')
+        self.pool_size = _config(nombre, 'HTTP_POOL_SIZE', HTTP_POOL_SIZE, int)
+        self.timeout = (
+            HTTP_CONNECT_TIMEOUT,
+            _config(nombre, 'HTTP_TIMEOUT', HTTP_READ_TIMEOUT, float)
+        )
+        self.reintentos = _config(nombre, 'HTTP_RETRIES', HTTP_RETRIES, int)
+        self.circuito = Circuito(
+            nombre,
+            _config(nombre, 'CIRCUIT_FAILURES', CIRCUIT_FAILURES, int),
+            _config(nombre, 'CIRCUIT_OPEN_SECONDS', CIRCUIT_OPEN_SECONDS, float)
+        )
+
+        # Métricas
+        self._lock = threading.Lock()
+        self._solicitudes = 0
+        self._errores = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+        self._latencia_nuevas = 0.0
+        self._solicitudes_nuevas = 0
+
+        _clientes[nombre] = self
+
+    def _conexiones_abiertas(self):
+        """Total de conexiones (handshakes) que ha abierto el cliente hasta ahora."""
+        raise NotImplementedError
+
+    def _registrar(self, duracion, error, conexion_nueva, caido=False):
+        """
+        Registra el resultado de una petición.
+
+        Args:
+            error: La respuesta fue un error (status >= 400)
+            caido: El upstream no respondió o respondió 429/5xx (cuenta para el circuito)
+        """
+        if caido:
+            self.circuito.registrar_fallo()
+        else:
+            self.circuito.registrar_exito()
+        observar('viajeia_upstream_segundos', duracion, upstream=self.nombre)
+        if error:
+            incrementar('viajeia_upstream_errores_total', upstream=self.nombre)
+        with self._lock:
+            self._solicitudes += 1
+            self._latencia_total += duracion
+            self._latencia_max = max(self._latencia_max, duracion)
+            if error:
+                self._errores += 1
+            if conexion_nueva:
+                self._solicitudes_nuevas += 1
+                self._latencia_nuevas += duracion
+
+    def estadisticas(self):
+        """
+        Obtiene las métricas del upstream.
+
+        La diferencia entre la latencia con conexión nueva y con conexión
+        reutilizada es, aproximadamente, el costo del handshake.
+        """
+        with self._lock:
+            reutilizadas = self._solicitudes - self._solicitudes_nuevas
+            latencia_reutilizadas = self._latencia_total - self._latencia_nuevas
+            return {
+                'solicitudes': self._solicitudes,
+                'errores': self._errores,
+                'conexiones_nuevas': self._conexiones_abiertas(),
+                'latencia_media_ms': round(1000 * self._latencia_total / self._solicitudes, 1) if self._solicitudes else 0.0,
+                'latencia_max_ms': round(1000 * self._latencia_max, 1),
+                'latencia_media_conexion_nueva_ms': round(1000 * self._latencia_nuevas / self._solicitudes_nuevas, 1) if self._solicitudes_nuevas else 0.0,
+                'latencia_media_reutilizada_ms': round(1000 * latencia_reutilizadas / reutilizadas, 1) if reutilizadas else 0.0,
+                'circuito': self.circuito.estadisticas()
+            }
+
+
+class ClienteUpstream(_UpstreamBase):
+    """
+    Cliente HTTP con sesión persistente para un único upstream.
+
+    Args:
+        nombre: Nombre corto del upstream (para configuración y métricas)
+        base_url: URL base, por ejemplo 'https://api.unsplash.com'
+        headers: Cabeceras que se envían en todas las peticiones
+    """
+
+    def __init__(self, nombre, base_url, headers=None):
+        super().__init__(nombre, base_url)
+        self._adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            max_retries=Retry(
+                total=self.reintentos,
+                backoff_factor=HTTP_BACKOFF,
+                status_forcelist=ESTADOS_REINTENTABLES,
+                allowed_methods=frozenset(['GET']),
+                respect_retry_after_header=True,
+                raise_on_status=False  # Tras el último intento se devuelve la respuesta
+            )
+        )
+        self.session = requests.Session()
+        self.session.mount(self.base_url, self._adapter)
+        if headers:
+            self.session.headers.update(headers)
+
+    def _conexiones_abiertas(self):
+        """Total de conexiones (handshakes) que ha abierto el pool hasta ahora."""
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[clave].num_connections for clave in list(pools.keys()))
+
+    def get(self, ruta, params=None, headers=None):
+        """
+        Hace un GET al upstream reutilizando las conexiones del pool.
+
+        Args:
+            ruta: Ruta relativa a base_url (por ejemplo '/search/photos')
+            params: Parámetros de la query string
+            headers: Cabeceras adicionales para esta petición
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.RequestException: si falla la conexión tras los reintentos
+            CircuitoAbierto: si el upstream está caído (no se intenta la conexión)
+        """
+        self.circuito.verificar()
+        conexiones_antes = self._conexiones_abiertas()
+        inicio = time.perf_counter()
+        try:
+            response = self.session.get(
+                f"{self.base_url}{ruta}",
+                params=params,
+                headers=headers,
+                timeout=self.timeout
+            )
+        except requests.RequestException:
+            self._registrar(time.perf_counter() - inicio, error=True, conexion_nueva=True, caido=True)
+            raise
+
+        conexion_nueva = self._conexiones_abiertas() > conexiones_antes
+        self._registrar(
+            time.perf_counter() - inicio,
+            error=response.status_code >= 400,
+            conexion_nueva=conexion_nueva,
+            caido=response.status_code in ESTADOS_REINTENTABLES
+        )
+        return response
+
+
+class ClienteUpstreamAsync(_UpstreamBase):
+    """
+    Cliente HTTP asíncrono (httpx) con conexiones persistentes para un único upstream.
+    Mismas opciones, reintentos y métricas que ClienteUpstream.
+
+    El cliente httpx se crea con `abrir()` dentro del event loop del servidor
+    y se cierra con `cerrar()` al apagarlo.
+    """
+
+    def __init__(self, nombre, base_url, headers=None):
+        super().__init__(nombre, base_url)
+        self.headers = headers or {}
+        self.client = None
+        self._conexiones = 0
+
+    async def abrir(self):
+        """Crea el cliente httpx (y su pool de conexiones)."""
+        # Import diferido: httpx solo hace falta en el backend asíncrono
+        import httpx
+
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=self.headers,
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                limits=httpx.Limits(
+                    max_connections=self.pool_size,
+                    max_keepalive_connections=self.pool_size
+                )
+            )
+
+    async def cerrar(self):
+        """Cierra las conexiones abiertas."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def _conexiones_abiertas(self):
+        return self._conexiones
+
+    async def get(self, ruta, params=None, headers=None):
+        """
+        Hace un GET al upstream sin bloquear el event loop, con reintentos
+        y espera exponencial ante 429/5xx y errores de conexión.
+
+        Returns:
+            httpx.Response
+
+        Raises:
+            httpx.HTTPError: si falla la conexión tras los reintentos
+            CircuitoAbierto: si el upstream está caído (no se intenta la conexión)
+        """
+        import httpx
+
+        self.circuito.verificar()
+        await self.abrir()
+        conexion_nueva = False
+
+        async def traza(evento, info):
+            # httpcore avisa cada vez que abre una conexión TCP nueva
+            nonlocal conexion_nueva
+            if evento == 'connection.connect_tcp.complete':
+                conexion_nueva = True
+
+        inicio = time.perf_counter()
+        for intento in range(self.reintentos + 1):
+            ultimo = intento == self.reintentos
+            try:
+                response = await self.client.get(
+                    ruta, params=params, headers=headers, extensions={'trace': traza}
+                )
+            except httpx.TransportError:
+                if ultimo:
+                    self._registrar(time.perf_counter() - inicio, error=True, conexion_nueva=True, caido=True)
+                    raise
+            else:
+                if ultimo or response.status_code not in ESTADOS_REINTENTABLES:
+                    break
+            await asyncio.sleep(HTTP_BACKOFF * (2 ** intento))
+
+        if conexion_nueva:
+            with self._lock:
+                self._conexiones += 1
+        self._registrar(
+            time.perf_counter() - inicio,
+            error=response.status_code >= 400,
+            conexion_nueva=conexion_nueva,
+            caido=response.status_code in ESTADOS_REINTENTABLES
+        )
+        return response
+
+
+def obtener_estadisticas():
+    """
+    Obtiene las métricas de todos los upstreams.
+
+    Returns:
+        dict: { nombre_upstream: { ...métricas } }
+    """
+    return {nombre: cliente.estadisticas() for nombre, cliente in _clientes.items()}
@@ -0,0 +1,338 @@
+"""
+============================================
+MÉTRICAS Y LOGS - VIAJEIA
+============================================
+
+Este módulo mide cuánto tarda cada etapa de una consulta (validación,
+clima, tipo de cambio, fotos, prompt, Gemini, serialización), cuenta
+eventos (aciertos de caché, errores de upstreams, rechazos del rate
+limit, tokens de Gemini) y lo expone en formato Prometheus en /api/metrics.
+
+También configura los logs: nivel con LOG_LEVEL y formato texto o JSON
+con LOG_FORMAT. Los mensajes por consulta van en nivel DEBUG, así que en
+producción (INFO o superior) no cuestan nada.
+
+¿Por qué es importante?
+- Permite saber si una consulta lenta se fue en Gemini, OpenWeatherMap,
+  Unsplash o el tipo de cambio
+- Los histogramas dan p50/p95/p99 sin guardar cada medición (memoria fija)
+- Cada worker de gunicorn tiene sus propias métricas (Prometheus las suma)
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# METRICS_ENABLED=false desactiva las mediciones (medir() no hace nada)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+
+# Límites de los buckets de los histogramas (segundos)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Límites para histogramas de tokens (prompts y respuestas de Gemini)
+BUCKETS_TOKENS = (50, 100, 200, 300, 400, 600, 800, 1000, 1200, 1600, 2000, 4000)
+
+PERCENTILES = (0.5, 0.95, 0.99)
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'texto').lower()
+
+
+# ============================================
+# HISTOGRAMAS Y CONTADORES
+# ============================================
+
+class Histograma:
+    """
+    Histograma acumulativo con buckets fijos (como los de Prometheus).
+
+    Registrar una medición es O(log buckets) y la memoria no crece con
+    la cantidad de mediciones. Los percentiles se estiman interpolando
+    dentro del bucket (igual que histogram_quantile de Prometheus).
+    """
+
+    def __init__(self, limites=BUCKETS_SEGUNDOS):
+        self.limites = limites
+        self.conteos = [0] * (len(limites) + 1)  # El último es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        self.conteos[bisect.bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.total += 1
+
+    def percentil(self, p):
+        """Estima el percentil p (0 a 1) de las mediciones."""
+        if not self.total:
+            return 0.0
+        objetivo = p * self.total
+        acumulado = 0
+        for i, conteo in enumerate(self.conteos):
+            if acumulado + conteo >= objetivo and conteo:
+                inferior = self.limites[i - 1] if i > 0 else 0.0
+                if i == len(self.limites):
+                    return inferior  # Por encima del último bucket no hay más precisión
+                superior = self.limites[i]
+                return inferior + (superior - inferior) * (objetivo - acumulado) / conteo
+            acumulado += conteo
+        return self.limites[-1]
+
+
+class RegistroMetricas:
+    """
+    Guarda los contadores e histogramas del proceso, con etiquetas.
+
+    Las series se identifican por (nombre, etiquetas ordenadas). Además de lo que
+    se registra directamente, se pueden agregar colectores: funciones que al
+    exportar devuelven valores ya calculados en otro lado (por ejemplo, los
+    contadores de las cachés).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._contadores = {}  # { (nombre, etiquetas): valor }
+        self._histogramas = {}  # { (nombre, etiquetas): Histograma }
+        self._ayudas = {}  # { nombre: texto }
+        self._colectores = []
+
+    def describir(self, nombre, ayuda):
+        """Texto de ayuda (# HELP) de una métrica."""
+        self._ayudas[nombre] = ayuda
+
+    def incrementar(self, nombre, valor=1, **etiquetas):
+        """Suma `valor` a un contador."""
+        if not METRICS_ENABLED:
+            return
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._contadores[clave] = self._contadores.get(clave, 0) + valor
+
+    def observar(self, nombre, valor, limites=BUCKETS_SEGUNDOS, **etiquetas):
+        """
+        Registra una medición en un histograma (en segundos, salvo que se
+        pasen otros `limites`, por ejemplo BUCKETS_TOKENS).
+        """
+        if not METRICS_ENABLED:
+            return
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            histograma = self._histogramas.get(clave)
+            if histograma is None:
+                histograma = self._histogramas[clave] = Histograma(limites)
+            histograma.observar(valor)
+
+    def agregar_colector(self, colector):
+        """
+        Agrega una función sin argumentos que devuelve
+        [(nombre, tipo, etiquetas, valor)] con tipo 'counter' o 'gauge'.
+        """
+        self._colectores.append(colector)
+
+    def _muestras_colectores(self):
+        muestras = []
+        for colector in self._colectores:
+            try:
+                muestras.extend(colector())
+            except Exception:
+                logger.exception('Error en un colector de métricas')
+        return muestras
+
+    def exportar_prometheus(self):
+        """Texto en el formato de exposición de Prometheus (text/plain; version=0.0.4)."""
+        with self._lock:
+            contadores = sorted(self._contadores.items())
+            histogramas = sorted(
+                (clave, list(h.conteos), h.suma, h.total, h.limites)
+                for clave, h in self._histogramas.items()
+            )
+
+        lineas = []
+        tipos_escritos = set()
+
+        def encabezado(nombre, tipo):
+            if nombre not in tipos_escritos:
+                tipos_escritos.add(nombre)
+                if nombre in self._ayudas:
+                    lineas.append(f'# HELP {nombre} {self._ayudas[nombre]}')
+                lineas.append(f'# TYPE {nombre} {tipo}')
+
+        for (nombre, etiquetas), valor in contadores:
+            encabezado(nombre, 'counter')
+            lineas.append(f'{nombre}{_formatear_etiquetas(etiquetas)} {valor}')
+
+        for nombre, tipo, etiquetas, valor in sorted(self._muestras_colectores(), key=lambda m: (m[0], sorted(m[2].items()))):
+            encabezado(nombre, tipo)
+            lineas.append(f'{nombre}{_formatear_etiquetas(tuple(sorted(etiquetas.items())))} {valor}')
+
+        for (nombre, etiquetas), conteos, suma, total, limites in histogramas:
+            encabezado(nombre, 'histogram')
+            acumulado = 0
+            for limite, conteo in zip(limites + (float('inf'),), conteos):
+                acumulado += conteo
+                le = '+Inf' if limite == float('inf') else repr(limite)
+                lineas.append(f'{nombre}_bucket{_formatear_etiquetas(etiquetas + (("le", le),))} {acumulado}')
+            lineas.append(f'{nombre}_sum{_formatear_etiquetas(etiquetas)} {round(suma, 6)}')
+            lineas.append(f'{nombre}_count{_formatear_etiquetas(etiquetas)} {total}')
+
+        return '\n'.join(lineas) + '\n'
+
+    def resumen(self):
+        """
+        Vista legible de las métricas: contadores y p50/p95/p99 de cada histograma.
+
+        Returns:
+            dict: { 'contadores': {...}, 'histogramas': { serie: { 'cantidad', 'media_ms', 'p50_ms', ... } } }
+            (los histogramas que no son de tiempos van sin sufijo: 'media', 'p50', ...)
+        """
+        with self._lock:
+            contadores = {
+                f'{nombre}{_formatear_etiquetas(etiquetas)}': valor
+                for (nombre, etiquetas), valor in sorted(self._contadores.items())
+            }
+            histogramas = {}
+            for (nombre, etiquetas), histograma in sorted(self._histogramas.items()):
+                # Los tiempos se muestran en milisegundos; el resto tal cual
+                factor, sufijo = (1000, '_ms') if histograma.limites is BUCKETS_SEGUNDOS else (1, '')
+                serie = {
+                    'cantidad': histograma.total,
+                    f'media{sufijo}': round(factor * histograma.suma / histograma.total, 1) if histograma.total else 0.0
+                }
+                for p in PERCENTILES:
+                    serie[f'p{int(p * 100)}{sufijo}'] = round(factor * histograma.percentil(p), 1)
+                histogramas[f'{nombre}{_formatear_etiquetas(etiquetas)}'] = serie
+
+        for nombre, _, etiquetas, valor in self._muestras_colectores():
+            contadores[f'{nombre}{_formatear_etiquetas(tuple(sorted(etiquetas.items())))}'] = valor
+        return {'contadores': contadores, 'histogramas': histogramas}
+
+    def limpiar(self):
+        """Borra las mediciones (útil en pruebas y benchmarks)."""
+        with self._lock:
+            self._contadores.clear()
+            self._histogramas.clear()
+
+
+def _escapar(valor):
+    """Escapa el valor de una etiqueta (barras, comillas y saltos de línea)."""
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_etiquetas(etiquetas):
+    """(('etapa', 'gemini'),) -> '{etapa="gemini"}'"""
+    if not etiquetas:
+        return ''
+    return '{' + ','.join(f'{clave}="{_escapar(valor)}"' for clave, valor in etiquetas) + '}'
+
+
+registro = RegistroMetricas()
+registro.describir('viajeia_etapa_segundos', 'Duración de cada etapa de una consulta de planificación')
+registro.describir('viajeia_request_segundos', 'Duración de cada request HTTP hasta enviar los encabezados')
+registro.describir('viajeia_upstream_segundos', 'Duración de las llamadas a APIs externas')
+registro.describir('viajeia_upstream_errores_total', 'Llamadas a APIs externas que fallaron (error de red o status >= 400)')
+registro.describir('viajeia_rate_limit_rechazos_total', 'Consultas rechazadas por el rate limiting (429)')
+registro.describir('viajeia_gemini_tokens_total', 'Tokens de Gemini usados (prompt y respuesta)')
+registro.describir('viajeia_gemini_errores_total', 'Llamadas a Gemini que fallaron')
+
+
+def incrementar(nombre, valor=1, **etiquetas):
+    """Suma `valor` a un contador del registro global."""
+    registro.incrementar(nombre, valor, **etiquetas)
+
+
+def observar(nombre, valor, limites=BUCKETS_SEGUNDOS, **etiquetas):
+    """Registra una medición en un histograma del registro global."""
+    registro.observar(nombre, valor, limites, **etiquetas)
+
+
+@contextmanager
+def medir(etapa, **etiquetas):
+    """
+    Mide la duración de una etapa de la consulta:
+
+        with medir('gemini'):
+            response = model.generate_content(...)
+
+    Se registra en viajeia_etapa_segundos{etapa="gemini"}, aunque la etapa falle.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registro.observar('viajeia_etapa_segundos', time.perf_counter() - inicio, etapa=etapa, **etiquetas)
+
+
+def registrar_uso_gemini(response):
+    """Suma los tokens que informa una respuesta de Gemini (si los informa)."""
+    uso = getattr(response, 'usage_metadata', None)
+    if not uso:
+        return
+    prompt = getattr(uso, 'prompt_token_count', 0) or 0
+    respuesta = getattr(uso, 'candidates_token_count', 0) or 0
+    # Parte del prompt que vino de la caché de contexto de Gemini (incluida en 'prompt')
+    cacheados = getattr(uso, 'cached_content_token_count', 0) or 0
+    if prompt:
+        incrementar('viajeia_gemini_tokens_total', prompt, tipo='prompt')
+    if respuesta:
+        incrementar('viajeia_gemini_tokens_total', respuesta, tipo='respuesta')
+    if cacheados:
+        incrementar('viajeia_gemini_tokens_total', cacheados, tipo='cacheados')
+
+
+# ============================================
+# LOGS
+# ============================================
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por log, con los campos pasados en `extra`."""
+
+    CAMPOS_ESTANDAR = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        datos = {
+            'ts': round(record.created, 3),
+            'nivel': record.levelname,
+            'logger': record.name,
+            'mensaje': record.getMessage()
+        }
+        for clave, valor in vars(record).items():
+            if clave not in self.CAMPOS_ESTANDAR:
+                datos[clave] = valor
+        if record.exc_info:
+            datos['excepcion'] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+def configurar_logging(nivel=LOG_LEVEL, formato=LOG_FORMAT):
+    """
+    Configura el logger 'viajeia' (una sola vez por proceso).
+
+    Args:
+        nivel: DEBUG, INFO, WARNING, ERROR
+        formato: 'texto' o 'json'
+    """
+    raiz = logging.getLogger('viajeia')
+    raiz.setLevel(nivel)
+    if raiz.handlers:
+        return raiz
+    handler = logging.StreamHandler()
+    if formato == 'json':
+        handler.setFormatter(FormatoJSON())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    raiz.addHandler(handler)
+    raiz.propagate = False
+    return raiz
+
+
+logger = logging.getLogger('viajeia.metricas')
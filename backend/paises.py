@@ -0,0 +1,298 @@
+"""
+============================================
+PAÍSES: MONEDA Y ZONA HORARIA - VIAJEIA
+============================================
+
+Tabla estática con todos los países de ISO 3166-1: su moneda (ISO 4217)
+y su zona horaria IANA. Con ella el panel lateral calcula la moneda, la
+hora local y la diferencia horaria sin depender de la API del clima, y
+zoneinfo se encarga del horario de verano.
+
+Los países con varias zonas (Estados Unidos, Brasil, México...) tienen
+además sus zonas principales con las coordenadas de la ciudad de
+referencia: se usa la más cercana al destino (Cancún no tiene la misma
+hora que la Ciudad de México).
+
+¿Por qué es importante?
+- Moneda y hora local aunque OpenWeatherMap esté lento o caído
+- La diferencia horaria es respecto a la zona del usuario, no la del servidor
+- Todo son búsquedas en diccionarios: microsegundos por consulta
+"""
+
+import math
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# Moneda cuando el país no se conoce (o no tiene moneda propia, como la Antártida)
+MONEDA_POR_DEFECTO = 'USD'
+
+# { código ISO: (moneda, zona horaria principal) }
+PAISES = {
+    'AD': ('EUR', 'Europe/Andorra'), 'AE': ('AED', 'Asia/Dubai'), 'AF': ('AFN', 'Asia/Kabul'),
+    'AG': ('XCD', 'America/Antigua'), 'AI': ('XCD', 'America/Anguilla'), 'AL': ('ALL', 'Europe/Tirane'),
+    'AM': ('AMD', 'Asia/Yerevan'), 'AO': ('AOA', 'Africa/Luanda'), 'AQ': ('', 'Antarctica/McMurdo'),
+    'AR': ('ARS', 'America/Argentina/Buenos_Aires'), 'AS': ('USD', 'Pacific/Pago_Pago'), 'AT': ('EUR', 'Europe/Vienna'),
+    'AU': ('AUD', 'Australia/Sydney'), 'AW': ('AWG', 'America/Aruba'), 'AX': ('EUR', 'Europe/Mariehamn'),
+    'AZ': ('AZN', 'Asia/Baku'), 'BA': ('BAM', 'Europe/Sarajevo'), 'BB': ('BBD', 'America/Barbados'),
+    'BD': ('BDT', 'Asia/Dhaka'), 'BE': ('EUR', 'Europe/Brussels'), 'BF': ('XOF', 'Africa/Ouagadougou'),
+    'BG': ('EUR', 'Europe/Sofia'), 'BH': ('BHD', 'Asia/Bahrain'), 'BI': ('BIF', 'Africa/Bujumbura'),
+    'BJ': ('XOF', 'Africa/Porto-Novo'), 'BL': ('EUR', 'America/St_Barthelemy'), 'BM': ('BMD', 'Atlantic/Bermuda'),
+    'BN': ('BND', 'Asia/Brunei'), 'BO': ('BOB', 'America/La_Paz'), 'BQ': ('USD', 'America/Kralendijk'),
+    'BR': ('BRL', 'America/Sao_Paulo'), 'BS': ('BSD', 'America/Nassau'), 'BT': ('BTN', 'Asia/Thimphu'),
+    'BV': ('NOK', 'Etc/UTC'), 'BW': ('BWP', 'Africa/Gaborone'), 'BY': ('BYN', 'Europe/Minsk'),
+    'BZ': ('BZD', 'America/Belize'), 'CA': ('CAD', 'America/Toronto'), 'CC': ('AUD', 'Indian/Cocos'),
+    'CD': ('CDF', 'Africa/Kinshasa'), 'CF': ('XAF', 'Africa/Bangui'), 'CG': ('XAF', 'Africa/Brazzaville'),
+    'CH': ('CHF', 'Europe/Zurich'), 'CI': ('XOF', 'Africa/Abidjan'), 'CK': ('NZD', 'Pacific/Rarotonga'),
+    'CL': ('CLP', 'America/Santiago'), 'CM': ('XAF', 'Africa/Douala'), 'CN': ('CNY', 'Asia/Shanghai'),
+    'CO': ('COP', 'America/Bogota'), 'CR': ('CRC', 'America/Costa_Rica'), 'CU': ('CUP', 'America/Havana'),
+    'CV': ('CVE', 'Atlantic/Cape_Verde'), 'CW': ('XCG', 'America/Curacao'), 'CX': ('AUD', 'Indian/Christmas'),
+    'CY': ('EUR', 'Asia/Nicosia'), 'CZ': ('CZK', 'Europe/Prague'), 'DE': ('EUR', 'Europe/Berlin'),
+    'DJ': ('DJF', 'Africa/Djibouti'), 'DK': ('DKK', 'Europe/Copenhagen'), 'DM': ('XCD', 'America/Dominica'),
+    'DO': ('DOP', 'America/Santo_Domingo'), 'DZ': ('DZD', 'Africa/Algiers'), 'EC': ('USD', 'America/Guayaquil'),
+    'EE': ('EUR', 'Europe/Tallinn'), 'EG': ('EGP', 'Africa/Cairo'), 'EH': ('MAD', 'Africa/El_Aaiun'),
+    'ER': ('ERN', 'Africa/Asmara'), 'ES': ('EUR', 'Europe/Madrid'), 'ET': ('ETB', 'Africa/Addis_Ababa'),
+    'FI': ('EUR', 'Europe/Helsinki'), 'FJ': ('FJD', 'Pacific/Fiji'), 'FK': ('FKP', 'Atlantic/Stanley'),
+    'FM': ('USD', 'Pacific/Pohnpei'), 'FO': ('DKK', 'Atlantic/Faroe'), 'FR': ('EUR', 'Europe/Paris'),
+    'GA': ('XAF', 'Africa/Libreville'), 'GB': ('GBP', 'Europe/London'), 'GD': ('XCD', 'America/Grenada'),
+    'GE': ('GEL', 'Asia/Tbilisi'), 'GF': ('EUR', 'America/Cayenne'), 'GG': ('GBP', 'Europe/Guernsey'),
+    'GH': ('GHS', 'Africa/Accra'), 'GI': ('GIP', 'Europe/Gibraltar'), 'GL': ('DKK', 'America/Nuuk'),
+    'GM': ('GMD', 'Africa/Banjul'), 'GN': ('GNF', 'Africa/Conakry'), 'GP': ('EUR', 'America/Guadeloupe'),
+    'GQ': ('XAF', 'Africa/Malabo'), 'GR': ('EUR', 'Europe/Athens'), 'GS': ('GBP', 'Atlantic/South_Georgia'),
+    'GT': ('GTQ', 'America/Guatemala'), 'GU': ('USD', 'Pacific/Guam'), 'GW': ('XOF', 'Africa/Bissau'),
+    'GY': ('GYD', 'America/Guyana'), 'HK': ('HKD', 'Asia/Hong_Kong'), 'HM': ('AUD', 'Indian/Kerguelen'),
+    'HN': ('HNL', 'America/Tegucigalpa'), 'HR': ('EUR', 'Europe/Zagreb'), 'HT': ('HTG', 'America/Port-au-Prince'),
+    'HU': ('HUF', 'Europe/Budapest'), 'ID': ('IDR', 'Asia/Jakarta'), 'IE': ('EUR', 'Europe/Dublin'),
+    'IL': ('ILS', 'Asia/Jerusalem'), 'IM': ('GBP', 'Europe/Isle_of_Man'), 'IN': ('INR', 'Asia/Kolkata'),
+    'IO': ('USD', 'Indian/Chagos'), 'IQ': ('IQD', 'Asia/Baghdad'), 'IR': ('IRR', 'Asia/Tehran'),
+    'IS': ('ISK', 'Atlantic/Reykjavik'), 'IT': ('EUR', 'Europe/Rome'), 'JE': ('GBP', 'Europe/Jersey'),
+    'JM': ('JMD', 'America/Jamaica'), 'JO': ('JOD', 'Asia/Amman'), 'JP': ('JPY', 'Asia/Tokyo'),
+    'KE': ('KES', 'Africa/Nairobi'), 'KG': ('KGS', 'Asia/Bishkek'), 'KH': ('KHR', 'Asia/Phnom_Penh'),
+    'KI': ('AUD', 'Pacific/Tarawa'), 'KM': ('KMF', 'Indian/Comoro'), 'KN': ('XCD', 'America/St_Kitts'),
+    'KP': ('KPW', 'Asia/Pyongyang'), 'KR': ('KRW', 'Asia/Seoul'), 'KW': ('KWD', 'Asia/Kuwait'),
+    'KY': ('KYD', 'America/Cayman'), 'KZ': ('KZT', 'Asia/Almaty'), 'LA': ('LAK', 'Asia/Vientiane'),
+    'LB': ('LBP', 'Asia/Beirut'), 'LC': ('XCD', 'America/St_Lucia'), 'LI': ('CHF', 'Europe/Vaduz'),
+    'LK': ('LKR', 'Asia/Colombo'), 'LR': ('LRD', 'Africa/Monrovia'), 'LS': ('LSL', 'Africa/Maseru'),
+    'LT': ('EUR', 'Europe/Vilnius'), 'LU': ('EUR', 'Europe/Luxembourg'), 'LV': ('EUR', 'Europe/Riga'),
+    'LY': ('LYD', 'Africa/Tripoli'), 'MA': ('MAD', 'Africa/Casablanca'), 'MC': ('EUR', 'Europe/Monaco'),
+    'MD': ('MDL', 'Europe/Chisinau'), 'ME': ('EUR', 'Europe/Podgorica'), 'MF': ('EUR', 'America/Marigot'),
+    'MG': ('MGA', 'Indian/Antananarivo'), 'MH': ('USD', 'Pacific/Majuro'), 'MK': ('MKD', 'Europe/Skopje'),
+    'ML': ('XOF', 'Africa/Bamako'), 'MM': ('MMK', 'Asia/Yangon'), 'MN': ('MNT', 'Asia/Ulaanbaatar'),
+    'MO': ('MOP', 'Asia/Macau'), 'MP': ('USD', 'Pacific/Saipan'), 'MQ': ('EUR', 'America/Martinique'),
+    'MR': ('MRU', 'Africa/Nouakchott'), 'MS': ('XCD', 'America/Montserrat'), 'MT': ('EUR', 'Europe/Malta'),
+    'MU': ('MUR', 'Indian/Mauritius'), 'MV': ('MVR', 'Indian/Maldives'), 'MW': ('MWK', 'Africa/Blantyre'),
+    'MX': ('MXN', 'America/Mexico_City'), 'MY': ('MYR', 'Asia/Kuala_Lumpur'), 'MZ': ('MZN', 'Africa/Maputo'),
+    'NA': ('NAD', 'Africa/Windhoek'), 'NC': ('XPF', 'Pacific/Noumea'), 'NE': ('XOF', 'Africa/Niamey'),
+    'NF': ('AUD', 'Pacific/Norfolk'), 'NG': ('NGN', 'Africa/Lagos'), 'NI': ('NIO', 'America/Managua'),
+    'NL': ('EUR', 'Europe/Amsterdam'), 'NO': ('NOK', 'Europe/Oslo'), 'NP': ('NPR', 'Asia/Kathmandu'),
+    'NR': ('AUD', 'Pacific/Nauru'), 'NU': ('NZD', 'Pacific/Niue'), 'NZ': ('NZD', 'Pacific/Auckland'),
+    'OM': ('OMR', 'Asia/Muscat'), 'PA': ('PAB', 'America/Panama'), 'PE': ('PEN', 'America/Lima'),
+    'PF': ('XPF', 'Pacific/Tahiti'), 'PG': ('PGK', 'Pacific/Port_Moresby'), 'PH': ('PHP', 'Asia/Manila'),
+    'PK': ('PKR', 'Asia/Karachi'), 'PL': ('PLN', 'Europe/Warsaw'), 'PM': ('EUR', 'America/Miquelon'),
+    'PN': ('NZD', 'Pacific/Pitcairn'), 'PR': ('USD', 'America/Puerto_Rico'), 'PS': ('ILS', 'Asia/Hebron'),
+    'PT': ('EUR', 'Europe/Lisbon'), 'PW': ('USD', 'Pacific/Palau'), 'PY': ('PYG', 'America/Asuncion'),
+    'QA': ('QAR', 'Asia/Qatar'), 'RE': ('EUR', 'Indian/Reunion'), 'RO': ('RON', 'Europe/Bucharest'),
+    'RS': ('RSD', 'Europe/Belgrade'), 'RU': ('RUB', 'Europe/Moscow'), 'RW': ('RWF', 'Africa/Kigali'),
+    'SA': ('SAR', 'Asia/Riyadh'), 'SB': ('SBD', 'Pacific/Guadalcanal'), 'SC': ('SCR', 'Indian/Mahe'),
+    'SD': ('SDG', 'Africa/Khartoum'), 'SE': ('SEK', 'Europe/Stockholm'), 'SG': ('SGD', 'Asia/Singapore'),
+    'SH': ('SHP', 'Atlantic/St_Helena'), 'SI': ('EUR', 'Europe/Ljubljana'), 'SJ': ('NOK', 'Arctic/Longyearbyen'),
+    'SK': ('EUR', 'Europe/Bratislava'), 'SL': ('SLE', 'Africa/Freetown'), 'SM': ('EUR', 'Europe/San_Marino'),
+    'SN': ('XOF', 'Africa/Dakar'), 'SO': ('SOS', 'Africa/Mogadishu'), 'SR': ('SRD', 'America/Paramaribo'),
+    'SS': ('SSP', 'Africa/Juba'), 'ST': ('STN', 'Africa/Sao_Tome'), 'SV': ('USD', 'America/El_Salvador'),
+    'SX': ('XCG', 'America/Lower_Princes'), 'SY': ('SYP', 'Asia/Damascus'), 'SZ': ('SZL', 'Africa/Mbabane'),
+    'TC': ('USD', 'America/Grand_Turk'), 'TD': ('XAF', 'Africa/Ndjamena'), 'TF': ('EUR', 'Indian/Kerguelen'),
+    'TG': ('XOF', 'Africa/Lome'), 'TH': ('THB', 'Asia/Bangkok'), 'TJ': ('TJS', 'Asia/Dushanbe'),
+    'TK': ('NZD', 'Pacific/Fakaofo'), 'TL': ('USD', 'Asia/Dili'), 'TM': ('TMT', 'Asia/Ashgabat'),
+    'TN': ('TND', 'Africa/Tunis'), 'TO': ('TOP', 'Pacific/Tongatapu'), 'TR': ('TRY', 'Europe/Istanbul'),
+    'TT': ('TTD', 'America/Port_of_Spain'), 'TV': ('AUD', 'Pacific/Funafuti'), 'TW': ('TWD', 'Asia/Taipei'),
+    'TZ': ('TZS', 'Africa/Dar_es_Salaam'), 'UA': ('UAH', 'Europe/Kyiv'), 'UG': ('UGX', 'Africa/Kampala'),
+    'UM': ('USD', 'Pacific/Wake'), 'US': ('USD', 'America/New_York'), 'UY': ('UYU', 'America/Montevideo'),
+    'UZ': ('UZS', 'Asia/Tashkent'), 'VA': ('EUR', 'Europe/Vatican'), 'VC': ('XCD', 'America/St_Vincent'),
+    'VE': ('VES', 'America/Caracas'), 'VG': ('USD', 'America/Tortola'), 'VI': ('USD', 'America/St_Thomas'),
+    'VN': ('VND', 'Asia/Ho_Chi_Minh'), 'VU': ('VUV', 'Pacific/Efate'), 'WF': ('XPF', 'Pacific/Wallis'),
+    'WS': ('WST', 'Pacific/Apia'), 'YE': ('YER', 'Asia/Aden'), 'YT': ('EUR', 'Indian/Mayotte'),
+    'ZA': ('ZAR', 'Africa/Johannesburg'), 'ZM': ('ZMW', 'Africa/Lusaka'), 'ZW': ('ZWG', 'Africa/Harare'),
+}
+
+# Países con varias zonas horarias: { código ISO: ((zona, lat, lon), ...) }
+# La primera es la principal (la misma de PAISES)
+ZONAS_POR_PAIS = {
+    'US': (
+        ('America/New_York', 40.7, -74.0),
+        ('America/Chicago', 41.9, -87.7),
+        ('America/Denver', 39.7, -105.0),
+        ('America/Phoenix', 33.4, -112.1),
+        ('America/Los_Angeles', 34.1, -118.2),
+        ('America/Anchorage', 61.2, -149.9),
+        ('Pacific/Honolulu', 21.3, -157.9),
+    ),
+    'CA': (
+        ('America/Toronto', 43.6, -79.4),
+        ('America/St_Johns', 47.6, -52.7),
+        ('America/Halifax', 44.6, -63.6),
+        ('America/Winnipeg', 49.9, -97.2),
+        ('America/Regina', 50.4, -104.7),
+        ('America/Edmonton', 53.5, -113.5),
+        ('America/Vancouver', 49.3, -123.1),
+    ),
+    'MX': (
+        ('America/Mexico_City', 19.4, -99.2),
+        ('America/Cancun', 21.1, -86.8),
+        ('America/Chihuahua', 28.6, -106.1),
+        ('America/Mazatlan', 23.2, -106.4),
+        ('America/Hermosillo', 29.1, -111.0),
+        ('America/Tijuana', 32.5, -117.0),
+    ),
+    'BR': (
+        ('America/Sao_Paulo', -23.5, -46.6),
+        ('America/Noronha', -3.9, -32.4),
+        ('America/Belem', -1.4, -48.5),
+        ('America/Manaus', -3.1, -60.0),
+        ('America/Cuiaba', -15.6, -56.1),
+        ('America/Rio_Branco', -10.0, -67.8),
+    ),
+    'RU': (
+        ('Europe/Moscow', 55.8, 37.6),
+        ('Europe/Kaliningrad', 54.7, 20.5),
+        ('Europe/Samara', 53.2, 50.1),
+        ('Asia/Yekaterinburg', 56.9, 60.6),
+        ('Asia/Omsk', 55.0, 73.4),
+        ('Asia/Novosibirsk', 55.0, 82.9),
+        ('Asia/Krasnoyarsk', 56.0, 92.8),
+        ('Asia/Irkutsk', 52.3, 104.3),
+        ('Asia/Yakutsk', 62.0, 129.7),
+        ('Asia/Vladivostok', 43.2, 131.9),
+        ('Asia/Magadan', 59.6, 150.8),
+        ('Asia/Kamchatka', 53.0, 158.7),
+    ),
+    'AU': (
+        ('Australia/Sydney', -33.9, 151.2),
+        ('Australia/Melbourne', -37.8, 145.0),
+        ('Australia/Brisbane', -27.5, 153.0),
+        ('Australia/Adelaide', -34.9, 138.6),
+        ('Australia/Darwin', -12.5, 130.8),
+        ('Australia/Perth', -31.9, 115.8),
+        ('Australia/Hobart', -42.9, 147.3),
+    ),
+    'CL': (
+        ('America/Santiago', -33.5, -70.7),
+        ('America/Punta_Arenas', -53.1, -70.9),
+        ('Pacific/Easter', -27.1, -109.4),
+    ),
+    'EC': (
+        ('America/Guayaquil', -2.2, -79.8),
+        ('Pacific/Galapagos', -0.9, -89.6),
+    ),
+    'ES': (
+        ('Europe/Madrid', 40.4, -3.7),
+        ('Atlantic/Canary', 28.1, -15.4),
+    ),
+    'PT': (
+        ('Europe/Lisbon', 38.7, -9.1),
+        ('Atlantic/Madeira', 32.6, -16.9),
+        ('Atlantic/Azores', 37.7, -25.7),
+    ),
+    'ID': (
+        ('Asia/Jakarta', -6.2, 106.8),
+        ('Asia/Makassar', -5.1, 119.4),
+        ('Asia/Jayapura', -2.5, 140.7),
+    ),
+    'MN': (
+        ('Asia/Ulaanbaatar', 47.9, 106.9),
+        ('Asia/Hovd', 48.0, 91.7),
+    ),
+    'CD': (
+        ('Africa/Kinshasa', -4.3, 15.3),
+        ('Africa/Lubumbashi', -11.7, 27.5),
+    ),
+    'NZ': (
+        ('Pacific/Auckland', -36.9, 174.8),
+        ('Pacific/Chatham', -44.0, -176.6),
+    ),
+    'PF': (
+        ('Pacific/Tahiti', -17.5, -149.6),
+        ('Pacific/Marquesas', -9.0, -139.5),
+        ('Pacific/Gambier', -23.1, -134.9),
+    ),
+    'KI': (
+        ('Pacific/Tarawa', 1.4, 173.0),
+        ('Pacific/Kanton', -2.8, -171.7),
+        ('Pacific/Kiritimati', 1.9, -157.3),
+    ),
+    'FM': (
+        ('Pacific/Pohnpei', 7.0, 158.2),
+        ('Pacific/Chuuk', 7.4, 151.8),
+    ),
+    'GL': (
+        ('America/Nuuk', 64.2, -51.7),
+        ('America/Scoresbysund', 70.5, -22.0),
+        ('America/Danmarkshavn', 76.8, -18.7),
+        ('America/Thule', 76.6, -68.8),
+    ),
+    'KZ': (
+        ('Asia/Almaty', 43.2, 77.0),
+        ('Asia/Aqtau', 44.5, 50.3),
+    ),
+}
+
+
+def moneda_pais(codigo_pais):
+    """Moneda de un país (código ISO 4217), o USD si no se conoce."""
+    datos = PAISES.get((codigo_pais or '').upper())
+    return (datos and datos[0]) or MONEDA_POR_DEFECTO
+
+
+def zona_pais(codigo_pais, lat=None, lon=None):
+    """
+    Zona horaria IANA de un país. Si tiene varias y se dan coordenadas,
+    la de la ciudad de referencia más cercana.
+
+    Returns:
+        str o None si el país no se conoce
+    """
+    codigo_pais = (codigo_pais or '').upper()
+    zonas = ZONAS_POR_PAIS.get(codigo_pais)
+    if zonas and lat is not None and lon is not None:
+        # Distancia aproximada en grados (la longitud se achica con la latitud)
+        escala = math.cos(math.radians(lat))
+        return min(zonas, key=lambda z: (z[1] - lat) ** 2 + ((z[2] - lon) * escala) ** 2)[0]
+    datos = PAISES.get(codigo_pais)
+    return datos[1] if datos else None
+
+
+def zona_horaria(nombre):
+    """
+    ZoneInfo de una zona IANA ('America/Lima'), o None si el nombre no es válido.
+    Sirve para validar la zona que manda el cliente: cualquier valor que no
+    sea texto (una lista o un objeto del JSON) también da None.
+    """
+    # El tipo se revisa antes de la caché: lru_cache falla con valores que no son hashables
+    if not nombre or not isinstance(nombre, str) or len(nombre) > 64:
+        return None
+    return _zona_horaria(nombre)
+
+
+@lru_cache(maxsize=512)
+def _zona_horaria(nombre):
+    try:
+        return ZoneInfo(nombre)
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        # OSError: una región como 'America' es una carpeta de la base de zonas
+        return None
+
+
+def hora_y_diferencia(zona_destino, zona_origen, ahora=None):
+    """
+    Hora actual en el destino y diferencia en horas con el origen.
+
+    Args:
+        zona_destino, zona_origen: tzinfo (ZoneInfo o un desfase fijo)
+        ahora: datetime con zona (por defecto, ahora en UTC)
+
+    Returns:
+        tuple: (datetime en el destino, diferencia en horas)
+    """
+    ahora = ahora or datetime.now(timezone.utc)
+    en_destino = ahora.astimezone(zona_destino)
+    diferencia = en_destino.utcoffset() - ahora.astimezone(zona_origen).utcoffset()
+    return en_destino, diferencia.total_seconds() / 3600
@@ -0,0 +1,569 @@
+"""
+============================================
+LÓGICA COMPARTIDA DE PLANIFICACIÓN - VIAJEIA
+============================================
+
+Este módulo contiene todo lo que no depende del servidor web:
+prompts, validaciones, lectura de las respuestas de las APIs externas,
+armado del panel lateral y cachés.
+
+Lo usan tanto el backend síncrono (app.py, Flask) como el asíncrono
+(app_async.py, Quart), para que ambos respondan exactamente igual.
+"""
+
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+from cache import CacheTTL
+from cache_disco import crear_cache_disco
+from cache_respuestas import CacheRespuestas
+from gazetteer import TIPO_CIUDAD, buscar_lugar, resolver_lugar
+from paises import hora_y_diferencia, moneda_pais, zona_horaria, zona_pais
+from prompts import plantilla
+from rate_limiter import REQUESTS_PER_MINUTE
+from sesiones import MAX_TURNOS_HISTORIAL, conversaciones, resumir_historial
+from metricas import registro
+from security import sanitizar_texto, validar_pregunta, validar_destino, validar_fecha
+from transporte import validar_campos
+
+logger = logging.getLogger('viajeia.planificacion')
+
+# ============================================
+# PROMPT Y GENERACIÓN
+# ============================================
+
+# Constantes de optimización (la plantilla del prompt y los presupuestos de tokens están en prompts.py)
+MAX_QUESTION_LENGTH = 500
+MIN_QUESTION_LENGTH = 10
+
+GEMINI_MODEL = 'gemini-2.0-flash'
+# Endpoint alternativo de la API de Gemini (por ejemplo, un proxy o el servidor
+# falso de benchmarks/); se usa el transporte REST para poder apuntar a http://
+GEMINI_API_ENDPOINT = os.getenv('GEMINI_API_ENDPOINT', '')
+
+# ============================================
+# ENRIQUECIMIENTO (CLIMA, TIPO DE CAMBIO, FOTOS)
+# ============================================
+
+# Enriquecimiento concurrente: clima, tipo de cambio y fotos se piden en paralelo
+# con Gemini, con un único plazo total por request (en segundos)
+ENRICHMENT_DEADLINE = float(os.getenv('ENRICHMENT_DEADLINE', '6'))
+# Tiempo máximo que Gemini espera al clima para incluirlo en el prompt
+PROMPT_WEATHER_WAIT = float(os.getenv('PROMPT_WEATHER_WAIT', '0.3'))
+
+# Lotes (/api/planificar/batch): máximo de consultas por lote y plazo total del lote
+# (por defecto, el límite por minuto: un lote más grande nunca cabría en el rate limit)
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', str(REQUESTS_PER_MINUTE)))
+BATCH_DEADLINE = float(os.getenv('BATCH_DEADLINE', '60'))
+
+# APIs externas
+OPENWEATHER_URL = os.getenv('OPENWEATHER_URL', 'https://api.openweathermap.org')
+EXCHANGERATE_URL = os.getenv('EXCHANGERATE_URL', 'https://api.exchangerate-api.com')
+UNSPLASH_URL = os.getenv('UNSPLASH_URL', 'https://api.unsplash.com')
+openweather_api_key = os.getenv('OPENWEATHER_API_KEY')
+unsplash_api_key = os.getenv('UNSPLASH_API_KEY')
+
+# Cachés de las APIs externas (TTL en segundos, por fuente)
+WEATHER_CACHE_TTL = int(os.getenv('WEATHER_CACHE_TTL', '600'))  # 10 minutos
+FX_CACHE_TTL = int(os.getenv('FX_CACHE_TTL', '43200'))  # 12 horas
+PHOTOS_CACHE_TTL = int(os.getenv('PHOTOS_CACHE_TTL', '604800'))  # 7 días
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '500'))
+# Tiempo extra que se conserva una entrada vencida: se sirve marcada como
+# obsoleta mientras se actualiza en segundo plano (o mientras el upstream
+# está caído). 0 desactiva el comportamiento.
+STALE_CACHE_TTL = int(os.getenv('STALE_CACHE_TTL', '86400'))  # 1 día
+
+# Tiempo que navegadores y CDNs pueden reutilizar las respuestas de
+# GET /api/destino/<nombre> (segundos). El panel trae la hora local:
+# con más de un minuto, la hora que se muestra queda atrasada.
+DESTINO_INFO_MAX_AGE = int(os.getenv('DESTINO_INFO_MAX_AGE', '60'))
+DESTINO_FOTOS_MAX_AGE = int(os.getenv('DESTINO_FOTOS_MAX_AGE', '86400'))  # 1 día
+
+
+def _marcar_obsoleto(valor):
+    """Copia de un valor de la caché con la marca 'obsoleto' (clima, tabla de cambio)."""
+    return {**valor, 'obsoleto': True}
+
+
+# Caché en disco compartida por los workers (None si CACHE_DISK_PATH está vacío).
+# Guarda lo que cuesta más volver a pedir: tablas de cambio, fotos y respuestas de
+# Gemini. El clima dura pocos minutos y no vale la pena.
+cache_disco = crear_cache_disco()
+# Las conversaciones también: la consulta siguiente puede llegar a otro worker
+conversaciones.usar_disco(cache_disco)
+
+cache_clima = CacheTTL('clima', WEATHER_CACHE_TTL, CACHE_MAX_ENTRIES, STALE_CACHE_TTL, _marcar_obsoleto)
+cache_tipo_cambio = CacheTTL('tipo_cambio', FX_CACHE_TTL, CACHE_MAX_ENTRIES, STALE_CACHE_TTL, _marcar_obsoleto,
+                             disco=cache_disco)
+# Unas fotos viejas del destino siguen siendo válidas: no se marcan
+cache_fotos = CacheTTL('fotos', PHOTOS_CACHE_TTL, CACHE_MAX_ENTRIES, STALE_CACHE_TTL, disco=cache_disco)
+
+# Caché de respuestas de Gemini para preguntas repetidas o casi iguales
+# RESPONSE_CACHE_SIMILARITY=0 desactiva la búsqueda por similitud
+cache_respuestas = CacheRespuestas(
+    ttl=int(os.getenv('RESPONSE_CACHE_TTL', '21600')),  # 6 horas
+    max_entradas=int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '1000')),
+    umbral_similitud=float(os.getenv('RESPONSE_CACHE_SIMILARITY', '0.8')),
+    disco=cache_disco
+)
+
+CACHES = (cache_clima, cache_tipo_cambio, cache_fotos, cache_respuestas)
+
+
+def _muestras_caches():
+    """Contadores de las cachés para /api/metrics."""
+    muestras = []
+    for cache in CACHES:
+        estadisticas = cache.estadisticas()
+        etiquetas = {'cache': cache.nombre}
+        muestras.append(('viajeia_cache_entradas', 'gauge', etiquetas, estadisticas['entradas']))
+        for contador in ('aciertos', 'fallos', 'compartidos', 'desalojos', 'obsoletos', 'aciertos_similares',
+                         'aciertos_disco'):
+            if contador in estadisticas:
+                muestras.append((f'viajeia_cache_{contador}_total', 'counter', etiquetas, estadisticas[contador]))
+    if cache_disco is not None:
+        estadisticas = cache_disco.estadisticas()
+        muestras.append(('viajeia_cache_disco_bytes', 'gauge', {}, estadisticas['archivo_bytes']))
+        muestras.append(('viajeia_cache_disco_escrituras_total', 'counter', {}, estadisticas['escrituras']))
+        muestras.append(('viajeia_cache_disco_desalojos_total', 'counter', {}, estadisticas['desalojos']))
+        muestras.append(('viajeia_cache_disco_errores_total', 'counter', {}, estadisticas['errores']))
+    return muestras
+
+
+registro.agregar_colector(_muestras_caches)
+
+
+def opciones_cliente_gemini():
+    """Argumentos extra de genai.configure (vacío si se usa la API de Google)."""
+    if not GEMINI_API_ENDPOINT:
+        return {}
+    return {'transport': 'rest', 'client_options': {'api_endpoint': GEMINI_API_ENDPOINT}}
+
+
+def clave_destino(nombre):
+    """Normaliza un nombre de destino para usarlo como clave de caché."""
+    return ' '.join(nombre.split()).lower()
+
+
+def parametros_clima(nombre_ciudad):
+    """
+    Parámetros de la consulta a OpenWeatherMap (GET /data/2.5/weather).
+    Si el destino está en el índice, se agrega el país ("Lima,PE" y no Lima
+    de Ohio); para un país se pide el clima de su capital por coordenadas.
+    """
+    parametros = {
+        'appid': openweather_api_key,
+        'units': 'metric',  # Para obtener temperatura en Celsius
+        'lang': 'es'  # Respuestas en español
+    }
+    lugar = resolver_lugar(nombre_ciudad)
+    if lugar is None:
+        parametros['q'] = nombre_ciudad
+    elif lugar.tipo == TIPO_CIUDAD:
+        parametros['q'] = f'{lugar.nombre},{lugar.pais}'
+    else:
+        parametros.update(lat=lugar.lat, lon=lugar.lon)
+    return parametros
+
+
+def parsear_clima(data):
+    """
+    Extrae la información relevante de la respuesta de OpenWeatherMap.
+    """
+    # Obtener zona horaria (offset en segundos)
+    timezone_offset = data.get('timezone', 0)  # Offset en segundos
+
+    return {
+        'ciudad': data['name'],
+        'pais': data['sys']['country'],
+        'temperatura': round(data['main']['temp']),
+        'sensacion_termica': round(data['main']['feels_like']),
+        'descripcion': data['weather'][0]['description'].capitalize(),
+        'humedad': data['main']['humidity'],
+        'viento': round(data['wind']['speed'] * 3.6),  # Convertir m/s a km/h
+        'presion': data['main']['pressure'],
+        'visibilidad': data.get('visibility', 0) / 1000 if data.get('visibility') else None,  # Convertir a km
+        'timezone_offset': timezone_offset  # Offset en segundos
+    }
+
+
+def parsear_tabla_cambio(data, base_currency):
+    """
+    Extrae la tabla de tasas de la respuesta de exchangerate-api.com.
+
+    Returns:
+        dict: { 'base': str, 'rates': {moneda: tasa}, 'fecha': str } o None
+    """
+    rates = data.get('rates', {})
+    if not rates:
+        return None
+    return {
+        'base': base_currency,
+        'rates': rates,
+        'fecha': data.get('date', '')
+    }
+
+
+def tipo_cambio_desde_tabla(tabla, target_currency):
+    """
+    Obtiene el tipo de cambio hacia una moneda a partir de la tabla de la moneda base.
+    """
+    if not tabla:
+        return None
+
+    rates = tabla['rates']
+    if target_currency in rates:
+        return {
+            'base': tabla['base'],
+            'target': target_currency,
+            'rate': rates[target_currency],
+            'fecha': tabla['fecha'],
+            'obsoleto': tabla.get('obsoleto', False)
+        }
+    return None
+
+
+def parametros_fotos(nombre_destino, cantidad):
+    """Parámetros de la búsqueda en Unsplash (GET /search/photos)."""
+    return {
+        'query': nombre_destino,
+        'per_page': cantidad,
+        'orientation': 'landscape',  # Fotos horizontales
+        'order_by': 'popularity'  # Las más populares
+    }
+
+
+def parsear_fotos(data, cantidad):
+    """
+    Extrae las fotos de la respuesta de Unsplash.
+    """
+    fotos = []
+    for photo in data.get('results', [])[:cantidad]:
+        fotos.append({
+            'url': photo['urls']['regular'],  # Tamaño regular (buena calidad)
+            'url_pequeña': photo['urls']['small'],  # Para carga rápida
+            'url_grande': photo['urls']['full'],  # Para ver en grande
+            'autor': photo['user']['name'],
+            'descripcion': photo.get('description', '') or photo.get('alt_description', '')
+        })
+    return fotos
+
+
+def pais_destino(destino):
+    """
+    Código de país de un destino según el índice local, o None si no está.
+    Con el país conocido, el tipo de cambio no tiene que esperar al clima.
+    """
+    lugar = resolver_lugar(destino)
+    return lugar.pais if lugar else None
+
+
+def obtener_moneda_pais(codigo_pais):
+    """
+    Moneda principal de un país (tabla de paises.py; USD si no se conoce).
+    """
+    return moneda_pais(codigo_pais)
+
+
+def construir_info_destino(info_clima, tipo_cambio=None, destino=None, zona_cliente=None):
+    """
+    Arma la información del panel lateral.
+
+    Si el destino está en el índice de lugares, el país, la moneda y la hora
+    local salen de las tablas locales y el panel se arma aunque el clima no
+    llegue (sin temperatura). Si el tipo de cambio no llegó a tiempo, sale sin él.
+    Si el clima o el tipo de cambio vienen de una entrada vencida de la caché
+    (upstream caído o actualizándose), 'datos_obsoletos' es True.
+
+    Args:
+        zona_cliente: ZoneInfo del usuario; sin ella se compara con la hora del servidor
+    """
+    lugar = resolver_lugar(destino)
+    if not info_clima and not lugar:
+        return None
+
+    zona_destino = zona_horaria(zona_pais(lugar.pais, lugar.lat, lugar.lon)) if lugar else None
+    if zona_destino is None:
+        # Destino fuera del índice: el desfase actual que informó OpenWeatherMap
+        zona_destino = timezone(timedelta(seconds=info_clima.get('timezone_offset', 0)))
+    zona_origen = zona_cliente or datetime.now().astimezone().tzinfo
+    hora_destino, diferencia_horas = hora_y_diferencia(zona_destino, zona_origen)
+
+    codigo_pais = info_clima['pais'] if info_clima else lugar.pais
+    moneda_destino = obtener_moneda_pais(codigo_pais)
+
+    return {
+        'ciudad': info_clima['ciudad'] if info_clima else lugar.nombre,
+        'pais': codigo_pais,
+        'temperatura': info_clima['temperatura'] if info_clima else None,
+        'descripcion': info_clima['descripcion'] if info_clima else None,
+        'diferencia_horaria': round(diferencia_horas, 1),
+        'hora_destino': hora_destino.strftime('%H:%M'),
+        'zona_horaria': getattr(zona_destino, 'key', None),
+        'moneda': moneda_destino,
+        'tipo_cambio': tipo_cambio['rate'] if tipo_cambio else None,
+        'simbolo_moneda': tipo_cambio['target'] if tipo_cambio else moneda_destino,
+        'datos_obsoletos': bool(
+            (info_clima and info_clima.get('obsoleto')) or (tipo_cambio and tipo_cambio.get('obsoleto'))
+        )
+    }
+
+
+# ============================================
+# PANEL DEL DESTINO (GET /api/destino/<nombre>)
+# ============================================
+
+def validar_consulta_destino(nombre, parametros):
+    """
+    Valida el destino y los parámetros de GET /api/destino/<nombre>
+    (?zonaHoraria=America/Lima&campos=info_destino.temperatura,...).
+
+    Returns:
+        tuple: ({ 'destino', 'zona_horaria', 'campos' }, None) o (None, (mensaje_error, status))
+    """
+    # 🔒 SEGURIDAD: el nombre llega en la URL, se valida igual que en datosViaje
+    es_valido, mensaje_error = validar_destino(nombre)
+    if not es_valido:
+        return None, (mensaje_error, 400)
+    # Solo destinos del índice: un nombre cualquiera no llega a las APIs externas
+    if resolver_lugar(nombre) is None:
+        return None, ('Destino desconocido', 404)
+    campos, error_campos = validar_campos(parametros.get('campos'))
+    if error_campos:
+        return None, (error_campos, 400)
+    return {
+        'destino': ' '.join(nombre.split()),
+        'zona_horaria': zona_horaria(parametros.get('zonaHoraria')),
+        'campos': campos
+    }, None
+
+
+def cache_control_destino(max_age, obsoleto=False):
+    """
+    Cabecera Cache-Control de una respuesta de /api/destino. Los datos
+    obsoletos (upstream caído) no se guardan: la próxima consulta los revisa.
+    """
+    if obsoleto or max_age <= 0:
+        return 'no-cache'
+    return f'public, max-age={max_age}, stale-while-revalidate={max_age}'
+
+
+# ============================================
+# SOLICITUDES
+# ============================================
+
+def validar_datos_solicitud(pregunta, datos_viaje):
+    """
+    Valida la pregunta y los datos del viaje.
+
+    Returns:
+        None si todo es válido, o (mensaje_error, status)
+    """
+    # 🔒 SEGURIDAD: Validar pregunta
+    es_valida, mensaje_error = validar_pregunta(pregunta)
+    if not es_valida:
+        return mensaje_error, 400
+
+    # 🔒 SEGURIDAD: Validar datos del viaje si están presentes
+    if datos_viaje:
+        if not isinstance(datos_viaje, dict):
+            return '"datosViaje" debe ser un objeto con "destino", "fecha" y "presupuesto"', 400
+        destino = datos_viaje.get('destino', '')
+        fecha = datos_viaje.get('fecha', '')
+        if not isinstance(destino, str) or not isinstance(fecha, str):
+            return 'El destino y la fecha del viaje deben ser texto', 400
+
+        if destino:
+            es_valido, mensaje = validar_destino(destino)
+            if not es_valido:
+                return mensaje, 400
+
+        if fecha:
+            es_valida, mensaje = validar_fecha(fecha)
+            if not es_valida:
+                return mensaje, 400
+
+    return None
+
+
+def validar_lote(items):
+    """
+    Valida la forma de un lote de /api/planificar/batch (cada consulta se valida aparte).
+
+    Returns:
+        None si es válido, o (mensaje_error, status)
+    """
+    if not isinstance(items, list) or not items:
+        return 'El lote debe incluir una lista "items" con al menos una consulta', 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return f'El lote no puede tener más de {BATCH_MAX_ITEMS} consultas', 400
+    if not all(isinstance(item, dict) for item in items):
+        return 'Cada consulta del lote debe ser un objeto con "pregunta" y "datosViaje"', 400
+    return None
+
+
+def resultado_error_item(indice, mensaje, status):
+    """Resultado de una consulta del lote que no se pudo responder."""
+    return {'indice': indice, 'error': mensaje, 'status': status}
+
+
+def detectar_destino(pregunta, datos_viaje):
+    """
+    Obtiene el destino de datos_viaje o intenta extraerlo de la pregunta.
+    """
+    destino = datos_viaje.get('destino', '') if datos_viaje else ''
+
+    # Si no hay destino en datos_viaje, buscar en la pregunta un lugar del índice
+    # (si no menciona ninguno, no se consultan el clima ni las fotos)
+    if not destino:
+        lugar = buscar_lugar(pregunta)
+        if lugar:
+            destino = lugar.nombre
+
+    logger.debug('Destino detectado: %s', destino)
+    return destino
+
+
+def preguntas_historial(historial):
+    """
+    Preguntas de los últimos turnos de un historial enviado por el cliente,
+    validadas y sanitizadas igual que 'pregunta'. Las entradas que no son
+    objetos o no pasan la validación se ignoran, y las respuestas se
+    descartan: el cliente podría inventarlas.
+    """
+    if not isinstance(historial, list):
+        return []
+    preguntas = []
+    for entrada in historial[-MAX_TURNOS_HISTORIAL:]:
+        if not isinstance(entrada, dict):
+            continue
+        pregunta = entrada.get('pregunta')
+        # 🔒 SEGURIDAD: El historial entra al prompt, se valida como la pregunta
+        es_valida, _ = validar_pregunta(pregunta)
+        if es_valida:
+            preguntas.append(sanitizar_texto(pregunta.strip()))
+    return preguntas
+
+
+def contexto_conversacion(conversacion_id, historial=None):
+    """
+    Contexto de las preguntas anteriores para el prompt: el que se guarda en
+    el servidor para la conversación o, si el cliente no manda un id (versiones
+    anteriores del frontend, lotes), el resumen de las preguntas del historial
+    que envía (ver preguntas_historial).
+    """
+    preguntas = preguntas_historial(historial)
+    if conversacion_id:
+        contexto = conversaciones.contexto(conversacion_id)
+        if not contexto and preguntas:
+            # Conversación retomada (por ejemplo, desde un favorito): se siembra con su historial
+            conversaciones.sembrar(conversacion_id, preguntas)
+            contexto = conversaciones.contexto(conversacion_id)
+        return contexto
+    if preguntas:
+        return resumir_historial(preguntas)
+    return ''
+
+
+def construir_prompt(pregunta, datos_viaje, destino, info_clima, contexto_previo=''):
+    """
+    Construye el prompt optimizado: sistema + formato + contexto + pregunta,
+    dentro del presupuesto de tokens de entrada (ver prompts.py).
+
+    Args:
+        contexto_previo: Resumen de la conversación (contexto_conversacion)
+
+    Returns:
+        Prompt: (texto, config de generación para el tipo de pregunta, tipo, tokens por sección)
+    """
+    # Construir contexto optimizado (solo información esencial), de mayor a menor prioridad
+    secciones = []
+
+    # Datos del viaje (solo si existen)
+    if datos_viaje and (destino or datos_viaje.get('fecha') or datos_viaje.get('presupuesto')):
+        viaje_info = []
+        if destino:
+            viaje_info.append(f"Destino: {destino}")
+        if datos_viaje.get('fecha'):
+            viaje_info.append(f"Fecha: {datos_viaje['fecha']}")
+        if datos_viaje.get('presupuesto'):
+            viaje_info.append(f"Presupuesto: {datos_viaje['presupuesto']}")
+        if viaje_info:
+            secciones.append(('viaje', "Viaje: ", " | ".join(viaje_info)))
+
+    # Clima (solo datos esenciales)
+    if info_clima:
+        secciones.append(('clima', "Clima: ", f"{info_clima['temperatura']}°C, {info_clima['descripcion']}"))
+
+    # Conversación previa (resumida; es lo primero que se recorta si no entra)
+    if contexto_previo:
+        secciones.append(('conversacion', "Conversación previa:\n", contexto_previo))
+
+    return plantilla.armar(pregunta, secciones)
+
+
+def mensaje_error_gemini(gemini_error):
+    """
+    Traduce un error de Gemini a un mensaje amigable para el usuario.
+    """
+    error_msg = str(gemini_error)
+    # Mensajes más amigables para errores comunes
+    if "quota" in error_msg.lower() or "quota_exceeded" in error_msg.lower():
+        error_msg = "Has excedido la cuota de la API de Gemini. Por favor, verifica tu plan en https://makersuite.google.com/app/apikey"
+    elif "invalid_api_key" in error_msg.lower() or "authentication" in error_msg.lower() or "API_KEY_INVALID" in error_msg:
+        error_msg = "La API key de Gemini no es válida. Por favor, verifica tu archivo .env"
+    elif "rate_limit" in error_msg.lower() or "RESOURCE_EXHAUSTED" in error_msg:
+        error_msg = "Has excedido el límite de solicitudes. Por favor, espera un momento e intenta de nuevo."
+    return f'Error con Gemini: {error_msg}'
+
+
+def buscar_respuesta_cacheada(solicitud, destino):
+    """
+    Busca en la caché una respuesta para la misma pregunta (o una casi igual).
+    Si la pregunta sigue una conversación no se busca: la respuesta depende
+    del contexto ("¿y con niños?" no significa lo mismo en cada conversación).
+    """
+    if solicitud['contexto']:
+        return None
+    respuesta = cache_respuestas.buscar(solicitud['pregunta'], solicitud['datos_viaje'], destino)
+    if respuesta is not None:
+        logger.debug('Respuesta servida desde la caché')
+        registrar_turno(solicitud, respuesta)
+    return respuesta
+
+
+def guardar_respuesta(solicitud, destino, respuesta):
+    """
+    Guarda la respuesta de Gemini para preguntas futuras equivalentes
+    (solo si no dependía de una conversación) y la suma a la conversación.
+    """
+    if not solicitud['contexto']:
+        cache_respuestas.guardar(solicitud['pregunta'], solicitud['datos_viaje'], destino, respuesta)
+    registrar_turno(solicitud, respuesta)
+
+
+def clave_generacion(solicitud, destino):
+    """
+    Clave con la que consultas idénticas comparten la respuesta de Gemini en
+    curso (coalescencia.py): la clave exacta de la caché de respuestas más el
+    contexto de la conversación, del que depende la respuesta.
+    """
+    clave = cache_respuestas.clave(solicitud['pregunta'], solicitud['datos_viaje'], destino)
+    if clave is None:
+        return None
+    return clave, solicitud['contexto']
+
+
+def registrar_turno(solicitud, respuesta):
+    """Agrega la pregunta y su respuesta a la conversación del cliente, si tiene una."""
+    if solicitud['conversacion_id'] and respuesta:
+        conversaciones.registrar_turno(solicitud['conversacion_id'], solicitud['pregunta'], respuesta)
+
+
+def estadisticas_caches():
+    """Contadores de todas las cachés, por nombre (y de las conversaciones)."""
+    estadisticas = {**{c.nombre: c.estadisticas() for c in CACHES}, 'conversaciones': conversaciones.estadisticas()}
+    if cache_disco is not None:
+        estadisticas['disco'] = cache_disco.estadisticas()
+    return estadisticas
@@ -0,0 +1,328 @@
+"""
+============================================
+PRECARGA DE DESTINOS POPULARES - VIAJEIA
+============================================
+
+Cuenta qué destinos se consultan más y, cada PREFETCH_INTERVAL segundos,
+vuelve a pedir el clima, las fotos y el tipo de cambio de los más
+populares antes de que venzan en la caché. Así la consulta de un destino
+común casi nunca espera a OpenWeatherMap, Unsplash o exchangerate-api.
+
+La popularidad se mide con un puntaje que se reduce a la mitad cada
+PREFETCH_HALF_LIFE segundos: lo que se pidió mucho ayer pesa menos que
+lo que se pide ahora. Cada ciclo hace como mucho PREFETCH_BUDGET llamadas
+a los upstreams, empezando por el destino más popular.
+
+Al apagarse (y al final de cada ciclo) la popularidad se guarda en la
+caché en disco (cache_disco.py), la misma que ya conserva las fotos, los
+tipos de cambio y las respuestas; al arrancar se carga, así que un
+reinicio o un despliegue no empiezan sin saber qué precargar. Sin caché
+en disco (CACHE_DISK_PATH vacío) no se guarda nada.
+
+¿Por qué es importante?
+- Los destinos frecuentes se sirven siempre desde la caché
+- El gasto de cuota de las APIs externas queda acotado por ciclo
+- Con varios workers cada uno precarga lo suyo: el presupuesto es por proceso
+"""
+
+import asyncio
+import heapq
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+from metricas import incrementar, registro
+
+logger = logging.getLogger('viajeia.precarga')
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# PREFETCH_ENABLED=false desactiva la precarga y el guardado de la popularidad
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+# Cantidad de destinos populares que se mantienen precargados
+PREFETCH_TOP_N = int(os.getenv('PREFETCH_TOP_N', '20'))
+# Segundos entre ciclos de precarga
+PREFETCH_INTERVAL = float(os.getenv('PREFETCH_INTERVAL', '300'))
+# Máximo de llamadas a los upstreams por ciclo
+PREFETCH_BUDGET = int(os.getenv('PREFETCH_BUDGET', '30'))
+# Vida media de la popularidad (segundos)
+PREFETCH_HALF_LIFE = float(os.getenv('PREFETCH_HALF_LIFE', '21600'))  # 6 horas
+# Espacio y clave de la popularidad en la caché en disco
+ESPACIO_DISCO = 'precarga'
+CLAVE_POPULARIDAD = 'popularidad'
+
+# Destinos distintos que se recuerdan como mucho
+MAX_DESTINOS = 1000
+
+# Qué se precarga de cada destino:
+#   cache: la CacheTTL donde se guarda
+#   clave: función destino -> clave de la caché (la misma que usa la consulta)
+#   calcular: función destino -> valor del upstream (o corrutina en app_async)
+Fuente = namedtuple('Fuente', ['cache', 'clave', 'calcular'])
+
+
+class Popularidad:
+    """
+    Puntaje de cada destino con decaimiento exponencial.
+
+    Args:
+        normalizar: Función nombre -> clave (para que "Roma" y "roma " cuenten igual)
+        vida_media: Segundos en que un puntaje se reduce a la mitad
+    """
+
+    def __init__(self, normalizar, vida_media=PREFETCH_HALF_LIFE, max_destinos=MAX_DESTINOS):
+        self._normalizar = normalizar
+        self.vida_media = vida_media
+        self.max_destinos = max_destinos
+        self._destinos = {}  # { clave: [puntaje, actualizado_en, nombre] }
+        self._lock = threading.Lock()
+
+    def _decaer(self, puntaje, desde, ahora):
+        return puntaje * 0.5 ** ((ahora - desde) / self.vida_media)
+
+    def registrar(self, destino, peso=1.0):
+        """Suma una consulta al destino."""
+        clave = self._normalizar(destino)
+        ahora = time.monotonic()
+        with self._lock:
+            entrada = self._destinos.get(clave)
+            if entrada is None:
+                self._destinos[clave] = [peso, ahora, destino]
+                if len(self._destinos) > self.max_destinos:
+                    self._recortar(ahora)
+            else:
+                entrada[0] = self._decaer(entrada[0], entrada[1], ahora) + peso
+                entrada[1] = ahora
+                entrada[2] = destino
+
+    def _recortar(self, ahora):
+        """Olvida el 10% menos popular. Debe llamarse con el lock tomado."""
+        conservar = heapq.nlargest(
+            int(self.max_destinos * 0.9), self._destinos.items(),
+            key=lambda item: self._decaer(item[1][0], item[1][1], ahora)
+        )
+        self._destinos = dict(conservar)
+
+    def top(self, n):
+        """
+        Returns:
+            list: [(nombre, puntaje)] de los n destinos más populares
+        """
+        ahora = time.monotonic()
+        with self._lock:
+            puntajes = [
+                (self._decaer(puntaje, desde, ahora), nombre)
+                for puntaje, desde, nombre in self._destinos.values()
+            ]
+        return [(nombre, puntaje) for puntaje, nombre in heapq.nlargest(n, puntajes)]
+
+    def __len__(self):
+        return len(self._destinos)
+
+    def exportar(self):
+        """[(nombre, puntaje actual)] para guardar en disco."""
+        return self.top(len(self._destinos))
+
+    def importar(self, destinos, segundos_transcurridos=0.0):
+        """Carga los puntajes guardados, descontando el tiempo que pasó desde entonces."""
+        for nombre, puntaje in destinos:
+            self.registrar(nombre, self._decaer(puntaje, 0.0, segundos_transcurridos))
+
+
+class Precargador:
+    """
+    Mantiene en caché los datos de los destinos más populares.
+
+    Args:
+        popularidad: Popularidad que alimentan las consultas
+        fuentes: [Fuente] que se precargan de cada destino
+        disco: CacheDisco donde se guarda la popularidad (None = no se guarda)
+    """
+
+    def __init__(self, popularidad, fuentes, top_n=PREFETCH_TOP_N, intervalo=PREFETCH_INTERVAL,
+                 presupuesto=PREFETCH_BUDGET, disco=None, activo=PREFETCH_ENABLED):
+        self.popularidad = popularidad
+        self.fuentes = fuentes
+        self.top_n = top_n
+        self.intervalo = intervalo
+        self.presupuesto = presupuesto
+        self.disco = disco
+        self.activo = activo
+        self._hilo_pid = None
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+
+        # Contadores
+        self.ciclos = 0
+        self.llamadas = 0
+
+    def registrar(self, destino):
+        """Cuenta una consulta al destino (se llama desde iniciar_enriquecimiento)."""
+        if self.activo:
+            self.popularidad.registrar(destino)
+
+    def pendientes(self):
+        """
+        Lo que hay que actualizar en este ciclo: las entradas de los destinos
+        populares que faltan o vencen antes del próximo ciclo, del más popular
+        al menos popular y hasta agotar el presupuesto.
+
+        Returns:
+            list: [(Fuente, clave, destino)]
+        """
+        pendientes = []
+        vistas = set()
+        for destino, _ in self.popularidad.top(self.top_n):
+            for fuente in self.fuentes:
+                clave = fuente.clave(destino)
+                if (fuente.cache.nombre, clave) in vistas:
+                    continue  # Por ejemplo, la tabla de cambio USD es la misma para todos
+                vistas.add((fuente.cache.nombre, clave))
+                restante = fuente.cache.restante(clave)
+                if restante is None or restante <= self.intervalo:
+                    pendientes.append((fuente, clave, destino))
+                    if len(pendientes) >= self.presupuesto:
+                        return pendientes
+        return pendientes
+
+    def _guardar_resultado(self, fuente, clave, valor):
+        self.llamadas += 1
+        incrementar('viajeia_precarga_llamadas_total', cache=fuente.cache.nombre)
+        if valor:
+            fuente.cache.guardar(clave, valor)
+
+    def ejecutar(self):
+        """Un ciclo de precarga (backend Flask). Devuelve las llamadas hechas."""
+        pendientes = self.pendientes()
+        for fuente, clave, destino in pendientes:
+            try:
+                self._guardar_resultado(fuente, clave, fuente.calcular(destino))
+            except Exception as e:
+                logger.warning("Error al precargar %s de %s: %s", fuente.cache.nombre, destino, e)
+        self.ciclos += 1
+        logger.debug("Precarga: %d llamadas para %d destinos", len(pendientes), len(self.popularidad))
+        return len(pendientes)
+
+    async def ejecutar_async(self):
+        """Un ciclo de precarga (backend app_async.py). Devuelve las llamadas hechas."""
+        pendientes = self.pendientes()
+        for fuente, clave, destino in pendientes:
+            try:
+                self._guardar_resultado(fuente, clave, await fuente.calcular(destino))
+            except Exception as e:
+                logger.warning("Error al precargar %s de %s: %s", fuente.cache.nombre, destino, e)
+        self.ciclos += 1
+        logger.debug("Precarga: %d llamadas para %d destinos", len(pendientes), len(self.popularidad))
+        return len(pendientes)
+
+    # ============================================
+    # EJECUCIÓN EN SEGUNDO PLANO
+    # ============================================
+
+    def iniciar(self):
+        """
+        Arranca el hilo de precarga si no corre en este proceso (backend Flask).
+        Es barato llamarlo en cada consulta: con preload_app, gunicorn importa
+        la app en el proceso maestro y los hilos no pasan a los workers, así que
+        el hilo se crea en cada worker con su primera consulta.
+        """
+        if not self.activo or self._hilo_pid == os.getpid():
+            return
+        with self._lock:
+            if self._hilo_pid == os.getpid():
+                return
+            self._hilo_pid = os.getpid()
+            self._detener.clear()
+            threading.Thread(target=self._bucle, name='precarga', daemon=True).start()
+
+    def _bucle(self):
+        while not self._detener.wait(self.intervalo):
+            try:
+                self.ejecutar()
+                self.guardar_popularidad()
+            except Exception as e:
+                logger.warning("Error en el ciclo de precarga: %s", e)
+
+    def detener(self):
+        """Detiene el hilo de precarga y guarda la popularidad."""
+        self._detener.set()
+        self.guardar_popularidad()
+        if self.activo and self.disco is not None:
+            # El hilo de escritura de la caché en disco no sobrevive al proceso
+            self.disco.esperar_escrituras(1.0)
+
+    async def bucle_async(self):
+        """Ciclo de precarga como tarea del event loop (backend app_async.py)."""
+        if not self.activo:
+            return
+        while True:
+            await asyncio.sleep(self.intervalo)
+            try:
+                await self.ejecutar_async()
+                self.guardar_popularidad()
+            except Exception as e:
+                logger.warning("Error en el ciclo de precarga: %s", e)
+
+    # ============================================
+    # POPULARIDAD EN DISCO
+    # ============================================
+
+    def guardar_popularidad(self):
+        """
+        Encola la popularidad para la caché en disco. Con varios workers
+        queda la del último que la guardó (todos ven destinos parecidos).
+        Las entradas de las cachés no hace falta guardarlas: las que valen
+        la pena ya están en la caché en disco.
+        """
+        if not self.activo or self.disco is None:
+            return
+        ahora = time.time()
+        # Después de diez vidas medias los puntajes ya no cuentan
+        vence_en = ahora + 10 * self.popularidad.vida_media
+        self.disco.guardar(ESPACIO_DISCO, CLAVE_POPULARIDAD, {
+            'guardado': ahora,
+            'destinos': self.popularidad.exportar()
+        }, vence_en, vence_en)
+
+    def cargar_popularidad(self):
+        """Carga la popularidad guardada (si hay), descontando el tiempo que pasó."""
+        if not self.activo or self.disco is None:
+            return
+        guardada = self.disco.leer(ESPACIO_DISCO, CLAVE_POPULARIDAD)
+        if guardada is None:
+            return
+        datos, _ = guardada
+        try:
+            self.popularidad.importar(datos['destinos'], max(0.0, time.time() - datos['guardado']))
+        except (KeyError, TypeError, ValueError) as e:
+            logger.warning("Popularidad guardada con formato inválido: %s", e)
+            return
+        logger.info("Popularidad de %d destinos cargada de la caché en disco", len(self.popularidad))
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'activo', 'destinos', 'top', 'ciclos', 'llamadas' }
+        """
+        return {
+            'activo': self.activo,
+            'destinos': len(self.popularidad),
+            'top': [nombre for nombre, _ in self.popularidad.top(5)],
+            'ciclos': self.ciclos,
+            'llamadas': self.llamadas
+        }
+
+    def muestras(self):
+        """Gauges para /api/metrics."""
+        return [('viajeia_precarga_destinos', 'gauge', {}, len(self.popularidad))]
+
+
+def crear_precargador(normalizar, fuentes, disco=None):
+    """Crea el precargador del proceso y lo registra en /api/metrics."""
+    precargador = Precargador(Popularidad(normalizar), fuentes, disco=disco)
+    registro.agregar_colector(precargador.muestras)
+    return precargador
@@ -0,0 +1,284 @@
+"""
+============================================
+PROMPTS Y PRESUPUESTO DE TOKENS - VIAJEIA
+============================================
+
+Arma el prompt de Gemini a partir de una plantilla que se construye una
+sola vez (instrucciones del sistema + formato de respuesta + cierre) y de
+las secciones de contexto de cada consulta (viaje, clima, conversación).
+El prefijo fijo (INSTRUCCION_SISTEMA) no va en el texto de cada consulta:
+es la system_instruction del modelo (ver gemini_cliente.py).
+
+- Cuenta los tokens de cada sección y respeta PROMPT_MAX_INPUT_TOKENS: si
+  no entra todo, se recorta primero la conversación y después el clima.
+- Los tokens se estiman por caracteres; la proporción se calibra con los
+  tokens reales que informa Gemini en cada respuesta (usage_metadata).
+- Elige max_output_tokens según el tipo de pregunta: una consulta breve
+  ("¿qué moneda usan?") no necesita el mismo espacio que un itinerario.
+- Registra los tokens de entrada y salida de cada consulta por tipo
+  (histogramas viajeia_gemini_tokens en /api/metrics).
+
+¿Por qué es importante?
+- El costo y la latencia de Gemini crecen con los tokens de entrada y salida
+- El prompt nunca crece sin control, aunque la conversación sea larga
+- Con los números reales se pueden ajustar los presupuestos
+"""
+
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+
+import google.generativeai as genai
+
+from metricas import BUCKETS_TOKENS, incrementar, observar, registrar_uso_gemini
+
+logger = logging.getLogger('viajeia.prompts')
+
+# ============================================
+# PLANTILLA
+# ============================================
+
+SYSTEM_PROMPT = "Asistente experto en viajes. Respuestas prácticas y concisas."
+RESPONSE_FORMAT = """Formato obligatorio (5 secciones con saltos de línea):
+» ALOJAMIENTO: [recomendaciones]
+Þ COMIDA LOCAL: [recomendaciones]
+ LUGARES IMPERDIBLES: [recomendaciones]
+ä CONSEJOS LOCALES: [tips]
+ø ESTIMACIÓN DE COSTOS: [breakdown]"""
+# Prefijo fijo: instrucción de sistema del modelo (y contenido de la caché de contexto)
+INSTRUCCION_SISTEMA = f"{SYSTEM_PROMPT}\n\n{RESPONSE_FORMAT}"
+CIERRE = "Responde usando el formato especificado con saltos de línea entre secciones."
+
+# Tipos de pregunta
+TIPO_BREVE = 'breve'
+TIPO_NORMAL = 'normal'
+TIPO_ITINERARIO = 'itinerario'
+
+# Indicación extra al final del prompt según el tipo (acompaña al límite de tokens)
+INDICACIONES = {
+    TIPO_BREVE: ' Sé breve: una o dos líneas por sección.',
+    TIPO_NORMAL: '',
+    TIPO_ITINERARIO: ' En LUGARES IMPERDIBLES organiza las actividades por día.',
+}
+
+# ============================================
+# PRESUPUESTOS
+# ============================================
+
+# Tokens de entrada como máximo (plantilla + contexto + pregunta)
+PROMPT_MAX_INPUT_TOKENS = int(os.getenv('PROMPT_MAX_INPUT_TOKENS', '700'))
+# max_output_tokens por tipo de pregunta
+GEMINI_MAX_TOKENS = int(os.getenv('GEMINI_MAX_TOKENS', '800'))
+GEMINI_MAX_TOKENS_BREVE = int(os.getenv('GEMINI_MAX_TOKENS_BREVE', '400'))
+GEMINI_MAX_TOKENS_ITINERARIO = int(os.getenv('GEMINI_MAX_TOKENS_ITINERARIO', '1200'))
+TEMPERATURA = 0.8  # Un poco más creativo para ser más entusiasta
+
+# Una configuración de generación por tipo, creadas una sola vez
+CONFIGURACIONES = {
+    tipo: genai.types.GenerationConfig(max_output_tokens=maximo, temperature=TEMPERATURA)
+    for tipo, maximo in (
+        (TIPO_BREVE, GEMINI_MAX_TOKENS_BREVE),
+        (TIPO_NORMAL, GEMINI_MAX_TOKENS),
+        (TIPO_ITINERARIO, GEMINI_MAX_TOKENS_ITINERARIO),
+    )
+}
+
+# Una sección de contexto por debajo de esto no vale la pena (se omite)
+MIN_TOKENS_SECCION = 15
+
+# ============================================
+# CLASIFICACIÓN DE PREGUNTAS
+# ============================================
+
+_PATRON_ITINERARIO = re.compile(
+    r'\b(itinerario|ruta|recorrido|\d+\s*d[ií]as|(una|dos|tres) semanas?|fin de semana|'
+    r'd[ií]a por d[ií]a|plan (completo|detallado))\b'
+)
+_PATRON_BREVE = re.compile(
+    r'\b(moneda|tipo de cambio|clima|temperatura|qu[eé] hora|huso horario|enchufes?|propinas?|'
+    r'visas?|vacunas?|idioma|voltaje|cu[aá]nto cuesta|cu[aá]nto sale)\b'
+)
+# Una pregunta breve es corta; si es larga, pide más que un dato
+MAX_CARACTERES_BREVE = 90
+
+
+def clasificar_pregunta(pregunta):
+    """
+    Tipo de pregunta para elegir el largo de la respuesta.
+
+    Returns:
+        str: TIPO_ITINERARIO, TIPO_BREVE o TIPO_NORMAL
+    """
+    texto = pregunta.lower()
+    if _PATRON_ITINERARIO.search(texto):
+        return TIPO_ITINERARIO
+    if len(texto) <= MAX_CARACTERES_BREVE and _PATRON_BREVE.search(texto):
+        return TIPO_BREVE
+    return TIPO_NORMAL
+
+
+# ============================================
+# CONTEO DE TOKENS
+# ============================================
+
+class ContadorTokens:
+    """
+    Estima tokens por la cantidad de caracteres. La proporción empieza en
+    ~4 caracteres por token (texto en español) y se ajusta con los tokens
+    reales de cada respuesta de Gemini (media móvil exponencial).
+    """
+
+    # Límites razonables de la proporción (descarta mediciones absurdas)
+    MINIMO = 2.0
+    MAXIMO = 8.0
+
+    def __init__(self, caracteres_por_token=4.0, suavizado=0.1):
+        self.caracteres_por_token = caracteres_por_token
+        self.suavizado = suavizado
+        self.mediciones = 0
+        self._lock = threading.Lock()
+
+    def contar(self, texto):
+        """Tokens estimados de un texto."""
+        if not texto:
+            return 0
+        return max(1, round(len(texto) / self.caracteres_por_token))
+
+    def caracteres(self, tokens):
+        """Caracteres que entran aproximadamente en `tokens`."""
+        return max(0, int(tokens * self.caracteres_por_token))
+
+    def calibrar(self, caracteres, tokens):
+        """Ajusta la proporción con una medición real (caracteres enviados, tokens informados)."""
+        if caracteres <= 0 or tokens <= 0:
+            return
+        proporcion = min(self.MAXIMO, max(self.MINIMO, caracteres / tokens))
+        with self._lock:
+            self.caracteres_por_token += self.suavizado * (proporcion - self.caracteres_por_token)
+            self.mediciones += 1
+
+
+contador = ContadorTokens()
+
+
+def contar_tokens(texto):
+    """Tokens estimados de un texto (con la proporción calibrada)."""
+    return contador.contar(texto)
+
+
+def recortar_contexto(texto, max_tokens):
+    """
+    Recorta un contexto de varias líneas a `max_tokens`, descartando primero
+    las líneas más viejas (las primeras). Devuelve '' si no entra nada útil.
+    """
+    if contador.contar(texto) <= max_tokens:
+        return texto
+    if max_tokens < MIN_TOKENS_SECCION:
+        return ''
+    lineas = texto.split('\n')
+    while len(lineas) > 1 and contador.contar('\n'.join(lineas)) > max_tokens:
+        lineas.pop(0)
+    texto = '\n'.join(lineas)
+    maximo = contador.caracteres(max_tokens)
+    if len(texto) > maximo:
+        texto = texto[:max(0, maximo - 1)].rsplit(' ', 1)[0] + '…'
+    return texto
+
+
+# ============================================
+# ARMADO DEL PROMPT
+# ============================================
+
+# texto: la parte variable del prompt (sin INSTRUCCION_SISTEMA); config: GenerationConfig;
+# tipo: tipo de pregunta; tokens: { sección: tokens estimados } (incluye 'total')
+Prompt = namedtuple('Prompt', ['texto', 'config', 'tipo', 'tokens'])
+
+
+class PlantillaPrompt:
+    """
+    Plantilla del prompt: las partes fijas se arman una vez y por consulta
+    solo se agregan las secciones de contexto que entran en el presupuesto.
+    El prefijo cuenta para el presupuesto aunque viaje como system_instruction.
+    """
+
+    def __init__(self, presupuesto=PROMPT_MAX_INPUT_TOKENS):
+        self.presupuesto = presupuesto
+        self.prefijo = INSTRUCCION_SISTEMA
+        self.cierres = {tipo: f"{CIERRE}{indicacion}" for tipo, indicacion in INDICACIONES.items()}
+        # Caracteres de las partes fijas por tipo (los tokens dependen de la calibración)
+        self.caracteres_fijos = {tipo: len(self.prefijo) + len(cierre) for tipo, cierre in self.cierres.items()}
+
+    def armar(self, pregunta, secciones):
+        """
+        Args:
+            pregunta: Pregunta ya sanitizada
+            secciones: [(nombre, encabezado, texto)] de mayor a menor prioridad.
+                       Una sección que no entra completa se recorta (se
+                       descartan sus primeras líneas) o se omite.
+
+        Returns:
+            Prompt
+        """
+        tipo = clasificar_pregunta(pregunta)
+        cierre = self.cierres[tipo]
+        tokens = {
+            'plantilla': round(self.caracteres_fijos[tipo] / contador.caracteres_por_token),
+            'pregunta': contador.contar(pregunta)
+        }
+        disponibles = self.presupuesto - tokens['plantilla'] - tokens['pregunta']
+
+        contexto = []
+        for nombre, encabezado, texto in secciones:
+            if not texto:
+                continue
+            texto = f"{encabezado}{texto}"
+            cantidad = contador.contar(texto)
+            if cantidad > disponibles:
+                texto = recortar_contexto(texto[len(encabezado):], disponibles - contador.contar(encabezado))
+                if not texto:
+                    continue
+                texto = f"{encabezado}{texto}"
+                cantidad = contador.contar(texto)
+            tokens[nombre] = cantidad
+            disponibles -= cantidad
+            contexto.append(texto)
+
+        partes = []
+        if contexto:
+            partes.append("Contexto:\n" + "\n".join(contexto))
+        partes.append(f"Pregunta: {pregunta}")
+        partes.append(cierre)
+        tokens['total'] = sum(tokens.values())
+        logger.debug('Prompt %s: %s tokens estimados', tipo, tokens)
+        return Prompt("\n\n".join(partes), CONFIGURACIONES[tipo], tipo, tokens)
+
+
+plantilla = PlantillaPrompt()
+
+
+def registrar_uso(prompt, response):
+    """
+    Registra los tokens reales de una respuesta de Gemini: contadores
+    totales, histogramas por tipo de pregunta y calibración del contador.
+    """
+    registrar_uso_gemini(response)
+    uso = getattr(response, 'usage_metadata', None)
+    if not uso:
+        return
+    entrada = getattr(uso, 'prompt_token_count', 0) or 0
+    salida = getattr(uso, 'candidates_token_count', 0) or 0
+    logger.debug(
+        'Tokens Gemini (%s): entrada %d (estimados %d), salida %d de %d',
+        prompt.tipo, entrada, prompt.tokens['total'], salida, prompt.config.max_output_tokens
+    )
+    if entrada:
+        # Los tokens de entrada incluyen la instrucción de sistema (y la caché de contexto)
+        contador.calibrar(len(INSTRUCCION_SISTEMA) + len(prompt.texto), entrada)
+        observar('viajeia_gemini_tokens', entrada, limites=BUCKETS_TOKENS, direccion='entrada', tipo=prompt.tipo)
+    if salida:
+        observar('viajeia_gemini_tokens', salida, limites=BUCKETS_TOKENS, direccion='salida', tipo=prompt.tipo)
+        if salida >= prompt.config.max_output_tokens:
+            # La respuesta se cortó por el límite: señal de que el presupuesto del tipo es corto
+            incrementar('viajeia_gemini_respuestas_cortadas_total', tipo=prompt.tipo)
@@ -12,9 +12,15 @@ para prevenir abuso y uso excesivo del servicio.
 - Asegura que todos los usuarios tengan acceso justo
 """
 
-from datetime import datetime, timedelta
-from collections import defaultdict
+import math
+import os
+import sqlite3
+import threading
 import time
+import uuid
+from collections import OrderedDict
+
+from metricas import incrementar
 
 # ============================================
 # CONFIGURACIÓN DE LÍMITES
@@ -30,54 +36,449 @@ REQUESTS_PER_HOUR = 30
 # Límite por día (límite diario)
 REQUESTS_PER_DAY = 100
 
+# Ventanas que se verifican, en orden: (tipo, duración en segundos, límite)
+VENTANAS = (
+    ('minute', 60, REQUESTS_PER_MINUTE),
+    ('hour', 3600, REQUESTS_PER_HOUR),
+    ('day', 86400, REQUESTS_PER_DAY),
+)
+
+# GET /api/destino tiene su propio cupo, aparte del de planificación: sus
+# respuestas salen casi siempre de la caché y no pasan por Gemini, y abrir el
+# panel no debe gastar consultas a Alex. Solo frena a quien recorre el índice.
+DESTINO_REQUESTS_PER_MINUTE = 30
+DESTINO_REQUESTS_PER_HOUR = 300
+
+VENTANAS_DESTINO = (
+    ('minute', 60, DESTINO_REQUESTS_PER_MINUTE),
+    ('hour', 3600, DESTINO_REQUESTS_PER_HOUR),
+)
+
+# Máximo de usuarios que se recuerdan a la vez (se olvidan los inactivos hace más tiempo)
+MAX_USUARIOS = int(os.getenv('RATE_LIMIT_MAX_USERS', '100000'))
+
 # ============================================
-# ALMACENAMIENTO EN MEMORIA
+# ALMACENAMIENTO
 # ============================================
-# En producción, deberías usar Redis o una base de datos
-# Para este ejemplo, usamos un diccionario en memoria
-
-# Estructura: { user_id: { 'minute': [...timestamps], 'hour': [...], 'day': [...] } }
-user_requests = defaultdict(lambda: {
-    'minute': [],
-    'hour': [],
-    'day': []
-})
-
-
-def limpiar_requests_antiguas(user_id):
-    """
-    Limpia las timestamps antiguas que ya no cuentan para los límites.
-    Esto previene que la memoria crezca indefinidamente.
-    """
-    ahora = time.time()
-    requests = user_requests[user_id]
-    
-    # Limpiar requests de hace más de 1 minuto
-    requests['minute'] = [
-        ts for ts in requests['minute'] 
-        if ahora - ts < 60
-    ]
-    
-    # Limpiar requests de hace más de 1 hora
-    requests['hour'] = [
-        ts for ts in requests['hour'] 
-        if ahora - ts < 3600
-    ]
-    
-    # Limpiar requests de hace más de 1 día
-    requests['day'] = [
-        ts for ts in requests['day'] 
-        if ahora - ts < 86400
-    ]
+# El estado puede vivir en:
+#   - 'memoria': diccionario del proceso (un solo worker)
+#   - 'sqlite':  archivo compartido por todos los workers de un mismo servidor
+#   - 'redis':   servidor Redis compartido por varios servidores
+# Se elige con RATE_LIMIT_BACKEND.
+
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memoria')
+RATE_LIMIT_SQLITE_PATH = os.getenv('RATE_LIMIT_SQLITE_PATH', 'rate_limit.sqlite3')
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+
+# En SQLite y Redis, para saber si un usuario llegó a un límite de N consultas
+# basta con mirar su N-ésima consulta más reciente: si está dentro de la
+# ventana, ya hizo N. Por eso se leen solo las últimas marcas de tiempo que
+# pide el mayor de los límites. En memoria se usan contadores (ver
+# ContadorDeslizante), que ocupan lo mismo sin importar el límite.
+_MAX_MARCAS = max(limite for _, _, limite in VENTANAS + VENTANAS_DESTINO)
+_VENTANA_MAS_LARGA = max(duracion for _, duracion, _ in VENTANAS + VENTANAS_DESTINO)
+
+_NOMBRES_VENTANA = {'minute': 'minuto', 'hour': 'hora', 'day': 'día'}
+
+
+def _evaluar(marcas, ahora, cantidad=1, ventanas=VENTANAS):
+    """
+    Calcula el resultado de la verificación a partir de las marcas de un usuario
+    (ordenadas de la más antigua a la más reciente).
+    `cantidad` es el número de consultas que se quieren hacer de una vez.
+    """
+    for tipo, duracion, limite in ventanas:
+        # Caben `cantidad` consultas más si la número `limite - cantidad + 1`
+        # contando desde la más reciente ya salió de la ventana
+        posicion = limite - cantidad + 1
+        if posicion <= 0 or (len(marcas) >= posicion and ahora - marcas[-posicion] < duracion):
+            # Calcular cuánto tiempo falta para el siguiente request permitido
+            retry_after = duracion if posicion <= 0 else int(duracion - (ahora - marcas[-posicion]))
+            return {
+                'allowed': False,
+                'reason': f'Has alcanzado el límite de {limite} consultas por {_NOMBRES_VENTANA[tipo]}',
+                'retry_after': retry_after,
+                'limit_type': tipo
+            }
+
+    # Si pasa todas las verificaciones, permitir el request
+    return {
+        'allowed': True,
+        'reason': None,
+        'retry_after': 0,
+        'limit_type': None
+    }
+
+
+def _contar_en_ventana(marcas, ahora, duracion):
+    """Cuenta las marcas dentro de una ventana (las más recientes están al final)."""
+    cantidad = 0
+    for ts in reversed(marcas):
+        if ahora - ts >= duracion:
+            break
+        cantidad += 1
+    return cantidad
+
+
+class ContadorDeslizante:
+    """
+    Consultas de un usuario con memoria O(1): para cada ventana de `ventanas`,
+    cuántas hizo en el tramo fijo actual (el minuto, la hora o el día en
+    curso) y cuántas en el anterior.
+
+    Las consultas de la ventana deslizante se estiman suponiendo que las del
+    tramo anterior se repartieron parejas: si pasó el 25% del minuto actual,
+    cuenta el 75% de las del minuto anterior más las del actual. Es la
+    misma aproximación de "sliding window counter" de los CDN; nunca deja
+    pasar más de lo que permite la ventana exacta en tráfico parejo.
+    """
+
+    __slots__ = ('ventanas', 'ultima', 'cuentas')
+
+    def __init__(self, ventanas=VENTANAS):
+        self.ventanas = ventanas
+        self.ultima = 0.0  # Última consulta registrada (para olvidar a los inactivos)
+        # Por ventana: [número del tramo actual, consultas en él, consultas en el anterior]
+        self.cuentas = [[0, 0, 0] for _ in ventanas]
+
+    @staticmethod
+    def _estimar(cuenta, duracion, ahora):
+        """
+        Pasa el contador de una ventana al tramo de `ahora` y devuelve las
+        consultas estimadas en la ventana deslizante que termina en `ahora`.
+        """
+        posicion = ahora / duracion
+        tramo = posicion // 1
+        if tramo != cuenta[0]:
+            cuenta[:] = [tramo, 0, cuenta[1] if tramo == cuenta[0] + 1 else 0]
+        return cuenta[2] * (1 + tramo - posicion) + cuenta[1]
+
+    def contar(self, ahora):
+        """{ tipo de ventana: consultas estimadas }"""
+        return {
+            tipo: math.ceil(round(self._estimar(cuenta, duracion, ahora), 9))
+            for (tipo, duracion, _), cuenta in zip(self.ventanas, self.cuentas)
+        }
+
+    def evaluar(self, ahora, cantidad=1):
+        """Igual que _evaluar, con los contadores en lugar de las marcas."""
+        for (tipo, duracion, limite), cuenta in zip(self.ventanas, self.cuentas):
+            # Los dos tramos completos son una cota de la estimación (aunque estén viejos):
+            # si con ellos alcanza, no hace falta calcularla
+            if cuenta[1] + cuenta[2] + cantidad <= limite:
+                continue
+            if self._estimar(cuenta, duracion, ahora) + cantidad <= limite + 1e-9:
+                continue
+            inicio, actuales, anteriores = cuenta[0] * duracion, cuenta[1], cuenta[2]
+            if cantidad > limite:
+                espera = duracion
+            elif actuales + cantidad <= limite:
+                # Alcanza con que pese menos el tramo anterior
+                espera = inicio + duracion * (1 - (limite - actuales - cantidad) / anteriores) - ahora
+            else:
+                # Hay que esperar al tramo siguiente y a que pese menos el actual
+                espera = inicio + duracion * (2 - (limite - cantidad) / actuales) - ahora
+            return {
+                'allowed': False,
+                'reason': f'Has alcanzado el límite de {limite} consultas por {_NOMBRES_VENTANA[tipo]}',
+                'retry_after': max(1, math.ceil(espera)),
+                'limit_type': tipo
+            }
+        return {
+            'allowed': True,
+            'reason': None,
+            'retry_after': 0,
+            'limit_type': None
+        }
+
+    def registrar(self, ahora, cantidad=1):
+        """Suma `cantidad` consultas en `ahora` (después de evaluar)."""
+        for (_, duracion, _), cuenta in zip(self.ventanas, self.cuentas):
+            self._estimar(cuenta, duracion, ahora)
+            cuenta[1] += cantidad
+        self.ultima = max(self.ultima, ahora)
+
+    def descontar(self, reserva):
+        """Resta la consulta registrada en `reserva`, si su tramo todavía cuenta."""
+        for (_, duracion, _), cuenta in zip(self.ventanas, self.cuentas):
+            tramo = reserva // duracion
+            if tramo == cuenta[0] and cuenta[1] > 0:
+                cuenta[1] -= 1
+            elif tramo == cuenta[0] - 1 and cuenta[2] > 0:
+                cuenta[2] -= 1
+
+
+class AlmacenLimites:
+    """
+    Interfaz de almacenamiento de las consultas de cada usuario.
+
+    `reservar` verifica y registra en una sola operación atómica: dos requests
+    simultáneos del mismo usuario no pueden pasar ambos el último cupo.
+    `ventanas` son los límites que se aplican (VENTANAS o VENTANAS_DESTINO);
+    cada juego de límites usa sus propios user_id. Los almacenes que guardan marcas de tiempo solo implementan `marcas`;
+    `verificar` y `contar` se calculan a partir de ellas.
+    """
+
+    def marcas(self, user_id, ahora):
+        """Últimas marcas de tiempo del usuario (de la más antigua a la más reciente)."""
+        raise NotImplementedError
+
+    def verificar(self, user_id, ahora, ventanas=VENTANAS):
+        """Resultado de _evaluar para una consulta más, sin registrarla."""
+        return _evaluar(self.marcas(user_id, ahora), ahora, 1, ventanas)
+
+    def contar(self, user_id, ahora, ventanas=VENTANAS):
+        """{ tipo de ventana: consultas del usuario en ella }"""
+        marcas = self.marcas(user_id, ahora)
+        return {tipo: _contar_en_ventana(marcas, ahora, duracion) for tipo, duracion, _ in ventanas}
+
+    def reservar(self, user_id, ahora, cantidad=1, ventanas=VENTANAS):
+        """
+        Verifica los límites y, si está permitido, registra `cantidad` consultas.
+
+        Returns:
+            tuple: (resultado de _evaluar, lista con una reserva por consulta o None)
+        """
+        raise NotImplementedError
+
+    def liberar(self, user_id, reserva):
+        """Deshace una reserva (la consulta falló y no debe contar)."""
+        raise NotImplementedError
+
+
+class AlmacenMemoria(AlmacenLimites):
+    """
+    Estado en un diccionario del proceso.
+
+    Estructura: { user_id: ContadorDeslizante } ordenado de menos a más
+    reciente por última actividad.
+    """
+
+    def __init__(self, max_usuarios=MAX_USUARIOS):
+        self.max_usuarios = max_usuarios
+        self.user_requests = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _barrer_inactivos(self, ahora):
+        """
+        Olvida a los usuarios cuya última consulta ya no cuenta para ningún límite,
+        y a los menos activos si se supera max_usuarios.
+        Esto evita que la memoria crezca indefinidamente. Debe llamarse con el lock tomado.
+        """
+        while self.user_requests:
+            user_id = next(iter(self.user_requests))
+            contador = self.user_requests[user_id]
+            # El tramo anterior de la ventana más larga todavía pesa hasta dos ventanas después
+            if ahora - contador.ultima < 2 * _VENTANA_MAS_LARGA and len(self.user_requests) <= self.max_usuarios:
+                break
+            del self.user_requests[user_id]
+
+    def verificar(self, user_id, ahora, ventanas=VENTANAS):
+        with self._lock:
+            self._barrer_inactivos(ahora)
+            contador = self.user_requests.get(user_id) or ContadorDeslizante(ventanas)
+            return contador.evaluar(ahora)
+
+    def contar(self, user_id, ahora, ventanas=VENTANAS):
+        with self._lock:
+            self._barrer_inactivos(ahora)
+            contador = self.user_requests.get(user_id)
+            return contador.contar(ahora) if contador else {tipo: 0 for tipo, _, _ in ventanas}
+
+    def reservar(self, user_id, ahora, cantidad=1, ventanas=VENTANAS):
+        with self._lock:
+            contador = self.user_requests.get(user_id) or ContadorDeslizante(ventanas)
+            resultado = contador.evaluar(ahora, cantidad)
+            if resultado['allowed']:
+                contador.registrar(ahora, cantidad)
+                # Nuevo o no, el usuario pasa al final: es el de actividad más reciente
+                self.user_requests[user_id] = contador
+                self.user_requests.move_to_end(user_id)
+            self._barrer_inactivos(ahora)
+            return resultado, ([ahora] * cantidad if resultado['allowed'] else None)
+
+    def liberar(self, user_id, reserva):
+        with self._lock:
+            contador = self.user_requests.get(user_id)
+            if contador is not None:
+                contador.descontar(reserva)
+
+
+class AlmacenSQLite(AlmacenLimites):
+    """
+    Estado en un archivo SQLite, compartido por todos los procesos del servidor
+    (por ejemplo, los workers de gunicorn).
+
+    La reserva corre dentro de una transacción BEGIN IMMEDIATE, que toma el
+    bloqueo de escritura antes de leer: verificar y registrar es atómico.
+    """
+
+    def __init__(self, ruta=RATE_LIMIT_SQLITE_PATH):
+        self.ruta = ruta
+        self._local = threading.local()
+        self._operaciones = 0
+        conexion = self._conexion()
+        conexion.execute('PRAGMA journal_mode=WAL')
+        conexion.execute(
+            'CREATE TABLE IF NOT EXISTS rate_limit (user_id TEXT NOT NULL, ts REAL NOT NULL)'
+        )
+        conexion.execute(
+            'CREATE INDEX IF NOT EXISTS rate_limit_user_ts ON rate_limit (user_id, ts)'
+        )
+        # No dejar conexiones abiertas heredables si gunicorn hace fork después (preload_app)
+        conexion.close()
+        self._local.conexion = None
+
+    def _conexion(self):
+        """Una conexión por hilo (sqlite3 no comparte conexiones entre hilos)."""
+        conexion = getattr(self._local, 'conexion', None)
+        if conexion is None:
+            conexion = sqlite3.connect(self.ruta, timeout=5, isolation_level=None)
+            conexion.execute('PRAGMA busy_timeout=5000')
+            self._local.conexion = conexion
+        return conexion
+
+    def _leer_marcas(self, conexion, user_id, ahora):
+        filas = conexion.execute(
+            'SELECT ts FROM rate_limit WHERE user_id = ? AND ts > ? ORDER BY ts DESC LIMIT ?',
+            (user_id, ahora - _VENTANA_MAS_LARGA, _MAX_MARCAS)
+        ).fetchall()
+        return [ts for (ts,) in reversed(filas)]
+
+    def marcas(self, user_id, ahora):
+        return self._leer_marcas(self._conexion(), user_id, ahora)
+
+    def reservar(self, user_id, ahora, cantidad=1, ventanas=VENTANAS):
+        conexion = self._conexion()
+        conexion.execute('BEGIN IMMEDIATE')
+        try:
+            resultado = _evaluar(self._leer_marcas(conexion, user_id, ahora), ahora, cantidad, ventanas)
+            if resultado['allowed']:
+                conexion.executemany(
+                    'INSERT INTO rate_limit (user_id, ts) VALUES (?, ?)',
+                    [(user_id, ahora)] * cantidad
+                )
+
+            # De vez en cuando, borrar lo que ya no cuenta para ningún límite
+            self._operaciones += 1
+            if self._operaciones % 1000 == 0:
+                conexion.execute('DELETE FROM rate_limit WHERE ts <= ?', (ahora - _VENTANA_MAS_LARGA,))
+
+            conexion.execute('COMMIT')
+        except Exception:
+            conexion.execute('ROLLBACK')
+            raise
+        return resultado, ([ahora] * cantidad if resultado['allowed'] else None)
+
+    def liberar(self, user_id, reserva):
+        self._conexion().execute(
+            'DELETE FROM rate_limit WHERE rowid IN '
+            '(SELECT rowid FROM rate_limit WHERE user_id = ? AND ts = ? LIMIT 1)',
+            (user_id, reserva)
+        )
+
+
+class AlmacenRedis(AlmacenLimites):
+    """
+    Estado en Redis (un sorted set por usuario), compartido entre servidores.
+
+    La reserva usa WATCH/MULTI: si otro proceso modifica las marcas del usuario
+    entre la lectura y la escritura, la transacción se reintenta.
+    Funciona con cualquier servidor que hable el protocolo de Redis
+    (por ejemplo, fakeredis para pruebas locales).
+
+    Args:
+        cliente: Cliente redis ya creado; si no se pasa, se conecta a `url`
+        url: URL de conexión (redis://host:puerto/db)
+        prefijo: Prefijo de las claves
+    """
+
+    def __init__(self, cliente=None, url=RATE_LIMIT_REDIS_URL, prefijo='viajeia:rate:'):
+        if cliente is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise RuntimeError('RATE_LIMIT_BACKEND=redis requiere el paquete "redis" (pip install redis)') from e
+            cliente = redis.Redis.from_url(url)
+        self.cliente = cliente
+        self.prefijo = prefijo
+
+    def _clave(self, user_id):
+        return f'{self.prefijo}{user_id}'
+
+    def _leer_marcas(self, origen, clave, ahora):
+        filas = origen.zrevrangebyscore(
+            clave, '+inf', f'({ahora - _VENTANA_MAS_LARGA}',
+            start=0, num=_MAX_MARCAS, withscores=True
+        )
+        return [ts for _, ts in reversed(filas)]
+
+    def marcas(self, user_id, ahora):
+        return self._leer_marcas(self.cliente, self._clave(user_id), ahora)
+
+    def reservar(self, user_id, ahora, cantidad=1, ventanas=VENTANAS):
+        from redis.exceptions import WatchError
+
+        clave = self._clave(user_id)
+        miembros = [f'{ahora:.6f}:{uuid.uuid4().hex[:8]}' for _ in range(cantidad)]
+        with self.cliente.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(clave)
+                    resultado = _evaluar(self._leer_marcas(pipe, clave, ahora), ahora, cantidad, ventanas)
+                    if not resultado['allowed']:
+                        pipe.unwatch()
+                        return resultado, None
+
+                    pipe.multi()
+                    pipe.zremrangebyscore(clave, '-inf', ahora - _VENTANA_MAS_LARGA)
+                    pipe.zadd(clave, {miembro: ahora for miembro in miembros})
+                    pipe.expire(clave, _VENTANA_MAS_LARGA)
+                    pipe.execute()
+                    return resultado, miembros
+                except WatchError:
+                    continue
+
+    def liberar(self, user_id, reserva):
+        self.cliente.zrem(self._clave(user_id), reserva)
+
+
+def crear_almacen(tipo=RATE_LIMIT_BACKEND):
+    """
+    Crea el almacenamiento configurado ('memoria', 'sqlite' o 'redis').
+    """
+    if tipo == 'memoria':
+        return AlmacenMemoria()
+    if tipo == 'sqlite':
+        return AlmacenSQLite()
+    if tipo == 'redis':
+        return AlmacenRedis()
+    raise ValueError(f'RATE_LIMIT_BACKEND desconocido: {tipo}')
+
+
+almacen = crear_almacen()
+
+
+def configurar_almacen(nuevo_almacen):
+    """Reemplaza el almacenamiento (útil para pruebas o configuración manual)."""
+    global almacen
+    almacen = nuevo_almacen
+
+
+def _contar_rechazo(resultado):
+    """Cuenta los rechazos (429) en las métricas, por tipo de límite."""
+    if not resultado['allowed']:
+        incrementar('viajeia_rate_limit_rechazos_total', limite=resultado['limit_type'])
+    return resultado
 
 
 def verificar_limite(user_id):
     """
     Verifica si un usuario puede hacer una consulta.
-    
+
     Args:
         user_id: ID del usuario (puede ser email, IP, o UID de Firebase)
-    
+
     Returns:
         dict: {
             'allowed': bool,
@@ -85,77 +486,86 @@ def verificar_limite(user_id):
             'retry_after': int (segundos para esperar)
         }
     """
-    # Limpiar requests antiguas primero
-    limpiar_requests_antiguas(user_id)
-    
-    ahora = time.time()
-    requests = user_requests[user_id]
-    
-    # Verificar límite por minuto
-    if len(requests['minute']) >= REQUESTS_PER_MINUTE:
-        # Calcular cuánto tiempo falta para el siguiente request permitido
-        tiempo_mas_antiguo = min(requests['minute'])
-        retry_after = int(60 - (ahora - tiempo_mas_antiguo))
-        return {
-            'allowed': False,
-            'reason': f'Has alcanzado el límite de {REQUESTS_PER_MINUTE} consultas por minuto',
-            'retry_after': retry_after,
-            'limit_type': 'minute'
-        }
-    
-    # Verificar límite por hora
-    if len(requests['hour']) >= REQUESTS_PER_HOUR:
-        tiempo_mas_antiguo = min(requests['hour'])
-        retry_after = int(3600 - (ahora - tiempo_mas_antiguo))
-        return {
-            'allowed': False,
-            'reason': f'Has alcanzado el límite de {REQUESTS_PER_HOUR} consultas por hora',
-            'retry_after': retry_after,
-            'limit_type': 'hour'
-        }
-    
-    # Verificar límite por día
-    if len(requests['day']) >= REQUESTS_PER_DAY:
-        tiempo_mas_antiguo = min(requests['day'])
-        retry_after = int(86400 - (ahora - tiempo_mas_antiguo))
-        return {
-            'allowed': False,
-            'reason': f'Has alcanzado el límite de {REQUESTS_PER_DAY} consultas por día',
-            'retry_after': retry_after,
-            'limit_type': 'day'
-        }
-    
-    # Si pasa todas las verificaciones, permitir el request
-    return {
-        'allowed': True,
-        'reason': None,
-        'retry_after': 0,
-        'limit_type': None
-    }
+    return _contar_rechazo(almacen.verificar(user_id, time.time()))
 
 
 def registrar_request(user_id):
     """
     Registra que un usuario hizo una consulta.
     Esto debe llamarse DESPUÉS de verificar que está permitido.
-    
+    Para verificar y registrar sin carreras entre requests, usar reservar_request.
+
+    Args:
+        user_id: ID del usuario
+    """
+    almacen.reservar(user_id, time.time())
+
+
+def reservar_request(user_id):
+    """
+    Verifica los límites y registra la consulta en una sola operación atómica.
+    Si la consulta falla después, se debe llamar a liberar_request con la reserva.
+
     Args:
         user_id: ID del usuario
+
+    Returns:
+        dict: Igual que verificar_limite, más 'reserva' (None si no está permitido)
+    """
+    resultado, reservas = almacen.reservar(user_id, time.time())
+    resultado['reserva'] = reservas[0] if reservas else None
+    return _contar_rechazo(resultado)
+
+
+def reservar_requests(user_id, cantidad):
+    """
+    Reserva varias consultas de una vez (por ejemplo, un lote de /api/planificar/batch)
+    en una sola operación atómica: se reservan todas o ninguna.
+    Cada consulta tiene su propia reserva, para poder devolver solo las que fallen.
+
+    Args:
+        user_id: ID del usuario
+        cantidad: Número de consultas
+
+    Returns:
+        dict: Igual que verificar_limite, más 'reservas' (lista, o None si no está permitido)
     """
-    ahora = time.time()
-    requests = user_requests[user_id]
-    
-    # Agregar timestamp a todas las listas
-    requests['minute'].append(ahora)
-    requests['hour'].append(ahora)
-    requests['day'].append(ahora)
+    resultado, reservas = almacen.reservar(user_id, time.time(), cantidad)
+    resultado['reservas'] = reservas
+    return _contar_rechazo(resultado)
+
+
+def _clave_destino(user_id):
+    """user_id del cupo de /api/destino (separado del de planificación)."""
+    return f'destino:{user_id}'
+
+
+def reservar_request_destino(user_id):
+    """
+    Verifica y registra una consulta GET /api/destino con su propio cupo
+    (VENTANAS_DESTINO), que no comparte con las consultas de planificación.
+    No se devuelve: la consulta cuenta aunque salga de la caché.
+
+    Returns:
+        dict: Igual que verificar_limite
+    """
+    resultado, _ = almacen.reservar(_clave_destino(user_id), time.time(), 1, VENTANAS_DESTINO)
+    return _contar_rechazo(resultado)
+
+
+def liberar_request(user_id, reserva):
+    """
+    Deshace una reserva hecha con reservar_request (la consulta no debe contar).
+    """
+    if reserva is not None:
+        almacen.liberar(user_id, reserva)
 
 
 def obtener_estadisticas(user_id):
     """
     Obtiene estadísticas de uso del usuario.
     Útil para mostrar al usuario cuántas consultas ha hecho.
-    
+
     Returns:
         dict: {
             'minute': int,
@@ -168,13 +578,12 @@ def obtener_estadisticas(user_id):
             }
         }
     """
-    limpiar_requests_antiguas(user_id)
-    requests = user_requests[user_id]
-    
+    cuentas = almacen.contar(user_id, time.time())
+
     return {
-        'minute': len(requests['minute']),
-        'hour': len(requests['hour']),
-        'day': len(requests['day']),
+        'minute': cuentas['minute'],
+        'hour': cuentas['hour'],
+        'day': cuentas['day'],
         'limits': {
             'minute': REQUESTS_PER_MINUTE,
             'hour': REQUESTS_PER_HOUR,
@@ -182,3 +591,13 @@ def obtener_estadisticas(user_id):
         }
     }
 
+
+def obtener_estadisticas_destino(user_id):
+    """
+    Consultas a /api/destino del usuario en cada ventana de VENTANAS_DESTINO.
+
+    Returns:
+        dict: { 'minute': int, 'hour': int, 'limits': { 'minute': int, 'hour': int } }
+    """
+    cuentas = almacen.contar(_clave_destino(user_id), time.time(), VENTANAS_DESTINO)
+    return {**cuentas, 'limits': {tipo: limite for tipo, _, limite in VENTANAS_DESTINO}}
@@ -12,8 +12,9 @@ datos antes de procesarlos, y detectar prompts peligrosos.
 - Valida datos antes de enviarlos a la IA
 """
 
+import os
 import re
-from typing import Dict, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 # ============================================
 # LISTA DE PALABRAS Y FRASES PELIGROSAS
@@ -63,6 +64,159 @@ PALABRAS_VIAJE = [
 ]
 
 
+# Archivo opcional con listas adicionales (una frase por línea, ver cargar_lista_bloqueo)
+SECURITY_BLOCKLIST_PATH = os.getenv('SECURITY_BLOCKLIST_PATH', '')
+
+# Categorías que reconoce el clasificador
+CATEGORIA_PELIGROSA = 'peligrosas'
+CATEGORIA_FUERA_DE_ALCANCE = 'fuera_de_alcance'
+CATEGORIA_VIAJE = 'viaje'
+
+# Patrones de sanitización y validación (compilados una sola vez)
+_PATRON_JAVASCRIPT = re.compile(r'javascript:', re.IGNORECASE)
+_PATRON_EVENTOS = re.compile(r'on\w+=', re.IGNORECASE)
+_PATRON_CARACTERES_DESTINO = re.compile(r'[<>{}[\]\\\/]')
+_PATRON_FECHA = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+
+
+class ClasificadorPrompt:
+    """
+    Busca todas las frases de varias categorías en un texto en una sola pasada.
+
+    Las frases se organizan en un trie y el trie se compila una vez como una
+    única expresión regular dentro de un lookahead `(?=(...))`: en cada posición
+    del texto solo se recorre el camino del trie que coincide con él, así que el
+    costo por consulta depende del largo del texto y no de cuántas frases haya.
+    Igual que la búsqueda por subcadenas que reemplaza, detecta coincidencias
+    superpuestas (por ejemplo, una frase dentro de otra).
+
+    Args:
+        categorias: { categoria: [frases] }. Se compara sin distinguir mayúsculas.
+    """
+
+    def __init__(self, categorias: Dict[str, Iterable[str]]):
+        # { frase: [(categoria, orden)] } con el orden original de cada lista
+        self._frases = {}
+        for categoria, frases in categorias.items():
+            for orden, frase in enumerate(frases):
+                frase = frase.strip().lower()
+                if frase:
+                    self._frases.setdefault(frase, []).append((categoria, orden))
+
+        # Si una frase contiene como prefijo a otra, el regex devuelve la más larga
+        # en esa posición: se precalculan también las categorías de sus prefijos
+        self._coincidencias = {
+            frase: sorted(
+                (categoria, orden, frase[:i])
+                for i in range(1, len(frase) + 1)
+                if frase[:i] in self._frases
+                for categoria, orden in self._frases[frase[:i]]
+            )
+            for frase in self._frases
+        }
+        self._patron = re.compile(f'(?=({self._compilar_trie()}))') if self._frases else None
+
+    def _compilar_trie(self) -> str:
+        """Convierte las frases en un regex con forma de trie (prefijos comunes factorizados)."""
+        trie = {}
+        for frase in self._frases:
+            nodo = trie
+            for caracter in frase:
+                nodo = nodo.setdefault(caracter, {})
+            nodo[''] = {}  # Fin de frase
+
+        def a_regex(nodo):
+            termina = '' in nodo
+            ramas = [re.escape(c) + a_regex(hijo) for c, hijo in sorted(nodo.items()) if c]
+            if not ramas:
+                return ''
+            cuerpo = ramas[0] if len(ramas) == 1 else '(?:' + '|'.join(ramas) + ')'
+            if termina:
+                # Se prueba primero la frase más larga; si no sigue, vale la que termina aquí
+                return f'(?:{cuerpo})?'
+            return cuerpo
+
+        return a_regex(trie)
+
+    def clasificar(self, texto: str) -> Dict[str, List[str]]:
+        """
+        Encuentra todas las frases presentes en el texto.
+
+        Returns:
+            Dict[str, List[str]]: { categoria: [frases encontradas] } solo con las
+            categorías que tuvieron coincidencias, en el orden original de cada lista
+        """
+        if not texto or self._patron is None:
+            return {}
+
+        encontradas = set()
+        for coincidencia in self._patron.finditer(texto.lower()):
+            encontradas.update(self._coincidencias[coincidencia.group(1)])
+
+        resultado = {}
+        for categoria, _, frase in sorted(encontradas):
+            resultado.setdefault(categoria, []).append(frase)
+        return resultado
+
+
+def cargar_lista_bloqueo(ruta: str) -> Dict[str, List[str]]:
+    """
+    Lee listas adicionales desde un archivo de texto.
+
+    Formato: una frase por línea; las líneas vacías y las que empiezan con '#'
+    se ignoran. Una línea `[categoria]` (peligrosas, fuera_de_alcance, viaje)
+    cambia la categoría de las frases siguientes; por defecto son 'peligrosas'.
+
+    Returns:
+        Dict[str, List[str]]: { categoria: [frases] }
+    """
+    categorias = {}
+    categoria = CATEGORIA_PELIGROSA
+    with open(ruta, encoding='utf-8') as archivo:
+        for linea in archivo:
+            linea = linea.strip()
+            if not linea or linea.startswith('#'):
+                continue
+            if linea.startswith('[') and linea.endswith(']'):
+                categoria = linea[1:-1].strip()
+                continue
+            categorias.setdefault(categoria, []).append(linea)
+    return categorias
+
+
+def crear_clasificador(ruta_lista_bloqueo: str = '') -> ClasificadorPrompt:
+    """
+    Construye el clasificador con las listas del módulo más las de un archivo opcional.
+    """
+    categorias = {
+        CATEGORIA_PELIGROSA: list(PALABRAS_PELIGROSAS),
+        CATEGORIA_FUERA_DE_ALCANCE: list(TEMAS_FUERA_DE_ALCANCE),
+        CATEGORIA_VIAJE: list(PALABRAS_VIAJE),
+    }
+    if ruta_lista_bloqueo:
+        for categoria, frases in cargar_lista_bloqueo(ruta_lista_bloqueo).items():
+            categorias.setdefault(categoria, []).extend(frases)
+    return ClasificadorPrompt(categorias)
+
+
+# Se compila una sola vez al importar el módulo
+clasificador = crear_clasificador(SECURITY_BLOCKLIST_PATH)
+
+
+def clasificar_prompt(prompt: str) -> Dict[str, List[str]]:
+    """
+    Clasifica un prompt en una sola pasada.
+
+    Args:
+        prompt: El prompt a analizar
+
+    Returns:
+        Dict[str, List[str]]: { categoria: [frases encontradas] },
+        por ejemplo { 'peligrosas': ['hackea'], 'viaje': ['hotel'] }
+    """
+    return clasificador.clasificar(prompt)
+
+
 def validar_pregunta(pregunta: str, min_length: int = 10, max_length: int = 500) -> Tuple[bool, str]:
     """
     Valida que una pregunta sea segura y apropiada.
@@ -108,25 +262,22 @@ def detectar_prompt_peligroso(prompt: str) -> Tuple[bool, str]:
     if not prompt:
         return False, 'El prompt está vacío'
     
-    prompt_lower = prompt.lower()
+    categorias = clasificar_prompt(prompt)
     
     # Verificar palabras peligrosas
-    for palabra in PALABRAS_PELIGROSAS:
-        if palabra.lower() in prompt_lower:
-            return False, f'El prompt contiene contenido no permitido: "{palabra}"'
+    peligrosas = categorias.get(CATEGORIA_PELIGROSA)
+    if peligrosas:
+        return False, f'El prompt contiene contenido no permitido: "{peligrosas[0]}"'
     
     # Verificar temas fuera de alcance (solo si el prompt es principalmente sobre esos temas)
-    palabras_prompt = prompt_lower.split()
-    palabras_temas_fuera = [tema for tema in TEMAS_FUERA_DE_ALCANCE if tema.lower() in prompt_lower]
-    
     # Si el prompt es corto y menciona temas fuera de alcance, rechazar
-    if palabras_temas_fuera and len(palabras_prompt) < 10:
+    if CATEGORIA_FUERA_DE_ALCANCE in categorias and len(prompt.split()) < 10:
         return False, 'Este asistente solo puede ayudarte con temas relacionados a viajes'
     
     # Verificar que el prompt esté relacionado con viajes (para prompts muy cortos)
-    tiene_relacion_viaje = any(palabra in prompt_lower for palabra in PALABRAS_VIAJE)
+    tiene_relacion_viaje = CATEGORIA_VIAJE in categorias
     
-    if len(prompt_lower) < 20 and not tiene_relacion_viaje:
+    if len(prompt) < 20 and not tiene_relacion_viaje:
         return False, 'Por favor, haz preguntas relacionadas con viajes y planificación'
     
     return True, ''
@@ -147,8 +298,8 @@ def sanitizar_texto(texto: str) -> str:
     
     # Remover caracteres peligrosos
     texto = texto.replace('<', '').replace('>', '')
-    texto = re.sub(r'javascript:', '', texto, flags=re.IGNORECASE)
-    texto = re.sub(r'on\w+=', '', texto, flags=re.IGNORECASE)
+    texto = _PATRON_JAVASCRIPT.sub('', texto)
+    texto = _PATRON_EVENTOS.sub('', texto)
     
     # Limitar longitud
     texto = texto[:1000]
@@ -178,7 +329,7 @@ def validar_destino(destino: str) -> Tuple[bool, str]:
         return False, 'El destino es demasiado largo'
     
     # Verificar caracteres peligrosos
-    if re.search(r'[<>{}[\]\\\/]', destino):
+    if _PATRON_CARACTERES_DESTINO.search(destino):
         return False, 'El destino contiene caracteres no permitidos'
     
     return True, ''
@@ -198,7 +349,7 @@ def validar_fecha(fecha: str) -> Tuple[bool, str]:
         return False, 'La fecha es obligatoria'
     
     # Validar formato
-    if not re.match(r'^\d{4}-\d{2}-\d{2}$', fecha):
+    if not _PATRON_FECHA.match(fecha):
         return False, 'Formato de fecha inválido'
     
     try:
@@ -0,0 +1,334 @@
+"""
+============================================
+CONVERSACIONES DEL LADO DEL SERVIDOR - VIAJEIA
+============================================
+
+Guarda el contexto de cada conversación (identificada por el
+conversacionId que genera el frontend), así cada consulta solo manda la
+pregunta nueva y no todo el historial.
+
+De cada conversación se guarda:
+- Un resumen de los turnos anteriores: una línea corta por turno
+  (pregunta y puntos clave de la respuesta). Cada turno nuevo agrega una
+  línea y, si el resumen pasa su presupuesto de tokens, se descartan las
+  más viejas; nunca se vuelve a procesar la conversación entera.
+- El último turno, con más detalle (es el que más importa para la
+  pregunta siguiente: "¿y para ir con niños?").
+
+El contexto que entra al prompt nunca supera SESSION_CONTEXT_TOKENS.
+
+¿Por qué es importante?
+- Las consultas pesan unos bytes en lugar de varios KB de historial
+- El modelo recibe contexto útil con un costo de tokens fijo
+- La memoria está acotada: máximo de conversaciones, LRU y vencimiento
+
+Con varios workers de gunicorn, las conversaciones también se guardan en
+la caché en disco (cache_disco.py, CACHE_DISK_PATH): la consulta siguiente
+puede caer en cualquier worker y encuentra el contexto. La memoria de cada
+proceso queda como una copia local para no leer el disco de más. Sin caché
+en disco (CACHE_DISK_PATH vacío) cada worker solo ve sus conversaciones.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from metricas import registro
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# Segundos sin actividad tras los que se olvida una conversación
+SESSION_TTL = int(os.getenv('SESSION_TTL', '7200'))  # 2 horas
+# Conversaciones que se guardan como mucho (se desaloja la usada hace más tiempo)
+SESSION_MAX_CONVERSATIONS = int(os.getenv('SESSION_MAX_CONVERSATIONS', '10000'))
+# Tokens que el contexto de la conversación puede ocupar en el prompt
+SESSION_CONTEXT_TOKENS = int(os.getenv('SESSION_CONTEXT_TOKENS', '300'))
+
+# Parte del presupuesto para el resumen; el resto es para el último turno
+FRACCION_RESUMEN = 0.6
+
+# Largo máximo de lo que se guarda del último turno (caracteres)
+MAX_PREGUNTA = 300
+MAX_RESPUESTA = 1200
+
+# Turnos que se toman de un historial enviado por el cliente
+MAX_TURNOS_HISTORIAL = 5
+
+# Espacio de las conversaciones en la caché en disco
+ESPACIO_DISCO = 'conversaciones'
+
+_PATRON_ID = re.compile(r'^[A-Za-z0-9_-]{8,64}$')
+# "» ALOJAMIENTO: Hoteles boutique..." -> "Hoteles boutique..."
+_PATRON_SECCION = re.compile(r'[A-ZÁÉÍÓÚÑ]{3}[A-ZÁÉÍÓÚÑ ]*:\s*(.+)')
+
+
+def estimar_tokens(texto):
+    """Aproximación de tokens de Gemini para texto en español (~4 caracteres por token)."""
+    return (len(texto) + 3) // 4
+
+
+def recortar(texto, max_caracteres):
+    """Recorta un texto en un límite de palabra, con '…' si se cortó."""
+    texto = ' '.join(texto.split())
+    if len(texto) <= max_caracteres:
+        return texto
+    corte = texto.rfind(' ', 0, max_caracteres)
+    return texto[:corte if corte > 0 else max_caracteres] + '…'
+
+
+def validar_conversacion_id(valor):
+    """El id de conversación si tiene un formato válido, o None."""
+    if isinstance(valor, str) and _PATRON_ID.match(valor):
+        return valor
+    return None
+
+
+def puntos_clave(respuesta, maximo=3, largo=60):
+    """
+    Lo esencial de una respuesta: el comienzo de las primeras secciones
+    del formato (alojamiento, comida, lugares...).
+    """
+    puntos = []
+    for linea in respuesta.splitlines():
+        seccion = _PATRON_SECCION.search(linea)
+        if seccion:
+            puntos.append(recortar(seccion.group(1).split('. ')[0].rstrip('.'), largo))
+            if len(puntos) == maximo:
+                break
+    if not puntos and respuesta.strip():
+        puntos.append(recortar(respuesta, largo * 2))
+    return puntos
+
+
+def condensar_turno(pregunta, respuesta):
+    """Una línea del resumen para un turno ya respondido."""
+    linea = f"- {recortar(pregunta, 120)}"
+    puntos = puntos_clave(respuesta)
+    if puntos:
+        linea += f" → {'; '.join(puntos)}"
+    return linea
+
+
+class Conversacion:
+    """Resumen acumulado y último turno de una conversación."""
+
+    __slots__ = ('resumen', 'tokens_resumen', 'ultimo_turno', 'turnos')
+
+    def __init__(self):
+        self.resumen = deque()  # Líneas de condensar_turno, de la más vieja a la más nueva
+        self.tokens_resumen = 0
+        self.ultimo_turno = None  # (pregunta, respuesta, línea para el resumen)
+        self.turnos = 0
+
+    def agregar_turno(self, pregunta, respuesta, presupuesto_resumen):
+        """
+        Pasa el último turno al resumen y guarda el nuevo.
+        Costo fijo por turno: una línea nueva y, si hace falta, se quitan las más viejas.
+        Un turno idéntico al último (doble clic o reintento) no se repite.
+        """
+        pregunta_corta, respuesta_corta = recortar(pregunta, MAX_PREGUNTA), recortar(respuesta, MAX_RESPUESTA)
+        if self.ultimo_turno is not None and self.ultimo_turno[:2] == (pregunta_corta, respuesta_corta):
+            return
+        if self.ultimo_turno is not None:
+            linea = self.ultimo_turno[2]
+            self.resumen.append(linea)
+            self.tokens_resumen += estimar_tokens(linea)
+            while self.tokens_resumen > presupuesto_resumen and self.resumen:
+                self.tokens_resumen -= estimar_tokens(self.resumen.popleft())
+        # La línea del resumen se arma ahora, con la respuesta completa (recortar une las líneas)
+        self.ultimo_turno = (pregunta_corta, respuesta_corta, condensar_turno(pregunta, respuesta))
+        self.turnos += 1
+
+    def contexto(self, presupuesto_tokens):
+        """Texto para el prompt, dentro de `presupuesto_tokens`."""
+        if self.ultimo_turno is None:
+            return ''
+        partes = []
+        if self.resumen:
+            partes.append("Antes:\n" + "\n".join(self.resumen))
+
+        # El último turno ocupa lo que deja el resumen
+        disponibles = max(0, presupuesto_tokens - self.tokens_resumen) * 4
+        pregunta, respuesta, _ = self.ultimo_turno
+        pregunta = recortar(pregunta, max(40, disponibles // 3))
+        partes.append(f"Última pregunta: {pregunta}")
+        largo_respuesta = disponibles - len(pregunta)
+        if largo_respuesta > 40 and respuesta:
+            partes.append(f"Última respuesta: {recortar(respuesta, largo_respuesta)}")
+        return "\n".join(partes)
+
+    def exportar(self):
+        """La conversación como dict JSON, para la caché en disco."""
+        return {
+            'resumen': list(self.resumen),
+            'tokens_resumen': self.tokens_resumen,
+            'ultimo_turno': self.ultimo_turno,
+            'turnos': self.turnos
+        }
+
+    @classmethod
+    def importar(cls, datos):
+        """Conversación guardada con exportar()."""
+        conversacion = cls()
+        conversacion.resumen = deque(datos['resumen'])
+        conversacion.tokens_resumen = datos['tokens_resumen']
+        conversacion.ultimo_turno = tuple(datos['ultimo_turno']) if datos['ultimo_turno'] else None
+        conversacion.turnos = datos['turnos']
+        return conversacion
+
+
+class AlmacenConversaciones:
+    """
+    Conversaciones en memoria con vencimiento por inactividad y desalojo LRU,
+    compartidas entre procesos a través de la caché en disco (si hay).
+
+    Args:
+        ttl: Segundos sin actividad tras los que se olvida una conversación
+        max_conversaciones: Máximo de conversaciones guardadas en memoria
+        presupuesto_tokens: Tokens del contexto que entra al prompt
+        disco: CacheDisco compartida por los workers (None = solo memoria)
+    """
+
+    def __init__(self, ttl=SESSION_TTL, max_conversaciones=SESSION_MAX_CONVERSATIONS,
+                 presupuesto_tokens=SESSION_CONTEXT_TOKENS, disco=None):
+        self.ttl = ttl
+        self.max_conversaciones = max_conversaciones
+        self.presupuesto_tokens = presupuesto_tokens
+        self.disco = disco
+        self._datos = OrderedDict()  # { id: (expira_en, Conversacion) }
+        self._lock = threading.Lock()
+
+        # Contadores
+        self.desalojos = 0
+        self.vencidas = 0
+        self.leidas_disco = 0
+
+    def usar_disco(self, disco):
+        """Comparte las conversaciones a través de la caché en disco (None = solo memoria)."""
+        self.disco = disco
+
+    def _leer_disco(self, conversacion_id):
+        """
+        La conversación guardada en disco por cualquier worker, o None.
+        Se llama sin el lock: es I/O.
+
+        Returns:
+            tuple: (Conversacion, vence_en en tiempo de reloj) o None
+        """
+        if self.disco is None:
+            return None
+        guardada = self.disco.leer(ESPACIO_DISCO, conversacion_id)
+        if guardada is None:
+            return None
+        datos, vence_en = guardada
+        try:
+            return Conversacion.importar(datos), vence_en
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _leer(self, conversacion_id, ahora, guardada=None):
+        """
+        La conversación vigente o None. Si la de disco (`guardada`) tiene más
+        turnos que la de memoria, la respondió otro worker: se usa esa.
+        Debe llamarse con el lock tomado.
+        """
+        entrada = self._datos.get(conversacion_id)
+        if entrada is not None and entrada[0] <= ahora:
+            del self._datos[conversacion_id]
+            self.vencidas += 1
+            entrada = None
+        if guardada is not None:
+            conversacion, vence_en = guardada
+            expira_en = vence_en - (time.time() - ahora)
+            if expira_en > ahora and (entrada is None or conversacion.turnos > entrada[1].turnos):
+                self._guardar(conversacion_id, conversacion, expira_en)
+                self.leidas_disco += 1
+                return conversacion
+        return None if entrada is None else entrada[1]
+
+    def _guardar(self, conversacion_id, conversacion, expira_en):
+        """Guarda en memoria y desaloja las más antiguas. Debe llamarse con el lock tomado."""
+        self._datos[conversacion_id] = (expira_en, conversacion)
+        self._datos.move_to_end(conversacion_id)
+        while len(self._datos) > self.max_conversaciones:
+            self._datos.popitem(last=False)
+            self.desalojos += 1
+
+    def contexto(self, conversacion_id):
+        """Contexto de la conversación para el prompt ('' si no existe o no tiene turnos)."""
+        guardada = self._leer_disco(conversacion_id)
+        with self._lock:
+            conversacion = self._leer(conversacion_id, time.monotonic(), guardada)
+            if conversacion is None:
+                return ''
+            return conversacion.contexto(self.presupuesto_tokens)
+
+    def registrar_turno(self, conversacion_id, pregunta, respuesta):
+        """Agrega un turno respondido a la conversación (la crea si no existe)."""
+        guardada = self._leer_disco(conversacion_id)
+        with self._lock:
+            ahora = time.monotonic()
+            conversacion = self._leer(conversacion_id, ahora, guardada)
+            if conversacion is None:
+                conversacion = Conversacion()
+            conversacion.agregar_turno(pregunta, respuesta, int(self.presupuesto_tokens * FRACCION_RESUMEN))
+            self._guardar(conversacion_id, conversacion, ahora + self.ttl)
+            datos = conversacion.exportar() if self.disco is not None else None
+        if datos is not None:
+            vence_en = time.time() + self.ttl
+            self.disco.guardar(ESPACIO_DISCO, conversacion_id, datos, vence_en, vence_en)
+
+    def sembrar(self, conversacion_id, preguntas):
+        """
+        Carga en una conversación las preguntas de un historial del cliente,
+        ya validadas. Las respuestas del cliente no se guardan: solo el
+        servidor escribe respuestas en la conversación.
+        """
+        for pregunta in preguntas[-MAX_TURNOS_HISTORIAL:]:
+            self.registrar_turno(conversacion_id, pregunta, '')
+
+    def __len__(self):
+        return len(self._datos)
+
+    def estadisticas(self):
+        """
+        Returns:
+            dict: { 'conversaciones', 'desalojos', 'vencidas', 'leidas_disco' }
+        """
+        with self._lock:
+            return {
+                'conversaciones': len(self._datos),
+                'desalojos': self.desalojos,
+                'vencidas': self.vencidas,
+                'leidas_disco': self.leidas_disco
+            }
+
+
+def resumir_historial(preguntas, presupuesto_tokens=SESSION_CONTEXT_TOKENS):
+    """
+    Contexto a partir de las preguntas (ya validadas) de un historial enviado
+    por el cliente, como mandaban las versiones anteriores del frontend.
+    """
+    conversacion = Conversacion()
+    for pregunta in preguntas[-MAX_TURNOS_HISTORIAL:]:
+        conversacion.agregar_turno(pregunta, '', int(presupuesto_tokens * FRACCION_RESUMEN))
+    return conversacion.contexto(presupuesto_tokens)
+
+
+conversaciones = AlmacenConversaciones()
+
+
+def _muestras_conversaciones():
+    """Conversaciones guardadas para /api/metrics."""
+    estadisticas = conversaciones.estadisticas()
+    return [
+        ('viajeia_conversaciones', 'gauge', {}, estadisticas['conversaciones']),
+        ('viajeia_conversaciones_desalojadas_total', 'counter', {}, estadisticas['desalojos']),
+    ]
+
+
+registro.agregar_colector(_muestras_conversaciones)
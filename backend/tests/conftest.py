@@ -0,0 +1,26 @@
+"""
+Configuración común de las pruebas (python -m pytest desde backend/).
+
+Los módulos del backend leen su configuración al importarse, así que el
+entorno se arma acá, antes de que ninguna prueba los importe: las APIs
+externas apuntan a los servidores falsos de benchmarks/ y nada se guarda
+en disco ni se precarga en segundo plano.
+"""
+
+import os
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+from benchmarks.servidores_falsos import ServidorFalso, perfiles  # noqa: E402
+
+servidor_falso = ServidorFalso(perfiles({'gemini': (5, 0), 'openweather': (1, 0), 'exchangerate': (1, 0),
+                                         'unsplash': (1, 0)})).iniciar()
+os.environ.update(servidor_falso.variables_entorno())
+os.environ.update({
+    'PREFETCH_ENABLED': 'false',
+    'RATE_LIMIT_BACKEND': 'memoria',
+    'FIREBASE_PROJECT_ID': '',
+    'LOG_LEVEL': 'ERROR',
+})
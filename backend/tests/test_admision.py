@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as errores_google
+
+from admision import ColaGemini, ServidorSaturado
+from autenticacion import CLASE_ANONIMO, CLASE_AUTENTICADO
+
+
+def cola(**opciones):
+    return ColaGemini(**{'max_concurrentes': 1, 'rpm': 0, 'tpm': 0, 'plazos': {
+        CLASE_AUTENTICADO: 30, CLASE_ANONIMO: 30
+    }, **opciones})
+
+
+def test_concede_hasta_la_capacidad_y_libera_una_vez():
+    gemini = cola(max_concurrentes=2)
+    uno = gemini.pedir('a', CLASE_ANONIMO, 100)
+    gemini.pedir('b', CLASE_ANONIMO, 100)
+    assert gemini.en_curso == 2
+    gemini.liberar(uno)
+    gemini.liberar(uno)
+    gemini.liberar(None)
+    assert gemini.en_curso == 1
+
+
+def test_equidad_entre_clientes():
+    gemini = cola()
+    ocupado = gemini.pedir('x', CLASE_ANONIMO, 100)
+    orden = []
+
+    def pedir(cliente):
+        turno = gemini.pedir(cliente, CLASE_ANONIMO, 100)
+        orden.append(cliente)
+        gemini.liberar(turno)
+
+    # El cliente 'a' manda tres consultas antes de que 'b' mande una
+    hilos = []
+    for cliente in ('a', 'a', 'a', 'b'):
+        hilos.append(threading.Thread(target=pedir, args=(cliente,)))
+        hilos[-1].start()
+        time.sleep(0.02)
+    gemini.liberar(ocupado)
+    for hilo in hilos:
+        hilo.join()
+    assert orden.index('b') < 2
+
+
+def test_rechaza_lo_que_no_llega_dentro_del_plazo():
+    gemini = cola(plazos={CLASE_AUTENTICADO: 30, CLASE_ANONIMO: 0.05})
+    gemini.pedir('x', CLASE_ANONIMO, 100)
+    with pytest.raises(ServidorSaturado) as error:
+        gemini.pedir('y', CLASE_ANONIMO, 100)
+    assert error.value.retry_after >= 1
+    assert gemini.estadisticas()['esperando'][CLASE_ANONIMO] == 0
+
+
+def test_cuota_agotada_pausa_la_cola():
+    gemini = cola(pausa_cuota=30, plazos={CLASE_AUTENTICADO: 1, CLASE_ANONIMO: 1})
+    turno = gemini.pedir('a', CLASE_AUTENTICADO, 100)
+    gemini.liberar(turno, error=errores_google.ResourceExhausted('cuota'))
+    assert gemini.estadisticas()['pausada']
+    with pytest.raises(ServidorSaturado):
+        gemini.pedir('a', CLASE_AUTENTICADO, 100)
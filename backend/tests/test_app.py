@@ -0,0 +1,101 @@
+import pytest
+from werkzeug.test import EnvironBuilder
+
+import app as servidor
+from rate_limiter import DESTINO_REQUESTS_PER_MINUTE, obtener_estadisticas, obtener_estadisticas_destino
+
+PREGUNTA = 'Qué lugares visitar en Roma en primavera'
+
+
+@pytest.fixture
+def cliente():
+    return servidor.app.test_client()
+
+
+def consultas_del_minuto(usuario_id):
+    return obtener_estadisticas(usuario_id)['minute']
+
+
+def test_consulta_exitosa_cuenta_para_el_rate_limit(cliente):
+    respuesta = cliente.post('/api/planificar', json={'pregunta': PREGUNTA, 'usuarioId': 'app-ok'})
+    assert respuesta.status_code == 200
+    assert respuesta.get_json()['respuesta']
+    assert consultas_del_minuto('app-ok') == 1
+
+
+@pytest.mark.parametrize('datos_viaje', ['Paris', ['Paris'], {'destino': 42}, {'fecha': ['2030-01-01']}])
+def test_datos_de_viaje_invalidos_no_ocupan_cupo(cliente, datos_viaje):
+    respuesta = cliente.post('/api/planificar', json={
+        'pregunta': PREGUNTA, 'datosViaje': datos_viaje, 'usuarioId': 'app-invalido'
+    })
+    assert respuesta.status_code == 400
+    assert consultas_del_minuto('app-invalido') == 0
+
+
+def test_cuerpo_que_no_es_objeto(cliente):
+    respuesta = cliente.post('/api/planificar', json=['pregunta'])
+    assert respuesta.status_code == 400
+
+
+def test_lote_solo_reserva_las_consultas_validas(cliente):
+    respuesta = cliente.post('/api/planificar/batch', json={'usuarioId': 'app-lote', 'items': [
+        {'pregunta': PREGUNTA},
+        {'pregunta': 'corta'},
+        {'pregunta': PREGUNTA, 'datosViaje': 'Roma'},
+    ]})
+    assert respuesta.status_code == 200
+    resultados = respuesta.get_json()['resultados']
+    assert [resultado.get('status') for resultado in resultados] == [None, 400, 400]
+    assert consultas_del_minuto('app-lote') == 1
+
+
+@pytest.mark.parametrize('zona', [['America/Lima'], {'zona': 'America/Lima'}, 42])
+def test_zona_horaria_que_no_es_texto_usa_la_por_defecto(cliente, zona):
+    respuesta = cliente.post('/api/planificar', json={
+        'pregunta': PREGUNTA, 'zonaHoraria': zona, 'usuarioId': 'app-zona'
+    })
+    assert respuesta.status_code == 200
+
+
+@pytest.mark.parametrize('zona', ['America', 'Europe'])
+def test_zona_horaria_que_es_una_region(cliente, zona):
+    respuesta = cliente.post('/api/planificar', json={
+        'pregunta': PREGUNTA, 'zonaHoraria': zona, 'usuarioId': 'app-region'
+    })
+    assert respuesta.status_code == 200
+    respuesta = cliente.get(f'/api/destino/Roma?zonaHoraria={zona}', environ_base={'REMOTE_ADDR': '10.9.0.3'})
+    assert respuesta.status_code == 200
+
+
+def test_destino_desconocido_no_ocupa_cupo(cliente):
+    respuesta = cliente.get('/api/destino/Atlantida', environ_base={'REMOTE_ADDR': '10.9.0.1'})
+    assert respuesta.status_code == 404
+    assert obtener_estadisticas_destino('10.9.0.1')['minute'] == 0
+
+
+def test_destino_tiene_su_propio_rate_limit(cliente):
+    for _ in range(DESTINO_REQUESTS_PER_MINUTE):
+        respuesta = cliente.get('/api/destino/Roma', environ_base={'REMOTE_ADDR': '10.9.0.2'})
+        assert respuesta.status_code == 200
+    assert obtener_estadisticas_destino('10.9.0.2')['minute'] == DESTINO_REQUESTS_PER_MINUTE
+    respuesta = cliente.get('/api/destino/Roma/fotos', environ_base={'REMOTE_ADDR': '10.9.0.2'})
+    assert respuesta.status_code == 429
+    # Abrir el panel no gasta consultas de planificación
+    assert consultas_del_minuto('10.9.0.2') == 0
+    respuesta = cliente.post('/api/planificar', json={'pregunta': PREGUNTA}, environ_base={'REMOTE_ADDR': '10.9.0.2'})
+    assert respuesta.status_code == 200
+
+
+def test_stream_cerrado_sin_leer_no_ocupa_cupo():
+    # El servidor cierra la respuesta sin recorrerla (el cliente se desconectó antes)
+    entorno = EnvironBuilder('/api/planificar/stream', method='POST', json={
+        'pregunta': PREGUNTA, 'usuarioId': 'app-sse-cerrado'
+    }).get_environ()
+    servidor.app.wsgi_app(entorno, lambda status, cabeceras, exc_info=None: None).close()
+    assert consultas_del_minuto('app-sse-cerrado') == 0
+
+
+def test_stream_completo_cuenta_para_el_rate_limit(cliente):
+    respuesta = cliente.post('/api/planificar/stream', json={'pregunta': PREGUNTA, 'usuarioId': 'app-sse-leido'})
+    assert b'event: fin' in respuesta.get_data()
+    assert consultas_del_minuto('app-sse-leido') == 1
@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from cache import CacheTTL
+from cache_disco import CacheDisco
+
+
+def test_ttl_y_desalojo_lru():
+    cache = CacheTTL('prueba', ttl=60, max_entradas=2)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obtener('a') == 1  # 'a' pasa a ser la más reciente
+    cache.guardar('c', 3)
+    assert cache.obtener('b') is None
+    assert cache.obtener('a') == 1 and cache.obtener('c') == 3
+    assert cache.estadisticas()['desalojos'] == 1
+
+    cache.guardar('corta', 'x', ttl=0)
+    assert cache.obtener('corta', 'vencida') == 'vencida'
+
+
+def test_una_sola_consulta_por_clave():
+    cache = CacheTTL('prueba', ttl=60)
+    llamadas = []
+    empezo = threading.Event()
+    seguir = threading.Event()
+
+    def calcular():
+        llamadas.append(1)
+        empezo.set()
+        seguir.wait(5)
+        return 'valor'
+
+    resultados = []
+    hilos = [threading.Thread(target=lambda: resultados.append(cache.obtener_o_calcular('k', calcular)))
+             for _ in range(5)]
+    hilos[0].start()
+    empezo.wait(5)
+    for hilo in hilos[1:]:
+        hilo.start()
+    time.sleep(0.05)
+    seguir.set()
+    for hilo in hilos:
+        hilo.join()
+
+    assert resultados == ['valor'] * 5
+    assert len(llamadas) == 1
+    assert cache.estadisticas()['compartidos'] == 4
+
+
+def test_no_guarda_lo_que_no_es_cacheable_ni_los_errores():
+    cache = CacheTTL('prueba', ttl=60)
+    assert cache.obtener_o_calcular('vacio', lambda: []) == []
+    assert cache.obtener('vacio') is None
+
+    def fallar():
+        raise RuntimeError('upstream caído')
+
+    with pytest.raises(RuntimeError):
+        cache.obtener_o_calcular('k', fallar)
+    assert cache.obtener_o_calcular('k', lambda: 'ok') == 'ok'
+
+
+def test_obsoleto_se_sirve_y_se_revalida_en_segundo_plano():
+    cache = CacheTTL('prueba', ttl=60, ttl_obsoleto=60, marcar_obsoleto=lambda valor: {**valor, 'obsoleto': True})
+    cache.guardar('k', {'v': 1}, ttl=0)
+    actualizado = threading.Event()
+
+    def calcular():
+        actualizado.set()
+        return {'v': 2}
+
+    assert cache.obtener_o_calcular('k', calcular) == {'v': 1, 'obsoleto': True}
+    assert actualizado.wait(5)
+    for _ in range(100):
+        if cache.obtener('k'):
+            break
+        time.sleep(0.01)
+    assert cache.obtener('k') == {'v': 2}
+
+
+def test_exportar_e_importar():
+    origen = CacheTTL('prueba', ttl=60)
+    origen.guardar('a', 1)
+    origen.guardar('vencida', 2, ttl=-1)
+    destino = CacheTTL('prueba', ttl=60)
+    assert destino.importar(origen.exportar()) == 1
+    assert destino.obtener('a') == 1
+    assert 0 < destino.restante('a') <= 60
+
+
+@pytest.fixture
+def disco(tmp_path):
+    return CacheDisco(str(tmp_path / 'cache.sqlite3'), intervalo_compactacion=0)
+
+
+def test_disco_comparte_entradas_entre_procesos(disco):
+    escritor = CacheTTL('clima', ttl=60, disco=disco)
+    escritor.guardar(('roma', 'metric'), {'temperatura': 21})
+    disco.esperar_escrituras()
+
+    # Otro worker (otra caché en memoria sobre el mismo archivo)
+    lector = CacheTTL('clima', ttl=60, disco=disco)
+    assert lector.obtener_o_calcular(('roma', 'metric'), lambda: pytest.fail('no debe ir al upstream')) == {
+        'temperatura': 21
+    }
+    assert lector.estadisticas()['aciertos_disco'] == 1
+
+    lector.invalidar(('roma', 'metric'))
+    disco.esperar_escrituras()
+    assert disco.leer('clima', ('roma', 'metric')) is None
+
+
+def test_disco_compacta_vencidas_y_desaloja_por_tamano(tmp_path):
+    disco = CacheDisco(str(tmp_path / 'cache.sqlite3'), max_bytes=2000, intervalo_compactacion=0)
+    ahora = time.time()
+    disco.guardar('fotos', 'vieja', 'x', ahora - 10, ahora - 5)
+    for i in range(20):
+        # Texto poco comprimible para que cada entrada ocupe algo
+        disco.guardar('fotos', i, ''.join(chr(33 + (i * 7 + j * 13) % 90) for j in range(300)), ahora + 60, ahora + 60)
+    disco.esperar_escrituras()
+
+    resultado = disco.compactar(forzar=True)
+    assert resultado['vencidas'] == 1
+    assert resultado['desalojadas'] > 0
+    assert resultado['bytes'] <= 2000
@@ -0,0 +1,67 @@
+import asyncio
+import threading
+
+import pytest
+
+from coalescencia import GeneracionDemorada, GeneracionesEnCurso
+
+
+def test_la_misma_clave_comparte_la_generacion():
+    en_curso = GeneracionesEnCurso()
+    generacion, nueva = en_curso.unirse('roma')
+    otra, segunda = en_curso.unirse('roma')
+    assert nueva and not segunda and otra is generacion
+    assert en_curso.unirse(None)[0] is not en_curso.unirse(None)[0]
+
+    generacion.terminar('respuesta')
+    # Una vez terminada, la clave queda libre para una generación nueva
+    assert en_curso.unirse('roma')[1]
+    assert en_curso.estadisticas()['compartidas'] == 1
+
+
+def test_quien_llega_tarde_recibe_lo_ya_generado():
+    generacion, _ = GeneracionesEnCurso().unirse('k')
+    generacion.publicar('Hola ')
+    eventos = []
+    generacion.escuchar(lambda tipo, dato: eventos.append((tipo, dato)))
+    generacion.publicar('mundo')
+    generacion.terminar()
+    assert eventos == [('token', 'Hola '), ('token', 'mundo'), ('fin', 'Hola mundo')]
+
+
+def test_resultado_espera_y_propaga_errores():
+    en_curso = GeneracionesEnCurso()
+    generacion, _ = en_curso.unirse('k')
+    threading.Timer(0.05, generacion.terminar, args=('listo',)).start()
+    assert generacion.resultado(timeout=5) == 'listo'
+
+    fallida, _ = en_curso.unirse('otra')
+    fallida.fallar(RuntimeError('cuota'))
+    with pytest.raises(RuntimeError):
+        fallida.resultado(timeout=5)
+
+
+def test_resultado_con_plazo_vencido():
+    en_curso = GeneracionesEnCurso()
+    generacion, _ = en_curso.unirse('k')
+    en_curso.unirse('k')
+    with pytest.raises(GeneracionDemorada):
+        generacion.resultado(timeout=0.05)
+    # Quien esperaba ya no cuenta como interesado
+    assert generacion.interesados == 1
+
+    en_curso.unirse('k')
+    with pytest.raises(GeneracionDemorada):
+        asyncio.run(generacion.resultado_async(timeout=0.05))
+    assert generacion.interesados == 1
+
+
+def test_cancelar_si_abandonada():
+    en_curso = GeneracionesEnCurso()
+    generacion, _ = en_curso.unirse('k')
+    en_curso.unirse('k')
+    generacion.dejar()
+    assert not generacion.cancelar_si_abandonada()
+    generacion.dejar()
+    assert generacion.cancelar_si_abandonada()
+    assert en_curso.estadisticas()['en_curso'] == 0
@@ -0,0 +1,28 @@
+from gazetteer import TIPO_CIUDAD, TIPO_PAIS, IndiceLugares, Lugar, buscar_lugar, normalizar, resolver_lugar
+
+ROMA = Lugar('Roma', TIPO_CIUDAD, 'IT', 41.9, 12.5)
+ITALIA = Lugar('Italia', TIPO_PAIS, 'IT', 41.9, 12.5)
+SAN_JUAN = Lugar('San Juan', TIPO_CIUDAD, 'PR', 18.5, -66.1)
+
+
+def test_normalizar():
+    assert normalizar('Ciudad de México') == ['ciudad', 'de', 'mexico']
+
+
+def test_buscar_prefiere_la_ciudad_y_el_nombre_mas_largo():
+    indice = IndiceLugares([(ITALIA, ['Italia']), (ROMA, ['Roma', 'Rome']), (SAN_JUAN, ['San Juan'])])
+    assert indice.buscar('Viaje a Italia, sobre todo ROMA') is ROMA
+    assert indice.buscar('hoteles en san juan') is SAN_JUAN
+    assert indice.buscar('Quiero ir a la playa') is None
+
+
+def test_resolver_exige_que_todas_las_palabras_sean_un_lugar():
+    indice = IndiceLugares([(ITALIA, ['Italia']), (ROMA, ['Roma']), (SAN_JUAN, ['San Juan'])])
+    assert indice.resolver('Roma, Italia') is ROMA
+    assert indice.resolver('San Juan de los Lagos') is None
+
+
+def test_indice_del_proyecto():
+    assert buscar_lugar('Qué ver en Ciudad de México')
+    assert resolver_lugar('Brasil').tipo == TIPO_PAIS
+    assert resolver_lugar('') is None
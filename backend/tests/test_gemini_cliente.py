@@ -0,0 +1,50 @@
+import os
+import time
+
+import google.generativeai as genai
+
+from gemini_cliente import ModeloGemini
+from planificacion import GEMINI_MODEL, opciones_cliente_gemini
+from prompts import INSTRUCCION_SISTEMA
+
+# Contra el servidor falso de conftest.py
+genai.configure(api_key=os.environ['GEMINI_API_KEY'], **opciones_cliente_gemini())
+
+
+def esperar(condicion, plazo=5.0):
+    limite = time.monotonic() + plazo
+    while not condicion() and time.monotonic() < limite:
+        time.sleep(0.01)
+    return condicion()
+
+
+def test_prefijo_mas_corto_que_el_minimo_no_intenta_la_cache():
+    modelo = ModeloGemini(GEMINI_MODEL, INSTRUCCION_SISTEMA, usar_cache=True, min_tokens=1024)
+    assert modelo.modelo() is modelo.modelo_base
+    assert modelo.estadisticas()['cache_contexto'] == 'prefijo corto'
+    assert modelo.errores_cache == 0
+
+
+def test_la_cache_se_crea_fuera_de_la_consulta():
+    # Un prefijo largo, por encima del mínimo que exige el servidor falso
+    modelo = ModeloGemini(GEMINI_MODEL, 'Responde como guía de viajes. ' * 300, usar_cache=True, min_tokens=1024)
+    # La consulta que dispara la creación no la espera
+    assert modelo.modelo() is modelo.modelo_base
+    assert esperar(lambda: modelo.caches_creadas == 1)
+    assert modelo.modelo() is not modelo.modelo_base
+    assert modelo.generate_content('Qué ver en Roma').text
+
+
+def test_cache_rechazada_sigue_con_system_instruction():
+    modelo = ModeloGemini(GEMINI_MODEL, INSTRUCCION_SISTEMA, usar_cache=True, min_tokens=0, reintento=3600)
+    modelo.modelo()
+    assert esperar(lambda: modelo.errores_cache == 1)
+    assert modelo.modelo() is modelo.modelo_base
+    assert modelo.estadisticas()['cache_contexto'] == 'no disponible'
+    assert modelo.generate_content('Qué ver en Roma').text
+
+
+def test_desactivada_por_defecto():
+    modelo = ModeloGemini(GEMINI_MODEL, INSTRUCCION_SISTEMA)
+    assert modelo.modelo() is modelo.modelo_base
+    assert modelo.estadisticas()['cache_contexto'] == 'desactivada'
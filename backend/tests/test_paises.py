@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from paises import hora_y_diferencia, moneda_pais, zona_horaria, zona_pais
+
+
+def test_moneda_y_zona_del_pais():
+    assert moneda_pais('jp') == 'JPY'
+    assert moneda_pais('ZZ') == 'USD'
+    assert zona_pais('PE') == 'America/Lima'
+    assert zona_pais('ZZ') is None
+
+
+def test_zona_por_coordenadas_en_paises_con_varias():
+    # Los Ángeles está en Pacífico aunque la zona por defecto de EE. UU. sea otra
+    assert zona_pais('US', 34.05, -118.24) == 'America/Los_Angeles'
+
+
+def test_zona_horaria_del_cliente():
+    assert zona_horaria('America/Lima') == ZoneInfo('America/Lima')
+    assert zona_horaria('Marte/Olympus') is None
+    assert zona_horaria('') is None
+    assert zona_horaria('America') is None
+    # Del JSON puede llegar cualquier cosa: no debe romper la caché
+    assert zona_horaria(['America/Lima']) is None
+    assert zona_horaria({'zona': 'America/Lima'}) is None
+
+
+def test_hora_y_diferencia():
+    ahora = datetime(2030, 1, 15, 12, 0, tzinfo=timezone.utc)
+    en_destino, diferencia = hora_y_diferencia(ZoneInfo('Asia/Tokyo'), ZoneInfo('America/Lima'), ahora)
+    assert en_destino.hour == 21
+    assert diferencia == 14
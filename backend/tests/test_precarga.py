@@ -0,0 +1,48 @@
+import pytest
+
+from cache import CacheTTL
+from cache_disco import CacheDisco
+from precarga import Fuente, Popularidad, Precargador
+
+
+def normalizar(destino):
+    return destino.strip().lower()
+
+
+def test_popularidad_decae_con_el_tiempo():
+    popularidad = Popularidad(normalizar, vida_media=100)
+    popularidad.registrar('Roma')
+    popularidad.registrar('roma ')
+    popularidad.registrar('Lima')
+    assert [nombre for nombre, _ in popularidad.top(2)] == ['roma ', 'Lima']
+
+    otra = Popularidad(normalizar, vida_media=100)
+    otra.importar(popularidad.exportar(), segundos_transcurridos=100)
+    assert otra.top(1)[0][1] == pytest.approx(1.0, rel=0.01)
+
+
+def test_pendientes_respeta_el_presupuesto_y_lo_vigente():
+    cache = CacheTTL('clima', ttl=3600)
+    fuente = Fuente(cache, normalizar, lambda destino: {'destino': destino})
+    precargador = Precargador(Popularidad(normalizar), [fuente], intervalo=60, presupuesto=2, activo=True)
+    for destino in ('Roma', 'Lima', 'Quito'):
+        precargador.registrar(destino)
+    cache.guardar('roma', {'destino': 'Roma'})
+
+    assert {destino for _, _, destino in precargador.pendientes()} == {'Lima', 'Quito'}
+    assert precargador.ejecutar() == 2
+    assert cache.obtener('quito') == {'destino': 'Quito'}
+
+
+def test_la_popularidad_se_guarda_en_la_cache_en_disco(tmp_path):
+    disco = CacheDisco(str(tmp_path / 'cache.sqlite3'), intervalo_compactacion=0)
+    anterior = Precargador(Popularidad(normalizar), [], disco=disco, activo=True)
+    anterior.registrar('Roma')
+    anterior.detener()
+
+    nuevo = Precargador(Popularidad(normalizar), [], disco=disco, activo=True)
+    nuevo.cargar_popularidad()
+    assert [nombre for nombre, _ in nuevo.popularidad.top(1)] == ['Roma']
+
+    # Sin caché en disco no se guarda nada
+    Precargador(Popularidad(normalizar), [], activo=True).cargar_popularidad()
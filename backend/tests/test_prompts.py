@@ -0,0 +1,32 @@
+from prompts import (
+    TIPO_BREVE, TIPO_ITINERARIO, TIPO_NORMAL, ContadorTokens, PlantillaPrompt, clasificar_pregunta
+)
+
+
+def test_clasificar_pregunta():
+    assert clasificar_pregunta('Arma un itinerario de 5 días por Japón') == TIPO_ITINERARIO
+    assert clasificar_pregunta('¿Qué moneda usan en Chile?') == TIPO_BREVE
+    assert clasificar_pregunta('Qué lugares visitar en Roma en primavera') == TIPO_NORMAL
+
+
+def test_contador_se_calibra_dentro_de_los_limites():
+    contador = ContadorTokens()
+    assert contador.contar('a' * 40) == 10
+    for _ in range(200):
+        contador.calibrar(1000, 1)
+    assert contador.caracteres_por_token <= ContadorTokens.MAXIMO
+
+
+def test_plantilla_respeta_el_presupuesto():
+    plantilla = PlantillaPrompt(presupuesto=400)
+    historial = '\n'.join(f'- Turno viejo número {i} sobre un viaje a Roma' for i in range(200))
+    prompt = plantilla.armar('Qué lugares visitar en Roma en primavera', [
+        ('clima', 'Clima: ', 'Soleado, 21 °C'),
+        ('historial', 'Conversación:\n', historial),
+        ('vacia', 'Nada: ', ''),
+    ])
+    assert prompt.tokens['total'] <= 400
+    assert 'Soleado' in prompt.texto
+    # Del historial se descartan primero las líneas más viejas
+    assert 'Turno viejo número 199' in prompt.texto and 'Turno viejo número 0 ' not in prompt.texto
+    assert 'vacia' not in prompt.tokens
@@ -0,0 +1,131 @@
+import threading
+
+import fakeredis
+import pytest
+
+import rate_limiter
+from rate_limiter import (
+    AlmacenMemoria, AlmacenRedis, AlmacenSQLite, ContadorDeslizante, DESTINO_REQUESTS_PER_MINUTE,
+    REQUESTS_PER_MINUTE, configurar_almacen, liberar_request, obtener_estadisticas,
+    obtener_estadisticas_destino, reservar_request, reservar_request_destino, reservar_requests
+)
+
+
+@pytest.fixture(params=['memoria', 'sqlite', 'redis'])
+def almacen(request, tmp_path):
+    if request.param == 'memoria':
+        nuevo = AlmacenMemoria()
+    elif request.param == 'sqlite':
+        nuevo = AlmacenSQLite(str(tmp_path / 'rate_limit.sqlite3'))
+    else:
+        nuevo = AlmacenRedis(cliente=fakeredis.FakeRedis())
+    anterior = rate_limiter.almacen
+    configurar_almacen(nuevo)
+    yield nuevo
+    configurar_almacen(anterior)
+
+
+def test_reserva_hasta_el_limite_por_minuto(almacen):
+    for _ in range(REQUESTS_PER_MINUTE):
+        assert reservar_request('ana')['allowed']
+    rechazo = reservar_request('ana')
+    assert not rechazo['allowed']
+    assert rechazo['limit_type'] == 'minute'
+    assert rechazo['reserva'] is None
+    # En memoria el tramo anterior se estima: la espera puede pasar el minuto por 60 / límite
+    assert 0 < rechazo['retry_after'] <= 60 + 60 // REQUESTS_PER_MINUTE
+    # Los límites son por usuario
+    assert reservar_request('beto')['allowed']
+
+
+def test_liberar_devuelve_el_cupo(almacen):
+    reservas = [reservar_request('ana')['reserva'] for _ in range(REQUESTS_PER_MINUTE)]
+    assert not reservar_request('ana')['allowed']
+
+    liberar_request('ana', reservas[0])
+    assert obtener_estadisticas('ana')['minute'] == REQUESTS_PER_MINUTE - 1
+    assert reservar_request('ana')['allowed']
+
+
+def test_liberar_sin_reserva_no_hace_nada(almacen):
+    reservar_request('ana')
+    liberar_request('ana', None)
+    assert obtener_estadisticas('ana')['minute'] == 1
+
+
+def test_lote_se_reserva_completo_o_nada(almacen):
+    reservar_request('ana')
+    assert not reservar_requests('ana', REQUESTS_PER_MINUTE)['allowed']
+    assert obtener_estadisticas('ana')['minute'] == 1
+
+    resultado = reservar_requests('ana', REQUESTS_PER_MINUTE - 1)
+    assert resultado['allowed']
+    assert len(resultado['reservas']) == REQUESTS_PER_MINUTE - 1
+    # Cada consulta del lote se devuelve por separado
+    liberar_request('ana', resultado['reservas'][0])
+    assert obtener_estadisticas('ana')['minute'] == REQUESTS_PER_MINUTE - 1
+
+
+def test_destino_tiene_su_propio_cupo(almacen):
+    for _ in range(DESTINO_REQUESTS_PER_MINUTE):
+        assert reservar_request_destino('ana')['allowed']
+    rechazo = reservar_request_destino('ana')
+    assert (rechazo['allowed'], rechazo['limit_type']) == (False, 'minute')
+    assert obtener_estadisticas_destino('ana')['minute'] == DESTINO_REQUESTS_PER_MINUTE
+    # El cupo de planificación queda intacto
+    assert obtener_estadisticas('ana')['minute'] == 0
+    assert reservar_request('ana')['allowed']
+
+
+def test_reservas_concurrentes_no_pasan_el_limite(almacen):
+    resultados = []
+    barrera = threading.Barrier(4 * REQUESTS_PER_MINUTE)
+
+    def reservar():
+        barrera.wait()
+        resultados.append(reservar_request('ana')['allowed'])
+
+    hilos = [threading.Thread(target=reservar) for _ in range(4 * REQUESTS_PER_MINUTE)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+
+    assert resultados.count(True) == REQUESTS_PER_MINUTE
+    assert obtener_estadisticas('ana')['minute'] == REQUESTS_PER_MINUTE
+
+
+def test_contador_deslizante_pesa_el_tramo_anterior():
+    contador = ContadorDeslizante()
+    inicio = 60 * 1000.0
+    contador.registrar(inicio + 50, REQUESTS_PER_MINUTE)
+    rechazo = contador.evaluar(inicio + 55)
+    # Esperar al minuto siguiente y a que las del minuto 50 pesen por una menos
+    assert (rechazo['allowed'], rechazo['retry_after']) == (False, 5 + 60 // REQUESTS_PER_MINUTE)
+    assert not contador.evaluar(inicio + 60 + 60 // REQUESTS_PER_MINUTE - 1)['allowed']
+    assert contador.evaluar(inicio + 60 + 60 // REQUESTS_PER_MINUTE)['allowed']
+    assert contador.contar(inicio + 90)['minute'] == REQUESTS_PER_MINUTE // 2 + REQUESTS_PER_MINUTE % 2
+    assert contador.contar(inicio + 120)['minute'] == 0
+
+    contador.descontar(inicio + 50)
+    assert contador.contar(inicio + 120)['hour'] == REQUESTS_PER_MINUTE - 1
+
+
+def test_memoria_olvida_al_usuario_menos_activo():
+    almacen = AlmacenMemoria(max_usuarios=2)
+    for user_id in ('ana', 'beto', 'ana', 'carla'):
+        almacen.reservar(user_id, 1000.0)
+    assert list(almacen.user_requests) == ['ana', 'carla']
+
+
+def test_sqlite_comparte_el_estado_entre_instancias(tmp_path):
+    # Dos workers con el mismo archivo ven las mismas consultas
+    ruta = str(tmp_path / 'compartido.sqlite3')
+    uno, otro = AlmacenSQLite(ruta), AlmacenSQLite(ruta)
+    _, reservas = uno.reservar('ana', 1000.0, REQUESTS_PER_MINUTE)
+    resultado, _ = otro.reservar('ana', 1001.0)
+    assert not resultado['allowed']
+
+    otro.liberar('ana', reservas[0])
+    resultado, _ = uno.reservar('ana', 1002.0)
+    assert resultado['allowed']
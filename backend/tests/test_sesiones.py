@@ -0,0 +1,67 @@
+from cache_disco import CacheDisco
+from sesiones import AlmacenConversaciones, estimar_tokens, resumir_historial, validar_conversacion_id
+
+RESPUESTA = 'ALOJAMIENTO: Hotel en Trastevere. Cerca del río.\nCOMIDA: Cacio e pepe en Testaccio.'
+
+
+def test_validar_conversacion_id():
+    assert validar_conversacion_id('conv_1234abcd') == 'conv_1234abcd'
+    assert validar_conversacion_id('corto') is None
+    assert validar_conversacion_id(['conv_1234abcd']) is None
+
+
+def test_contexto_con_resumen_y_ultimo_turno():
+    almacen = AlmacenConversaciones(presupuesto_tokens=300)
+    assert almacen.contexto('conv_1234abcd') == ''
+    almacen.registrar_turno('conv_1234abcd', 'Qué hacer en Roma', RESPUESTA)
+    almacen.registrar_turno('conv_1234abcd', 'Y en Florencia', 'Visita los Uffizi.')
+    contexto = almacen.contexto('conv_1234abcd')
+    assert 'Antes:\n- Qué hacer en Roma → Hotel en Trastevere; Cacio e pepe en Testaccio' in contexto
+    assert 'Última pregunta: Y en Florencia' in contexto
+    assert estimar_tokens(contexto) <= 300
+
+
+def test_turno_repetido_no_se_duplica():
+    almacen = AlmacenConversaciones()
+    for _ in range(2):
+        almacen.registrar_turno('conv_1234abcd', 'Qué hacer en Roma', RESPUESTA)
+    assert 'Antes' not in almacen.contexto('conv_1234abcd')
+
+
+def test_vencimiento_y_desalojo():
+    almacen = AlmacenConversaciones(ttl=0)
+    almacen.registrar_turno('conv_1234abcd', 'Qué hacer en Roma', RESPUESTA)
+    assert almacen.contexto('conv_1234abcd') == ''
+
+    almacen = AlmacenConversaciones(max_conversaciones=1)
+    almacen.registrar_turno('conv_aaaaaaaa', 'Qué hacer en Roma', RESPUESTA)
+    almacen.registrar_turno('conv_bbbbbbbb', 'Qué hacer en Roma', RESPUESTA)
+    assert len(almacen) == 1 and almacen.estadisticas()['desalojos'] == 1
+
+
+def test_resumir_historial_del_cliente():
+    assert resumir_historial(['Qué hacer en Roma']) == 'Última pregunta: Qué hacer en Roma'
+
+
+def test_sembrar_no_guarda_respuestas():
+    almacen = AlmacenConversaciones()
+    almacen.sembrar('conv_1234abcd', ['Qué hacer en Roma', 'Y en Florencia'])
+    contexto = almacen.contexto('conv_1234abcd')
+    assert 'Antes:\n- Qué hacer en Roma' in contexto and 'Última respuesta' not in contexto
+
+
+def test_los_workers_comparten_las_conversaciones_por_disco(tmp_path):
+    disco = CacheDisco(str(tmp_path / 'cache.sqlite3'), intervalo_compactacion=0)
+    uno, otro = AlmacenConversaciones(disco=disco), AlmacenConversaciones(disco=disco)
+    uno.registrar_turno('conv_1234abcd', 'Qué hacer en Roma', RESPUESTA)
+    disco.esperar_escrituras()
+
+    # La pregunta siguiente cae en el otro worker
+    assert 'Última pregunta: Qué hacer en Roma' in otro.contexto('conv_1234abcd')
+    otro.registrar_turno('conv_1234abcd', 'Y en Florencia', 'Visita los Uffizi.')
+    disco.esperar_escrituras()
+
+    # El primero ve el turno que respondió el otro
+    contexto = uno.contexto('conv_1234abcd')
+    assert 'Antes:\n- Qué hacer en Roma' in contexto and 'Última pregunta: Y en Florencia' in contexto
+    assert uno.estadisticas()['leidas_disco'] == 1
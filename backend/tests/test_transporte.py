@@ -0,0 +1,61 @@
+import gzip
+
+import pytest
+
+from transporte import (
+    CuerpoInvalido, cargar_json, comprimir_respuesta, descomprimir, elegir_codificacion,
+    seleccionar_campos, validar_campos
+)
+
+
+def test_elegir_codificacion():
+    assert elegir_codificacion('gzip, deflate') == 'gzip'
+    assert elegir_codificacion('gzip;q=0, identity') is None
+    assert elegir_codificacion('') is None
+
+
+def test_comprimir_respuesta_solo_si_conviene():
+    grande = b'{"respuesta": "' + b'a' * 4000 + b'"}'
+    datos, codificacion = comprimir_respuesta(grande, 'application/json', None, 'gzip')
+    assert codificacion == 'gzip' and gzip.decompress(datos) == grande
+    assert comprimir_respuesta(b'{}', 'application/json', None, 'gzip') == (None, None)
+    assert comprimir_respuesta(grande, 'text/event-stream', None, 'gzip') == (None, None)
+
+
+def test_descomprimir_limita_el_tamano():
+    bomba = gzip.compress(b'0' * 10000)
+    assert descomprimir(bomba, 'gzip', maximo=20000) == b'0' * 10000
+    with pytest.raises(CuerpoInvalido) as error:
+        descomprimir(bomba, 'gzip', maximo=1000)
+    assert error.value.status == 413
+    with pytest.raises(CuerpoInvalido) as error:
+        descomprimir(b'no es gzip', 'gzip')
+    assert error.value.status == 400
+    # br solo se usa en las respuestas: en los cuerpos no se acepta
+    for codificacion in ('compress', 'br'):
+        with pytest.raises(CuerpoInvalido) as error:
+            descomprimir(b'x', codificacion)
+        assert error.value.status == 415
+
+
+def test_cargar_json():
+    assert cargar_json(b'') is None
+    assert cargar_json(gzip.compress(b'{"a": 1}'), 'gzip') == {'a': 1}
+    with pytest.raises(CuerpoInvalido):
+        cargar_json(b'{a')
+
+
+def test_seleccion_de_campos():
+    seleccion, error = validar_campos('fotos.url, info_destino.temperatura')
+    assert error is None
+    datos = {
+        'respuesta': 'texto',
+        'fotos': [{'url': 'u', 'autor': 'a'}],
+        'info_destino': {'temperatura': 20, 'moneda': 'EUR'}
+    }
+    assert seleccionar_campos(datos, seleccion) == {
+        'respuesta': 'texto', 'fotos': [{'url': 'u'}], 'info_destino': {'temperatura': 20}
+    }
+    assert seleccionar_campos(datos, {}) is datos
+    assert validar_campos(['fotos.desconocido'])[1]
+    assert validar_campos({'fotos': 'url'})[1]
@@ -0,0 +1,226 @@
+"""
+============================================
+TRANSPORTE DE RESPUESTAS - VIAJEIA
+============================================
+
+Todo lo que reduce los bytes que viajan entre el backend y el cliente,
+sin cambiar lo que se responde:
+
+- Compresión negociada: las respuestas JSON (y de texto) se comprimen con
+  brotli o gzip según el Accept-Encoding del cliente (brotli está en
+  requirements.txt; si falta el paquete se usa gzip).
+- Cuerpos comprimidos: una consulta puede llegar con Content-Encoding
+  gzip (por ejemplo, con el historial de una conversación). Se descomprime
+  con un tope de MAX_REQUEST_BYTES, así un cuerpo chico que se expande a
+  gigas no llega a ocupar memoria. br no se acepta en los cuerpos: el
+  frontend solo manda gzip y descomprimir brotli con tope depende de la
+  versión del paquete.
+- Selección de campos: el cliente puede pedir solo los campos de las fotos
+  y del panel que muestra ("campos": ["fotos.url", "info_destino.temperatura"]).
+- GET condicional: las respuestas GET llevan ETag y, si el cliente ya
+  tiene esa versión (If-None-Match), se responde 304 sin cuerpo.
+
+¿Por qué es importante?
+- Una respuesta de /api/planificar pesa varios KB: comprimida, una fracción
+- En redes móviles cada KB cuenta, y serializar menos campos también ahorra CPU
+- El panel de un destino que no cambió no se vuelve a descargar
+"""
+
+import gzip
+import json
+import os
+import zlib
+
+try:
+    import brotli
+except ImportError:  # brotli es opcional: sin el paquete solo se ofrece gzip
+    brotli = None
+
+# ============================================
+# CONFIGURACIÓN
+# ============================================
+
+# COMPRESSION_ENABLED=false desactiva la compresión de respuestas
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'true').lower() not in ('0', 'false', 'no')
+# Respuestas más chicas que esto no se comprimen (no vale la pena)
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+# Niveles medios: casi toda la reducción por una parte del costo de CPU
+NIVEL_GZIP = 5
+CALIDAD_BROTLI = 4
+
+# Tamaño máximo de un cuerpo de consulta ya descomprimido (evita "bombas" de compresión)
+MAX_REQUEST_BYTES = int(os.getenv('MAX_REQUEST_BYTES', str(256 * 1024)))
+
+# Tipos de contenido que se comprimen
+TIPOS_COMPRIMIBLES = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+# Codificaciones que se ofrecen, en orden de preferencia
+CODIFICACIONES = ('br', 'gzip') if brotli else ('gzip',)
+
+# Campos que se pueden seleccionar de cada sección de la respuesta
+CAMPOS_SELECCIONABLES = {
+    'fotos': frozenset(('url', 'url_pequeña', 'url_grande', 'autor', 'descripcion')),
+    'info_destino': frozenset((
+        'ciudad', 'pais', 'temperatura', 'descripcion', 'diferencia_horaria', 'hora_destino',
+        'zona_horaria', 'moneda', 'tipo_cambio', 'simbolo_moneda', 'datos_obsoletos'
+    )),
+}
+MAX_CAMPOS = 30
+
+
+class CuerpoInvalido(Exception):
+    """El cuerpo de la consulta no se puede leer (codificación, tamaño o JSON)."""
+
+    def __init__(self, mensaje, status=400):
+        super().__init__(mensaje)
+        self.status = status
+
+
+# ============================================
+# COMPRESIÓN
+# ============================================
+
+def elegir_codificacion(accept_encoding):
+    """
+    La codificación a usar según el encabezado Accept-Encoding del cliente.
+
+    Returns:
+        str: 'br', 'gzip' o None (sin compresión)
+    """
+    if not accept_encoding:
+        return None
+    aceptadas = {}
+    for parte in accept_encoding.lower().split(','):
+        nombre, _, parametros = parte.strip().partition(';')
+        calidad = 1.0
+        if parametros.strip().startswith('q='):
+            try:
+                calidad = float(parametros.strip()[2:])
+            except ValueError:
+                calidad = 0.0
+        aceptadas[nombre.strip()] = calidad
+    comodin = aceptadas.get('*', 0.0)
+    mejor, mejor_calidad = None, 0.0
+    for codificacion in CODIFICACIONES:
+        calidad = aceptadas.get(codificacion, comodin)
+        if calidad > mejor_calidad:
+            mejor, mejor_calidad = codificacion, calidad
+    return mejor
+
+
+def comprimir(datos, codificacion):
+    """Comprime `datos` (bytes) con 'br' o 'gzip'."""
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=CALIDAD_BROTLI)
+    # mtime=0: el mismo contenido produce siempre los mismos bytes
+    return gzip.compress(datos, compresslevel=NIVEL_GZIP, mtime=0)
+
+
+def comprimir_respuesta(datos, mimetype, content_encoding, accept_encoding):
+    """
+    Comprime el cuerpo de una respuesta si conviene y el cliente lo acepta.
+
+    Returns:
+        tuple: (datos comprimidos, codificación) o (None, None) si se envía tal cual
+    """
+    if (
+        not COMPRESSION_ENABLED or content_encoding
+        or len(datos) < COMPRESSION_MIN_BYTES or mimetype not in TIPOS_COMPRIMIBLES
+    ):
+        return None, None
+    codificacion = elegir_codificacion(accept_encoding)
+    if codificacion is None:
+        return None, None
+    return comprimir(datos, codificacion), codificacion
+
+
+def descomprimir(datos, codificacion, maximo=MAX_REQUEST_BYTES):
+    """
+    Descomprime el cuerpo de una consulta.
+
+    Raises:
+        CuerpoInvalido: codificación no soportada (415), demasiado grande (413) o datos corruptos (400)
+    """
+    codificacion = (codificacion or 'identity').strip().lower()
+    if codificacion == 'identity':
+        resultado = datos
+    elif codificacion == 'gzip':
+        # Nunca se descomprime más de maximo + 1 bytes (lo justo para saber que se pasó)
+        descompresor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            resultado = descompresor.decompress(datos, maximo + 1)
+        except zlib.error as e:
+            raise CuerpoInvalido('El cuerpo comprimido con gzip está dañado') from e
+    else:
+        raise CuerpoInvalido(f'Content-Encoding no soportado: {codificacion}', 415)
+    if len(resultado) > maximo:
+        raise CuerpoInvalido('El cuerpo de la consulta es demasiado grande', 413)
+    return resultado
+
+
+def cargar_json(datos, codificacion=None):
+    """
+    JSON del cuerpo de una consulta, descomprimido si hace falta.
+    Un cuerpo vacío devuelve None (como request.get_json(silent=True)).
+
+    Raises:
+        CuerpoInvalido
+    """
+    datos = descomprimir(datos, codificacion)
+    if not datos:
+        return None
+    try:
+        return json.loads(datos)
+    except ValueError as e:
+        raise CuerpoInvalido('El cuerpo de la consulta no es JSON válido') from e
+
+
+# ============================================
+# SELECCIÓN DE CAMPOS
+# ============================================
+
+def validar_campos(valor):
+    """
+    Interpreta la selección de campos del cliente: una lista (o texto
+    separado por comas) de 'seccion.campo', por ejemplo 'fotos.url'.
+
+    Returns:
+        tuple: ({ seccion: frozenset(campos) }, None) o (None, mensaje de error).
+               Una selección vacía ({}) deja la respuesta completa.
+    """
+    if valor is None:
+        return {}, None
+    if isinstance(valor, str):
+        valor = [parte for parte in valor.split(',') if parte.strip()]
+    if not isinstance(valor, list) or len(valor) > MAX_CAMPOS or not all(isinstance(c, str) for c in valor):
+        return None, f'"campos" debe ser una lista de hasta {MAX_CAMPOS} nombres como "fotos.url"'
+    seleccion = {}
+    for campo in valor:
+        seccion, _, nombre = campo.strip().partition('.')
+        if nombre not in CAMPOS_SELECCIONABLES.get(seccion, ()):
+            return None, f'Campo desconocido: "{campo.strip()}"'
+        seleccion.setdefault(seccion, set()).add(nombre)
+    return {seccion: frozenset(nombres) for seccion, nombres in seleccion.items()}, None
+
+
+def seleccionar_campos(datos, seleccion):
+    """
+    Copia de `datos` con solo los campos pedidos en las secciones
+    seleccionadas ('fotos' es una lista, 'info_destino' un dict).
+    Las secciones sin selección y el resto de las claves quedan igual.
+    """
+    if not seleccion:
+        return datos
+    resultado = dict(datos)
+    campos_fotos = seleccion.get('fotos')
+    if campos_fotos and resultado.get('fotos'):
+        resultado['fotos'] = [
+            {clave: valor for clave, valor in foto.items() if clave in campos_fotos}
+            for foto in resultado['fotos']
+        ]
+    campos_info = seleccion.get('info_destino')
+    if campos_info and resultado.get('info_destino'):
+        resultado['info_destino'] = {
+            clave: valor for clave, valor in resultado['info_destino'].items() if clave in campos_info
+        }
+    return resultado
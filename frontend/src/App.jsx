@@ -1,7 +1,10 @@
-import { useState, useEffect } from 'react'
+import { useState, useEffect, useRef } from 'react'
 import { useAuth } from './context/AuthContext'
 import Login from './components/Login'
 import Register from './components/Register'
+import { leerEventosSSE } from './utils/sse'
+import { cuerpoJSON, CAMPOS_RESPUESTA } from './utils/cuerpo'
+import { cargarInfoDestino } from './utils/destino'
 import './App.css'
 
 const METRICAS_INICIALES = {
@@ -11,6 +14,10 @@ const METRICAS_INICIALES = {
   consultasPorDia: {}
 }
 
+// Id aleatorio de la conversación (el backend acepta letras, números, '-' y '_')
+const nuevaConversacionId = () =>
+  crypto.randomUUID ? crypto.randomUUID() : `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`
+
 function App() {
   const { currentUser, logout, guardarConsulta, userData, loading, error } = useAuth()
   const [mostrarAuth, setMostrarAuth] = useState('login') // 'login' o 'register'
@@ -35,8 +42,14 @@ function App() {
   const [respuesta, setRespuesta] = useState('')
   const [fotos, setFotos] = useState([])
   const [infoDestino, setInfoDestino] = useState(null)
+  // Número de la última carga del panel: un panel que llega tarde no pisa al actual
+  const cargaPanel = useRef(0)
   const [cargando, setCargando] = useState(false)
   const [historial, setHistorial] = useState([])
+  // El backend guarda el contexto de la conversación: solo se manda la pregunta nueva
+  const [conversacionId, setConversacionId] = useState(nuevaConversacionId)
+  // Al abrir un favorito, su historial se manda una vez para que el backend lo retome
+  const [historialPendiente, setHistorialPendiente] = useState(false)
   const [favoritos, setFavoritos] = useState(() => {
     // Cargar favoritos del localStorage
     const saved = localStorage.getItem('viajeia_favoritos')
@@ -217,6 +230,17 @@ function App() {
     localStorage.setItem('viajeia_favoritos', JSON.stringify(nuevosFavoritos))
   }
 
+  // Panel de un destino sin hacer una pregunta (al abrir un favorito)
+  const mostrarPanelDestino = (destino) => {
+    const carga = ++cargaPanel.current
+    setInfoDestino(null)
+    if (!destino?.trim()) return
+    const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5001'
+    cargarInfoDestino(API_URL, destino).then((info) => {
+      if (info && carga === cargaPanel.current) setInfoDestino(info)
+    })
+  }
+
   const cargarFavorito = (favorito) => {
     setDatosViaje({
       destino: favorito.destino,
@@ -225,8 +249,11 @@ function App() {
       preferencia: favorito.preferencia
     })
     setHistorial(favorito.historial || [])
+    setConversacionId(nuevaConversacionId())
+    setHistorialPendiente((favorito.historial || []).length > 0)
     setMostrarFormulario(false)
     setMostrarFavoritos(false)
+    mostrarPanelDestino(favorito.destino)
   }
 
   const exportarPDF = () => {
@@ -307,20 +334,28 @@ function App() {
     setRespuesta('')
     setFotos([])
     setInfoDestino(null)
+    cargaPanel.current++ // Desde acá el panel llega por el stream
 
     try {
       // Usar variable de entorno en producción, localhost en desarrollo
       const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:5001'
-      const response = await fetch(`${API_URL}/api/planificar`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-        },
-        body: JSON.stringify({ 
-          pregunta: pregunta,
-          datosViaje: datosViaje,
-          historial: historial.slice(-5) // Enviar últimas 5 conversaciones para contexto
+      // Con el ID token, el backend identifica al usuario y le da prioridad en la cola de Gemini
+      const token = await currentUser.getIdToken().catch(() => null)
+      // El cuerpo se comprime si es grande (por ejemplo, con el historial de un favorito)
+      const { headers, body } = await cuerpoJSON({
+        pregunta: pregunta,
+        datosViaje: datosViaje,
+        conversacionId: conversacionId,
+        ...(historialPendiente && {
+          historial: historial.slice(-5).map(({ pregunta }) => ({ pregunta }))
         }),
+        zonaHoraria: Intl.DateTimeFormat().resolvedOptions().timeZone, // Para la diferencia horaria
+        campos: CAMPOS_RESPUESTA // Solo lo que muestran el panel y la galería
+      }, token)
+      const response = await fetch(`${API_URL}/api/planificar/stream`, {
+        method: 'POST',
+        headers,
+        body,
       })
 
       if (!response.ok) {
@@ -328,16 +363,34 @@ function App() {
         throw new Error(errorData.error || `Error del servidor: ${response.status}`)
       }
 
-      const data = await response.json()
-      if (data.error) {
-        setRespuesta(`Error: ${data.error}`)
+      // La respuesta llega por partes: se muestra a medida que Alex la escribe
+      let nuevaRespuesta = ''
+      let fotosRecibidas = []
+      let errorStream = null
+      let completado = false
+      await leerEventosSSE(response, (evento, datos) => {
+        if (evento === 'token') {
+          nuevaRespuesta += datos.texto
+          setRespuesta(nuevaRespuesta)
+        } else if (evento === 'info_destino') {
+          setInfoDestino(datos.info_destino || null)
+        } else if (evento === 'fotos') {
+          fotosRecibidas = datos.fotos || []
+          setFotos(fotosRecibidas)
+        } else if (evento === 'error') {
+          errorStream = datos.error
+        } else if (evento === 'fin') {
+          completado = true
+        }
+      })
+
+      if (errorStream || !completado) {
+        setRespuesta(`Error: ${errorStream || 'La respuesta se interrumpió. Intenta de nuevo.'}`)
         setFotos([])
         setInfoDestino(null)
       } else {
-        const nuevaRespuesta = data.respuesta || 'No se pudo obtener una respuesta.'
+        nuevaRespuesta = nuevaRespuesta || 'No se pudo obtener una respuesta.'
         setRespuesta(nuevaRespuesta)
-        setFotos(data.fotos || [])
-        setInfoDestino(data.info_destino || null)
         
         // Agregar al historial
         const nuevaEntrada = {
@@ -346,9 +399,10 @@ function App() {
           respuesta: nuevaRespuesta,
           fecha: new Date().toLocaleString('es-ES'),
           destino: datosViaje.destino,
-          fotos: data.fotos || []
+          fotos: fotosRecibidas
         }
         setHistorial(prev => [...prev, nuevaEntrada])
+        setHistorialPendiente(false)
         actualizarMetricas(datosViaje.destino)
 
         // 🔥 Guardar consulta en Firebase
@@ -379,6 +433,7 @@ function App() {
       // Limpiar estados locales al cerrar sesión
       setMostrarFormulario(true)
       setHistorial([])
+      setConversacionId(nuevaConversacionId())
       setDatosViaje({
         destino: '',
         fecha: '',
@@ -397,18 +452,23 @@ function App() {
           <div className="panel-header">
             <h3 className="panel-titulo">📍 {infoDestino.ciudad}</h3>
             <p className="panel-subtitulo">{infoDestino.pais}</p>
+            {infoDestino.datos_obsoletos && (
+              <p className="panel-aviso">Últimos datos disponibles, se están actualizando</p>
+            )}
           </div>
           
-          <div className="panel-seccion">
-            <div className="panel-item">
-              <div className="panel-icono">🌡️</div>
-              <div className="panel-contenido">
-                <div className="panel-label">Temperatura</div>
-                <div className="panel-valor">{infoDestino.temperatura}°C</div>
-                <div className="panel-descripcion">{infoDestino.descripcion}</div>
+          {infoDestino.temperatura != null && (
+            <div className="panel-seccion">
+              <div className="panel-item">
+                <div className="panel-icono">🌡️</div>
+                <div className="panel-contenido">
+                  <div className="panel-label">Temperatura</div>
+                  <div className="panel-valor">{infoDestino.temperatura}°C</div>
+                  <div className="panel-descripcion">{infoDestino.descripcion}</div>
+                </div>
               </div>
             </div>
-          </div>
+          )}
 
           <div className="panel-seccion">
             <div className="panel-item">
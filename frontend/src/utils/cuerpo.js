@@ -0,0 +1,45 @@
+/**
+ * ============================================
+ * CUERPO DE LAS CONSULTAS AL BACKEND - VIAJEIA
+ * ============================================
+ *
+ * Arma el cuerpo JSON de una consulta y, si es grande (por ejemplo, con
+ * el historial de un favorito), lo comprime con gzip usando
+ * CompressionStream. El backend acepta Content-Encoding: gzip.
+ *
+ * ¿Por qué es importante?
+ * - En redes móviles subir menos bytes acelera la consulta
+ * - Los navegadores sin CompressionStream siguen mandando JSON normal
+ */
+
+// Campos de las fotos y del panel que muestra la interfaz (el backend omite el resto)
+export const CAMPOS_RESPUESTA = [
+  'fotos.url', 'fotos.url_grande', 'fotos.autor', 'fotos.descripcion',
+  'info_destino.ciudad', 'info_destino.pais', 'info_destino.datos_obsoletos',
+  'info_destino.temperatura', 'info_destino.descripcion',
+  'info_destino.hora_destino', 'info_destino.diferencia_horaria',
+  'info_destino.tipo_cambio', 'info_destino.simbolo_moneda', 'info_destino.moneda'
+]
+
+// Cuerpos más chicos que esto se envían sin comprimir (no vale la pena)
+const MINIMO_COMPRESION = 1024
+
+/**
+ * Opciones de fetch (headers y body) para enviar `datos` como JSON
+ * @param {object} datos - Cuerpo de la consulta
+ * @param {string|null} [token] - ID token de Firebase: el backend da prioridad a los usuarios autenticados
+ * @returns {Promise<{headers: object, body: string|ArrayBuffer}>}
+ */
+export async function cuerpoJSON(datos, token = null) {
+  const texto = JSON.stringify(datos)
+  const headers = { 'Content-Type': 'application/json' }
+  if (token) {
+    headers.Authorization = `Bearer ${token}`
+  }
+  if (texto.length < MINIMO_COMPRESION || typeof CompressionStream === 'undefined') {
+    return { headers, body: texto }
+  }
+  const comprimido = new Blob([texto]).stream().pipeThrough(new CompressionStream('gzip'))
+  const body = await new Response(comprimido).arrayBuffer()
+  return { headers: { ...headers, 'Content-Encoding': 'gzip' }, body }
+}
@@ -0,0 +1,37 @@
+/**
+ * ============================================
+ * PANEL DEL DESTINO - VIAJEIA
+ * ============================================
+ *
+ * Pide el panel lateral (clima, hora local, moneda) de un destino a
+ * GET /api/destino/<nombre>, sin hacerle una pregunta a Alex (por ejemplo,
+ * al abrir un viaje guardado). Durante una consulta no hace falta: el
+ * stream de /api/planificar/stream ya manda el panel y las fotos.
+ * Es una respuesta GET con Cache-Control y ETag: el navegador (o una CDN)
+ * la reutiliza y, si no cambió, el backend responde 304 sin cuerpo.
+ *
+ * ¿Por qué es importante?
+ * - El panel de un favorito aparece en milisegundos, sin gastar una consulta
+ * - Volver a abrir el mismo destino no descarga nada nuevo
+ */
+
+import { CAMPOS_RESPUESTA } from './cuerpo'
+
+/**
+ * Pide el panel de un destino
+ * @param {string} apiUrl - URL base del backend
+ * @param {string} destino - Nombre del destino
+ * @returns {Promise<object|null>} info_destino, o null si no está disponible
+ */
+export async function cargarInfoDestino(apiUrl, destino) {
+  const parametros = new URLSearchParams({
+    zonaHoraria: Intl.DateTimeFormat().resolvedOptions().timeZone, // Para la diferencia horaria
+    campos: CAMPOS_RESPUESTA.filter((campo) => campo.startsWith('info_destino.')).join(',')
+  })
+  try {
+    const response = await fetch(`${apiUrl}/api/destino/${encodeURIComponent(destino.trim())}?${parametros}`)
+    return response.ok ? (await response.json()).info_destino || null : null
+  } catch {
+    return null
+  }
+}
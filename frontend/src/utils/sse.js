@@ -0,0 +1,52 @@
+/**
+ * ============================================
+ * LECTOR DE SERVER-SENT EVENTS - VIAJEIA
+ * ============================================
+ *
+ * El backend envía la respuesta de Alex por partes (text/event-stream)
+ * a través de una petición POST, así que no podemos usar EventSource.
+ * Esta función lee el stream de fetch y entrega cada evento ya parseado.
+ *
+ * ¿Por qué es importante?
+ * - El usuario ve la respuesta mientras se genera
+ * - El panel lateral y las fotos aparecen en cuanto están listos
+ */
+
+/**
+ * Lee los eventos SSE de una respuesta de fetch
+ * @param {Response} response - Respuesta de fetch con Content-Type text/event-stream
+ * @param {function} onEvento - Callback (evento: string, datos: object) por cada evento
+ * @returns {Promise<void>} - Se resuelve cuando el stream termina
+ */
+export async function leerEventosSSE(response, onEvento) {
+  const reader = response.body.getReader()
+  const decoder = new TextDecoder('utf-8')
+  let buffer = ''
+
+  while (true) {
+    const { done, value } = await reader.read()
+    if (done) break
+
+    buffer += decoder.decode(value, { stream: true })
+
+    // Los eventos terminan con una línea en blanco
+    let separador = buffer.indexOf('\n\n')
+    while (separador !== -1) {
+      const bloque = buffer.slice(0, separador)
+      buffer = buffer.slice(separador + 2)
+      separador = buffer.indexOf('\n\n')
+
+      let evento = 'message'
+      let datos = ''
+      bloque.split('\n').forEach((linea) => {
+        if (linea.startsWith('event:')) {
+          evento = linea.slice(6).trim()
+        } else if (linea.startsWith('data:')) {
+          datos += linea.slice(5).trim()
+        }
+      })
+
+      onEvento(evento, datos ? JSON.parse(datos) : {})
+    }
+  }
+}